@@ -3,61 +3,80 @@ This file is part of the TheLMA (THe Laboratory Management Application) project.
 See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
 Barcode printer driver.
+
+Labels are sent to the printers through a spool backend (the lpr spooler
+or, for tests and printers with names ending in "DUMMY", a dummy backend).
+The rendered formats of several labels for the same printer are submitted
+as one spool job (see L{BarcodePrinter.print_barcodes}).
+
+The process-wide L{BarcodePrintQueue} (see L{get_barcode_print_queue})
+prints label batches asynchronously in one worker thread per printer.
 """
+from Queue import Empty
+from Queue import Queue
+import atexit
+from itertools import count
 import logging
 import os
 from subprocess import PIPE
 from subprocess import Popen
+from threading import Event
+from threading import Lock
+from threading import Thread
+import time
 
 
 __docformat__ = "reStructuredText en"
 __all__ = ['BarcodePrinter',
+           'BarcodePrintQueue',
+           'DummySpoolBackend',
+           'LprSpoolBackend',
+           'PrintQueueJob',
+           'PrintQueueMetrics',
            'SatoBarcode',
            'UniTwoLabelRackBarcode',
            'LocationBarcode',
            'EmptyBarcode',
+           'get_barcode_print_queue',
            'print_two_label_unirack_barcode',
            'print_location_barcode']
 
 
-class BarcodePrinter(object):
+logger = logging.getLogger(__name__)
+
+
+class LprSpoolBackend(object):
     """
-    Print a barcode to a barcode printer.
+    Submits printer format strings to the lpr spooler.
     """
-    def __init__(self, barcode_printer_name):
+    #: The default CUPS server (host:port).
+    DEFAULT_SERVER = '192.168.1.33:631'
+
+    def __init__(self, server=None):
         """
-        @param barcode_printer_name: The name of a printer in the unix-lpd
-          system. If None or "", then the barcode is printed to the terminal.
-        @type barcode_printer_name: L{str} or L{NoneType}
+        @param server: The CUPS server (host:port).
+        @type server: L{str} or L{NoneType} (use L{DEFAULT_SERVER})
         """
-        self.barcode_printer_name = barcode_printer_name
+        if server is None:
+            server = self.DEFAULT_SERVER
+        self.server = server
 
-    def print_barcode(self, barcode):
+    def submit(self, printer_name, format_string):
         """
-        @param barcode: Barcode-instance that renders a string for the printer
-        @type barcode: L{SatoBarcode}
-        """
-        bc_string = barcode.render()
-        if self.barcode_printer_name and \
-               not self.barcode_printer_name.upper().endswith('DUMMY'):
-            cmd = 'lpr -H192.168.1.33:631 -P%s -#%d' \
-                  % (self.barcode_printer_name, 1)
-            self._run_command(cmd, input_string=bc_string)
-        logging.getLogger().info('Sent format string %r to barcode printer %s'
-                                 % (bc_string, self.barcode_printer_name))
+        Submits one spool job.
 
-    def get_printer_name(self):
-        return self.barcode_printer_name
+        @raise OSError: if the lpr command fails
+        """
+        cmd = ['lpr', '-H%s' % self.server, '-P%s' % printer_name, '-#1']
+        self._run_command(cmd, input_string=format_string)
 
     def _run_command(self, cmd, suppress_errors=False, input_string=None,
                    environment=None):
         """
-        Runs the given command string in a command shell.
-
-        Uses L{os.popen3}).
+        Runs the given command.
 
-        @param cmd_string: command to execute
-        @type cmd_string: string
+        @param cmd: command to execute (program and arguments)
+        @type cmd: list of strings
         @param input_string: input to pass to C{sys.stdin} of the process
         @type input_string: string
         @param suppress_errors: if set, errors happening during the execution
@@ -72,18 +91,457 @@ class BarcodePrinter(object):
         """
         if environment is None:
             environment = os.environ
-        child = Popen(cmd, shell=True, env=environment,
-                       stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        if not input_string is None:
-            child.stdin.write(input_string)
-            child.stdin.close()
-        if child.wait() != 0:
-            str_error = child.stderr.read()
+        child = Popen(cmd, env=environment,
+                      stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        output, str_error = child.communicate(input_string)
+        if child.returncode != 0:
             if not suppress_errors:
                 raise OSError(str_error)
             else:
                 print 'error during command execution: %s' % str_error
-        return child.stdout.read()
+        return output
+
+
+class DummySpoolBackend(object):
+    """
+    Records the submitted format strings instead of printing them.
+    """
+    def __init__(self):
+        #: The submissions as (printer name, format string) tuples.
+        self.submissions = []
+        #: The number of submissions that shall fail (for testing retries).
+        self.failures = 0
+        #: The names of printers all submissions to which fail.
+        self.offline_printers = set()
+
+    def submit(self, printer_name, format_string):
+        """
+        Records one spool job.
+
+        @raise OSError: if failures are pending (see L{failures}) or the
+          printer is offline (see L{offline_printers})
+        """
+        if printer_name in self.offline_printers:
+            raise OSError('Dummy printer %s is offline.' % printer_name)
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError('Dummy spool failure.')
+        self.submissions.append((printer_name, format_string))
+
+
+class BarcodePrinter(object):
+    """
+    Print a barcode to a barcode printer.
+    """
+    def __init__(self, barcode_printer_name, backend=None):
+        """
+        @param barcode_printer_name: The name of a printer in the unix-lpd
+          system. If None or "" or ending with "DUMMY", then the barcode is
+          only logged.
+        @type barcode_printer_name: L{str} or L{NoneType}
+        @param backend: The spool backend.
+        @type backend: L{LprSpoolBackend} or L{DummySpoolBackend} or
+          L{NoneType} (choose by printer name)
+        """
+        self.barcode_printer_name = barcode_printer_name
+        if backend is None:
+            if self.barcode_printer_name and \
+               not self.barcode_printer_name.upper().endswith('DUMMY'):
+                backend = LprSpoolBackend()
+            else:
+                backend = DummySpoolBackend()
+        self.backend = backend
+
+    def print_barcode(self, barcode):
+        """
+        @param barcode: Barcode-instance that renders a string for the printer
+        @type barcode: L{SatoBarcode}
+        """
+        self.print_barcodes([barcode])
+
+    def print_barcodes(self, barcodes):
+        """
+        Prints the given barcodes with one spool job.
+
+        @param barcodes: Barcode-instances that render strings for the printer
+        @type barcodes: sequence of L{SatoBarcode}
+        """
+        bc_string = ''.join([barcode.render() for barcode in barcodes])
+        self.backend.submit(self.barcode_printer_name, bc_string)
+        logger.info('Sent format string %r to barcode printer %s',
+                    bc_string, self.barcode_printer_name)
+
+    def get_printer_name(self):
+        return self.barcode_printer_name
+
+
+class PrintQueueJob(object):
+    """
+    A batch of barcodes waiting in a L{BarcodePrintQueue}.
+    """
+    #: Generates the job IDs (unique within the process).
+    __id_counter = count(1)
+
+    def __init__(self, printer_name, barcodes):
+        """
+        @param printer_name: The name of the printer.
+        @type printer_name: L{str}
+        @param barcodes: The barcodes to print.
+        @type barcodes: sequence of L{SatoBarcode}
+        """
+        #: The ID of the job.
+        self.job_id = next(self.__id_counter)
+        #: The name of the printer.
+        self.printer_name = printer_name
+        #: The barcodes to print.
+        self.barcodes = list(barcodes)
+        #: The time of the submission to the queue.
+        self.submit_time = time.time()
+        #: The exception of the last print attempt if printing failed.
+        self.error = None
+        #: Set when the job has been processed.
+        self.__done = Event()
+
+    def set_done(self, error=None):
+        """
+        Marks the job as processed.
+        """
+        self.error = error
+        self.__done.set()
+
+    @property
+    def is_done(self):
+        """
+        Has the job been processed (successfully or not)?
+        """
+        return self.__done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the job to be processed.
+
+        @param timeout: The maximum time to wait in seconds.
+        @type timeout: L{float} or L{NoneType} (wait until the job is done)
+        @return: C{True} if the job has been processed
+        @rtype: L{bool}
+        """
+        self.__done.wait(timeout)
+        return self.__done.is_set()
+
+    def __repr__(self):
+        str_format = '<%s id: %i, printer: %s, barcodes: %i>'
+        params = (self.__class__.__name__, self.job_id, self.printer_name,
+                  len(self.barcodes))
+        return str_format % params
+
+
+class PrintQueueMetrics(object):
+    """
+    Statistics of a L{BarcodePrintQueue}.
+    """
+    def __init__(self):
+        #: The number of processed jobs.
+        self.number_jobs = 0
+        #: The number of spool submissions (successful or not).
+        self.number_submissions = 0
+        #: The number of printed labels (barcodes).
+        self.number_labels = 0
+        #: The number of retried spool submissions.
+        self.number_retries = 0
+        #: The number of jobs that could not be printed.
+        self.number_failures = 0
+        #: The total time between the queue submission and the printing of
+        #: the printed jobs in seconds.
+        self.total_latency = 0.0
+        #: The maximum time between queue submission and printing.
+        self.max_latency = 0.0
+        #: Guards the counters.
+        self.__lock = Lock()
+
+    def record_submission(self, jobs, success, number_attempts):
+        """
+        Records a spool submission for the given jobs.
+        """
+        now = time.time()
+        with self.__lock:
+            self.number_jobs += len(jobs)
+            self.number_submissions += number_attempts
+            self.number_retries += number_attempts - 1
+            if success:
+                for job in jobs:
+                    latency = now - job.submit_time
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                    self.number_labels += len(job.barcodes)
+            else:
+                self.number_failures += len(jobs)
+
+    @property
+    def average_latency(self):
+        """
+        The average time between queue submission and printing.
+        """
+        number_printed = self.number_jobs - self.number_failures
+        if number_printed == 0:
+            return 0.0
+        return self.total_latency / number_printed
+
+    def get_summary(self):
+        """
+        Returns a summary of the statistics.
+        """
+        return '%i jobs, %i labels, %i spool submissions (%i retries), ' \
+               '%i failed jobs, latency %.3f s average, %.3f s maximum' \
+               % (self.number_jobs, self.number_labels,
+                  self.number_submissions, self.number_retries,
+                  self.number_failures, self.average_latency,
+                  self.max_latency)
+
+    def __str__(self):
+        return self.get_summary()
+
+
+class BarcodePrintQueue(object):
+    """
+    Prints batches of barcodes asynchronously.
+
+    Each printer has its own job queue and worker thread (started with the
+    first submission for the printer), so an unavailable printer does not
+    hold up the jobs for other printers. A worker takes all pending jobs
+    for its printer off the queue, concatenates the rendered formats and
+    submits them as one spool job. Failed submissions are retried.
+
+    Pending jobs are waited for (up to L{SHUTDOWN_TIMEOUT} seconds)
+    when the interpreter exits.
+    """
+    #: The default number of retries for a failed spool submission.
+    MAX_RETRIES = 3
+    #: The default delay in seconds before retrying a failed submission.
+    RETRY_DELAY = 2.0
+    #: The default time in seconds L{print_barcodes} waits for a job.
+    WAIT_TIMEOUT = 30.0
+    #: The maximum time in seconds to wait for pending jobs at exit.
+    SHUTDOWN_TIMEOUT = 30.0
+
+    def __init__(self, backend=None, max_retries=None, retry_delay=None,
+                 wait_timeout=None):
+        """
+        @param backend: The spool backend.
+        @type backend: L{LprSpoolBackend} or L{DummySpoolBackend} or
+          L{NoneType} (choose by printer name, see L{BarcodePrinter})
+        @param max_retries: The number of retries for a failed spool
+          submission.
+        @type max_retries: L{int} or L{NoneType} (use L{MAX_RETRIES})
+        @param retry_delay: The delay in seconds before retrying a failed
+          submission.
+        @type retry_delay: L{float} or L{NoneType} (use L{RETRY_DELAY})
+        @param wait_timeout: The time in seconds L{print_barcodes} waits
+          for a job to be processed.
+        @type wait_timeout: L{float} or L{NoneType} (use L{WAIT_TIMEOUT})
+        """
+        #: The spool backend (C{None} to choose by printer name).
+        self.backend = backend
+        if max_retries is None:
+            max_retries = self.MAX_RETRIES
+        #: The number of retries for a failed spool submission.
+        self.max_retries = max_retries
+        if retry_delay is None:
+            retry_delay = self.RETRY_DELAY
+        #: The delay in seconds before retrying a failed submission.
+        self.retry_delay = retry_delay
+        if wait_timeout is None:
+            wait_timeout = self.WAIT_TIMEOUT
+        #: The time in seconds L{print_barcodes} waits for a job.
+        self.wait_timeout = wait_timeout
+        #: The queue statistics.
+        self.metrics = PrintQueueMetrics()
+        #: Shall barcodes be printed through the queue?
+        self.__is_enabled = False
+        #: The job queues mapped onto printer names (each queue has its own
+        #: worker thread).
+        self.__queues = dict()
+        #: The jobs that have been submitted but not processed yet.
+        self.__pending_jobs = set()
+        #: Has the exit handler been registered?
+        self.__has_exit_handler = False
+        #: Guards the queues, the worker start and the pending jobs.
+        self.__lock = Lock()
+
+    @property
+    def is_enabled(self):
+        """
+        Shall barcodes be printed through the queue?
+        """
+        return self.__is_enabled
+
+    def enable(self):
+        """
+        Enables the queue.
+        """
+        self.__is_enabled = True
+
+    def disable(self):
+        """
+        Disables the queue (pending jobs are still printed).
+        """
+        self.__is_enabled = False
+
+    @property
+    def queue_depth(self):
+        """
+        The number of jobs waiting to be printed (for all printers).
+        """
+        with self.__lock:
+            queues = self.__queues.values()
+        return sum([queue.qsize() for queue in queues])
+
+    def submit(self, printer_name, barcodes):
+        """
+        Queues the given barcodes for printing (without waiting).
+
+        @param printer_name: The name of the printer.
+        @type printer_name: L{str}
+        @param barcodes: The barcodes to print.
+        @type barcodes: sequence of L{SatoBarcode}
+        @return: the queued job
+        @rtype: L{PrintQueueJob}
+        """
+        job = PrintQueueJob(printer_name, barcodes)
+        with self.__lock:
+            queue = self.__queues.get(printer_name)
+            if queue is None:
+                queue = self.__start_worker(printer_name)
+            self.__pending_jobs.add(job)
+            queue.put(job)
+        return job
+
+    def print_barcodes(self, printer_name, barcodes, timeout=None):
+        """
+        Queues the given barcodes for printing and waits for the job to be
+        processed.
+
+        @param printer_name: The name of the printer.
+        @type printer_name: L{str}
+        @param barcodes: The barcodes to print.
+        @type barcodes: sequence of L{SatoBarcode}
+        @param timeout: The maximum time to wait in seconds.
+        @type timeout: L{float} or L{NoneType} (use L{wait_timeout})
+        @raise OSError: if printing failed (the error of the last attempt)
+          or if the job has not been processed within the timeout (it
+          stays queued in this case)
+        @return: the processed job
+        @rtype: L{PrintQueueJob}
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        job = self.submit(printer_name, barcodes)
+        if not job.wait(timeout):
+            raise OSError('The barcodes for printer %s have not been printed '
+                          'within %.1f s (the job is still queued).'
+                          % (printer_name, timeout))
+        if not job.error is None:
+            raise job.error
+        return job
+
+    def join(self, timeout=None):
+        """
+        Waits until all jobs submitted so far have been processed.
+
+        @param timeout: The maximum time to wait in seconds.
+        @type timeout: L{float} or L{NoneType} (wait until all jobs are
+          done)
+        @return: C{True} if all jobs have been processed
+        @rtype: L{bool}
+        """
+        with self.__lock:
+            jobs = list(self.__pending_jobs)
+        if timeout is None:
+            for job in jobs:
+                job.wait()
+            return True
+        deadline = time.time() + timeout
+        for job in jobs:
+            if not job.wait(max(deadline - time.time(), 0)):
+                return False
+        return True
+
+    def __start_worker(self, printer_name):
+        # Creates the queue and starts the worker for the given printer
+        # (the lock must be held).
+        queue = Queue()
+        self.__queues[printer_name] = queue
+        worker = Thread(target=self.__run, args=(printer_name, queue),
+                        name='barcode-print-queue-%s' % printer_name)
+        worker.daemon = True
+        worker.start()
+        if not self.__has_exit_handler:
+            # The workers are daemon threads - give pending jobs a chance
+            # to be printed before the interpreter exits.
+            atexit.register(self.__flush)
+            self.__has_exit_handler = True
+        return queue
+
+    def __flush(self):
+        if not self.join(self.SHUTDOWN_TIMEOUT):
+            logger.error('Barcode print queue: pending jobs have not been '
+                         'printed at exit (%s).', self)
+
+    def __run(self, printer_name, queue):
+        # Worker loop: prints all pending jobs for the given printer.
+        while True:
+            jobs = [queue.get()]
+            while True:
+                try:
+                    jobs.append(queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.__print_batch(printer_name, jobs)
+            except Exception as exc: # pylint: disable=W0703
+                # Keep the worker alive whatever happens.
+                logger.exception('Unexpected barcode print queue error.')
+                for job in jobs:
+                    if not job.is_done:
+                        job.set_done(error=exc)
+            with self.__lock:
+                self.__pending_jobs.difference_update(jobs)
+            logger.debug('Barcode print queue: %s, queue depth %i.',
+                         self.metrics, self.queue_depth)
+
+    def __print_batch(self, printer_name, jobs):
+        # Prints the barcodes of the given jobs with one spool submission.
+        barcodes = []
+        for job in jobs:
+            barcodes.extend(job.barcodes)
+        printer = BarcodePrinter(printer_name, backend=self.backend)
+        number_attempts = 0
+        error = None
+        while number_attempts <= self.max_retries:
+            number_attempts += 1
+            try:
+                printer.print_barcodes(barcodes)
+            except (OSError, IOError) as exc:
+                error = exc
+                logger.warning('Printing %i barcodes on printer %s failed '
+                               '(attempt %i): %s', len(barcodes),
+                               printer_name, number_attempts, exc)
+                if number_attempts <= self.max_retries:
+                    # Only holds up the jobs for this printer.
+                    time.sleep(self.retry_delay)
+            else:
+                error = None
+                break
+        self.metrics.record_submission(jobs, error is None, number_attempts)
+        if not error is None:
+            logger.error('Giving up printing %i barcodes on printer %s.',
+                         len(barcodes), printer_name)
+        for job in jobs:
+            job.set_done(error=error)
+
+    def __repr__(self):
+        str_format = '<%s queue depth: %i>'
+        params = (self.__class__.__name__, self.queue_depth)
+        return str_format % params
 
 
 class SatoBarcode(object):
@@ -347,3 +805,13 @@ def print_location_barcode(barcode_number, label_row_1, printer_name=None):
                               label_row_1=label_row_1)
     barcodePrinter = BarcodePrinter(printer_name)
     barcodePrinter.print_barcode(barcode)
+
+
+#: The process-wide barcode print queue.
+__BARCODE_PRINT_QUEUE = BarcodePrintQueue()
+
+def get_barcode_print_queue():
+    """
+    Returns the process-wide L{BarcodePrintQueue}.
+    """
+    return __BARCODE_PRINT_QUEUE
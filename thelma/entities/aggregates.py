@@ -6,13 +6,19 @@ Aggregate implementations.
 
 Created Sep 25, 2011
 """
+from contextlib import contextmanager
+
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm import subqueryload_all
 from sqlalchemy.sql.expression import and_
 
 from everest.querying.base import EXPRESSION_KINDS
 from everest.repositories.rdb.aggregate import RdbAggregate as Aggregate
 from everest.utils import get_filter_specification_visitor
 from thelma.entities.container import Tube
+from thelma.entities.container import Well
 from thelma.entities.location import BarcodedLocation
 from thelma.entities.moleculedesign import MoleculeDesignPool
 from thelma.entities.rack import Plate
@@ -24,18 +30,169 @@ from thelma.entities.suppliermoleculedesign import SupplierMoleculeDesign
 
 
 __docformat__ = 'reStructuredText en'
-__all__ = ['ThelmaRdbAggregate',
+__all__ = ['QUERY_PROFILES',
+           'ThelmaRdbAggregate',
+           'load_query_profile',
            ]
 
 
+class QUERY_PROFILES(object):
+    """
+    Names of the loading profiles for rack, container and molecule design
+    pool queries. A profile declares which related entities are loaded
+    together with the queried entities. Related collections are loaded in
+    batches (one additional query per relationship for all queried
+    entities) rather than lazily entity by entity.
+    """
+    #: Racks with their specs, status and location.
+    RACK = 'rack'
+    #: Racks with their containers (and tube locations).
+    RACK_CONTAINERS = 'rack-containers'
+    #: Racks with their containers and samples.
+    RACK_SAMPLES = 'rack-samples'
+    #: Racks with their containers, samples, sample molecules, molecules
+    #: and molecule designs.
+    RACK_SAMPLE_MOLECULES = 'rack-sample-molecules'
+    #: Containers with their samples (and tube locations).
+    CONTAINER_SAMPLES = 'container-samples'
+    #: Containers with their samples, sample molecules, molecules and
+    #: molecule designs (and tube locations).
+    CONTAINER_SAMPLE_MOLECULES = 'container-sample-molecules'
+    #: Molecule design pools with their molecule designs.
+    POOL_MOLECULE_DESIGNS = 'pool-molecule-designs'
+
+    __RACK_PROFILES = [RACK, RACK_CONTAINERS, RACK_SAMPLES,
+                       RACK_SAMPLE_MOLECULES]
+    __CONTAINER_PROFILES = [CONTAINER_SAMPLES, CONTAINER_SAMPLE_MOLECULES]
+
+    @classmethod
+    def get_loader_options(cls, entity_class, profile):
+        """
+        Returns the query options implementing the given profile for the
+        given entity class.
+
+        :raises ValueError: If the profile is not available for the
+            entity class.
+        """
+        if profile == cls.RACK and issubclass(entity_class, Rack):
+            opts = cls.__get_rack_options()
+        elif profile in cls.__RACK_PROFILES \
+                        and issubclass(entity_class, (Plate, TubeRack)):
+            # Only the rack subclasses have containers.
+            opts = cls.__get_rack_options() \
+                   + cls.__get_container_options(entity_class, profile,
+                                                 'containers.')
+        elif profile in cls.__CONTAINER_PROFILES \
+                        and issubclass(entity_class, (Tube, Well)):
+            opts = cls.__get_container_options(entity_class, profile, '')
+        elif profile == cls.POOL_MOLECULE_DESIGNS \
+                        and issubclass(entity_class, MoleculeDesignPool):
+            opts = [subqueryload(MoleculeDesignPool.molecule_designs)] # pylint: disable=E1101
+        else:
+            msg = 'Unknown query profile "%s" for %s entities.' \
+                  % (profile, entity_class.__name__)
+            raise ValueError(msg)
+        return opts
+
+    @classmethod
+    def __get_rack_options(cls):
+        # Using hidden instrumented attributes pylint: disable=W0212,E1101
+        return [joinedload(Rack._location),
+                joinedload(Rack.specs),
+                joinedload(Rack.status)]
+        # pylint: enable=W0212,E1101
+
+    @classmethod
+    def __get_container_options(cls, entity_class, profile, prefix):
+        # The prefix is the path from the queried entity to the containers.
+        if profile in (cls.RACK_SAMPLE_MOLECULES,
+                       cls.CONTAINER_SAMPLE_MOLECULES):
+            sample_path = 'sample.sample_molecules.molecule.molecule_design'
+        elif profile in (cls.RACK_SAMPLES, cls.CONTAINER_SAMPLES):
+            sample_path = 'sample'
+        else:
+            sample_path = None
+        opts = []
+        if prefix:
+            opts.append(subqueryload(prefix.rstrip('.')))
+        if not sample_path is None:
+            opts.append(subqueryload_all(prefix + sample_path))
+        if issubclass(entity_class, (Tube, TubeRack)):
+            # Tube positions are stored in the tube locations.
+            opts.append(subqueryload_all(prefix + 'location'))
+        return opts
+
+
+def load_query_profile(entities, profile):
+    """
+    Loads the related entities declared by the given query profile for
+    the passed (persistent) entities in batches. Tools use this for racks,
+    containers and pools they receive as input before they traverse them.
+    Relationships that are loaded already are not reloaded.
+
+    :param entities: The entities to load the profile for (entities that
+        are not attached to a session are ignored).
+    :type entities: iterable of :class:`thelma.entities.rack.Rack`,
+        :class:`thelma.entities.container.Container` or
+        :class:`thelma.entities.moleculedesign.MoleculeDesignPool` objects
+    :param str profile: A :class:`QUERY_PROFILES` name.
+    :raises ValueError: If the profile is not available for an entity.
+    """
+    entity_map = {}
+    for entity in entities:
+        session = object_session(entity)
+        if session is None or entity.id is None:
+            continue
+        key = (session, type(entity))
+        entity_map.setdefault(key, set()).add(entity.id)
+    for (session, entity_class), ids in entity_map.iteritems():
+        opts = QUERY_PROFILES.get_loader_options(entity_class, profile)
+        session.query(entity_class) \
+               .options(*opts) \
+               .filter(entity_class.id.in_(list(ids))) \
+               .all()
+
+
 class ThelmaRdbAggregate(Aggregate):
     """
     TheLMA implementation for aggregates (using SQLAlchemy).
 
     This specializes the everest RDB aggregate implementation to use
     TheLMA-specific query, filter, and order information.
+
+    Rack and container aggregates can load related entities along with
+    the queried entities (see :class:`QUERY_PROFILES` and
+    :func:`use_query_profile`).
     """
+    #: The name of the query profile to use (see :class:`QUERY_PROFILES`).
+    #: If this is *None*, the default options for the entity class are
+    #: used.
+    query_profile = None
+
+    @contextmanager
+    def use_query_profile(self, profile):
+        """
+        Context manager selecting a query profile for all aggregate calls
+        within the block: ::
+
+            with rack_agg.use_query_profile(
+                            QUERY_PROFILES.RACK_SAMPLE_MOLECULES):
+                rack = rack_agg.get_by_slug(barcode)
+
+        :param str profile: A :class:`QUERY_PROFILES` name.
+        """
+        former_profile = self.query_profile
+        self.query_profile = profile
+        try:
+            yield self
+        finally:
+            self.query_profile = former_profile
+
     def _query_optimizer(self, query, key):
+        if not self.query_profile is None:
+            opts = QUERY_PROFILES.get_loader_options(self.entity_class,
+                                                     self.query_profile)
+            return query.options(*opts)
         gen_query = _QueryOptimizers.get(self.entity_class, query, key)
         if gen_query is None:
             gen_query = super(ThelmaRdbAggregate, # pylint: disable=W0212
@@ -65,7 +222,7 @@ class _QueryOptimizers(object):
                                       joinedload(Rack.specs),
                                       joinedload(Rack.status))
         else:
-            opt_query = query.op
+            opt_query = query
         return opt_query
 
     __map = {TubeRack:'_rack_query_generator',
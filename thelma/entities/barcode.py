@@ -23,6 +23,9 @@ class BarcodePrintJob(Entity):
     printer = None
     #: The type for the barcode
     type = None
+    #: The ID of the print queue job (only set if the barcodes are printed
+    #: asynchronously).
+    print_queue_job_id = None
 
     # pylint:disable=W0622
     def __init__(self, barcodes='', labels=None, printer=None, type=None, **kw):
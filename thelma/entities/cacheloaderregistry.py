@@ -23,6 +23,9 @@ class CacheLoaderRegistry(object):
     def register_loader(self, entity_class, loader):
         self.__loaders[entity_class] = loader
 
+    def has_loader(self, entity_class):
+        return self.__loaders.has_key(entity_class)
+
     def __call__(self, entity_class):
         loader = self.__loaders.get(entity_class)
         if not loader is None:
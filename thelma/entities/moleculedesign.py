@@ -58,6 +58,9 @@ class MoleculeDesign(Entity):
     # The Id (name) of the molecule type associated with this design. Used for
     # validation purposes.
     _molecule_type_id = None
+    # The cached structure hash string (reset when the chemical structures
+    # change, see :meth:`invalidate_hash_cache`).
+    _structure_hash_string = None
 
     def __init__(self, molecule_type, chemical_structures,
                  supplier_molecule_designs=None, genes=None, **kw):
@@ -74,6 +77,7 @@ class MoleculeDesign(Entity):
         hash_string = \
             MoleculeDesign.make_structure_hash_string(chemical_structures)
         self.structure_hash = md5(hash_string).hexdigest()
+        self._structure_hash_string = hash_string
         if supplier_molecule_designs is None:
             supplier_molecule_designs = []
         self.supplier_molecule_designs = supplier_molecule_designs
@@ -112,7 +116,17 @@ class MoleculeDesign(Entity):
 
     @property
     def structure_hash_string(self):
-        return self.make_structure_hash_string(self.chemical_structures)
+        if self._structure_hash_string is None:
+            self._structure_hash_string = \
+                    self.make_structure_hash_string(self.chemical_structures)
+        return self._structure_hash_string
+
+    def invalidate_hash_cache(self):
+        """
+        Discards the cached structure hash string (called by the mapper when
+        the chemical structures of this design change).
+        """
+        self._structure_hash_string = None
 
     @staticmethod
     def make_structure_hash_string(structures):
@@ -148,6 +162,31 @@ class MoleculeDesign(Entity):
         md5_hash = md5(MoleculeDesign.make_structure_hash_string(structures))
         return md5_hash.hexdigest()
 
+    @staticmethod
+    def make_structure_hashes(structure_lists):
+        """
+        Computes the structure hashes (see :meth:`make_structure_hash`) for
+        a batch of chemical structure sequences in one pass. Sequences
+        with the same structures are hashed only once.
+
+        :param structure_lists: sequence of chemical structure sequences.
+        :raises ValueError: if one of the structure sequences is `None` or
+            empty.
+        :returns: list of md5 hexdigests (in the order of the given
+            sequences).
+        """
+        hash_map = {}
+        hashes = []
+        for structures in structure_lists:
+            hash_string = \
+                    MoleculeDesign.make_structure_hash_string(structures)
+            struc_hash = hash_map.get(hash_string)
+            if struc_hash is None:
+                struc_hash = md5(hash_string).hexdigest()
+                hash_map[hash_string] = struc_hash
+            hashes.append(struc_hash)
+        return hashes
+
     def __str__(self):
         return str(self.id)
 
@@ -524,6 +563,11 @@ class MoleculeDesignPool(MoleculeDesignSetBase):
     #: A hash value built as md5 hash from the the member hash string as
     #: returned by the make_member_hash_string static method.
     member_hash = None
+    #: A hash value built as md5 hash from the sorted structure hashes of
+    #: the member designs as returned by the make_structure_hash static
+    #: method. Unlike the :attr:`member_hash`, this can be computed before
+    #: the designs have IDs.
+    structure_hash = None
     #: The number of molecule designs in the set of desigs.
     number_designs = None
     #: The (pool) supplier molecule designs for this design pool.
@@ -534,6 +578,9 @@ class MoleculeDesignPool(MoleculeDesignSetBase):
     #: this is not explicitly specified during initialization, the default
     #: for the pool's molecule type is used.
     default_stock_concentration = None
+    # The cached member hash string (reset when the molecule designs
+    # change, see :meth:`invalidate_hash_cache`).
+    _member_hash_string = None
 
     def __init__(self, molecule_designs, default_stock_concentration=None,
                  **kw):
@@ -556,6 +603,8 @@ class MoleculeDesignPool(MoleculeDesignSetBase):
         self.default_stock_concentration = default_stock_concentration
         self.member_hash = \
             md5(self.make_member_hash_string(molecule_designs)).hexdigest()
+        self.structure_hash = self.make_structure_hash(
+                            [md.structure_hash for md in molecule_designs])
         self.number_designs = len(molecule_designs)
 
     @staticmethod
@@ -590,9 +639,61 @@ class MoleculeDesignPool(MoleculeDesignSetBase):
         """
         return md5(cls.make_member_hash_string(molecule_designs)).hexdigest()
 
+    @classmethod
+    def make_member_hashes(cls, molecule_design_lists):
+        """
+        Computes the member hashes (see :meth:`make_member_hash`) for a
+        batch of molecule design sequences in one pass. Sequences with the
+        same designs are hashed only once.
+
+        :returns: list of md5 hexdigests (in the order of the given
+            sequences).
+        """
+        hash_map = {}
+        hashes = []
+        for molecule_designs in molecule_design_lists:
+            hash_string = cls.make_member_hash_string(molecule_designs)
+            member_hash = hash_map.get(hash_string)
+            if member_hash is None:
+                member_hash = md5(hash_string).hexdigest()
+                hash_map[hash_string] = member_hash
+            hashes.append(member_hash)
+        return hashes
+
+    @staticmethod
+    def make_structure_hash(design_structure_hashes):
+        """
+        Creates the pool structure hash for the given structure hashes of
+        the member designs (see :meth:`MoleculeDesign.make_structure_hash`)
+        as md5 hexdigest of the sorted, semicolon-concatenated design
+        structure hashes.
+
+        :raises ValueError: if the value passed for
+            :param:`design_structure_hashes` is `None` or an empty sequence.
+        :returns: md5 hexdigest of the pool structure hash string
+        """
+        if design_structure_hashes is None \
+           or len(design_structure_hashes) == 0:
+            raise ValueError('Can not create structure hash for pool '
+                             'without design information.')
+        return md5(';'.join(sorted(design_structure_hashes))).hexdigest()
+
     @property
     def member_hash_string(self):
-        return self.make_member_hash_string(self.molecule_designs)
+        hash_string = self._member_hash_string
+        if hash_string is None:
+            hash_string = self.make_member_hash_string(self.molecule_designs)
+            # New designs do not have IDs before they are flushed.
+            if not any(md.id is None for md in self.molecule_designs):
+                self._member_hash_string = hash_string
+        return hash_string
+
+    def invalidate_hash_cache(self):
+        """
+        Discards the cached member hash string (called by the mapper when
+        the molecule designs of this pool change).
+        """
+        self._member_hash_string = None
 
     @classmethod
     def create_from_data(cls, data):
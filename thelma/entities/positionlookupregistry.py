@@ -0,0 +1,53 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Registry for rack position lookups.
+"""
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['position_lookup_registry',
+           ]
+
+
+class PositionLookupRegistry(object):
+    """
+    Rack position lookup registry. Caches (such as the rack position cache
+    in :mod:`thelma.tools.semiconstants`) register their lookups here, so
+    that the rack entities can use them without depending on the caching
+    layer. If there are no lookups registered, the rack entities fetch the
+    positions from the rack position aggregate.
+    """
+    def __init__(self):
+        self.__from_label = None
+        self.__from_indices = None
+        self.__for_shape = None
+
+    def register_lookups(self, from_label, from_indices, for_shape):
+        """
+        Registers the lookup functions.
+
+        :param from_label: Returns the position for a label (raises a
+            :class:`ValueError` for unknown labels).
+        :param from_indices: Returns the position for a row and a column
+            index.
+        :param for_shape: Returns the positions (sorted by row) for a rack
+            shape.
+        """
+        self.__from_label = from_label
+        self.__from_indices = from_indices
+        self.__for_shape = for_shape
+
+    def has_lookups(self):
+        return not self.__from_label is None
+
+    def from_label(self, label):
+        return self.__from_label(label)
+
+    def from_indices(self, row_index, column_index):
+        return self.__from_indices(row_index, column_index)
+
+    def for_shape(self, rack_shape):
+        return self.__for_shape(rack_shape)
+
+position_lookup_registry = PositionLookupRegistry()
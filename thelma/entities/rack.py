@@ -14,7 +14,8 @@ from everest.querying.specifications import lt
 from thelma.entities.container import TubeLocation
 from thelma.entities.container import Well
 from thelma.entities.location import BarcodedLocationRack
-from thelma.entities.utils import BinaryRunLengthEncoder
+from thelma.entities.positionlookupregistry import position_lookup_registry
+from thelma.entities.utils import PositionBitmask
 from thelma.entities.utils import number_from_label
 from thelma.interfaces import IRackPosition
 from thelma.interfaces import IRackPositionSet
@@ -313,24 +314,23 @@ class Plate(Rack):
         c_specs = self.specs.well_specs
         containers = []
         cp_map = {}
-        # We fetch all the rack positions in one query to speed up things.
         shape = self.specs.shape
-        agg = get_root_aggregate(IRackPosition)
-        agg.filter = lt(_row_index=shape.number_rows) \
-                     & lt(_column_index=shape.number_columns)
-        iterator = agg.iterator()
-        while True:
-            try:
-                rack_pos = iterator.next()
-            except StopIteration:
-                break
-            else:
-                well = Well.create_from_rack_and_position(c_specs,
-                                                          self.status,
-                                                          self,
-                                                          rack_pos)
-                containers.append(well)
-                cp_map[rack_pos] = well
+        if position_lookup_registry.has_lookups():
+            # The rack positions are taken from the registered cache.
+            rack_positions = position_lookup_registry.for_shape(shape)
+        else:
+            # We fetch all the rack positions in one query to speed up things.
+            agg = get_root_aggregate(IRackPosition)
+            agg.filter = lt(_row_index=shape.number_rows) \
+                         & lt(_column_index=shape.number_columns)
+            rack_positions = agg.iterator()
+        for rack_pos in rack_positions:
+            well = Well.create_from_rack_and_position(c_specs,
+                                                      self.status,
+                                                      self,
+                                                      rack_pos)
+            containers.append(well)
+            cp_map[rack_pos] = well
         self.containers = containers
         return cp_map
 
@@ -597,32 +597,33 @@ class RackPosition(Entity):
     def from_label(cls, label):
         """
         Returns a new RackPosition instance from the rack position label.
-
-        :Note: Try not to use this method if you can avoid it as it takes
-            as it takes a lot of time if you try to fetch a larger number
-            of rack positions one by one. Use the rack position cache in the
-            :mod:`semiconstants` module instead, if possible.
+        The position is taken from the registered rack position cache (see
+        :mod:`thelma.entities.positionlookupregistry`) if there is one.
 
         :param label: a set of characters from a-z (or A-Z) which
                       signifies a row followed by an number
                       signifying the column
         :type label: :class:`string`
 
-        :return: The wanted rack position.
+        :return: The wanted rack position or *None* if there is no rack
+            position for this label.
         :rtype: :class:`RackPosition`
         """
-        agg = get_root_aggregate(IRackPosition)
-        return agg.get_by_slug(label.lower())
+        if not position_lookup_registry.has_lookups():
+            agg = get_root_aggregate(IRackPosition)
+            return agg.get_by_slug(label.lower())
+        try:
+            return position_lookup_registry.from_label(label)
+        except ValueError:
+            # Unknown rack position.
+            return None
 
     @classmethod
     def from_indices(cls, row_index, column_index):
         """
         Returns a RackPosition from the row index and column index.
-
-        :Note: Try not to use this method if you can avoid it as it takes
-            as it takes a lot of time if you try to fetch a larger number
-            of rack positions one by one. Use the rack position cache in the
-            :mod:`semiconstants` module instead, if possible.
+        The position is taken from the registered rack position cache (see
+        :mod:`thelma.entities.positionlookupregistry`) if there is one.
 
         :param row_index: the row of the container (this is 0 based).
         :type row_index: :class:`int`
@@ -633,9 +634,12 @@ class RackPosition(Entity):
         :return: The wanted rack position.
         :rtype: :class:`RackPosition`
         """
-        agg = get_root_aggregate(IRackPosition)
-        agg.filter = eq(_row_index=row_index) & eq(_column_index=column_index)
-        return list(agg.iterator())[0]
+        if not position_lookup_registry.has_lookups():
+            agg = get_root_aggregate(IRackPosition)
+            agg.filter = eq(_row_index=row_index) \
+                         & eq(_column_index=column_index)
+            return list(agg.iterator())[0]
+        return position_lookup_registry.from_indices(row_index, column_index)
 
     @classmethod
     def from_row_column(cls, row, column):
@@ -644,11 +648,6 @@ class RackPosition(Entity):
         and column number.
         Invokes :func:`from_indices`.
 
-        :Note: Try not to use this method if you can avoid it as it takes
-            as it takes a lot of time if you try to fetch a larger number
-            of rack positions one by one. Use the rack position cache in the
-            :mod:`semiconstants` module instead, if possible.
-
         :param row: a set of characters from a-z (or A-Z) which signifies a row
         :type row: :class:`string`
 
@@ -708,6 +707,9 @@ class RackPositionSet(Entity):
     #: pattern generated by the :func:`_encode_rack_position_set` function
     #: - immutable.
     _hash_value = None
+    #: The positions as :class:`thelma.entities.utils.PositionBitmask`
+    #: (derived from the positions on first use).
+    _bitmask = None
 
     def __init__(self, positions, hash_value, **kw):
         """
@@ -728,12 +730,17 @@ class RackPositionSet(Entity):
         """
         if not isinstance(positions, set):
             positions = set(positions)
-        hash_value = cls.encode_rack_position_set(positions)
+        bitmask = PositionBitmask.from_indices(
+                            [(rack_pos.row_index, rack_pos.column_index)
+                             for rack_pos in positions])
+        hash_value = bitmask.encode_as_run_length_string()
         agg = get_root_aggregate(IRackPositionSet)
         rps = agg.get_by_slug(hash_value)
         if rps is None:
             rps = cls(positions=positions, hash_value=hash_value)
             agg.add(rps)
+        if rps._bitmask is None: # pylint: disable=W0212
+            rps._bitmask = bitmask # pylint: disable=W0212
         return rps
 
     @property
@@ -757,6 +764,17 @@ class RackPositionSet(Entity):
         """
         return self._hash_value
 
+    @property
+    def bitmask(self):
+        """
+        The positions as :class:`thelma.entities.utils.PositionBitmask`
+        (decoded from the :attr:`hash_value`).
+        """
+        if self._bitmask is None:
+            self._bitmask = \
+                    PositionBitmask.from_run_length_string(self._hash_value)
+        return self._bitmask
+
     @staticmethod
     def encode_rack_position_set(position_set):
         """
@@ -767,8 +785,10 @@ class RackPositionSet(Entity):
         :type position_set: :class:`RackPosition`
         :return: run length decoded string
         """
-        encoder = _PositionSetLengthEncoder(position_set)
-        return encoder.encode_as_run_length_string()
+        bitmask = PositionBitmask.from_indices(
+                            [(rack_pos.row_index, rack_pos.column_index)
+                             for rack_pos in position_set])
+        return bitmask.encode_as_run_length_string()
 
     def __contains__(self, rack_position):
         """
@@ -779,7 +799,8 @@ class RackPositionSet(Entity):
         :type rack_positions: :class:`RackPosition`
         :return: :class:`boolean`
         """
-        return rack_position in self.positions
+        return self.bitmask.contains(rack_position.row_index,
+                                     rack_position.column_index)
 
     def __eq__(self, other):
         """
@@ -801,23 +822,3 @@ class RackPositionSet(Entity):
         str_format = '<%s hash value: %s>'
         params = (self.__class__.__name__, self._hash_value)
         return str_format % params
-
-
-class _PositionSetLengthEncoder(BinaryRunLengthEncoder):
-    """
-    Special BinaryRunLengthEncoder dealing with sets of RackPosition objects.
-    Wells present in the position set are considered "positive".
-    """
-    def _create_lookup(self):
-        """
-        For rack positions the coordinates must be derived from the entity.
-        """
-        for rack_pos in self._positive_positions:
-            coord = (rack_pos.row_index, rack_pos.column_index)
-            self._index_lookup.add(coord)
-
-    def _get_row_index_from_input_set(self, position):
-        return position.row_index
-
-    def _get_column_index_from_input_set(self, position):
-        return position.column_index
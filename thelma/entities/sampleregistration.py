@@ -7,6 +7,8 @@ Sample registration entity classes.
 Created Nov 24, 2014.
 """
 from everest.entities.base import Entity
+from thelma.entities.moleculedesign import MoleculeDesign
+from thelma.entities.moleculedesign import MoleculeDesignPool
 
 
 __docformat__ = 'reStructuredText en'
@@ -51,6 +53,19 @@ class MoleculeDesignRegistrationItem(MoleculeDesignRegistrationItemBase):
         MoleculeDesignRegistrationItemBase.__init__(self, molecule_type, **kw)
         self.chemical_structures = chemical_structures
 
+    @staticmethod
+    def make_structure_hashes(registration_items):
+        """
+        Computes the structure hashes of the designs to register for a batch
+        of registration items in one pass (see
+        :meth:`thelma.entities.moleculedesign.MoleculeDesign.make_structure_hashes`).
+
+        :returns: list of md5 hexdigests (in the order of the given items).
+        """
+        return MoleculeDesign.make_structure_hashes(
+                        [mdri.chemical_structures
+                         for mdri in registration_items])
+
 
 class MoleculeDesignPoolRegistrationItem(MoleculeDesignRegistrationItemBase):
     """
@@ -68,6 +83,27 @@ class MoleculeDesignPoolRegistrationItem(MoleculeDesignRegistrationItemBase):
         self.molecule_design_registration_items = \
                                         molecule_design_registration_items
 
+    @staticmethod
+    def make_structure_hashes(registration_items):
+        """
+        Computes the structure hashes of the pools to register for a batch
+        of registration items in one pass (see
+        :meth:`thelma.entities.moleculedesign.MoleculeDesignPool.make_structure_hash`).
+        The design structure hashes are computed once for all design
+        registration items of the batch.
+
+        :returns: list of md5 hexdigests (in the order of the given items).
+        """
+        md_hashes = iter(MoleculeDesignRegistrationItem.make_structure_hashes(
+                                [mdri
+                                 for mdpri in registration_items
+                                 for mdri in
+                                    mdpri.molecule_design_registration_items]))
+        return [MoleculeDesignPool.make_structure_hash(
+                        [next(md_hashes)
+                         for _ in mdpri.molecule_design_registration_items])
+                for mdpri in registration_items]
+
 
 class SampleData(Entity):
     """
@@ -7,6 +7,8 @@ Utilities for entity classes.
 NP
 """
 
+from itertools import groupby
+
 from everest.entities.utils import get_root_aggregate
 from pyramid.threadlocal import get_current_request
 from pyramid.security import authenticated_userid
@@ -20,6 +22,7 @@ __all__ = ['get_current_user',
            'label_from_number',
            'number_from_label',
            'BinaryRunLengthEncoder',
+           'PositionBitmask',
            'encode_index_tuples'
            ]
 
@@ -257,6 +260,206 @@ class BinaryRunLengthEncoder(object):
         return position[1]
 
 
+class PositionBitmask(object):
+    """
+    An immutable set of positions (row index, column index) stored as bitmask
+    (an arbitrary length integer). The bit for a position is located at
+    *column_index * ROW_STRIDE + row_index*, i.e. the positions are ordered
+    column-wise like in the scanning pattern of the
+    :class:`BinaryRunLengthEncoder`. Hence, set operations work on whole
+    machine words and the run-length encoding (see
+    :func:`encode_as_run_length_string`) can be derived directly from the
+    bits.
+    """
+    #: The maximum number of rows (rows of a 1536-well plate).
+    ROW_STRIDE = 32
+    #: The mask for the bits of a column.
+    __COLUMN_MASK = (1 << ROW_STRIDE) - 1
+
+    def __init__(self, mask=0):
+        """
+        Constructor.
+
+        :param int mask: The bitmask (use :func:`from_indices` or
+            :func:`from_run_length_string` to create a mask).
+        """
+        #: The bitmask.
+        self.mask = mask
+
+    @classmethod
+    def get_bit(cls, row_index, column_index):
+        """
+        Returns the bit (as integer) for the given position.
+
+        :raises ValueError: If the row index exceeds the :attr:`ROW_STRIDE`.
+        """
+        if not 0 <= row_index < cls.ROW_STRIDE or column_index < 0:
+            msg = 'Invalid position (row index: %s, column index: %s). The ' \
+                  'maximum row index is %i.' % (row_index, column_index,
+                                                cls.ROW_STRIDE - 1)
+            raise ValueError(msg)
+        return 1 << (column_index * cls.ROW_STRIDE + row_index)
+
+    @classmethod
+    def from_indices(cls, index_tuples):
+        """
+        Creates a bitmask for the given positions.
+
+        :param index_tuples: The positions as (row index, column index)
+            tuples.
+        """
+        mask = 0
+        for row_index, column_index in index_tuples:
+            mask |= cls.get_bit(row_index, column_index)
+        return cls(mask)
+
+    @classmethod
+    def from_run_length_string(cls, run_length_string):
+        """
+        Creates a bitmask from a string created by the
+        :class:`BinaryRunLengthEncoder` (or :func:`encode_as_run_length_string`).
+
+        :raises ValueError: If the string is invalid.
+        """
+        try:
+            rl_string, row_number = run_length_string.rsplit('_', 1)
+            row_number = int(row_number)
+        except ValueError:
+            msg = 'Invalid run length string "%s".' % (run_length_string)
+            raise ValueError(msg)
+        s62_map = dict([(str(c), i) for i, c
+                        in enumerate(BinaryRunLengthEncoder.S62_NUMBERS)])
+        mask = 0
+        index = 0
+        is_positive = True
+        i = 0
+        while i < len(rl_string):
+            if rl_string[i] == BinaryRunLengthEncoder.TWO_PLACE_MARKER:
+                counter = s62_map[rl_string[i + 1]] * 62 \
+                          + s62_map[rl_string[i + 2]]
+                i += 3
+            else:
+                counter = s62_map[rl_string[i]]
+                i += 1
+            if is_positive:
+                for linear_index in xrange(index, index + counter):
+                    column_index, row_index = divmod(linear_index, row_number)
+                    mask |= cls.get_bit(row_index, column_index)
+            index += counter
+            is_positive = not is_positive
+        return cls(mask)
+
+    def encode_as_run_length_string(self):
+        """
+        Returns the same run-length encoded string as the
+        :class:`BinaryRunLengthEncoder` would return for the positions.
+
+        :raises ValueError: If the bitmask is empty.
+        """
+        if self.mask == 0:
+            raise ValueError('Cannot encode an empty position set.')
+        columns = self.__get_columns()
+        row_bits = 0
+        for column_bits in columns:
+            row_bits |= column_bits
+        row_number = row_bits.bit_length()
+        # One character per position in scanning order (rows within columns).
+        pattern = ''.join([bin(column_bits)[2:].zfill(row_number)[::-1]
+                           for column_bits in columns])
+        run_lengths = []
+        if pattern[0] == '0':
+            run_lengths.append(0)
+        run_lengths.extend([len(list(group)) for _, group
+                            in groupby(pattern)])
+        rl_string = ''.join([self.__encode_counter(counter)
+                             for counter in run_lengths])
+        return '%s_%i' % (rl_string, row_number)
+
+    def __get_columns(self):
+        # Returns the bits of all columns (up to the last positive one).
+        columns = []
+        mask = self.mask
+        while mask:
+            columns.append(mask & self.__COLUMN_MASK)
+            mask >>= self.ROW_STRIDE
+        return columns
+
+    @classmethod
+    def __encode_counter(cls, counter):
+        # Encodes a stretch length in the 62-number system.
+        numbers = BinaryRunLengthEncoder.S62_NUMBERS
+        if counter < 62:
+            return str(numbers[counter])
+        c1, c2 = divmod(counter, 62)
+        return '%s%s%s' % (BinaryRunLengthEncoder.TWO_PLACE_MARKER,
+                           numbers[c1], numbers[c2])
+
+    def contains(self, row_index, column_index):
+        """
+        Checks whether the given position is part of the set.
+        """
+        if not 0 <= row_index < self.ROW_STRIDE or column_index < 0:
+            return False
+        return bool(self.mask & self.get_bit(row_index, column_index))
+
+    def union(self, other):
+        return PositionBitmask(self.mask | other.mask)
+
+    def intersection(self, other):
+        return PositionBitmask(self.mask & other.mask)
+
+    def difference(self, other):
+        return PositionBitmask(self.mask & ~other.mask)
+
+    def issubset(self, other):
+        return self.mask & ~other.mask == 0
+
+    def issuperset(self, other):
+        return other.mask & ~self.mask == 0
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __contains__(self, index_tuple):
+        return self.contains(*index_tuple)
+
+    def __iter__(self):
+        """
+        Iterates over the (row index, column index) tuples (column-wise).
+        """
+        for column_index, column_bits in enumerate(self.__get_columns()):
+            row_index = 0
+            while column_bits:
+                if column_bits & 1:
+                    yield (row_index, column_index)
+                column_bits >>= 1
+                row_index += 1
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    def __eq__(self, other):
+        return isinstance(other, PositionBitmask) and self.mask == other.mask
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def __repr__(self):
+        return '<%s %i positions>' % (self.__class__.__name__, len(self))
+
+
 def encode_index_tuples(position_set):
-    encoder = BinaryRunLengthEncoder(position_set)
-    return encoder.encode_as_run_length_string()
+    return PositionBitmask.from_indices(position_set).\
+                encode_as_run_length_string()
@@ -0,0 +1,409 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+SQL statement instrumentation.
+
+Counts the SQL statements issued through an instrumented engine together
+with the number of returned rows and the time spent in the DB. Statements
+that are issued by ORM lazy loads are attributed to the relationship that
+fired them.
+
+Statistics are collected per thread for all active collections (see
+:func:`collect_sql_statistics`); collections can be nested (e.g. a tool run
+within a REST request). REST requests are instrumented by the
+:func:`sql_statistics_tween_factory` tween, tool runs by
+:class:`thelma.tools.base.BaseTool` (only if the instrumentation has been
+enabled, see :func:`enable_sql_instrumentation`).
+
+Statements issued through raw DB-API cursors bypass the engine listeners;
+such cursors have to be wrapped with :func:`instrument_cursor`.
+"""
+from contextlib import contextmanager
+import logging
+import sys
+import threading
+import time
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event
+from sqlalchemy.orm.strategies import LazyLoader
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['InstrumentedCursor',
+           'SqlStatistics',
+           'check_sql_statement_budget',
+           'collect_sql_statistics',
+           'disable_sql_instrumentation',
+           'enable_sql_instrumentation',
+           'install_sql_instrumentation',
+           'instrument_cursor',
+           'is_sql_instrumentation_enabled',
+           'sql_statistics_tween_factory',
+           ]
+
+
+logger = logging.getLogger(__name__)
+
+#: The engines that have been instrumented already.
+_instrumented_engines = WeakKeyDictionary()
+
+#: Holds the stack of active statistics collections for each thread.
+_collections = threading.local()
+
+#: The key under which the start times of the running statements are
+#: stored in the connection info dictionary.
+_START_TIMES_KEY = 'thelma_statement_start_times'
+
+#: The maximum number of frames to search for a lazy loader.
+_MAX_LAZY_LOAD_FRAME_DEPTH = 60
+
+#: Determines whether tool runs are instrumented (see
+#: :func:`enable_sql_instrumentation`).
+_enabled = False
+
+
+class SqlStatistics(object):
+    """
+    SQL statement statistics for a request or tool run.
+    """
+    #: The default duration in seconds above which statements are recorded
+    #: as slow.
+    SLOW_STATEMENT_THRESHOLD = 0.5
+    #: The maximum number of slow statements to record.
+    MAX_SLOW_STATEMENTS = 10
+
+    def __init__(self, label=None, slow_statement_threshold=None):
+        """
+        Constructor:
+
+        :param str label: Describes the instrumented request or tool run.
+        :param float slow_statement_threshold: The duration in seconds
+            above which statements are recorded as slow.
+        :default slow_statement_threshold: *None* (use
+            :attr:`SLOW_STATEMENT_THRESHOLD`)
+        """
+        #: Describes the instrumented request or tool run.
+        self.label = label
+        if slow_statement_threshold is None:
+            slow_statement_threshold = self.SLOW_STATEMENT_THRESHOLD
+        #: The duration in seconds above which statements are recorded as
+        #: slow.
+        self.slow_statement_threshold = slow_statement_threshold
+        #: The number of issued statements.
+        self.number_statements = 0
+        #: The number of rows returned or affected by the statements (rows
+        #: fetched from server-side cursors are only included if the cursor
+        #: is instrumented, see :class:`InstrumentedCursor`).
+        self.number_rows = 0
+        #: The total time spent executing the statements in seconds.
+        self.duration = 0.0
+        #: Maps the relationships that have been lazy loaded (as string,
+        #: e.g. "Container.sample") onto the number of load statements.
+        self.lazy_loads = {}
+        #: The slow statements as (duration, statement) tuples.
+        self.slow_statements = []
+
+    def add_statement(self, statement, number_rows, duration,
+                      lazy_relationship=None):
+        """
+        Records an executed statement.
+        """
+        self.number_statements += 1
+        self.number_rows += number_rows
+        self.duration += duration
+        if not lazy_relationship is None:
+            self.lazy_loads[lazy_relationship] = \
+                    self.lazy_loads.get(lazy_relationship, 0) + 1
+        if duration > self.slow_statement_threshold \
+                and len(self.slow_statements) < self.MAX_SLOW_STATEMENTS:
+            self.slow_statements.append((duration, statement))
+
+    @property
+    def number_lazy_loads(self):
+        """
+        The total number of lazy load statements.
+        """
+        return sum(self.lazy_loads.values())
+
+    def get_headers(self):
+        """
+        Returns the statistics as HTTP response header map.
+        """
+        return {'X-Thelma-Sql-Statements' : str(self.number_statements),
+                'X-Thelma-Sql-Rows' : str(self.number_rows),
+                'X-Thelma-Sql-Time' : '%.3f' % (self.duration),
+                'X-Thelma-Sql-Lazy-Loads' : str(self.number_lazy_loads)}
+
+    def get_summary(self):
+        """
+        Returns a summary of the statistics (including the most frequently
+        lazy loaded relationships and the slow statements).
+        """
+        summary = '%s: %i SQL statements, %i rows, %.3f s, %i lazy loads' \
+                  % (self.label, self.number_statements, self.number_rows,
+                     self.duration, self.number_lazy_loads)
+        if len(self.lazy_loads) > 0:
+            lazy_loads = sorted(self.lazy_loads.items(),
+                                key=lambda item: item[1], reverse=True)
+            summary += ' (%s)' % (', '.join(['%s: %i' % item
+                                            for item in lazy_loads[:5]]))
+        for duration, statement in self.slow_statements:
+            summary += '\n  slow statement (%.3f s): %s' \
+                       % (duration, ' '.join(statement.split())[:200])
+        return summary
+
+    def __str__(self):
+        return self.get_summary()
+
+    def __repr__(self):
+        str_format = '<%s %s, statements: %i>'
+        params = (self.__class__.__name__, self.label,
+                  self.number_statements)
+        return str_format % params
+
+
+def enable_sql_instrumentation():
+    """
+    Enables the collection of SQL statement statistics for tool runs
+    (set by the ``sql_instrumentation`` setting).
+    """
+    global _enabled # pylint: disable=W0603
+    _enabled = True
+
+
+def disable_sql_instrumentation():
+    """
+    Disables the collection of SQL statement statistics for tool runs.
+    """
+    global _enabled # pylint: disable=W0603
+    _enabled = False
+
+
+def is_sql_instrumentation_enabled():
+    """
+    Checks whether SQL statement statistics are collected for tool runs.
+    """
+    return _enabled
+
+
+def _get_active_collections():
+    # Returns the stack of active statistics for the current thread.
+    try:
+        stack = _collections.stack
+    except AttributeError:
+        stack = _collections.stack = []
+    return stack
+
+
+@contextmanager
+def collect_sql_statistics(label=None, slow_statement_threshold=None):
+    """
+    Context manager collecting the statistics for all statements issued
+    by the current thread within the block: ::
+
+        with collect_sql_statistics('rack verification') as stats:
+            verifier.run()
+        print stats.get_summary()
+
+    :param str label: Describes the instrumented request or tool run.
+    :param float slow_statement_threshold: The duration in seconds above
+        which statements are recorded as slow.
+    :returns: :class:`SqlStatistics`
+    """
+    stats = SqlStatistics(label=label,
+                          slow_statement_threshold=slow_statement_threshold)
+    stack = _get_active_collections()
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+
+@contextmanager
+def check_sql_statement_budget(max_statements, label=None):
+    """
+    Context manager failing if the statements issued by the current thread
+    within the block exceed the given budget (e.g. in tests, see the
+    ``sql_statement_budget`` fixture).
+
+    :param int max_statements: The maximum number of statements.
+    :param str label: Describes the instrumented code.
+    :raises AssertionError: If the budget is exceeded.
+    """
+    with collect_sql_statistics(label=label) as stats:
+        yield stats
+    if stats.number_statements > max_statements:
+        msg = 'SQL statement budget exceeded (%i statements, budget: %i). ' \
+              '%s' % (stats.number_statements, max_statements,
+                      stats.get_summary())
+        raise AssertionError(msg)
+
+
+def _find_lazy_relationship():
+    # Searches the call stack for a lazy loader and returns the
+    # relationship it loads (*None* if the statement is not a lazy load).
+    frame = sys._getframe(2) # pylint: disable=W0212
+    depth = 0
+    while not frame is None and depth < _MAX_LAZY_LOAD_FRAME_DEPTH:
+        loader = frame.f_locals.get('self')
+        if isinstance(loader, LazyLoader):
+            return str(loader.parent_property)
+        frame = frame.f_back
+        depth += 1
+    return None
+
+
+def _record_statement(stack, statement, number_rows, duration,
+                      lazy_relationship=None):
+    # Records the statement in all given statistics collections.
+    for stats in stack:
+        stats.add_statement(statement, number_rows, duration,
+                            lazy_relationship=lazy_relationship)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany): # pylint: disable=W0613
+    if len(_get_active_collections()) > 0:
+        conn.info.setdefault(_START_TIMES_KEY, []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany): # pylint: disable=W0613
+    stack = _get_active_collections()
+    start_times = conn.info.get(_START_TIMES_KEY)
+    if len(stack) > 0 and start_times:
+        duration = time.time() - start_times.pop()
+        number_rows = max(cursor.rowcount, 0)
+        lazy_relationship = _find_lazy_relationship()
+        _record_statement(stack, statement, number_rows, duration,
+                          lazy_relationship=lazy_relationship)
+
+
+class InstrumentedCursor(object):
+    """
+    Wraps a raw DB-API (psycopg2) cursor and records the statements
+    issued through it in the active statistics collections (statements
+    executed on raw cursors are not seen by the engine listeners).
+
+    For named (server-side) cursors, each fetch is a round trip to the DB
+    and is recorded as separate statement together with the number of
+    fetched rows. Iterating over a named cursor is not recorded.
+    """
+    def __init__(self, cursor):
+        """
+        Constructor:
+
+        :param cursor: The DB-API cursor to wrap.
+        """
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, statement, *args, **kw):
+        return self.__call(statement, None, self._cursor.execute,
+                           statement, *args, **kw)
+
+    def executemany(self, statement, *args, **kw):
+        return self.__call(statement, None, self._cursor.executemany,
+                           statement, *args, **kw)
+
+    def callproc(self, procname, *args, **kw):
+        return self.__call('CALL %s' % procname, None,
+                           self._cursor.callproc, procname, *args, **kw)
+
+    def copy_from(self, stream, table, *args, **kw):
+        return self.__call('COPY %s FROM STDIN' % table, None,
+                           self._cursor.copy_from, stream, table,
+                           *args, **kw)
+
+    def copy_expert(self, statement, stream, *args, **kw):
+        return self.__call(statement, None, self._cursor.copy_expert,
+                           statement, stream, *args, **kw)
+
+    def fetchone(self):
+        return self.__fetch(lambda record: int(not record is None),
+                            self._cursor.fetchone)
+
+    def fetchmany(self, *args, **kw):
+        return self.__fetch(len, self._cursor.fetchmany, *args, **kw)
+
+    def fetchall(self):
+        return self.__fetch(len, self._cursor.fetchall)
+
+    def __fetch(self, count_rows, method, *args, **kw):
+        # Fetches from named cursors are round trips to the DB.
+        if self._cursor.name is None:
+            return method(*args, **kw)
+        return self.__call('FETCH FROM %s' % self._cursor.name, count_rows,
+                           method, *args, **kw)
+
+    def __call(self, statement, count_rows, method, *args, **kw):
+        # Calls the cursor method and records the statement (the number of
+        # rows is taken from the cursor unless a count function is passed).
+        stack = _get_active_collections()
+        if len(stack) == 0:
+            return method(*args, **kw)
+        start_time = time.time()
+        result = method(*args, **kw)
+        duration = time.time() - start_time
+        if count_rows is None:
+            number_rows = max(self._cursor.rowcount, 0)
+        else:
+            number_rows = count_rows(result)
+        _record_statement(stack, statement, number_rows, duration)
+        return result
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+def instrument_cursor(cursor):
+    """
+    Wraps the given raw DB-API cursor so that the statements issued
+    through it are counted (see :class:`InstrumentedCursor`).
+    """
+    return InstrumentedCursor(cursor)
+
+
+def install_sql_instrumentation(engine):
+    """
+    Installs the statement listeners for the given engine (repeated calls
+    for the same engine have no effect). As long as no statistics are
+    collected, the listeners do not do anything.
+    """
+    if not engine in _instrumented_engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        _instrumented_engines[engine] = True
+
+
+def sql_statistics_tween_factory(handler, registry):
+    """
+    Pyramid tween factory collecting the SQL statement statistics for each
+    request. The statistics are added to the response headers and a
+    summary is logged.
+
+    The slow statement threshold (in seconds) can be set with the
+    ``sql_slow_statement_threshold`` setting.
+    """
+    threshold = registry.settings.get('sql_slow_statement_threshold')
+    if not threshold is None:
+        threshold = float(threshold)
+
+    def sql_statistics_tween(request):
+        label = '%s %s' % (request.method, request.path_qs)
+        with collect_sql_statistics(label=label,
+                                    slow_statement_threshold=threshold) \
+                                    as stats:
+            response = handler(request)
+        response.headers.update(stats.get_headers())
+        logger.info(stats.get_summary())
+        return response
+    return sql_statistics_tween
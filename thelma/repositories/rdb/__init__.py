@@ -1,3 +1,4 @@
+from thelma.instrumentation import install_sql_instrumentation
 from thelma.repositories.rdb.mappers import initialize_mappers
 from thelma.repositories.rdb.schema import initialize_schema
 
@@ -6,4 +7,5 @@ def create_metadata(engine):
     metadata = initialize_schema()
     initialize_mappers(metadata.tables, metadata.views) # pylint: disable=E1101
     metadata.bind = engine
+    install_sql_instrumentation(engine)
     return metadata
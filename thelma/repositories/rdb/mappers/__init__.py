@@ -151,7 +151,7 @@ def initialize_mappers(tables, views):
                        tables['molecule_design'],
                        tables['molecule_design_pool'])
     species.create_mapper(tables['species'])
-    stockinfo.create_mapper(views['stock_info_view'],
+    stockinfo.create_mapper(tables['stock_info_summary'],
                             tables['molecule_design_set'],
                             tables['molecule_design_set_gene'],
                             tables['refseq_gene'])
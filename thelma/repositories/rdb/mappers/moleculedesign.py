@@ -12,6 +12,8 @@ from thelma.entities.gene import Gene
 from thelma.entities.moleculedesign import MoleculeDesign
 from thelma.entities.moleculetype import MoleculeType
 from thelma.entities.suppliermoleculedesign import SupplierMoleculeDesign
+from thelma.repositories.rdb.mappers.utils import \
+    invalidate_hash_cache_on_change
 
 
 __docformat__ = 'reStructuredText en'
@@ -52,4 +54,6 @@ def create_mapper(molecule_design_tbl, molecule_design_structure_tbl,
           polymorphic_on=molecule_design_tbl.c.molecule_type_id,
           polymorphic_identity=MOLECULE_TYPE,
           )
+    # Discard cached hash strings when the chemical structures change.
+    invalidate_hash_cache_on_change(MoleculeDesign.chemical_structures) # pylint: disable=E1101
     return m
@@ -14,6 +14,8 @@ from thelma.entities.moleculedesign import MOLECULE_DESIGN_SET_TYPES
 from thelma.entities.moleculedesign import MoleculeDesignPool
 from thelma.entities.moleculetype import MoleculeType
 from thelma.entities.suppliermoleculedesign import SupplierMoleculeDesign
+from thelma.repositories.rdb.mappers.utils import \
+    invalidate_hash_cache_on_change
 
 
 __docformat__ = "reStructuredText en"
@@ -52,6 +54,8 @@ def create_mapper(molecule_design_set_mapper, molecule_design_pool_tbl,
                     ),
                polymorphic_identity=MOLECULE_DESIGN_SET_TYPES.POOL)
     event.listen(MoleculeDesignPool, 'init', check_init)
+    # Discard cached hash strings when the molecule designs change.
+    invalidate_hash_cache_on_change(MoleculeDesignPool.molecule_designs) # pylint: disable=E1101
     return m
 
 
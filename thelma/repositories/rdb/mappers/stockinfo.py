@@ -18,18 +18,23 @@ __docformat__ = 'reStructuredText en'
 __all__ = ['create_mapper']
 
 
-def create_mapper(stock_info_vw, molecule_design_set_tbl,
+def create_mapper(stock_info_summary_tbl, molecule_design_set_tbl,
                   molecule_design_set_gene_tbl, refseq_gene_tbl):
-    "Mapper factory."
-    siv = stock_info_vw
+    """
+    Mapper factory.
+
+    Stock infos are mapped to the materialised stock info summary table
+    (see :mod:`thelma.repositories.rdb.schema.views.stockinfo`).
+    """
+    siv = stock_info_summary_tbl
     mds = molecule_design_set_tbl
     mdsg = molecule_design_set_gene_tbl
     rsg = refseq_gene_tbl
-    m = mapper(StockInfo, stock_info_vw,
+    m = mapper(StockInfo, stock_info_summary_tbl,
         id_attribute='stock_info_id',
         slug_expression=lambda cls: as_slug_expression(cls.stock_info_id),
-        primary_key=[stock_info_vw.c.molecule_design_set_id,
-                     stock_info_vw.c.concentration],
+        primary_key=[siv.c.molecule_design_set_id,
+                     siv.c.concentration],
         properties=dict(
             molecule_design_pool=
                     relationship(MoleculeDesignPool,
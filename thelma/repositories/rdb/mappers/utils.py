@@ -4,6 +4,7 @@ See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
 Mapper utilities.
 """
+from sqlalchemy import event
 from sqlalchemy import func
 from sqlalchemy.orm import ColumnProperty
 
@@ -11,6 +12,7 @@ from sqlalchemy.orm import ColumnProperty
 __docformat__ = 'reStructuredText en'
 __all__ = ['CaseInsensitiveComparator',
            'ProxyDict',
+           'invalidate_hash_cache_on_change',
            ]
 
 
@@ -110,3 +112,21 @@ class ProxyDict(object):
             return self._key_func(key)
         else:
             return key
+
+
+def invalidate_hash_cache_on_change(collection_attribute):
+    """
+    Discards the cached hash string of an entity whenever the given
+    collection of the entity changes (the entity class needs to provide
+    an :meth:`invalidate_hash_cache` method).
+
+    :param collection_attribute: The instrumented collection attribute
+        (e.g. ``MoleculeDesignPool.molecule_designs``).
+    """
+    for event_name in ('append', 'remove', 'set'):
+        event.listen(collection_attribute, event_name, _invalidate_hash_cache,
+                     propagate=True)
+
+
+def _invalidate_hash_cache(target, *args): # unused args pylint:disable=W0613
+    target.invalidate_hash_cache()
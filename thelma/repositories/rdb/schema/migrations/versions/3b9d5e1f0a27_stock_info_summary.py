@@ -0,0 +1,164 @@
+"""stock info summary
+
+Revision ID: 3b9d5e1f0a27
+Revises: 1d6d30bd88b6
+Create Date: 2026-10-18 09:12:31.508214
+
+"""
+# revision identifiers, used by Alembic.
+revision = '3b9d5e1f0a27'
+down_revision = '1d6d30bd88b6'
+
+from alembic import op
+import sqlalchemy as sa
+
+# op module has magic attributes pylint: disable=E1101
+
+#: The maintenance functions and triggers for the summary table (as of this
+#: revision; later changes to the live schema need their own revisions).
+_STOCK_INFO_SUMMARY_DDL = """
+CREATE OR REPLACE FUNCTION refresh_stock_info_summary(pool_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+  -- Serialise concurrent refreshes of the same pool.
+  PERFORM pg_advisory_xact_lock(hashtext('stock_info_summary'), pool_id);
+  DELETE FROM stock_info_summary WHERE molecule_design_set_id = pool_id;
+  INSERT INTO stock_info_summary
+    (stock_info_id, molecule_design_set_id, molecule_type_id,
+     concentration, total_tubes, total_volume, minimum_volume,
+     maximum_volume)
+    SELECT stock_info_id, molecule_design_set_id, molecule_type_id,
+           concentration, total_tubes, total_volume, minimum_volume,
+           maximum_volume
+    FROM stock_info_view
+    WHERE molecule_design_set_id = pool_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_stock_info_summary()
+RETURNS INTEGER AS $$
+DECLARE
+  number_records INTEGER;
+BEGIN
+  LOCK TABLE stock_info_summary IN EXCLUSIVE MODE;
+  DELETE FROM stock_info_summary;
+  INSERT INTO stock_info_summary
+    (stock_info_id, molecule_design_set_id, molecule_type_id,
+     concentration, total_tubes, total_volume, minimum_volume,
+     maximum_volume)
+    SELECT stock_info_id, molecule_design_set_id, molecule_type_id,
+           concentration, total_tubes, total_volume, minimum_volume,
+           maximum_volume
+    FROM stock_info_view;
+  GET DIAGNOSTICS number_records = ROW_COUNT;
+  RETURN number_records;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stock_sample_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM refresh_stock_info_summary(OLD.molecule_design_set_id);
+  ELSE
+    PERFORM refresh_stock_info_summary(OLD.molecule_design_set_id);
+    IF NEW.molecule_design_set_id <> OLD.molecule_design_set_id THEN
+      PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sample_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_stock_info_summary(ss.molecule_design_set_id)
+    FROM stock_sample ss
+    WHERE ss.sample_id = NEW.sample_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION container_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_stock_info_summary(pool.molecule_design_set_id)
+    FROM (SELECT DISTINCT ss.molecule_design_set_id
+          FROM sample s
+            INNER JOIN stock_sample ss ON ss.sample_id = s.sample_id
+          WHERE s.container_id = NEW.container_id) AS pool;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION molecule_design_pool_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stock_sample_stock_info
+  AFTER INSERT OR UPDATE OR DELETE ON stock_sample
+  FOR EACH ROW EXECUTE PROCEDURE stock_sample_stock_info_trigger();
+
+CREATE TRIGGER sample_stock_info
+  AFTER UPDATE OF volume, container_id ON sample
+  FOR EACH ROW
+  WHEN (OLD.volume IS DISTINCT FROM NEW.volume
+        OR OLD.container_id IS DISTINCT FROM NEW.container_id)
+  EXECUTE PROCEDURE sample_stock_info_trigger();
+
+CREATE TRIGGER container_stock_info
+  AFTER UPDATE OF item_status ON container
+  FOR EACH ROW
+  WHEN (OLD.item_status IS DISTINCT FROM NEW.item_status)
+  EXECUTE PROCEDURE container_stock_info_trigger();
+
+CREATE TRIGGER molecule_design_pool_stock_info
+  AFTER INSERT ON molecule_design_pool
+  FOR EACH ROW EXECUTE PROCEDURE molecule_design_pool_stock_info_trigger();
+
+SELECT rebuild_stock_info_summary();
+"""
+
+
+def upgrade():
+    op.create_table(
+        'stock_info_summary',
+        sa.Column('stock_info_id', sa.String, nullable=False),
+        sa.Column('molecule_design_set_id', sa.Integer,
+                  sa.ForeignKey('molecule_design_pool.molecule_design_set_id',
+                                ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('molecule_type_id', sa.String(10),
+                  sa.ForeignKey('molecule_type.molecule_type_id'),
+                  nullable=False),
+        sa.Column('concentration', sa.Float, primary_key=True),
+        sa.Column('total_tubes', sa.Integer, nullable=False),
+        sa.Column('total_volume', sa.Float, nullable=False),
+        sa.Column('minimum_volume', sa.Float, nullable=False),
+        sa.Column('maximum_volume', sa.Float, nullable=False)
+        )
+    # Installs the maintenance functions and triggers and populates the
+    # table from the stock info view.
+    op.execute(_STOCK_INFO_SUMMARY_DDL)
+
+
+def downgrade():
+    op.execute('drop trigger molecule_design_pool_stock_info'
+               ' on molecule_design_pool')
+    op.execute('drop trigger container_stock_info on container')
+    op.execute('drop trigger sample_stock_info on sample')
+    op.execute('drop trigger stock_sample_stock_info on stock_sample')
+    op.execute('drop function molecule_design_pool_stock_info_trigger()')
+    op.execute('drop function container_stock_info_trigger()')
+    op.execute('drop function sample_stock_info_trigger()')
+    op.execute('drop function stock_sample_stock_info_trigger()')
+    op.execute('drop function rebuild_stock_info_summary()')
+    op.execute('drop function refresh_stock_info_summary(integer)')
+    op.drop_table('stock_info_summary')
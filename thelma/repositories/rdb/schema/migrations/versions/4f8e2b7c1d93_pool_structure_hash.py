@@ -0,0 +1,47 @@
+"""pool structure hash
+
+Revision ID: 4f8e2b7c1d93
+Revises: 3b9d5e1f0a27
+Create Date: 2026-10-18 14:36:02.719304
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f8e2b7c1d93'
+down_revision = '3b9d5e1f0a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+# op module has magic attributes pylint: disable=E1101
+
+def upgrade():
+    op.add_column('molecule_design_pool',
+                  sa.Column('structure_hash', sa.String))
+    # Fill the new structure hash field from the structure hashes of the
+    # member designs (see MoleculeDesignPool.make_structure_hash). The
+    # structure hashes are sorted bytewise like in Python.
+    op.execute('update molecule_design_pool'
+               ' set structure_hash=tmp.structure_hash'
+               ' from (select mdsm.molecule_design_set_id,'
+               '        md5(string_agg(md.structure_hash, \';\''
+               '            order by md.structure_hash collate "C"))'
+               '        as structure_hash'
+               '       from molecule_design_set_member mdsm'
+               '       inner join molecule_design md'
+               '       on md.molecule_design_id=mdsm.molecule_design_id'
+               '       group by mdsm.molecule_design_set_id) tmp'
+               ' where tmp.molecule_design_set_id='
+               'molecule_design_pool.molecule_design_set_id')
+    op.alter_column('molecule_design_pool', 'structure_hash',
+                    nullable=False)
+    op.create_unique_constraint('molecule_design_pool_structure_hash_key',
+                                'molecule_design_pool', ['structure_hash'])
+
+
+def downgrade():
+    op.drop_constraint('molecule_design_pool_structure_hash_key',
+                       'molecule_design_pool', type_='unique')
+    op.drop_column('molecule_design_pool', 'structure_hash')
+
+# pylint: enable=E1101
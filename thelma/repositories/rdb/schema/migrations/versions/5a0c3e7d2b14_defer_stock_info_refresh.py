@@ -0,0 +1,52 @@
+"""defer stock info refresh
+
+Revision ID: 5a0c3e7d2b14
+Revises: 4f8e2b7c1d93
+Create Date: 2026-10-18 16:05:47.183602
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a0c3e7d2b14'
+down_revision = '4f8e2b7c1d93'
+
+from alembic import op
+
+# op module has magic attributes pylint: disable=E1101
+
+#: The stock sample trigger function body. The first slot takes the check
+#: for the deferred refresh setting.
+_TRIGGER_FUNCTION_TEMPLATE = """
+CREATE OR REPLACE FUNCTION stock_sample_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN%s
+  IF TG_OP = 'INSERT' THEN
+    PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM refresh_stock_info_summary(OLD.molecule_design_set_id);
+  ELSE
+    PERFORM refresh_stock_info_summary(OLD.molecule_design_set_id);
+    IF NEW.molecule_design_set_id <> OLD.molecule_design_set_id THEN
+      PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+#: Lets bulk writers suspend the stock info summary refresh for the current
+#: transaction. The two argument form of current_setting (returning NULL
+#: for unknown settings) requires PostgreSQL 9.6 or later.
+_DEFER_REFRESH_CHECK = """
+  IF current_setting('thelma.defer_stock_info_refresh', true) = 'on' THEN
+    RETURN NULL;
+  END IF;"""
+
+
+def upgrade():
+    op.execute(_TRIGGER_FUNCTION_TEMPLATE % (_DEFER_REFRESH_CHECK))
+
+
+def downgrade():
+    op.execute(_TRIGGER_FUNCTION_TEMPLATE % (''))
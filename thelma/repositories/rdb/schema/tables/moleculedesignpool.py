@@ -29,6 +29,8 @@ def create_table(metadata, molecule_design_set_tbl, molecule_type_tbl):
                             molecule_type_tbl.c.molecule_type_id),
                        key='molecule_type_id', nullable=False),
                 Column('member_hash', String, nullable=False, unique=True),
+                Column('structure_hash', String, nullable=False,
+                       unique=True),
                 Column('number_designs', Integer, nullable=False),
                 Column('default_stock_concentration', Float,
                        CheckConstraint('default_stock_concentration' > 0),
@@ -11,6 +11,11 @@ def initialize_views(metadata, tables):
         tables['sample'],
         tables['container'],
         )
+    stockinfo.create_summary_table(
+        metadata,
+        tables['molecule_design_pool'],
+        tables['molecule_type'],
+        )
     moleculetypemodification.create_view(
         metadata,
         tables['molecule_design'],
@@ -2,9 +2,22 @@
 This file is part of the TheLMA (THe Laboratory Management Application) project.
 See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
-Stock info view.
+Stock info view and its materialised summary table.
+
+Reading the stock info view re-runs the aggregation over the whole stock.
+Therefore, the view results are materialised in the stock info summary
+table (keyed by pool and concentration). On PostgreSQL, triggers on the
+stock sample, sample, container and molecule design pool tables refresh
+the summary records of the affected pools whenever stock samples are
+added or removed, sample volumes or containers change or the item status
+of a container changes (the view does not depend on tube locations).
 """
+from sqlalchemy import Column
+from sqlalchemy import Float
+from sqlalchemy import Integer
 from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy.schema import DDL
 from sqlalchemy.schema import ForeignKey
 from sqlalchemy.sql import and_
 from sqlalchemy.sql import cast
@@ -17,10 +30,20 @@ from thelma.repositories.rdb.view import view_factory
 
 
 __docformat__ = 'reStructuredText en'
-__all__ = ['create_view']
+__all__ = ['DEFER_REFRESH_SETTING',
+           'STOCK_INFO_SUMMARY_DDL',
+           'SUMMARY_TABLE_NAME',
+           'VIEW_NAME',
+           'create_summary_table',
+           'create_view']
 
 
 VIEW_NAME = 'stock_info_view'
+SUMMARY_TABLE_NAME = 'stock_info_summary'
+#: Setting this (transaction local) option to "on" suspends the summary
+#: refresh by the stock sample trigger (requires PostgreSQL 9.6 or later,
+#: see migration 5a0c3e7d2b14).
+DEFER_REFRESH_SETTING = 'thelma.defer_stock_info_refresh'
 _STOCK_CONTAINER_ITEM_STATUS = 'MANAGED'
 _STOCK_CONTAINER_SPECS = 'MATRIX0500'
 
@@ -69,3 +92,153 @@ def create_view(metadata, molecule_design_pool_tbl,
     fkey_mt.parent = stock.c.molecule_type_id
     stock.c.molecule_type_id.foreign_keys.add(fkey_mt)
     return view_factory(VIEW_NAME, metadata, stock)
+
+
+#: Functions and triggers maintaining the stock info summary table (changes
+#: need a schema migration replacing the installed functions).
+#: refresh_stock_info_summary(<pool ID>) recomputes the records for one
+#: pool from the view, rebuild_stock_info_summary() recomputes all records.
+#: Bulk writers can suspend the stock sample trigger for the current
+#: transaction (see :data:`DEFER_REFRESH_SETTING`) and refresh the affected
+#: pools themselves afterwards.
+STOCK_INFO_SUMMARY_DDL = """
+CREATE OR REPLACE FUNCTION refresh_stock_info_summary(pool_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+  -- Serialise concurrent refreshes of the same pool.
+  PERFORM pg_advisory_xact_lock(hashtext('stock_info_summary'), pool_id);
+  DELETE FROM stock_info_summary WHERE molecule_design_set_id = pool_id;
+  INSERT INTO stock_info_summary
+    (stock_info_id, molecule_design_set_id, molecule_type_id,
+     concentration, total_tubes, total_volume, minimum_volume,
+     maximum_volume)
+    SELECT stock_info_id, molecule_design_set_id, molecule_type_id,
+           concentration, total_tubes, total_volume, minimum_volume,
+           maximum_volume
+    FROM stock_info_view
+    WHERE molecule_design_set_id = pool_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_stock_info_summary()
+RETURNS INTEGER AS $$
+DECLARE
+  number_records INTEGER;
+BEGIN
+  LOCK TABLE stock_info_summary IN EXCLUSIVE MODE;
+  DELETE FROM stock_info_summary;
+  INSERT INTO stock_info_summary
+    (stock_info_id, molecule_design_set_id, molecule_type_id,
+     concentration, total_tubes, total_volume, minimum_volume,
+     maximum_volume)
+    SELECT stock_info_id, molecule_design_set_id, molecule_type_id,
+           concentration, total_tubes, total_volume, minimum_volume,
+           maximum_volume
+    FROM stock_info_view;
+  GET DIAGNOSTICS number_records = ROW_COUNT;
+  RETURN number_records;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stock_sample_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF current_setting('thelma.defer_stock_info_refresh', true) = 'on' THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP = 'INSERT' THEN
+    PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM refresh_stock_info_summary(OLD.molecule_design_set_id);
+  ELSE
+    PERFORM refresh_stock_info_summary(OLD.molecule_design_set_id);
+    IF NEW.molecule_design_set_id <> OLD.molecule_design_set_id THEN
+      PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sample_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_stock_info_summary(ss.molecule_design_set_id)
+    FROM stock_sample ss
+    WHERE ss.sample_id = NEW.sample_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION container_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_stock_info_summary(pool.molecule_design_set_id)
+    FROM (SELECT DISTINCT ss.molecule_design_set_id
+          FROM sample s
+            INNER JOIN stock_sample ss ON ss.sample_id = s.sample_id
+          WHERE s.container_id = NEW.container_id) AS pool;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION molecule_design_pool_stock_info_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_stock_info_summary(NEW.molecule_design_set_id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stock_sample_stock_info
+  AFTER INSERT OR UPDATE OR DELETE ON stock_sample
+  FOR EACH ROW EXECUTE PROCEDURE stock_sample_stock_info_trigger();
+
+CREATE TRIGGER sample_stock_info
+  AFTER UPDATE OF volume, container_id ON sample
+  FOR EACH ROW
+  WHEN (OLD.volume IS DISTINCT FROM NEW.volume
+        OR OLD.container_id IS DISTINCT FROM NEW.container_id)
+  EXECUTE PROCEDURE sample_stock_info_trigger();
+
+CREATE TRIGGER container_stock_info
+  AFTER UPDATE OF item_status ON container
+  FOR EACH ROW
+  WHEN (OLD.item_status IS DISTINCT FROM NEW.item_status)
+  EXECUTE PROCEDURE container_stock_info_trigger();
+
+CREATE TRIGGER molecule_design_pool_stock_info
+  AFTER INSERT ON molecule_design_pool
+  FOR EACH ROW EXECUTE PROCEDURE molecule_design_pool_stock_info_trigger();
+
+SELECT rebuild_stock_info_summary();
+"""
+
+
+def create_summary_table(metadata, molecule_design_pool_tbl,
+                         molecule_type_tbl):
+    """
+    stock_info_summary table factory.
+
+    The maintenance functions and triggers are installed (and the table is
+    populated) after the view has been created.
+    """
+    mdp = molecule_design_pool_tbl
+    tbl = Table(SUMMARY_TABLE_NAME, metadata,
+                Column('stock_info_id', String, nullable=False),
+                Column('molecule_design_set_id', Integer,
+                       ForeignKey(mdp.c.molecule_design_set_id,
+                                  ondelete='CASCADE'),
+                       primary_key=True),
+                Column('molecule_type_id', String(10),
+                       ForeignKey(molecule_type_tbl.c.molecule_type_id),
+                       nullable=False),
+                Column('concentration', Float, primary_key=True),
+                Column('total_tubes', Integer, nullable=False),
+                Column('total_volume', Float, nullable=False),
+                Column('minimum_volume', Float, nullable=False),
+                Column('maximum_volume', Float, nullable=False),
+                )
+    DDL(STOCK_INFO_SUMMARY_DDL, on='postgresql'
+        ).execute_at('after-create', metadata)
+    return tbl
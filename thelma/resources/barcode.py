@@ -12,6 +12,7 @@ from thelma.barcodeprinter import BarcodePrinter
 from thelma.barcodeprinter import EmptyBarcode
 from thelma.barcodeprinter import SatoUniLocationBarcode
 from thelma.barcodeprinter import UniTwoLabelRackBarcode
+from thelma.barcodeprinter import get_barcode_print_queue
 from thelma.resources.base import RELATION_BASE_URL
 
 
@@ -48,6 +49,7 @@ class BarcodePrintJobCollection(Collection):
             labels = member.labels.split(",")
         else:
             labels = [''] * len(barcodes)
+        print_barcodes = []
         i = 0
         for barcode in barcodes:
             if barcode_type == "UNIRACK":
@@ -61,6 +63,16 @@ class BarcodePrintJobCollection(Collection):
             else:
                 raise ValueError('"%s" is not a valid barcode type'
                                  % barcode_type)
-            bcp = BarcodePrinter(printer_name)
-            bcp.print_barcode(barcode)
+            print_barcodes.append(barcode)
             i += 1
+        # All labels of the job are sent to the printer with one spool job.
+        # The queue batches concurrent jobs per printer and prints them in
+        # the background; the job ID is passed on to the client (see
+        # PostBarcodePrintJobCollectionView).
+        print_queue = get_barcode_print_queue()
+        if print_queue.is_enabled:
+            job = print_queue.submit(printer_name, print_barcodes)
+            member.get_entity().print_queue_job_id = job.job_id
+        else:
+            bcp = BarcodePrinter(printer_name)
+            bcp.print_barcodes(print_barcodes)
@@ -4,11 +4,16 @@ See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
 Functions to create a WSGI application
 """
+from pyramid.settings import asbool
 from tractor import make_api_from_config
 
 from everest.configuration import Configurator
 from everest.root import RootFactory
+from thelma.barcodeprinter import get_barcode_print_queue
+from thelma.instrumentation import enable_sql_instrumentation
 from thelma.interfaces import ITractor
+from thelma.tools.semiconstants import initialize_semiconstant_caches
+from thelma.tools.stock.index import get_stock_index
 
 
 __docformat__ = "reStructuredText en"
@@ -31,6 +36,18 @@ def create_config(settings, package='thelma', registry=None):
     tractor_config_file = settings['tractor_config_file']
     tractor_api = make_api_from_config(tractor_config_file)
     config.registry.registerUtility(tractor_api, ITractor) # pylint: disable=E1103
+    # process-local stock index for tube picking (built on first use)
+    if asbool(settings.get('stock_index', False)):
+        get_stock_index().enable()
+    # queued barcode printing (worker thread per printer with retries)
+    if asbool(settings.get('barcode_print_queue', False)):
+        get_barcode_print_queue().enable()
+    # SQL statement statistics per request and tool run (response headers
+    # and log)
+    if asbool(settings.get('sql_instrumentation', False)):
+        enable_sql_instrumentation()
+        config.add_tween('thelma.instrumentation.'
+                         'sql_statistics_tween_factory')
     return config
 
 
@@ -42,4 +59,12 @@ def app(global_settings, **local_settings): # pylint: disable=W0613
     ``paster serve``.
     """
     config = create_config(local_settings)
-    return config.make_wsgi_app()
+    wsgi_app = config.make_wsgi_app()
+    # load the semiconstant caches once for the whole process
+    if asbool(local_settings.get('preload_semiconstants', False)):
+        config.begin()
+        try:
+            initialize_semiconstant_caches()
+        finally:
+            config.end()
+    return wsgi_app
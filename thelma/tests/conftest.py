@@ -11,6 +11,7 @@ from everest.entities.utils import get_root_aggregate
 from everest.entities.utils import slug_from_string
 from everest.repositories.rdb.session import ScopedSessionMaker as Session
 from everest.repositories.rdb.testing import RdbContextManager
+from thelma.instrumentation import check_sql_statement_budget
 from thelma.tools.semiconstants import ITEM_STATUS_NAMES
 from thelma.tools.semiconstants import PIPETTING_SPECS_NAMES
 from thelma.tools.semiconstants import RESERVOIR_SPECS_NAMES
@@ -968,3 +969,15 @@ def session():
 def nested_session():
     with RdbContextManager() as sess:
         yield sess
+
+
+@fixture
+def sql_statement_budget():
+    """
+    Returns a context manager failing the test if the SQL statements
+    issued within its block exceed the given budget: ::
+
+        with sql_statement_budget(5):
+            rack_agg.get_by_slug(barcode)
+    """
+    return check_sql_statement_budget
@@ -4,6 +4,7 @@ from everest.repositories.rdb.testing import check_attributes
 from everest.repositories.rdb.testing import persist
 from thelma.entities.moleculedesign import DoubleStrandedDesign
 from thelma.entities.moleculedesign import MoleculeDesign
+from thelma.entities.moleculedesign import MoleculeDesignPool
 from thelma.entities.moleculedesign import SingleStrandedDesign
 from thelma.tests.entity.conftest import TestEntityBase
 
@@ -38,6 +39,28 @@ class TestMoleculeDesignEntity(TestEntityBase):
         # and the retrieval order is undefined.
         persist(nested_session, md, fac.init_kw, False)
 
+    def test_structure_hashes(self, sirna_molecule_design_fac,
+                              compound_molecule_design_fac):
+        md1 = sirna_molecule_design_fac()
+        md2 = compound_molecule_design_fac()
+        css_lists = [md1.chemical_structures, md2.chemical_structures,
+                     list(reversed(md1.chemical_structures))]
+        assert MoleculeDesign.make_structure_hashes(css_lists) == \
+               [md1.structure_hash, md2.structure_hash, md1.structure_hash]
+        with pytest.raises(ValueError):
+            MoleculeDesign.make_structure_hashes([[]])
+
+    def test_structure_hash_string_cache(self, sirna_molecule_design_fac,
+                                         nucleic_acid_chemical_structure_fac):
+        md = sirna_molecule_design_fac()
+        hash_string = md.structure_hash_string
+        assert hash_string == \
+               MoleculeDesign.make_structure_hash_string(
+                                                md.chemical_structures)
+        md.chemical_structures.append(
+            nucleic_acid_chemical_structure_fac(representation='CCCCC'))
+        assert md.structure_hash_string != hash_string
+
 
 class TestMoleculeDesignSetEntity(TestEntityBase):
 
@@ -60,6 +83,15 @@ class TestMoleculeDesignPoolEntity(TestEntityBase):
         mdp = molecule_design_pool_fac()
         persist(nested_session, mdp, molecule_design_pool_fac.init_kw, True)
 
+    def test_hashes(self, molecule_design_pool_fac):
+        mdp = molecule_design_pool_fac()
+        mds = list(mdp.molecule_designs)
+        assert mdp.structure_hash == \
+            MoleculeDesignPool.make_structure_hash(
+                            [md.structure_hash for md in reversed(mds)])
+        assert MoleculeDesignPool.make_member_hashes([mds, mds[::-1]]) == \
+               [MoleculeDesignPool.make_member_hash(mds)] * 2
+
 
 class TestPoolSetEntity(TestEntityBase):
 
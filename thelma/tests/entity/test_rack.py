@@ -157,6 +157,7 @@ class TestRackPosition(TestEntityBase):
         assert rack_pos == \
             RackPosition.from_row_column(rack_pos.label[0],
                                          int(rack_pos.label[1]))
+        assert RackPosition.from_label('ZZ99') is None
 
 
 class TestRackPositionSetEntity(TestEntityBase):
@@ -1,3 +1,9 @@
+import random
+
+import pytest
+
+from thelma.entities.utils import BinaryRunLengthEncoder
+from thelma.entities.utils import PositionBitmask
 from thelma.entities.utils import label_from_number
 from thelma.entities.utils import number_from_label
 
@@ -12,3 +18,72 @@ class TestNumberFromLabel(object):
 
     def test_basic(self):
         assert number_from_label('ag') == 33
+
+
+class TestPositionBitmask(object):
+    # The example pattern from the BinaryRunLengthEncoder documentation:
+    #     0 1 1 0
+    #     1 1 0 1
+    positions = [(1, 0), (0, 1), (1, 1), (0, 2), (1, 3)]
+
+    def test_encode(self):
+        mask = PositionBitmask.from_indices(self.positions)
+        assert mask.encode_as_run_length_string() == '01421_2'
+
+    def test_decode(self):
+        mask = PositionBitmask.from_run_length_string('01421_2')
+        assert mask == PositionBitmask.from_indices(self.positions)
+        assert list(mask) == self.positions
+
+    @pytest.mark.parametrize('number_rows,number_columns,density',
+                             [(8, 12, 0.5), (16, 24, 0.1), (16, 24, 0.9),
+                              (32, 48, 0.05), (32, 48, 1.0)])
+    def test_rle_equivalence(self, number_rows, number_columns, density):
+        rnd = random.Random(number_rows * number_columns)
+        positions = set([(row_index, column_index)
+                         for row_index in range(number_rows)
+                         for column_index in range(number_columns)
+                         if rnd.random() < density])
+        if len(positions) < 1:
+            positions.add((0, 0))
+        expected = \
+            BinaryRunLengthEncoder(positions).encode_as_run_length_string()
+        mask = PositionBitmask.from_indices(positions)
+        assert mask.encode_as_run_length_string() == expected
+        decoded = PositionBitmask.from_run_length_string(expected)
+        assert decoded == mask
+        assert set(decoded) == positions
+
+    def test_long_stretches(self):
+        # Stretches of more than 61 positions use the two place encoding.
+        positions = [(row_index, column_index)
+                     for row_index in range(32) for column_index in range(3)]
+        positions.append((5, 10))
+        expected = \
+            BinaryRunLengthEncoder(positions).encode_as_run_length_string()
+        assert BinaryRunLengthEncoder.TWO_PLACE_MARKER in expected
+        assert PositionBitmask.from_indices(positions).\
+                    encode_as_run_length_string() == expected
+
+    def test_set_operations(self):
+        mask1 = PositionBitmask.from_indices([(0, 0), (1, 0), (2, 5)])
+        mask2 = PositionBitmask.from_indices([(1, 0), (3, 3)])
+        assert set(mask1 | mask2) == set([(0, 0), (1, 0), (2, 5), (3, 3)])
+        assert list(mask1 & mask2) == [(1, 0)]
+        assert set(mask1 - mask2) == set([(0, 0), (2, 5)])
+        assert (mask1 & mask2).issubset(mask1)
+        assert mask1.issuperset(mask1 & mask2)
+        assert not mask1.issubset(mask2)
+        assert len(mask1) == 3
+        assert (2, 5) in mask1
+        assert not (2, 4) in mask1
+        assert not (40, 0) in mask1
+        assert not PositionBitmask()
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            PositionBitmask.get_bit(32, 0)
+        with pytest.raises(ValueError):
+            PositionBitmask().encode_as_run_length_string()
+        with pytest.raises(ValueError):
+            PositionBitmask.from_run_length_string('0142')
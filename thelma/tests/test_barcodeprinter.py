@@ -0,0 +1,116 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the barcode printer driver and print queue.
+"""
+import pytest
+
+from thelma.barcodeprinter import BarcodePrintQueue
+from thelma.barcodeprinter import BarcodePrinter
+from thelma.barcodeprinter import DummySpoolBackend
+from thelma.barcodeprinter import LocationBarcode
+from thelma.barcodeprinter import UniTwoLabelRackBarcode
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestBarcodePrinter',
+           'TestBarcodePrintQueue',
+           ]
+
+
+class TestBarcodePrinter(object):
+
+    def test_print_barcodes(self):
+        backend = DummySpoolBackend()
+        printer = BarcodePrinter('PRINTER', backend=backend)
+        bcs = [UniTwoLabelRackBarcode('02480532', 'label 1'),
+               LocationBarcode('02480533', 'label 2')]
+        printer.print_barcodes(bcs)
+        assert backend.submissions == \
+                [('PRINTER', ''.join([bc.render() for bc in bcs]))]
+
+    def test_dummy_printer(self):
+        printer = BarcodePrinter('BARCODEDUMMY')
+        assert isinstance(printer.backend, DummySpoolBackend)
+        printer.print_barcode(LocationBarcode('02480533', 'label'))
+        assert len(printer.backend.submissions) == 1
+
+
+class TestBarcodePrintQueue(object):
+
+    def test_submit(self):
+        backend = DummySpoolBackend()
+        queue = BarcodePrintQueue(backend=backend)
+        bcs1 = [UniTwoLabelRackBarcode('02480532', 'label 1')]
+        bcs2 = [UniTwoLabelRackBarcode('02480533', 'label 2')]
+        job1 = queue.submit('PRINTER', bcs1)
+        job2 = queue.submit('PRINTER', bcs2)
+        assert job2.job_id > job1.job_id
+        queue.join()
+        assert job1.is_done and job1.error is None
+        assert job2.is_done and job2.error is None
+        assert queue.queue_depth == 0
+        # Jobs for the same printer may have been batched.
+        fmt = ''.join([submission[1] for submission in backend.submissions])
+        assert fmt == ''.join([bc.render() for bc in bcs1 + bcs2])
+        assert queue.metrics.number_jobs == 2
+        assert queue.metrics.number_labels == 2
+        assert queue.metrics.number_failures == 0
+        assert queue.metrics.max_latency >= queue.metrics.average_latency
+
+    def test_retry(self):
+        backend = DummySpoolBackend()
+        backend.failures = 2
+        queue = BarcodePrintQueue(backend=backend, max_retries=2,
+                                  retry_delay=0)
+        job = queue.submit('PRINTER', [LocationBarcode('02480533', 'l')])
+        assert job.wait(10)
+        assert job.error is None
+        assert len(backend.submissions) == 1
+        assert queue.metrics.number_retries == 2
+        assert queue.metrics.number_submissions == 3
+
+    def test_failure(self):
+        backend = DummySpoolBackend()
+        backend.failures = 3
+        queue = BarcodePrintQueue(backend=backend, max_retries=1,
+                                  retry_delay=0)
+        job = queue.submit('PRINTER', [LocationBarcode('02480533', 'l')])
+        assert job.wait(10)
+        assert isinstance(job.error, OSError)
+        assert len(backend.submissions) == 0
+        assert queue.metrics.number_failures == 1
+
+    def test_print_barcodes(self):
+        backend = DummySpoolBackend()
+        queue = BarcodePrintQueue(backend=backend, max_retries=0,
+                                  retry_delay=0)
+        job = queue.print_barcodes('PRINTER',
+                                   [LocationBarcode('02480533', 'l')])
+        assert job.is_done
+        assert len(backend.submissions) == 1
+        backend.failures = 1
+        with pytest.raises(OSError):
+            queue.print_barcodes('PRINTER', [LocationBarcode('02480533', 'l')])
+        assert len(backend.submissions) == 1
+
+    def test_offline_printer(self):
+        backend = DummySpoolBackend()
+        backend.offline_printers.add('OFFLINE')
+        queue = BarcodePrintQueue(backend=backend, max_retries=1,
+                                  retry_delay=1)
+        offline_job = queue.submit('OFFLINE',
+                                   [LocationBarcode('02480532', 'l')])
+        job = queue.submit('PRINTER', [LocationBarcode('02480533', 'l')])
+        # The retries for the offline printer do not hold up other printers.
+        assert job.wait(0.5)
+        assert job.error is None
+        assert not offline_job.is_done
+        assert not queue.join(0)
+        with pytest.raises(OSError):
+            queue.print_barcodes('OFFLINE', [LocationBarcode('02480532', 'l')],
+                                 timeout=0)
+        assert queue.join(10)
+        assert isinstance(offline_job.error, OSError)
+        assert queue.queue_depth == 0
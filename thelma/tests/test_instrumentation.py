@@ -0,0 +1,189 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the SQL statement instrumentation.
+"""
+import pytest
+
+from everest.entities.utils import get_root_aggregate
+from thelma.instrumentation import SqlStatistics
+from thelma.instrumentation import check_sql_statement_budget
+from thelma.instrumentation import collect_sql_statistics
+from thelma.instrumentation import disable_sql_instrumentation
+from thelma.instrumentation import enable_sql_instrumentation
+from thelma.instrumentation import instrument_cursor
+from thelma.interfaces import IRack
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.base import BaseTool
+from thelma.tools.stock.sampleregistration import PoolMemberQuery
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestInstrumentedCursor',
+           'TestSqlStatementBudget',
+           'TestSqlStatistics',
+           'TestSqlStatisticsCollection',
+           'TestToolInstrumentation',
+           ]
+
+
+class _Cursor(object):
+    # Stands in for a DB-API cursor returning the given records.
+    def __init__(self, records, name=None):
+        self.records = list(records)
+        self.name = name
+        self.rowcount = -1
+        self.itersize = 2000
+
+    def execute(self, statement, parameters=None): # pylint: disable=W0613
+        if self.name is None:
+            self.rowcount = len(self.records)
+
+    def copy_from(self, stream, table, columns=None): # pylint: disable=W0613
+        self.rowcount = len(stream.splitlines())
+
+    def fetchmany(self, size):
+        records = self.records[:size]
+        del self.records[:size]
+        return records
+
+
+class _Tool(BaseTool):
+    # Runs the given function.
+    NAME = 'Instrumentation Test Tool'
+
+    def __init__(self, function):
+        BaseTool.__init__(self)
+        self.function = function
+
+    def run(self):
+        self.return_value = self.function()
+
+
+class TestSqlStatistics(object):
+
+    def test_add_statement(self):
+        stats = SqlStatistics(label='test', slow_statement_threshold=1.0)
+        stats.add_statement('SELECT 1', 1, 0.5)
+        stats.add_statement('SELECT 2', 3, 1.5,
+                            lazy_relationship='Container.sample')
+        stats.add_statement('SELECT 3', 0, 0.1,
+                            lazy_relationship='Container.sample')
+        assert stats.number_statements == 3
+        assert stats.number_rows == 4
+        assert abs(stats.duration - 2.1) < 1e-9
+        assert stats.lazy_loads == {'Container.sample' : 2}
+        assert stats.number_lazy_loads == 2
+        assert stats.slow_statements == [(1.5, 'SELECT 2')]
+        assert stats.get_headers()['X-Thelma-Sql-Statements'] == '3'
+        summary = stats.get_summary()
+        assert summary.startswith('test: 3 SQL statements, 4 rows')
+        assert 'Container.sample: 2' in summary
+
+    def test_max_slow_statements(self):
+        stats = SqlStatistics(slow_statement_threshold=0)
+        for i in range(SqlStatistics.MAX_SLOW_STATEMENTS + 5):
+            stats.add_statement('SELECT %i' % i, 0, 1)
+        assert len(stats.slow_statements) == \
+                    SqlStatistics.MAX_SLOW_STATEMENTS
+
+
+class TestInstrumentedCursor(object):
+
+    def test_execute(self):
+        cursor = instrument_cursor(_Cursor([(1,), (2,)]))
+        with collect_sql_statistics() as stats:
+            cursor.execute('SELECT 1')
+            cursor.copy_from('a\nb\nc', 'tube')
+        assert stats.number_statements == 2
+        assert stats.number_rows == 5
+
+    def test_named_cursor_fetches(self):
+        cursor = instrument_cursor(_Cursor([(1,), (2,), (3,)],
+                                           name='test_cursor'))
+        cursor.itersize = 2
+        assert cursor.itersize == 2
+        with collect_sql_statistics() as stats:
+            cursor.execute('SELECT 1')
+            while len(cursor.fetchmany(2)) > 0:
+                pass
+        # DECLARE plus three FETCH round trips (the last one is empty).
+        assert stats.number_statements == 4
+        assert stats.number_rows == 3
+
+    def test_not_collecting(self):
+        cursor = instrument_cursor(_Cursor([(1,)]))
+        cursor.execute('SELECT 1')
+        with collect_sql_statistics() as stats:
+            pass
+        assert stats.number_statements == 0
+
+
+class TestSqlStatisticsCollection(object):
+
+    def test_nested(self):
+        cursor = instrument_cursor(_Cursor([(1,)]))
+        with collect_sql_statistics('outer') as outer_stats:
+            cursor.execute('SELECT 1')
+            with collect_sql_statistics('inner') as inner_stats:
+                cursor.execute('SELECT 2')
+        assert outer_stats.number_statements == 2
+        assert inner_stats.number_statements == 1
+
+    def test_budget(self):
+        cursor = instrument_cursor(_Cursor([(1,)]))
+        with check_sql_statement_budget(1):
+            cursor.execute('SELECT 1')
+        with pytest.raises(AssertionError):
+            with check_sql_statement_budget(1, label='test'):
+                cursor.execute('SELECT 1')
+                cursor.execute('SELECT 2')
+
+
+class TestToolInstrumentation(TestEntityBase):
+
+    def test_disabled(self):
+        tool = _Tool(lambda: instrument_cursor(_Cursor([])).execute('S'))
+        tool.get_result()
+        assert tool.sql_statistics is None
+
+    def test_enabled(self):
+        tool = _Tool(lambda: instrument_cursor(_Cursor([])).execute('S'))
+        enable_sql_instrumentation()
+        try:
+            tool.get_result()
+        finally:
+            disable_sql_instrumentation()
+        assert tool.sql_statistics.label == tool.name
+        assert tool.sql_statistics.number_statements == 1
+
+
+class TestSqlStatementBudget(TestEntityBase):
+
+    def test_rack_get_by_slug(self, sql_statement_budget):
+        rack_agg = get_root_aggregate(IRack)
+        with sql_statement_budget(3) as stats:
+            rack = rack_agg.get_by_slug('02503031')
+        assert not rack is None
+        assert stats.number_statements > 0
+
+    def test_custom_query(self, nested_session, sql_statement_budget,
+                          molecule_design_pool_fac):
+        pool = molecule_design_pool_fac()
+        nested_session.add(pool)
+        nested_session.flush()
+        member_ids = set([md.id for md in pool.molecule_designs])
+        query = PoolMemberQuery([pool.id])
+        # Server-side cursor: DECLARE plus two FETCH round trips.
+        with sql_statement_budget(3) as stats:
+            query.run(nested_session)
+        assert stats.number_statements == 3
+        assert stats.number_rows == len(member_ids)
+        assert set([record[2] for record in query.get_query_results()]) \
+                    == member_ids
+        # Prepared statement: PREPARE (only once per connection) and EXECUTE.
+        query.fetch_size = None
+        with sql_statement_budget(2) as stats:
+            query.run(nested_session)
+        assert stats.number_rows == len(member_ids)
@@ -0,0 +1,90 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the experiment batch worklist writer.
+"""
+from StringIO import StringIO
+
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.experiment import batch
+from thelma.tools.experiment.batch import ExperimentBatchWorklistWriter
+from thelma.tools.writers import read_zip_archive
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestExperimentBatchWorklistWriter',
+           ]
+
+
+class _Writer(object):
+    # Stands in for the experiment writers (printing mode).
+    def __init__(self, file_contents):
+        self.file_contents = file_contents
+        self.return_file_map = False
+
+    def get_result(self):
+        assert self.return_file_map
+        return dict([(fn, StringIO(content))
+                     for fn, content in self.file_contents.iteritems()])
+
+
+class TestExperimentBatchWorklistWriter(TestEntityBase):
+
+    def __create_experiments(self, experiment_fac, experiment_design_fac,
+                             file_contents, monkeypatch):
+        # Creates one experiment per file contents map; the experiment
+        # writers return the files of their experiment.
+        design = experiment_design_fac()
+        experiments = []
+        writers = {}
+        for i, contents in enumerate(file_contents):
+            exp = experiment_fac(label='exp %i' % i,
+                                 experiment_design=design)
+            experiments.append(exp)
+            writers[exp.label] = _Writer(contents)
+
+        def get_writer(experiment, parent=None): # pylint:disable=W0613
+            return writers[experiment.label]
+        monkeypatch.setattr(batch, 'get_experiment_writer', get_writer)
+        return experiments
+
+    def test_replaced_files(self, experiment_fac, experiment_design_fac,
+                            monkeypatch):
+        experiments = self.__create_experiments(
+                            experiment_fac, experiment_design_fac,
+                            [{'a.csv' : 'a0', 'b.csv' : 'b0'},
+                             {'b.csv' : 'b1', 'c.csv' : 'c1'},
+                             {'b.csv' : 'b2'}],
+                            monkeypatch)
+        writer = ExperimentBatchWorklistWriter(experiments, number_threads=1)
+        zip_stream = writer.get_result()
+        assert not writer.has_errors()
+        # The archive is rebuilt with the files of the last experiment.
+        zip_stream.seek(0)
+        file_map = read_zip_archive(zip_stream)
+        assert sorted(file_map.keys()) == ['a.csv', 'b.csv', 'c.csv']
+        assert [file_map[fn].read() for fn in sorted(file_map)] == \
+                    ['a0', 'b2', 'c1']
+        warnings = writer.get_messages()
+        assert len(warnings) == 2
+        assert 'experiment "exp 2" have the same names as files of other ' \
+               'experiments and replace them: b.csv.' in warnings[1]
+
+    def test_archive_error(self, experiment_fac, experiment_design_fac,
+                           monkeypatch):
+        experiments = self.__create_experiments(
+                            experiment_fac, experiment_design_fac,
+                            [{'a.csv' : 'a0'}, {'b.csv' : 'b1'}],
+                            monkeypatch)
+
+        def add_entries(archive, stream_map): # pylint:disable=W0613
+            raise IOError('disk full')
+        monkeypatch.setattr(batch, 'add_zip_archive_entries', add_entries)
+        writer = ExperimentBatchWorklistWriter(experiments, number_threads=1)
+        assert writer.get_result() is None
+        assert writer.has_errors()
+        errors = writer.get_messages()
+        assert len(errors) == 1
+        assert 'Error when trying to add worklist files to the zip ' \
+               'archive: disk full' in errors[0]
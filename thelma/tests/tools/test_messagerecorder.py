@@ -0,0 +1,132 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the message recorder.
+"""
+import logging
+
+from pytest import yield_fixture # pylint: disable=E0611
+
+from thelma.tools.messagerecorder import MessageRecorder
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestMessageRecorder',
+           ]
+
+
+class _Recorder(MessageRecorder):
+    NAME = 'Recorder'
+
+
+class _ChildRecorder(MessageRecorder):
+    NAME = 'Child'
+
+
+class _LimitedRecorder(MessageRecorder):
+    NAME = 'Limited'
+    MAX_MESSAGE_STACK_SIZE = 3
+
+
+class _Argument(object):
+    # Counts how often the argument is converted into a string.
+    def __init__(self):
+        self.format_count = 0
+
+    def __str__(self):
+        self.format_count += 1
+        return 'arg'
+
+
+def _get_logger(recorder_cls):
+    return logging.getLogger(recorder_cls.__module__ + '.'
+                             + recorder_cls.__name__)
+
+
+@yield_fixture
+def log_level():
+    # Sets the level of the recorder loggers (restored afterwards).
+    loggers = [_get_logger(cls) for cls in (_Recorder, _LimitedRecorder)]
+    levels = [logger.level for logger in loggers]
+
+    def set_level(level):
+        for logger in loggers:
+            logger.setLevel(level)
+    yield set_level
+    for logger, level in zip(loggers, levels):
+        logger.setLevel(level)
+
+
+class TestMessageRecorder(object):
+
+    def test_level_gating(self, log_level):
+        log_level(logging.WARNING)
+        recorder = _Recorder()
+        recorder.add_debug('debug')
+        recorder.add_info('info')
+        recorder.add_warning('warning')
+        recorder.add_error('error')
+        assert recorder.get_messages(logging.DEBUG) == \
+                    ['Recorder - warning', 'Recorder - error']
+        assert recorder.suppressed_message_count == 2
+        assert recorder.has_errors()
+        log_level(logging.DEBUG)
+        recorder.reset()
+        recorder.add_debug('debug')
+        assert recorder.get_messages(logging.DEBUG) == ['Recorder - debug']
+        assert recorder.suppressed_message_count == 0
+
+    def test_lazy_formatting(self, log_level):
+        log_level(logging.INFO)
+        recorder = _Recorder()
+        arg = _Argument()
+        recorder.add_debug('Debug %s.', arg)
+        assert arg.format_count == 0
+        recorder.add_info('Info %s.', arg)
+        assert arg.format_count == 1
+        assert recorder.get_messages(logging.INFO) == ['Recorder - Info arg.']
+
+    def test_child_recorder(self, log_level):
+        log_level(logging.INFO)
+        recorder = _Recorder()
+        child = _ChildRecorder(parent=recorder)
+        child.add_debug('debug')
+        child.add_info('Info %i.', 1)
+        assert child.suppressed_message_count == 1
+        assert recorder.suppressed_message_count == 0
+        assert recorder.get_messages(logging.INFO) == \
+                    ['Recorder->Child - Info 1.']
+
+    def test_ring_buffer(self, log_level):
+        log_level(logging.DEBUG)
+        recorder = _LimitedRecorder()
+        recorder.add_warning('warning 0')
+        for i in range(5):
+            recorder.add_info('info %i', i)
+        recorder.add_warning('warning 1')
+        # The oldest info messages are discarded, warnings are kept.
+        assert recorder.get_messages(logging.DEBUG) == \
+                    ['Limited - warning 0', 'Limited - info 2',
+                     'Limited - info 3', 'Limited - info 4',
+                     'Limited - warning 1']
+        assert recorder.get_messages() == \
+                    ['Limited - warning 0', 'Limited - warning 1']
+
+    def test_message_order(self, log_level):
+        log_level(logging.DEBUG)
+        recorder = _LimitedRecorder()
+        recorder.add_info('info 0')
+        recorder.add_error('error 0')
+        recorder.add_debug('debug 0')
+        recorder.add_warning('warning 0')
+        recorder.add_info('info 1')
+        # Messages from the stack and the buffer are merged in recording
+        # order.
+        assert recorder.get_messages(logging.DEBUG) == \
+                    ['Limited - info 0', 'Limited - error 0',
+                     'Limited - debug 0', 'Limited - warning 0',
+                     'Limited - info 1']
+        assert recorder.get_messages(logging.INFO) == \
+                    ['Limited - info 0', 'Limited - error 0',
+                     'Limited - warning 0', 'Limited - info 1']
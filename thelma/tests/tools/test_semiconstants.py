@@ -0,0 +1,87 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the semiconstant caches.
+"""
+from threading import Thread
+
+from sqlalchemy.orm import object_session
+
+from everest.repositories.rdb.session import ScopedSessionMaker as Session
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.semiconstants import CachedEntityKey
+from thelma.tools.semiconstants import ITEM_STATUS_NAMES
+from thelma.tools.semiconstants import RACK_POSITION_LABELS
+from thelma.tools.semiconstants import RACK_SHAPE_NAMES
+from thelma.tools.semiconstants import get_positions_for_shape
+from thelma.tools.semiconstants import get_rack_position_from_indices
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestSemiconstantCache',
+           ]
+
+
+class TestSemiconstantCache(TestEntityBase):
+
+    def test_keys_cached(self):
+        status = ITEM_STATUS_NAMES.from_name(ITEM_STATUS_NAMES.MANAGED)
+        key = ITEM_STATUS_NAMES._get_cache()[ITEM_STATUS_NAMES.MANAGED] # pylint: disable=W0212
+        assert isinstance(key, CachedEntityKey)
+        assert key.id == status.id
+        assert object_session(status) is Session()
+        assert ITEM_STATUS_NAMES.from_name(ITEM_STATUS_NAMES.MANAGED) \
+                    is status
+
+    def test_positions(self):
+        positions = get_positions_for_shape(RACK_SHAPE_NAMES.SHAPE_96)
+        assert len(positions) == 96
+        assert positions[13] is get_rack_position_from_indices(1, 1)
+        assert positions[13].label == 'B2'
+        session = Session()
+        assert all([object_session(pos) is session for pos in positions])
+
+    def test_new_session(self, sql_statement_budget):
+        status = ITEM_STATUS_NAMES.from_name(ITEM_STATUS_NAMES.MANAGED)
+        get_positions_for_shape(RACK_SHAPE_NAMES.SHAPE_96)
+        results = []
+        errors = []
+
+        def look_up():
+            # The thread has its own session. Once the caches are loaded,
+            # lookups must not access the DB.
+            try:
+                with sql_statement_budget(0):
+                    results.append(ITEM_STATUS_NAMES.from_name(
+                                                ITEM_STATUS_NAMES.MANAGED))
+                    results.append(get_positions_for_shape(
+                                                RACK_SHAPE_NAMES.SHAPE_96)[13])
+                    results.append(Session())
+            except AssertionError as error:
+                errors.append(error)
+        thread = Thread(target=look_up)
+        thread.start()
+        thread.join()
+        assert errors == []
+        thread_status, thread_pos, thread_session = results
+        assert not thread_session is Session()
+        assert object_session(thread_status) is thread_session
+        assert not thread_status is status
+        assert thread_status.id == status.id
+        assert thread_pos.label == 'B2'
+        assert object_session(thread_pos) is thread_session
+
+    def test_statistics(self):
+        RACK_POSITION_LABELS.initialize_cache()
+        before = RACK_POSITION_LABELS.get_statistics()['hits']
+
+        def count_lookups():
+            for _ in range(1000):
+                RACK_POSITION_LABELS._count_lookup(True) # pylint: disable=W0212
+        threads = [Thread(target=count_lookups) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert RACK_POSITION_LABELS.get_statistics()['hits'] == before + 4000
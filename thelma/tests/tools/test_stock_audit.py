@@ -0,0 +1,80 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the stock audit reporter.
+"""
+import os
+
+from everest.repositories.rdb.session import ScopedSessionMaker as Session
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.stock.audit import StockAuditReporter
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestStockAuditReporter',
+           ]
+
+
+class TestStockAuditReporter(TestEntityBase):
+    MOLECULE_TYPE = 'MIRNA_MIMI'
+
+    def __run(self, output_file, **kw):
+        reporter = StockAuditReporter(self.MOLECULE_TYPE, output_file, **kw)
+        result = reporter.get_result()
+        assert not reporter.has_errors()
+        return result
+
+    def __count_records(self, file_names):
+        # Returns the number of records in the given report files (without
+        # the header lines).
+        number_records = 0
+        for file_name in file_names:
+            with open(file_name) as report_file:
+                lines = report_file.read().splitlines()
+            assert lines[0].startswith('"Cenix Pool ID"')
+            number_records += len(lines) - 1
+        return number_records
+
+    def test_concentration_partitions(self, tmpdir):
+        output_file = str(tmpdir.join('audit.csv'))
+        assert self.__run(output_file) == output_file
+        number_records = self.__count_records([output_file])
+        file_names = self.__run(output_file, partition_by='concentration',
+                                concentration_bands=[50, 10],
+                                number_threads=2)
+        assert [os.path.basename(fn) for fn in file_names] == \
+                    ['audit_below_10uM.csv', 'audit_10_to_50uM.csv',
+                     'audit_50uM_and_above.csv']
+        # Every record is exported into exactly one partition.
+        assert self.__count_records(file_names) == number_records
+
+    def test_supplier_partitions(self, tmpdir):
+        output_file = str(tmpdir.join('audit.csv'))
+        number_records = self.__count_records([self.__run(output_file)])
+        file_names = self.__run(output_file, partition_by='supplier')
+        # Samples without stock sample supplier have their own partition.
+        assert file_names[-1] == str(tmpdir.join('audit_unassigned.csv'))
+        assert self.__count_records(file_names) == number_records
+
+    def test_watermark(self, tmpdir):
+        output_file = str(tmpdir.join('audit.csv'))
+        watermark_file = str(tmpdir.join('watermark.txt'))
+        number_records = self.__count_records([self.__run(output_file)])
+        # Without watermark file, a full audit is run.
+        self.__run(output_file, watermark_file=watermark_file)
+        assert self.__count_records([output_file]) == number_records
+        with open(watermark_file) as wm_file:
+            watermark = wm_file.read()
+        # The watermark lies before the start of the open transactions.
+        is_before = Session().execute(
+                    "SELECT CAST(:watermark AS timestamptz) "
+                    "<= now() - interval '%i seconds'"
+                    % (StockAuditReporter.WATERMARK_OVERLAP),
+                    params=dict(watermark=watermark)).scalar()
+        assert is_before
+        # Incremental audits only export changes after the watermark.
+        with open(watermark_file, 'w') as wm_file:
+            wm_file.write('2999-01-01 00:00:00+00')
+        self.__run(output_file, watermark_file=watermark_file)
+        assert self.__count_records([output_file]) == 0
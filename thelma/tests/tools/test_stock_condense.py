@@ -0,0 +1,218 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the stock condenser.
+"""
+import csv
+
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.semiconstants import get_rack_position_from_indices
+from thelma.tools.stock.condense import CONDENSE_STRATEGIES
+from thelma.tools.stock.condense import CondenseRackQuery
+from thelma.tools.stock.condense import StockCondenseRack
+from thelma.tools.stock.condense import StockCondenseReportWriter
+from thelma.tools.stock.condense import StockCondenser
+from thelma.tools.stock.condense import TubeCountIndex
+from thelma.tools.worklists.tubehandler import XL20WorklistWriter
+from thelma.tools.writers import read_zip_archive
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestStockCondenser',
+           'TestTubeCountIndex',
+           ]
+
+
+def _make_racks(tube_counts):
+    # Creates one stock condense rack for each tube count (the barcodes are
+    # derived from the positions in the list).
+    return [StockCondenseRack('0250%04i' % (i), tube_count)
+            for i, tube_count in enumerate(tube_counts)]
+
+
+def _make_tube_count_map(racks):
+    # Maps the given racks onto their tube counts.
+    tube_count_map = dict()
+    for rack in racks:
+        tube_count_map.setdefault(rack.tube_count, []).append(rack)
+    return tube_count_map
+
+
+class TestTubeCountIndex(object):
+
+    def test_init(self):
+        racks = _make_racks([30, 10, 20, 10])
+        index = TubeCountIndex(_make_tube_count_map(racks))
+        assert len(index) == 3
+        assert index.get_lowest_tube_count() == 10
+        # Racks with the same count are returned in removal order.
+        assert index.get_racks() == [racks[3], racks[1], racks[2], racks[0]]
+
+    def test_init_empty(self):
+        index = TubeCountIndex({10 : []})
+        assert len(index) == 0
+        assert index.get_lowest_tube_count() is None
+        assert index.get_racks() == []
+        assert len(TubeCountIndex()) == 0
+
+    def test_add_pop(self):
+        racks = _make_racks([20, 20, 5])
+        index = TubeCountIndex()
+        for rack in racks:
+            index.add(rack.tube_count, rack)
+        assert index.get_lowest_tube_count() == 5
+        assert index.pop(20) is racks[1]
+        assert index.pop(20) is racks[0]
+        assert index.pop(20) is None
+        assert len(index) == 1
+        assert index.pop(5) is racks[2]
+        assert index.get_lowest_tube_count() is None
+        assert index.pop(5) is None
+
+    def test_neighbours(self):
+        index = TubeCountIndex(_make_tube_count_map(
+                                            _make_racks([10, 20, 40, 80])))
+        assert index.get_next_higher_tube_count(20, 96) == 40
+        assert index.get_next_higher_tube_count(15, 96) == 20
+        assert index.get_next_higher_tube_count(40, 80) is None
+        assert index.get_next_higher_tube_count(80, 96) is None
+        assert index.get_next_lower_tube_count(40) == 20
+        assert index.get_next_lower_tube_count(45) == 40
+        assert index.get_next_lower_tube_count(10) is None
+        # Removing the last rack of a count removes the count.
+        index.pop(40)
+        assert index.get_next_higher_tube_count(20, 96) == 80
+        assert index.get_next_lower_tube_count(80) == 20
+
+
+class TestStockCondenser(TestEntityBase):
+    #: Tube counts of the racks created for the tests.
+    TUBE_COUNTS = [1, 2, 30, 40, 45]
+
+    def __create_racks(self, session, tube_rack_fac, tube_fac, tube_counts):
+        # Creates stock racks with the given numbers of tubes (the tubes
+        # occupy the first positions) and returns the rack barcodes.
+        racks = []
+        tube_number = 0
+        for tube_count in tube_counts:
+            tube_rack = tube_rack_fac()
+            for i in range(tube_count):
+                tube = tube_fac(barcode='10199%05i' % (tube_number))
+                tube_number += 1
+                rack_pos = get_rack_position_from_indices(
+                                        row_index=i // 12, column_index=i % 12)
+                tube_rack.add_tube(tube, rack_pos)
+            session.add(tube_rack)
+            racks.append(tube_rack)
+        session.flush()
+        return [tube_rack.barcode for tube_rack in racks]
+
+    def __condense(self, session, rack_barcodes, **kw):
+        # Runs the condenser for the given racks only (all other stock racks
+        # are excluded). Returns the worklist rows (without header) and the
+        # report.
+        query = CondenseRackQuery()
+        try:
+            query.run(session)
+        finally:
+            CondenseRackQuery.shut_down()
+        excluded_racks = kw.pop('excluded_racks', [])
+        for racks in query.get_query_results().values():
+            excluded_racks.extend([scr.rack_barcode for scr in racks
+                                   if not scr.rack_barcode in rack_barcodes])
+        condenser = StockCondenser(excluded_racks=excluded_racks, **kw)
+        zip_map = read_zip_archive(condenser.get_result())
+        assert not condenser.has_errors()
+        worklist_stream = zip_map[StockCondenser.WORKLIST_FILE_NAME]
+        rows = list(csv.reader(worklist_stream))
+        assert rows[0] == [XL20WorklistWriter.SOURCE_RACK_HEADER,
+                           XL20WorklistWriter.SOURCE_POSITION_HEADER,
+                           XL20WorklistWriter.TUBE_BARCODE_HEADER,
+                           XL20WorklistWriter.DEST_RACK_HEADER,
+                           XL20WorklistWriter.DEST_POSITION_HEADER]
+        report = zip_map[StockCondenser.REPORT_FILE_NAME].getvalue()
+        self.__check_worklist(rows[1:])
+        return rows[1:], report
+
+    def __check_worklist(self, rows):
+        # No rack is donor and receiver at a time, each tube is moved once
+        # and each target position takes up only one tube.
+        source_racks = set([row[0] for row in rows])
+        target_racks = set([row[3] for row in rows])
+        assert source_racks.isdisjoint(target_racks)
+        target_positions = [(row[3], row[4]) for row in rows]
+        assert len(set(target_positions)) == len(target_positions)
+        assert len(set([row[2] for row in rows])) == len(rows)
+
+    def __get_moves(self, rows):
+        # Returns the number of moved tubes for each pair of source and
+        # destination rack.
+        moves = dict()
+        for row in rows:
+            key = (row[0], row[3])
+            moves[key] = moves.get(key, 0) + 1
+        return moves
+
+    def __check_report(self, report, strategy, racks_emptied, tubes_moved):
+        lines = report.splitlines()
+        assert StockCondenseReportWriter.STRATEGY_LINE % (strategy) in lines
+        assert StockCondenseReportWriter.RACKS_EMPTIED_LINE \
+                    % (racks_emptied) in lines
+        assert StockCondenseReportWriter.TUBES_MOVED_LINE \
+                    % (tubes_moved) in lines
+
+    def test_best_fit(self, nested_session, tube_rack_fac, tube_fac):
+        barcodes = self.__create_racks(nested_session, tube_rack_fac,
+                                       tube_fac, self.TUBE_COUNTS)
+        rows, report = self.__condense(nested_session, barcodes,
+                                strategy=CONDENSE_STRATEGIES.BIN_PACKING)
+        # The three emptiest racks are emptied into the fullest rack that
+        # can take up all their tubes.
+        assert self.__get_moves(rows) == {(barcodes[0], barcodes[4]) : 1,
+                                          (barcodes[1], barcodes[4]) : 2,
+                                          (barcodes[2], barcodes[4]) : 30}
+        # The tubes are placed on the free positions of the receiver.
+        assert sorted([row[4] for row in rows]) == \
+                    sorted([get_rack_position_from_indices(
+                                row_index=i // 12, column_index=i % 12).label
+                            for i in range(45, 78)])
+        self.__check_report(report, CONDENSE_STRATEGIES.BIN_PACKING, 3, 33)
+
+    def test_greedy(self, nested_session, tube_rack_fac, tube_fac):
+        barcodes = self.__create_racks(nested_session, tube_rack_fac,
+                                       tube_fac, self.TUBE_COUNTS)
+        rows, report = self.__condense(nested_session, barcodes)
+        assert self.__get_moves(rows) == {(barcodes[0], barcodes[4]) : 1,
+                                          (barcodes[1], barcodes[4]) : 2,
+                                          (barcodes[2], barcodes[4]) : 30}
+        self.__check_report(report, CONDENSE_STRATEGIES.GREEDY, 3, 33)
+
+    def test_racks_to_empty(self, nested_session, tube_rack_fac, tube_fac):
+        barcodes = self.__create_racks(nested_session, tube_rack_fac,
+                                       tube_fac, self.TUBE_COUNTS)
+        rows, report = self.__condense(nested_session, barcodes,
+                                racks_to_empty=1,
+                                strategy=CONDENSE_STRATEGIES.BIN_PACKING)
+        assert self.__get_moves(rows) == {(barcodes[0], barcodes[4]) : 1}
+        self.__check_report(report, CONDENSE_STRATEGIES.BIN_PACKING, 1, 1)
+
+    def test_excluded_racks(self, nested_session, tube_rack_fac, tube_fac):
+        barcodes = self.__create_racks(nested_session, tube_rack_fac,
+                                       tube_fac, self.TUBE_COUNTS)
+        rows, report = self.__condense(nested_session, barcodes,
+                                excluded_racks=[barcodes[0]],
+                                strategy=CONDENSE_STRATEGIES.BIN_PACKING)
+        assert self.__get_moves(rows) == {(barcodes[1], barcodes[4]) : 2,
+                                          (barcodes[2], barcodes[4]) : 30}
+        self.__check_report(report, CONDENSE_STRATEGIES.BIN_PACKING, 2, 32)
+
+    def test_split(self, nested_session, tube_rack_fac, tube_fac):
+        barcodes = self.__create_racks(nested_session, tube_rack_fac,
+                                       tube_fac, [4, 93, 94])
+        rows, report = self.__condense(nested_session, barcodes,
+                                strategy=CONDENSE_STRATEGIES.BIN_PACKING)
+        # No receiver can take up all 4 tubes.
+        assert self.__get_moves(rows) == {(barcodes[0], barcodes[1]) : 3,
+                                          (barcodes[0], barcodes[2]) : 1}
+        self.__check_report(report, CONDENSE_STRATEGIES.BIN_PACKING, 1, 4)
@@ -0,0 +1,104 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the process-local stock index.
+"""
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.stock.index import StockIndex
+from thelma.tools.stock.index import get_stock_index
+from thelma.tools.utils.base import CONCENTRATION_CONVERSION_FACTOR
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestStockIndexInvalidation',
+           'TestStockIndexRefresh',
+           ]
+
+
+class _Session(object):
+    # Stands in for a DB session (must be weak-referenceable).
+    pass
+
+
+class TestStockIndexInvalidation(object):
+
+    def test_stale_after_commit(self):
+        index = StockIndex()
+        index.enable()
+        session = _Session()
+        index.mark_stale(['1019999999'], session)
+        # Uncommitted changes must not trigger a reload.
+        assert index.stale_tube_barcodes == frozenset()
+        index.session_committed(session)
+        assert index.stale_tube_barcodes == frozenset(['1019999999'])
+
+    def test_stale_per_session(self):
+        index = StockIndex()
+        index.enable()
+        session1 = _Session()
+        session2 = _Session()
+        index.mark_stale(['1019999998'], session1)
+        index.mark_stale(['1019999999'], session2)
+        index.session_committed(session2)
+        assert index.stale_tube_barcodes == frozenset(['1019999999'])
+        index.session_committed(session1)
+        assert index.stale_tube_barcodes == \
+                    frozenset(['1019999998', '1019999999'])
+
+    def test_disabled(self):
+        index = StockIndex()
+        session = _Session()
+        index.mark_stale(['1019999999'], session)
+        index.session_committed(session)
+        assert index.stale_tube_barcodes == frozenset()
+
+
+class TestStockIndexRefresh(TestEntityBase):
+
+    def __create_stock_sample(self, session, stock_sample_fac,
+                              tube_rack_fac, rack_position_fac):
+        stock_spl = stock_sample_fac()
+        tube_rack = tube_rack_fac()
+        tube_rack.add_tube(stock_spl.container, rack_position_fac())
+        session.add(tube_rack)
+        session.add(stock_spl)
+        session.flush()
+        return stock_spl
+
+    def test_flush_hook(self, nested_session, stock_sample_fac,
+                        tube_rack_fac, rack_position_fac):
+        stock_index = get_stock_index()
+        stock_index.enable()
+        try:
+            stock_spl = self.__create_stock_sample(nested_session,
+                                                   stock_sample_fac,
+                                                   tube_rack_fac,
+                                                   rack_position_fac)
+            stock_index.session_committed(nested_session)
+            assert stock_spl.container.barcode \
+                        in stock_index.stale_tube_barcodes
+        finally:
+            stock_index.disable()
+
+    def test_refresh(self, nested_session, stock_sample_fac, tube_rack_fac,
+                     rack_position_fac):
+        stock_spl = self.__create_stock_sample(nested_session,
+                                               stock_sample_fac,
+                                               tube_rack_fac,
+                                               rack_position_fac)
+        pool_id = stock_spl.molecule_design_pool.id
+        conc = stock_spl.concentration * CONCENTRATION_CONVERSION_FACTOR
+        index = StockIndex()
+        index.enable()
+        index.build(nested_session)
+        assert index.get_stock_sample_map([pool_id], conc) \
+                    == {pool_id : [stock_spl.id]}
+        # Drop the volume below the stock dead volume.
+        stock_spl.volume = 1e-6
+        nested_session.flush()
+        index.mark_stale([stock_spl.container.barcode], nested_session)
+        index.session_committed(nested_session)
+        index.refresh(nested_session)
+        assert index.stale_tube_barcodes == frozenset()
+        assert index.get_stock_sample_map([pool_id], conc) == {}
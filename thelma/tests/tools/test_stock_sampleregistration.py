@@ -0,0 +1,156 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the sample registrar.
+"""
+from thelma.entities.chemicalstructure import CHEMICAL_STRUCTURE_TYPE_IDS
+from thelma.entities.chemicalstructure import CompoundChemicalStructure
+from thelma.entities.chemicalstructure import ModificationChemicalStructure
+from thelma.entities.chemicalstructure import NucleicAcidChemicalStructure
+from thelma.entities.sampleregistration import SampleRegistrationItem
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.stock.sampleregistration import ChemicalStructureResolver
+from thelma.tools.stock.sampleregistration import SampleRegistrar
+from thelma.tools.stock.stockinfo import StockInfoSummaryChecker
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestChemicalStructureResolver',
+           'TestSampleRegistrarBulk',
+           ]
+
+
+#: Fetches the rows written for the registered tubes (without generated
+#: IDs and time stamps).
+_REGISTERED_ROWS_QUERY = '''
+SELECT t.barcode, c.container_specs_id, c.item_status, c.container_type,
+       rp.label, s.sample_type, s.volume, ss.molecule_design_set_id,
+       ss.supplier_id, ss.molecule_type, ss.concentration, sr.volume,
+       m.molecule_design_id, m.supplier_id, sm.concentration,
+       sm.freeze_thaw_cycles
+FROM tube t
+INNER JOIN container c ON c.container_id = t.container_id
+INNER JOIN tube_location tl ON tl.container_id = t.container_id
+INNER JOIN rack_position rp ON rp.rack_position_id = tl.rack_position_id
+INNER JOIN sample s ON s.container_id = t.container_id
+INNER JOIN stock_sample ss ON ss.sample_id = s.sample_id
+INNER JOIN sample_registration sr ON sr.sample_id = s.sample_id
+INNER JOIN sample_molecule sm ON sm.sample_id = s.sample_id
+INNER JOIN molecule m ON m.molecule_id = sm.molecule_id
+WHERE t.barcode IN :barcodes
+ORDER BY t.barcode, m.molecule_design_id'''
+
+
+class TestSampleRegistrarBulk(TestEntityBase):
+
+    def __register(self, session, bulk, tube_barcodes, rack_barcode, pools,
+                   supplier, rack_positions):
+        items = [SampleRegistrationItem(supplier, 5e-5, 2e-4, pool,
+                                        tube_barcode=tube_bc,
+                                        rack_barcode=rack_barcode,
+                                        rack_position=rack_pos)
+                 for tube_bc, pool, rack_pos
+                 in zip(tube_barcodes, pools, rack_positions)]
+        registrar = SampleRegistrar(items, bulk=bulk)
+        registrar.run()
+        assert not registrar.has_errors()
+        session.flush()
+        rows = session.execute(_REGISTERED_ROWS_QUERY,
+                               params=dict(barcodes=tuple(tube_barcodes))
+                               ).fetchall()
+        # Replace the tube barcodes with their index.
+        return [(tube_barcodes.index(row[0]),) + tuple(row[1:])
+                for row in rows]
+
+    def test_bulk_rows(self, nested_session, molecule_design_pool_fac,
+                       organization_fac, rack_position_fac):
+        pools = [molecule_design_pool_fac(), molecule_design_pool_fac()]
+        supplier = organization_fac()
+        nested_session.add(supplier)
+        for pool in pools:
+            nested_session.add(pool)
+        nested_session.flush()
+        rack_positions = [rack_position_fac(row_index=0, column_index=0),
+                          rack_position_fac(row_index=0, column_index=1)]
+        orm_rows = self.__register(nested_session, False,
+                                   ['1019999990', '1019999991'], 'SUP0001',
+                                   pools, supplier, rack_positions)
+        bulk_rows = self.__register(nested_session, True,
+                                    ['1019999992', '1019999993'], 'SUP0002',
+                                    pools, supplier, rack_positions)
+        assert len(orm_rows) > 0
+        assert bulk_rows == orm_rows
+        # The deferred summary refresh has been run for the pools.
+        checker = StockInfoSummaryChecker(pool_ids=[pool.id
+                                                    for pool in pools])
+        assert checker.get_result() == []
+
+
+class TestChemicalStructureResolver(TestEntityBase):
+    #: Representation shared by structures of two types (non-ASCII).
+    SHARED_REPRESENTATION = u'TEST-\u00e9\u00df-C(=O)O'
+
+    def __create_structures(self, session):
+        structures = [NucleicAcidChemicalStructure('ACGUACGUACGUACGUACGUCC'),
+                      CompoundChemicalStructure(self.SHARED_REPRESENTATION),
+                      ModificationChemicalStructure(
+                                            self.SHARED_REPRESENTATION)]
+        for structure in structures:
+            session.add(structure)
+        session.flush()
+        return structures
+
+    def __get_dummy_keys(self, number_keys):
+        # Keys of structures that do not exist.
+        return [(CHEMICAL_STRUCTURE_TYPE_IDS.NUCLEIC_ACID, 'TESTDUMMY%06i' % i)
+                for i in range(number_keys)]
+
+    def test_resolve(self, nested_session):
+        na_cs, compound_cs, modification_cs = \
+                                    self.__create_structures(nested_session)
+        resolver = ChemicalStructureResolver(nested_session)
+        na_key = (na_cs.structure_type_id, na_cs.representation)
+        compound_key = (CHEMICAL_STRUCTURE_TYPE_IDS.COMPOUND,
+                        self.SHARED_REPRESENTATION)
+        missing_key = (CHEMICAL_STRUCTURE_TYPE_IDS.COMPOUND,
+                       na_cs.representation)
+        cs_map = resolver.resolve([na_key, compound_key, compound_key,
+                                   missing_key])
+        # The representation hashes are matched per structure type.
+        assert cs_map == {na_key : na_cs, compound_key : compound_cs}
+        modification_key = (CHEMICAL_STRUCTURE_TYPE_IDS.MODIFICATION,
+                            self.SHARED_REPRESENTATION)
+        # Byte string representations match the UTF-8 encoded ones.
+        utf8_key = (CHEMICAL_STRUCTURE_TYPE_IDS.MODIFICATION,
+                    self.SHARED_REPRESENTATION.encode('utf-8'))
+        cs_map = resolver.resolve([modification_key, utf8_key])
+        assert cs_map == {modification_key : modification_cs}
+        assert resolver.resolve([]) == {}
+
+    def test_chunks(self, nested_session, sql_statement_budget):
+        na_cs = self.__create_structures(nested_session)[0]
+        resolver = ChemicalStructureResolver(nested_session)
+        chunk_size = ChemicalStructureResolver.CHUNK_SIZE
+        na_key = (na_cs.structure_type_id, na_cs.representation)
+        keys = self.__get_dummy_keys(chunk_size - 1) + [na_key]
+        with sql_statement_budget(1):
+            cs_map = resolver.resolve(keys)
+        assert cs_map == {na_key : na_cs}
+        keys = self.__get_dummy_keys(chunk_size) + [na_key]
+        with sql_statement_budget(2) as stats:
+            cs_map = resolver.resolve(keys)
+        assert stats.number_statements == 2
+        assert cs_map == {na_key : na_cs}
+
+    def test_bulk_lookup(self, nested_session, sql_statement_budget):
+        # Looks up 50000 structures (one query per chunk and type).
+        na_cs, compound_cs, _ = self.__create_structures(nested_session)
+        resolver = ChemicalStructureResolver(nested_session)
+        keys = self.__get_dummy_keys(49998) \
+               + [(na_cs.structure_type_id, na_cs.representation),
+                  (compound_cs.structure_type_id, compound_cs.representation)]
+        with sql_statement_budget(6) as stats:
+            cs_map = resolver.resolve(keys)
+        assert stats.number_statements == 6
+        assert len(cs_map) == 2
@@ -0,0 +1,91 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the stock info summary maintenance tools.
+"""
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.stock.stockinfo import StockInfoSummaryChecker
+from thelma.tools.stock.stockinfo import StockInfoSummaryDifferenceQuery
+from thelma.tools.stock.stockinfo import StockInfoSummaryRebuilder
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestStockInfoSummaryTools',
+           ]
+
+
+class TestStockInfoSummaryTools(TestEntityBase):
+
+    def __create_pool(self, session, stock_sample_fac, tube_rack_fac,
+                      rack_position_fac):
+        # Creates a stock sample (the summary is maintained by the triggers)
+        # and returns the ID of its pool.
+        stock_spl = stock_sample_fac()
+        tube_rack = tube_rack_fac()
+        tube_rack.add_tube(stock_spl.container, rack_position_fac())
+        session.add(tube_rack)
+        session.add(stock_spl)
+        session.flush()
+        return stock_spl.molecule_design_pool.id
+
+    def __check(self, pool_id, repair=False):
+        checker = StockInfoSummaryChecker(pool_ids=[pool_id], repair=repair)
+        differences = checker.get_result()
+        return checker, differences
+
+    def test_consistent(self, nested_session, stock_sample_fac,
+                        tube_rack_fac, rack_position_fac):
+        pool_id = self.__create_pool(nested_session, stock_sample_fac,
+                                     tube_rack_fac, rack_position_fac)
+        checker, differences = self.__check(pool_id)
+        assert differences == []
+        assert not checker.has_errors()
+
+    def test_values_differ(self, nested_session, stock_sample_fac,
+                           tube_rack_fac, rack_position_fac):
+        pool_id = self.__create_pool(nested_session, stock_sample_fac,
+                                     tube_rack_fac, rack_position_fac)
+        nested_session.execute('UPDATE stock_info_summary '
+                               'SET total_tubes = total_tubes + 1 '
+                               'WHERE molecule_design_set_id = :id',
+                               params=dict(id=pool_id))
+        checker, differences = self.__check(pool_id)
+        assert checker.has_errors()
+        assert [(diff[0], diff[2]) for diff in differences] == \
+                    [(pool_id, StockInfoSummaryDifferenceQuery.VALUES_DIFFER)]
+        checker, differences = self.__check(pool_id, repair=True)
+        assert not checker.has_errors()
+        assert len(differences) == 1
+        checker, differences = self.__check(pool_id)
+        assert differences == []
+
+    def test_missing_in_summary(self, nested_session, stock_sample_fac,
+                                tube_rack_fac, rack_position_fac):
+        pool_id = self.__create_pool(nested_session, stock_sample_fac,
+                                     tube_rack_fac, rack_position_fac)
+        nested_session.execute('DELETE FROM stock_info_summary '
+                               'WHERE molecule_design_set_id = :id',
+                               params=dict(id=pool_id))
+        checker, differences = self.__check(pool_id)
+        assert checker.has_errors()
+        assert set([diff[2] for diff in differences]) == \
+                    set([StockInfoSummaryDifferenceQuery.MISSING_IN_SUMMARY])
+
+    def test_rebuild(self, nested_session, stock_sample_fac, tube_rack_fac,
+                     rack_position_fac):
+        pool_id = self.__create_pool(nested_session, stock_sample_fac,
+                                     tube_rack_fac, rack_position_fac)
+        nested_session.execute('DELETE FROM stock_info_summary '
+                               'WHERE molecule_design_set_id = :id',
+                               params=dict(id=pool_id))
+        rebuilder = StockInfoSummaryRebuilder()
+        number_records = rebuilder.get_result()
+        assert not rebuilder.has_errors()
+        assert number_records > 0
+        assert number_records == \
+                nested_session.execute('SELECT count(*) '
+                                       'FROM stock_info_summary').scalar()
+        checker, differences = self.__check(pool_id)
+        assert differences == []
+        assert not checker.has_errors()
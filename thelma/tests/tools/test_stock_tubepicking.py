@@ -0,0 +1,157 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the tube picking helpers.
+"""
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.stock.tubepicking import BatchTubePicker
+from thelma.tools.stock.tubepicking import TubeCandidate
+from thelma.tools.stock.tubepicking import pick_lowest_volume_candidate
+from thelma.tools.stock.tubepicking import sort_candidates_by_rack_cover
+from thelma.tools.utils.base import CONCENTRATION_CONVERSION_FACTOR
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestBatchTubePicker',
+           'TestPickLowestVolumeCandidate',
+           'TestSortCandidatesByRackCover',
+           ]
+
+
+def _make_candidates(rack_pools, volume=1e-5):
+    # Creates one candidate for each pool ID in each rack (the tube barcodes
+    # are made of the rack barcode and the pool ID).
+    candidates = []
+    for rack_barcode, pool_ids in rack_pools:
+        for pool_id in pool_ids:
+            candidates.append(TubeCandidate(pool_id=pool_id,
+                                    rack_barcode=rack_barcode,
+                                    rack_position=None,
+                                    tube_barcode='%s_%i' % (rack_barcode,
+                                                            pool_id),
+                                    concentration=5e-5,
+                                    volume=volume))
+    return candidates
+
+
+def _get_racks(candidates):
+    # Returns the rack barcodes in candidate order (without repetitions).
+    racks = []
+    for candidate in candidates:
+        if not candidate.rack_barcode in racks:
+            racks.append(candidate.rack_barcode)
+    return racks
+
+
+class TestSortCandidatesByRackCover(object):
+    rack_pools = [('R4', [1]), ('R2', [3, 4]), ('R1', [1, 2, 3]),
+                  ('R3', [4])]
+
+    def test_greedy_cover(self):
+        candidates = _make_candidates(self.rack_pools)
+        sorted_candidates = sort_candidates_by_rack_cover(candidates)
+        assert len(sorted_candidates) == len(candidates)
+        # R1 covers three pools, R2 and R3 the remaining pool 4 (tie broken
+        # by barcode); racks that add nothing keep their original order.
+        assert _get_racks(sorted_candidates) == ['R1', 'R2', 'R4', 'R3']
+
+    def test_pulled_racks(self):
+        candidates = _make_candidates(self.rack_pools)
+        sorted_candidates = sort_candidates_by_rack_cover(candidates,
+                                                          pulled_racks=['R3'])
+        assert _get_racks(sorted_candidates) == ['R3', 'R1', 'R4', 'R2']
+
+    def test_first_candidate_per_pool(self):
+        candidates = _make_candidates(self.rack_pools)
+        picked = dict()
+        for candidate in sort_candidates_by_rack_cover(candidates):
+            picked.setdefault(candidate.pool_id, candidate.tube_barcode)
+        assert picked == {1 : 'R1_1', 2 : 'R1_2', 3 : 'R1_3', 4 : 'R2_4'}
+
+    def test_rack_order_kept(self):
+        candidates = _make_candidates([('R1', [3, 1, 2])])
+        sorted_candidates = sort_candidates_by_rack_cover(candidates)
+        assert [c.tube_barcode for c in sorted_candidates] == \
+                    ['R1_3', 'R1_1', 'R1_2']
+
+    def test_empty(self):
+        assert sort_candidates_by_rack_cover([]) == []
+
+
+class TestPickLowestVolumeCandidate(object):
+
+    def test_lowest_volume(self):
+        candidates = _make_candidates([('R1', [1])], volume=3e-5) \
+                     + _make_candidates([('R2', [1])], volume=2e-5) \
+                     + _make_candidates([('R3', [1])], volume=1e-5)
+        # Volumes are compared in ul.
+        assert pick_lowest_volume_candidate(candidates, 15).tube_barcode \
+                    == 'R2_1'
+        assert pick_lowest_volume_candidate(candidates, 20).tube_barcode \
+                    == 'R2_1'
+        assert pick_lowest_volume_candidate(candidates, 31) is None
+
+    def test_tie_break(self):
+        # Among tubes with the same volume, the first candidate is picked.
+        candidates = _make_candidates([('R2', [1]), ('R1', [1])])
+        assert pick_lowest_volume_candidate(candidates, 5).tube_barcode \
+                    == 'R2_1'
+
+    def test_empty(self):
+        assert pick_lowest_volume_candidate([], 5) is None
+
+
+class TestBatchTubePicker(TestEntityBase):
+
+    def __create_stock_sample(self, session, stock_sample_fac, tube_fac,
+                              pool, concentration, tube_barcode, tube_rack,
+                              rack_position):
+        stock_spl = stock_sample_fac(container=tube_fac(barcode=tube_barcode),
+                                     molecule_design_pool=pool,
+                                     concentration=concentration)
+        tube_rack.add_tube(stock_spl.container, rack_position)
+        session.add(tube_rack)
+        session.add(stock_spl)
+        session.flush()
+        return stock_spl
+
+    def test_mixed_concentrations(self, nested_session, stock_sample_fac,
+                                  tube_fac, tube_rack_fac,
+                                  molecule_design_pool_fac, rack_position_fac):
+        pool1 = molecule_design_pool_fac()
+        pool2 = molecule_design_pool_fac()
+        rack1 = tube_rack_fac(label='test tube rack 1')
+        rack2 = tube_rack_fac(label='test tube rack 2')
+        a1_pos = rack_position_fac(row_index=0, column_index=0)
+        a2_pos = rack_position_fac(row_index=0, column_index=1)
+        # Pool 1 is in both racks, pool 2 (other stock concentration) only
+        # in rack 2. Rack 2 covers both pools and must be preferred.
+        self.__create_stock_sample(nested_session, stock_sample_fac,
+                                   tube_fac, pool1, 5e-5, '1019999990',
+                                   rack1, a1_pos)
+        self.__create_stock_sample(nested_session, stock_sample_fac,
+                                   tube_fac, pool1, 5e-5, '1019999991',
+                                   rack2, a1_pos)
+        self.__create_stock_sample(nested_session, stock_sample_fac,
+                                   tube_fac, pool2, 1e-5, '1019999992',
+                                   rack2, a2_pos)
+        conc1 = 5e-5 * CONCENTRATION_CONVERSION_FACTOR
+        conc2 = 1e-5 * CONCENTRATION_CONVERSION_FACTOR
+        picker = BatchTubePicker({pool1 : conc1, pool2 : conc2},
+                                 take_out_volumes={pool1 : 10, pool2 : 10})
+        sorted_candidates = picker.get_result()
+        assert not picker.has_errors()
+        assert [c.tube_barcode for c in sorted_candidates[pool1]] == \
+                    ['1019999991', '1019999990']
+        assert [c.tube_barcode for c in sorted_candidates[pool2]] == \
+                    ['1019999992']
+        # This is how the ISO planner picks the tubes for fixed pools.
+        picked = pick_lowest_volume_candidate(sorted_candidates[pool1], 15)
+        assert picked.rack_barcode == rack2.barcode
+        assert picked.pool == pool1
+        # The stock concentration is checked for each pool.
+        picker = BatchTubePicker({pool1 : conc1, pool2 : conc1})
+        sorted_candidates = picker.get_result()
+        assert not sorted_candidates.has_key(pool2)
+        assert 'Unable to find valid tubes' in picker.get_messages()[0]
@@ -0,0 +1,161 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the column-oriented rack sample states of the liquid
+transfer execution.
+"""
+import pytest
+
+from thelma.tools.worklists.execution import RackSampleState
+from thelma.tools.worklists.execution import SourceRackSampleState
+from thelma.tools.worklists.execution import TargetRackSampleState
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestSourceRackSampleState',
+           'TestTargetRackSampleState',
+           ]
+
+
+class _Object(object):
+    # Stands in for an entity (the attributes are passed as keywords).
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class _Sample(object):
+    # Stands in for a sample entity (volume in l, concentrations in M).
+    def __init__(self, volume, components=None, freeze_thaw_cycles=0):
+        self.volume = volume
+        self.freeze_thaw_cycles = freeze_thaw_cycles
+        self.sample_molecules = []
+        if not components is None:
+            for md_id, concentration in components:
+                self.make_sample_molecule(_make_molecule(md_id),
+                                          concentration)
+
+    def make_sample_molecule(self, molecule, concentration):
+        self.sample_molecules.append(
+                        _Object(molecule=molecule, concentration=concentration))
+
+    def get_concentrations(self):
+        return dict([(sm.molecule.molecule_design.id, sm.concentration)
+                     for sm in self.sample_molecules])
+
+
+class _Container(object):
+    # Stands in for a container entity.
+    def __init__(self, row_index, column_index, sample=None):
+        self.position = _Object(row_index=row_index,
+                                column_index=column_index)
+        self.sample = sample
+
+    def make_sample(self, volume):
+        self.sample = _Sample(volume, freeze_thaw_cycles=0)
+        return self.sample
+
+
+def _make_molecule(md_id):
+    return _Object(molecule_design=_Object(id=md_id))
+
+
+def _make_rack(containers):
+    # Creates a 96-well rack (8 x 12) holding the given containers.
+    return _Object(rack_shape=_Object(number_columns=12, size=96),
+                   containers=containers)
+
+
+class TestSourceRackSampleState(object):
+
+    def test_abstract(self):
+        with pytest.raises(TypeError):
+            RackSampleState(_make_rack([]))
+
+    def test_remove_volume(self):
+        sample = _Sample(20e-6, [(11, 50e-9)], freeze_thaw_cycles=2)
+        container = _Container(1, 2, sample)
+        empty_container = _Container(0, 0)
+        state = SourceRackSampleState(_make_rack([container,
+                                                  empty_container]))
+        components = state.remove_volume(container.position, 5e-6)
+        assert [(md_id, round(conc, 6)) for md_id, _, conc in components] \
+                    == [(11, 50.0)]
+        state.remove_volume(container.position, 2.5e-6)
+        assert state.remove_volume(empty_container.position, 1e-6) is None
+        assert len(state) == 2
+        assert state.get_freeze_thaw_cycles(container.position) == 2
+        transfer_volumes = state.get_transfer_volumes()
+        assert len(transfer_volumes) == 1
+        rack_pos, volume, transfer_volume = transfer_volumes[0]
+        assert rack_pos is container.position
+        assert round(volume, 6) == 20.0
+        assert round(transfer_volume, 6) == 7.5
+        updated = state.update_container_samples()
+        assert set(updated) == set([container, empty_container])
+        assert abs(sample.volume - 12.5e-6) < 1e-12
+        # Source sample components are not altered.
+        assert sample.get_concentrations() == {11 : 50e-9}
+        assert empty_container.sample is None
+
+    def test_duplicate_component(self):
+        container = _Container(0, 0, _Sample(20e-6, [(11, 50e-9),
+                                                     (11, 20e-9)]))
+        state = SourceRackSampleState(_make_rack([container]))
+        with pytest.raises(ValueError):
+            state.remove_volume(container.position, 1e-6)
+
+
+class TestTargetRackSampleState(object):
+
+    def test_add_to_sample(self):
+        sample = _Sample(10e-6, [(11, 100e-9)], freeze_thaw_cycles=1)
+        container = _Container(7, 11, sample)
+        state = TargetRackSampleState(_make_rack([container]))
+        molecule = _make_molecule(12)
+        state.add_volume(container.position, 10e-6,
+                         [(11, _make_molecule(11), 50.0),
+                          (12, molecule, 200.0)])
+        state.set_freeze_thaw_cycles(container.position, 3)
+        assert [(pos, round(vol, 6))
+                for pos, vol in state.get_final_volumes()] \
+                    == [(container.position, 20.0)]
+        state.update_container_samples()
+        assert abs(sample.volume - 20e-6) < 1e-12
+        assert sample.freeze_thaw_cycles == 3
+        concentrations = sample.get_concentrations()
+        # (100 nM * 10 ul + 50 nM * 10 ul) / 20 ul
+        assert abs(concentrations[11] - 75e-9) < 1e-15
+        # 200 nM * 10 ul / 20 ul
+        assert abs(concentrations[12] - 100e-9) < 1e-15
+        assert sample.sample_molecules[-1].molecule is molecule
+
+    def test_add_to_empty_container(self):
+        container = _Container(0, 3)
+        state = TargetRackSampleState(_make_rack([container]))
+        state.add_volume(container.position, 2e-6,
+                         [(13, _make_molecule(13), 1000.0)])
+        state.add_volume(container.position, 3e-6)
+        state.update_container_samples()
+        sample = container.sample
+        assert abs(sample.volume - 5e-6) < 1e-12
+        # No freeze/thaw cycles have been copied over.
+        assert sample.freeze_thaw_cycles is None
+        # 1000 nM * 2 ul / 5 ul
+        assert abs(sample.get_concentrations()[13] - 400e-9) < 1e-15
+
+    def test_rounding(self):
+        container = _Container(0, 0, _Sample(10e-6, [(11, 10e-9)]))
+        state = TargetRackSampleState(_make_rack([container]))
+        state.add_volume(container.position, 20e-6)
+        state.update_container_samples()
+        # 10 nM * 10 ul / 30 ul = 3.333 nM is rounded to 0.01 nM.
+        assert abs(container.sample.get_concentrations()[11] - 3.33e-9) \
+                    < 1e-15
+
+    def test_no_volume(self):
+        container = _Container(0, 0)
+        state = TargetRackSampleState(_make_rack([container]))
+        state.add_volume(container.position, 0)
+        state.update_container_samples()
+        assert container.sample is None
@@ -0,0 +1,97 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Unit tests for the CSV writer base class.
+"""
+from StringIO import StringIO
+import zipfile
+
+from thelma.tests.entity.conftest import TestEntityBase
+from thelma.tools.writers import CsvColumnParameters
+from thelma.tools.writers import CsvWriter
+from thelma.tools.writers import add_zip_archive_writer_entry
+from thelma.tools.writers import read_zip_archive
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['TestCsvWriter',
+           ]
+
+
+class _ColumnWriter(CsvWriter):
+    # Writes the given value lists (one per column).
+    NAME = 'Column Test Writer'
+
+    def __init__(self, value_lists):
+        CsvWriter.__init__(self)
+        self.value_lists = value_lists
+
+    def _init_column_map_list(self):
+        self._column_map_list = [
+                CsvColumnParameters.create_csv_parameter_map(i, 'col%i' % i,
+                                                             value_list)
+                for i, value_list in enumerate(self.value_lists)]
+
+
+class _RowWriter(CsvWriter):
+    # Writes the given rows.
+    NAME = 'Row Test Writer'
+
+    def __init__(self, rows):
+        CsvWriter.__init__(self)
+        self.rows = rows
+
+    def _prepare_data(self):
+        pass
+
+    def _get_header_names(self):
+        return ['col0', 'col1']
+
+    def _iterate_rows(self):
+        return iter(self.rows)
+
+
+class TestCsvWriter(TestEntityBase):
+
+    def test_column_writer(self):
+        writer = _ColumnWriter([['A1', 'B1'], [1, 2.5]])
+        stream = writer.get_result()
+        assert stream.read() == 'col0,col1\r\nA1,1\r\nB1,2.5\r\n'
+        stream = writer.get_result(write_headers=False)
+        assert stream.read() == 'A1,1\r\nB1,2.5\r\n'
+
+    def test_no_quoting(self):
+        # Values are written as they are (like before the writers were
+        # changed to write row by row).
+        writer = _RowWriter([('a,b', 'say "hi"')])
+        stream = writer.get_result()
+        assert stream.read() == 'col0,col1\r\na,b,say "hi"\r\n'
+
+    def test_errors(self):
+        writer = _ColumnWriter([['A1', 'B1'], [1]])
+        assert writer.get_result() is None
+        assert writer.has_errors()
+        writer = _RowWriter([])
+        assert writer.get_result() is None
+        writer = _RowWriter([('A1', 1), ('B1',)])
+        assert writer.get_result() is None
+
+    def test_write_to(self):
+        stream = StringIO()
+        writer = _RowWriter([('A1', 1), ('B1', 2)])
+        assert writer.write_to(stream, write_headers=False)
+        assert stream.getvalue() == 'A1,1\r\nB1,2\r\n'
+        assert not _RowWriter([]).write_to(StringIO())
+
+    def test_zip_archive_writer_entry(self):
+        zip_stream = StringIO()
+        archive = zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED)
+        assert add_zip_archive_writer_entry(archive, 'rows.csv',
+                                            _RowWriter([('a,b', 1)]))
+        assert not add_zip_archive_writer_entry(archive, 'empty.csv',
+                                                _RowWriter([]))
+        archive.close()
+        zip_map = read_zip_archive(zip_stream)
+        assert zip_map.keys() == ['rows.csv']
+        assert zip_map['rows.csv'].read() == 'col0,col1\r\na,b,1\r\n'
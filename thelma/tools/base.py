@@ -5,9 +5,12 @@ See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 :Date: 02 aug 2011
 """
 
+import logging
+
 from everest.repositories.rdb.session import ScopedSessionMaker as Session
+from thelma.instrumentation import collect_sql_statistics
+from thelma.instrumentation import is_sql_instrumentation_enabled
 from thelma.tools.messagerecorder import MessageRecorder
-from thelma.tools.semiconstants import clear_semiconstant_caches
 from thelma.tools.semiconstants import initialize_semiconstant_caches
 from thelma.tools.utils.base import get_trimmed_string
 
@@ -27,9 +30,15 @@ class BaseTool(MessageRecorder):
     def __init__(self, parent=None):
         MessageRecorder.__init__(self, parent=parent)
         if self._is_root:
+            # The caches are process-wide and stay loaded after the run
+            # (see :mod:`thelma.tools.semiconstants` for invalidation).
             initialize_semiconstant_caches()
         #: The object to be passed as result.
         self.return_value = None
+        #: The SQL statement statistics of the last run started through
+        #: :func:`get_result` (:class:`thelma.instrumentation.SqlStatistics`;
+        #: only collected if the SQL instrumentation is enabled).
+        self.sql_statistics = None
 
     def run(self):
         """
@@ -48,11 +57,13 @@ class BaseTool(MessageRecorder):
         # FIXME: Get rid of the run parameter - a "get_*" method should not
         #        have side effects!
         if run:
-            try:
+            if is_sql_instrumentation_enabled():
+                with collect_sql_statistics(label=self.name) as stats:
+                    self.run()
+                self.sql_statistics = stats
+                logging.getLogger(__name__).debug(stats.get_summary())
+            else:
                 self.run()
-            finally:
-                if self._is_root:
-                    clear_semiconstant_caches()
         return self.return_value
 
     def reset(self):
@@ -62,6 +73,8 @@ class BaseTool(MessageRecorder):
         MessageRecorder.reset(self)
         self.return_value = None
         if self._is_root:
+            # The caches are process-wide and stay loaded after the run
+            # (see :mod:`thelma.tools.semiconstants` for invalidation).
             initialize_semiconstant_caches()
         self.add_info('Reset.')
 
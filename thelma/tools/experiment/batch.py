@@ -7,11 +7,19 @@ This module provides class to deal with experiment batch operations.
 AAB
 """
 from StringIO import StringIO
+from itertools import imap
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+import zipfile
+
+from everest.repositories.rdb.session import ScopedSessionMaker as Session
 from thelma.tools.semiconstants import ITEM_STATUS_NAMES
 from thelma.tools.base import BaseTool
 from thelma.tools.experiment.manual import ExperimentManualExecutor
 from thelma.tools.experiment.mastermix import get_experiment_executor
 from thelma.tools.experiment.mastermix import get_experiment_writer
+from thelma.tools.writers import add_zip_archive_entries
+from thelma.tools.writers import close_zip_archive
 from thelma.tools.writers import create_zip_archive
 from thelma.tools.writers import read_zip_archive
 from thelma.entities.experiment import Experiment
@@ -162,62 +170,152 @@ class ExperimentBatchWorklistWriter(ExperimentBatchTool):
     Writes robot worklists for all experiments that have not been updated
     so far.
 
+    The worklists of the experiments are generated in parallel by worker
+    threads. Each thread reloads its experiment in its own (thread-local)
+    DB session because sessions must not be shared between threads. The
+    worklist files are written into one zip archive directly (the
+    experiment writers do not create archives of their own) in the order
+    of the experiments while later experiments are still being generated.
+
     Return Value: zip stream
     """
     NAME = 'Experiment Batch Worklist Writer'
 
-    def __init__(self, experiments, parent=None):
+    #: The default number of threads generating worklists in parallel.
+    NUMBER_WRITER_THREADS = 4
+
+    def __init__(self, experiments, number_threads=None, parent=None):
+        """
+        Constructor.
+
+        :param int number_threads: The number of threads generating
+            worklists in parallel (with 1, the worklists are generated in
+            the calling thread and session).
+        :default number_threads: *None* (:attr:`NUMBER_WRITER_THREADS`)
+        """
         ExperimentBatchTool.__init__(self, experiments, parent=parent)
-        #: Collects the zip streams for the experiments.
-        self.__zip_streams = None
+        #: The number of threads generating worklists in parallel.
+        if number_threads is None:
+            number_threads = self.NUMBER_WRITER_THREADS
+        self.number_threads = number_threads
+        #: The names of the files added to the archive so far.
+        self.__file_names = None
+        #: Are there files that are replaced by the files of a later
+        #: experiment?
+        self.__has_replaced_files = False
 
     def reset(self):
         ExperimentBatchTool.reset(self)
-        self.__zip_streams = []
+        self.__file_names = set()
+        self.__has_replaced_files = False
+
+    def _check_input(self):
+        ExperimentBatchTool._check_input(self)
+        self._check_input_class('number of threads', self.number_threads,
+                                int)
 
     def _execute_experiment_task(self):
         """
-        Runs worklist writers for all experiments and merges the files
+        Runs worklist writers for all experiments and streams the files
         into one zip file.
         """
         self.add_debug('Start batch worklist writing ...')
-
-        if not self.has_errors(): self.__write_streams()
+        zip_stream = StringIO()
+        archive = zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED,
+                                  False)
+        number_threads = max(1, min(self.number_threads,
+                                    len(self.experiments)))
+        if number_threads == 1:
+            results = imap(self.__generate_file_map, self.experiments)
+            self.__write_streams(archive, results)
+        else:
+            experiment_ids = [exp.id for exp in self.experiments]
+            pool = ThreadPool(number_threads)
+            try:
+                # The results are returned in the order of the experiments.
+                results = pool.imap(self.__generate_file_map_in_thread,
+                                    experiment_ids)
+                self.__write_streams(archive, results)
+            finally:
+                pool.close()
+                pool.join()
         if not self.has_errors():
-            self.return_value = self.__summarize_streams()
+            close_zip_archive(archive)
+            if self.__has_replaced_files:
+                zip_stream = self.__remove_replaced_files(zip_stream)
+            self.return_value = zip_stream
             self.add_info('Worklists writing completed.')
 
-    def __write_streams(self):
-        # Writes the zip streams for the :attr:`experiments`.
+    def __generate_file_map_in_thread(self, experiment_id):
+        # Generates the worklists of an experiment in a worker thread (using
+        # the thread-local session).
+        session = Session()
+        try:
+            experiment = session.query(Experiment).get(experiment_id)
+            result = self.__generate_file_map(experiment)
+        finally:
+            session.close()
+        return result
+
+    def __generate_file_map(self, experiment):
+        # Runs the writer for the given experiment. Returns the file streams
+        # mapped onto file names (*None* if the worklist generation failed)
+        # and the writer lookup error (if any). Errors are recorded by the
+        # calling thread.
+        try:
+            writer = get_experiment_writer(experiment=experiment,
+                                           parent=self)
+        except TypeError as e:
+            return None, str(e)
+        writer.return_file_map = True
+        return writer.get_result(), None
+
+    def __write_streams(self, archive, results):
+        # Adds the generated worklist files of the :attr:`experiments` to the
+        # archive.
         self.add_debug('Write streams ...')
-        for experiment in self.experiments:
-            kw = dict(experiment=experiment, parent=self)
-            writer = self._run_and_record_error(get_experiment_writer,
-                    base_msg='Error when trying to fetch writer for ' \
-                             'experiment "%s": ' % (experiment.label),
-                    error_types=TypeError, **kw)
-            if writer is None:
+        for experiment, result in izip(self.experiments, results):
+            file_map, writer_error = result
+            if not writer_error is None:
+                msg = 'Error when trying to fetch writer for experiment ' \
+                      '"%s": %s' % (experiment.label, writer_error)
+                self.add_error(msg)
                 continue
-            zip_stream = writer.get_result()
-            if zip_stream is None:
+            if file_map is None:
                 msg = 'Error when trying to generate worklists for ' \
                       'experiment "%s".' % (experiment.label)
                 self.add_error(msg)
                 break
-            else:
-                self.__zip_streams.append(zip_stream)
-
-    def __summarize_streams(self):
-        # Reads the zip streams and generates a new common archive.
-        self.add_debug('Summarize zip archives ...')
-
-        zip_map = dict()
-        for zip_stream in self.__zip_streams:
-            file_map = read_zip_archive(zip_stream)
-            for fn, stream in file_map.iteritems(): zip_map[fn] = stream
+            self.__check_file_names(experiment, file_map)
+            try:
+                add_zip_archive_entries(archive, file_map)
+            except StandardError as e:
+                msg = 'Error when trying to add worklist files to the zip ' \
+                      'archive: %s' % (e)
+                self.add_error(msg)
+                break
 
+    def __check_file_names(self, experiment, file_map):
+        # Files of later experiments replace files with the same names.
+        duplicates = sorted([fn for fn in file_map
+                             if fn in self.__file_names])
+        if len(duplicates) > 0:
+            msg = 'Some worklist files for experiment "%s" have the same ' \
+                  'names as files of other experiments and replace them: ' \
+                  '%s.' % (experiment.label, ', '.join(duplicates))
+            self.add_warning(msg)
+            self.__has_replaced_files = True
+        self.__file_names.update(file_map.keys())
+
+    def __remove_replaced_files(self, zip_stream):
+        # Zip entries can not be replaced, so the archive contains several
+        # entries for replaced files. Creates a new archive with the last
+        # entry for each file name.
+        self.add_debug('Remove replaced files ...')
+        zip_stream.seek(0)
+        file_map = read_zip_archive(zip_stream)
         final_stream = StringIO()
-        create_zip_archive(final_stream, zip_map)
+        create_zip_archive(final_stream, file_map)
         return final_stream
 
 
@@ -33,7 +33,9 @@ from thelma.tools.iso.lab.base import LabIsoPrepLayout
 from thelma.tools.iso.lab.base import LabIsoPrepPosition
 from thelma.tools.iso.lab.base import get_stock_takeout_volume
 from thelma.tools.stock.base import STOCK_DEAD_VOLUME
+from thelma.tools.stock.tubepicking import BatchTubePicker
 from thelma.tools.stock.tubepicking import TubePicker
+from thelma.tools.stock.tubepicking import pick_lowest_volume_candidate
 from thelma.tools.worklists.base import get_dynamic_dead_volume
 from thelma.tools.utils.base import CONCENTRATION_CONVERSION_FACTOR
 from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
@@ -682,6 +684,9 @@ class LabIsoPlanner(IsoProvider):
 
     NAME = 'Lab ISO Planner'
     _ISO_TYPE = ISO_TYPES.LAB
+    #: Tube picking and layout building record debug messages per pool and
+    #: position - only the latest ones are kept.
+    MAX_MESSAGE_STACK_SIZE = 1000
 
     #: The class of the builder  generated by this planner.
     _BUILDER_CLS = LabIsoBuilder
@@ -1243,12 +1248,17 @@ class LabIsoPlanner(IsoProvider):
     def __find_fixed_candidates(self):
         """
         Finds tube candidates for the fixed (control) positions. The take out
-        volumes are determined via the ISO plate positions.
+        volumes are determined via the ISO plate positions. The candidates
+        for all fixed pools of the job (whatever their stock concentration
+        and volume) are picked in one :class:`BatchTubePicker` run, so the
+        stock racks are ranked across all stock concentrations. Unlike with
+        one tube picker run per concentration, a tie between tubes with the
+        same volume may therefore be resolved in favour of a different rack.
         """
         self.add_debug('Find candidates for fixed pools ...')
 
         layouts = self._builder.get_all_layouts()
-        conc_map = dict()
+        stock_concentrations = dict()
         vol_map = dict()
         for layout in layouts.values():
             for plate_pos in layout.working_positions():
@@ -1258,28 +1268,30 @@ class LabIsoPlanner(IsoProvider):
                 take_out_vol = plate_pos.get_stock_takeout_volume()
                 if not vol_map.has_key(pool):
                     vol_map[pool] = take_out_vol + STOCK_DEAD_VOLUME
-                    add_list_map_element(conc_map,
-                                         plate_pos.stock_concentration, pool)
+                    stock_concentrations[pool] = plate_pos.stock_concentration
                 else:
                     vol_map[pool] += take_out_vol
 
         fixed_candidates = dict()
-        for stock_conc, pools in conc_map.iteritems():
-            tube_picker = TubePicker(pools, stock_conc,
-                                     excluded_racks=self.excluded_racks,
-                                     requested_tubes=self.requested_tubes,
-                                     parent=self)
+        if len(stock_concentrations) > 0:
+            take_out_volumes = dict([(pool, vol - STOCK_DEAD_VOLUME)
+                                     for pool, vol in vol_map.iteritems()])
+            tube_picker = BatchTubePicker(stock_concentrations,
+                                          take_out_volumes=take_out_volumes,
+                                          excluded_racks=self.excluded_racks,
+                                          requested_tubes=self.requested_tubes,
+                                          parent=self)
             sorted_candidates = tube_picker.get_result()
             if sorted_candidates is None:
                 msg = 'Error when trying to find tube candidates for fixed ' \
                       'pools.'
                 self.add_error(msg)
-                break
             else:
-                unsorted_candidates = tube_picker.get_unsorted_candidates()
+                # We take the tube with the lowest volume; ties are resolved
+                # in favour of the better rack.
                 for pool, candidates in sorted_candidates.iteritems():
-                    picked_candidate = self.__pick_fixed_candidate(
-                            vol_map[pool], candidates, unsorted_candidates)
+                    picked_candidate = pick_lowest_volume_candidate(
+                                                candidates, vol_map[pool])
                     if picked_candidate is None: continue
                     fixed_candidates[pool] = picked_candidate
 
@@ -1295,29 +1307,6 @@ class LabIsoPlanner(IsoProvider):
         else:
             self._builder.set_fixed_candidates(fixed_candidates)
 
-    def __pick_fixed_candidate(self, required_volume, pool_candidates,
-                               unsorted_candidates):
-        """
-        We take the one with the lowest volume. If there are several tubes
-        with the same volume we take the one with the lowest index in the
-        unsorted candidates list (= the one that is best for rack number
-        minimisation).
-        """
-        suitable = dict()
-        for candidate in pool_candidates:
-            if is_smaller_than(candidate.volume, required_volume): continue
-            add_list_map_element(suitable, candidate.volume, candidate)
-        if len(suitable) < 1: return None
-
-        min_vol = min(suitable.keys())
-        suitable_candidates = suitable[min_vol]
-        if len(suitable_candidates) == 1: return suitable_candidates[0]
-
-        index_map = dict()
-        for candidate in suitable_candidates:
-            index_map[unsorted_candidates.index(candidate)] = candidate
-        return index_map[min(index_map.keys())]
-
 
 class _PoolContainer(object):
     """
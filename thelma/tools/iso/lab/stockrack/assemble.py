@@ -834,25 +834,21 @@ class LabIsoXL20WorklistWriter(BaseXL20WorklistWriter):
                     'stock tube container map', 'pool', MoleculeDesignPool,
                     'stock tube container', StockTubeContainer)
 
-    def _store_column_values(self):
+    def _generate_rows(self):
         """
         The target positions are stored in the layout, the source data is
         stored in the containers. The data can be combined via the pool.
         """
-        no_container = []
-
         for sr_pos in self.stock_rack_layout.get_sorted_working_positions():
             pool = sr_pos.molecule_design_pool
             if not self.stock_tube_containers.has_key(pool):
-                no_container.append(pool.id)
                 continue
             container = self.stock_tube_containers[pool]
             tube_candidate = container.tube_candidate
-            self._source_position_values.append(tube_candidate.rack_position)
-            self._source_rack_values.append(tube_candidate.rack_barcode)
-            self._tube_barcode_values.append(tube_candidate.tube_barcode)
-            self._dest_rack_values.append(self.rack_barcode)
-            self._dest_position_values.append(sr_pos.rack_position)
+            yield self._make_row(tube_candidate.rack_barcode,
+                                 tube_candidate.rack_position,
+                                 tube_candidate.tube_barcode,
+                                 self.rack_barcode, sr_pos.rack_position)
 
 
 class LabIsoXL20SummaryWriter(TxtWriter):
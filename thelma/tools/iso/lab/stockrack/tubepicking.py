@@ -13,7 +13,7 @@ from thelma.tools.base import SessionTool
 from thelma.tools.iso.lab.stockrack.base import StockTubeContainer
 from thelma.tools.stock.base import RackLocationQuery
 from thelma.tools.stock.base import STOCK_DEAD_VOLUME
-from thelma.tools.stock.tubepicking import SinglePoolQuery
+from thelma.tools.stock.tubepicking import BatchTubePicker
 from thelma.tools.stock.tubepicking import TubeCandidate
 from thelma.tools.utils.base import add_list_map_element
 from thelma.tools.utils.base import are_equal_values
@@ -272,29 +272,44 @@ class LabIsoXL20TubePicker(SessionTool):
 
     def __find_new_tubes(self):
         """
-        Finds tubes for pool that do not have a tube candidate yet.
+        Finds tubes for pool that do not have a tube candidate yet. All pools
+        are handled in one :class:`BatchTubePicker` run. The candidates are
+        sorted by rack so that the number of additional stock racks is
+        minimised (racks that already provide other tubes are preferred).
         """
         self.add_debug('Find tubes for missing pools ...')
 
+        stock_concentrations = dict()
+        take_out_volumes = dict()
         for pool_id in self.__replaced_tube_containers:
             pool = self.__pool_map[pool_id]
             container = self.stock_tube_containers[pool]
-            required_volume = self.__volume_map[pool_id]
-            query = SinglePoolQuery(pool_id=pool_id,
-                            concentration=container.get_stock_concentration(),
-                            minimum_volume=required_volume)
-            self._run_query(query, None)
-            candidates = query.get_query_results()
-            while len(candidates) > 0:
-                candidate = candidates.pop(0)
-                tube_barcode = candidate.tube_barcode
-                if candidate.rack_barcode in self.excluded_racks:
-                    add_list_map_element(self.__excluded_tubes, pool_id,
-                                         tube_barcode, as_set=True)
-                else:
-                    container.tube_candidate = candidate
-                    candidate.set_pool(container.pool)
-                    break
+            stock_concentrations[pool] = container.get_stock_concentration()
+            take_out_volumes[pool] = self.__volume_map[pool_id]
+        pulled_racks = set()
+        for container in self.stock_tube_containers.values():
+            if not container.tube_candidate is None:
+                pulled_racks.add(container.tube_candidate.rack_barcode)
+        picker = BatchTubePicker(stock_concentrations,
+                                 take_out_volumes=take_out_volumes,
+                                 excluded_racks=self.excluded_racks,
+                                 pulled_racks=sorted(pulled_racks),
+                                 parent=self)
+        candidate_map = picker.get_result()
+        if candidate_map is None:
+            msg = 'Error when trying to find tubes for replaced pools.'
+            self.add_error(msg)
+            return
+
+        for pool_id, tube_barcodes in \
+                                picker.get_excluded_tubes().iteritems():
+            for tube_barcode in tube_barcodes:
+                add_list_map_element(self.__excluded_tubes, pool_id,
+                                     tube_barcode, as_set=True)
+        for pool, candidates in candidate_map.iteritems():
+            self.stock_tube_containers[pool].tube_candidate = candidates[0]
+        for pool_id in self.__replaced_tube_containers:
+            container = self.stock_tube_containers[self.__pool_map[pool_id]]
             if container.tube_candidate is None:
                 self.__missing_pools.append(container.pool)
 
@@ -439,7 +439,7 @@ class StockSampleCreationTicketGenerator(BaseTracTool):
             self.add_error(msg)
         else:
             self.return_value = ticket_id
-            self.add_info('Ticket created (ID: %i).' % (ticket_id))
+            self.add_info('Ticket created (ID: %i).', ticket_id)
             self.was_successful = True
 
 
@@ -507,8 +507,7 @@ class StockSampleCreationIsoGenerator(BaseTool):
             self.__create_isos()
         if not self.has_errors():
             self.return_value = self.iso_request
-            self.add_info('%i ISOs have been created.' \
-                           % (self.__new_iso_counter))
+            self.add_info('%i ISOs have been created.', self.__new_iso_counter)
 
     def __check_input(self):
         self._check_input_class('ISO request', self.iso_request,
@@ -10,7 +10,6 @@ from thelma.tools.stock.tubepicking import OptimizingQuery
 from thelma.tools.stock.tubepicking import TubePicker
 from thelma.tools.utils.base import CustomQuery
 from thelma.tools.utils.base import add_list_map_element
-from thelma.tools.utils.base import create_in_term_for_db_queries
 from collections import OrderedDict
 
 __docformat__ = 'reStructuredText en'
@@ -285,14 +284,14 @@ class SingleDesignPoolQuery(CustomQuery):
     The results are stored in a dictionary (single design IDs mapped onto
     pool IDs).
     """
-    QUERY_TEMPLATE = '''
+    PREPARED_QUERY_TEMPLATE = '''
     SELECT mdp.molecule_design_set_id AS pool_id,
            mdsm.molecule_design_id AS molecule_design_id
     FROM molecule_design_pool mdp,
         molecule_design_set_member mdsm
     WHERE mdp.number_designs = 1
     AND mdp.molecule_design_set_id = mdsm.molecule_design_set_id
-    AND mdsm.molecule_design_id IN %s'''
+    AND mdsm.molecule_design_id = ANY($1)'''
 
     __POOL_ID_COL_NAME = 'pool_id'
     __MOLECULE_DESIGN_COL_NAME = 'molecule_design_id'
@@ -315,8 +314,8 @@ class SingleDesignPoolQuery(CustomQuery):
         #: The molecule design IDs for which you want to find the pool IDs.
         self.molecule_design_ids = molecule_design_ids
 
-    def _get_params_for_sql_statement(self):
-        return create_in_term_for_db_queries(self.molecule_design_ids)
+    def _get_params_for_prepared_statement(self):
+        return (list(self.molecule_design_ids),)
 
     def _store_result(self, result_record):
         pool_id = result_record[self.__POOL_ID_INDEX]
@@ -152,7 +152,7 @@ class LibraryCreationTicketGenerator(BaseTracTool):
             self.add_error(msg)
         else:
             self.return_value = ticket_id
-            self.add_info('Ticket created (ID: %i).' % (ticket_id))
+            self.add_info('Ticket created (ID: %i).', ticket_id)
             self.was_successful = True
 
 
@@ -209,8 +209,7 @@ class LibraryCreationIsoCreator(BaseTool):
             self.__create_isos()
         if not self.has_errors():
             self.return_value = self.molecule_design_library
-            self.add_info('%i ISOs have been created.' % (
-                                                    self.__new_iso_counter))
+            self.add_info('%i ISOs have been created.', self.__new_iso_counter)
 
     def __check_input(self):
         if self._check_input_class('molecule design library',
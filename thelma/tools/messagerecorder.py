@@ -4,6 +4,9 @@ See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
 :Date: May 2011
 """
+from collections import deque
+from heapq import merge
+from itertools import count
 import logging
 
 from pyramid.compat import native_
@@ -20,9 +23,25 @@ class MessageRecorder(object):
 
     The message recorder passes on all messages to the logging framework. In
     addition, it keeps a stack of all messages recorded during its lifetime.
+
+    Messages up to the :attr:`LAZY_RECORDING_LEVEL` (by default: info and
+    debug messages) are only recorded if the logger of the root recorder
+    is enabled for their level. Otherwise, they are counted as suppressed
+    without being formatted. To save string building for suppressed
+    messages, pass the message arguments separately (lazy
+    `%`-style formatting), e.g.
+    ``self.add_debug('Process position %s ...', rack_pos.label)``.
     """
     #: A name passed by the object used to group the recorded messages.
     NAME = None
+    #: Messages with this logging level or lower are only recorded if the
+    #: logger is enabled for their level (*None* records all messages).
+    LAZY_RECORDING_LEVEL = logging.INFO
+    #: The maximum number of messages below the warning level kept in the
+    #: message stack of a root recorder. If the limit is exceeded, the
+    #: oldest of these messages are discarded (ring buffer). Warnings and
+    #: errors are always kept. *None* means unlimited.
+    MAX_MESSAGE_STACK_SIZE = None
 
     def __init__(self, parent=None):
         """
@@ -44,8 +63,15 @@ class MessageRecorder(object):
         self.abort_execution = False
         #: The message stack of this recorder. This will only contain
         #: messages if this is a root recorder (i.e., :param:`parent` is
-        #: `None`).
-        self._message_stack = []
+        #: `None`). Messages are stored as (sequence number, logging level,
+        #: message) tuples.
+        self._message_stack = None
+        #: Stores the messages below warning level if the message stack
+        #: size is limited (see :attr:`MAX_MESSAGE_STACK_SIZE`).
+        self._message_buffer = None
+        #: The number of messages that have not been recorded because the
+        #: logger was not enabled for their level.
+        self._suppressed_count = 0
         #
         if parent is None:
             # This is a root recorder - create a logger for it.
@@ -57,6 +83,8 @@ class MessageRecorder(object):
             get_fn = getattr(logging, 'getLogger')
             self._logger = get_fn(self.__class__.__module__ + '.' +
                                   self.__class__.__name__)
+            #: Generates the sequence numbers of the recorded messages.
+            self.__message_counter = count()
             self.__name = self.NAME
         else:
             if not isinstance(parent, MessageRecorder):
@@ -65,7 +93,17 @@ class MessageRecorder(object):
             self._root_recorder = parent._root_recorder # pylint:disable=W0212
             self._is_root = False
             self._logger = None
+            self.__message_counter = None
             self.__name = self._root_recorder.name + '->' + self.NAME
+        self.__init_message_stack()
+
+    def __init_message_stack(self):
+        # Initialises the message stack and buffer.
+        self._message_stack = []
+        if self.MAX_MESSAGE_STACK_SIZE is None:
+            self._message_buffer = None
+        else:
+            self._message_buffer = deque(maxlen=self.MAX_MESSAGE_STACK_SIZE)
 
     def disable_error_and_warning_recording(self):
         """
@@ -80,9 +118,13 @@ class MessageRecorder(object):
         """
         Returns all messages having the given severity level or more.
         """
-        return [msg
-                for (log_lvl, msg) in self._root_recorder._message_stack # pylint:disable=W0212
-                if log_lvl >= logging_level]
+        # pylint:disable=W0212
+        events = self._root_recorder._message_stack
+        message_buffer = self._root_recorder._message_buffer
+        # pylint:enable=W0212
+        if not message_buffer is None and logging_level < logging.WARNING:
+            events = merge(events, message_buffer)
+        return [msg for (_, log_lvl, msg) in events if log_lvl >= logging_level]
 
     def has_errors(self):
         """
@@ -102,6 +144,14 @@ class MessageRecorder(object):
             err_cnt = self._root_recorder.error_count
         return err_cnt
 
+    @property
+    def suppressed_message_count(self):
+        """
+        The number of messages this recorder did not record because the
+        logger was not enabled for their level.
+        """
+        return self._suppressed_count
+
     @property
     def name(self):
         """
@@ -119,49 +169,61 @@ class MessageRecorder(object):
         """
         self._error_count = 0
         self.abort_execution = False
-        self._message_stack = []
+        self._suppressed_count = 0
+        self.__init_message_stack()
 
-    def add_critical_error(self, message):
+    def add_critical_error(self, message, *args):
         """
         Records a critical error.
 
         :param str message: Message to record.
+        :param args: Arguments for lazy `%`-style formatting of the message.
         """
-        self.__record_message(logging.CRITICAL, message)
+        self.__record_message(logging.CRITICAL, message, args)
 
-    def add_error(self, message):
+    def add_error(self, message, *args):
         """
         Records an error.
 
         :param str message: Message to record.
+        :param args: Arguments for lazy `%`-style formatting of the message.
         """
-        self.__record_message(logging.ERROR, message)
+        self.__record_message(logging.ERROR, message, args)
 
-    def add_warning(self, message):
+    def add_warning(self, message, *args):
         """
         Records a warning.
 
         :param str message: Message to record.
+        :param args: Arguments for lazy `%`-style formatting of the message.
         """
-        self.__record_message(logging.WARNING, message)
+        self.__record_message(logging.WARNING, message, args)
 
-    def add_info(self, message):
+    def add_info(self, message, *args):
         """
         Records an info message.
 
         :param str message: Message to record.
+        :param args: Arguments for lazy `%`-style formatting of the message.
         """
-        self.__record_message(logging.INFO, message)
+        self.__record_message(logging.INFO, message, args)
 
-    def add_debug(self, message):
+    def add_debug(self, message, *args):
         """
         Records a debug message.
 
         :param str message: Message to record.
+        :param args: Arguments for lazy `%`-style formatting of the message.
         """
-        self.__record_message(logging.DEBUG, message)
+        self.__record_message(logging.DEBUG, message, args)
 
-    def __record_message(self, logging_level, message):
+    def __record_message(self, logging_level, message, args):
+        root_recorder = self._root_recorder
+        if not self.LAZY_RECORDING_LEVEL is None \
+                and logging_level <= self.LAZY_RECORDING_LEVEL \
+                and not root_recorder._logger.isEnabledFor(logging_level): # pylint:disable=W0212
+            self._suppressed_count += 1
+            return
         do_record = True
         if logging_level >= logging.ERROR:
             do_record = not self._disable_err_warn_rec
@@ -169,9 +231,15 @@ class MessageRecorder(object):
                 self._error_count += 1
             self.abort_execution = True
         if do_record:
+            if len(args) > 0:
+                message = message % args
             msg = "%s - %s" % (self.__name, native_(message))
-            evt = (logging_level, msg)
-             # pylint:disable=W0212
-            self._root_recorder._message_stack.append(evt)
-            self._root_recorder._logger.log(*evt)
+            # pylint:disable=W0212
+            evt = (next(root_recorder.__message_counter), logging_level, msg)
+            if logging_level < logging.WARNING \
+                    and not root_recorder._message_buffer is None:
+                root_recorder._message_buffer.append(evt)
+            else:
+                root_recorder._message_stack.append(evt)
+            root_recorder._logger.log(logging_level, msg)
             # pylint:enable=W0212
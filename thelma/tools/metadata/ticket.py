@@ -132,7 +132,7 @@ class IsoRequestTicketCreator(BaseTracTool):
         ticket_id = self._submit(self.tractor_api.create_ticket, kw)
         if not self.has_errors():
             self.return_value = ticket_id
-            self.add_info('Ticket created (ID: %i).' % (ticket_id))
+            self.add_info('Ticket created (ID: %i).', ticket_id)
             self.was_successful = True
 
 
@@ -233,7 +233,7 @@ class IsoRequestTicketUpdateTool(BaseTracTool):
         updated_ticket = self._submit(self.tractor_api.update_ticket, kw)
         if not self.has_errors():
             self.return_value = updated_ticket
-            self.add_info('Ticket %i has been updated.' % (self._ticket_id))
+            self.add_info('Ticket %i has been updated.', self._ticket_id)
             self.was_successful = True
 
 
@@ -771,7 +771,7 @@ class IsoRequestTicketReassigner(IsoRequestTicketUpdateTool):
         if not self.has_errors():
             self.return_value = updated_ticket, self._comment, \
                                 self.__missing_pools_stream
-            self.add_info('Ticket %i has been updated.' % (self._ticket_id))
+            self.add_info('Ticket %i has been updated.', self._ticket_id)
             self.was_successful = True
 
 
@@ -21,7 +21,6 @@ from thelma.tools.metadata.ticket \
     import IsoRequestTicketDescriptionBuilder
 from thelma.tools.worklists.base import DEAD_VOLUME_COEFFICIENT
 from thelma.tools.worklists.base import LIMIT_TARGET_WELLS
-from thelma.tools.writers import CsvColumnParameters
 from thelma.tools.writers import CsvWriter
 from thelma.tools.writers import TxtWriter
 from thelma.tools.tracbase import BaseTracTool
@@ -89,13 +88,8 @@ class ExperimentMetadataAssignmentWriter(CsvWriter):
         self.association_layouts = None
         #: A map containing the final concentrations for each design rack.
         self.final_concentrations = None
-        #: Intermediate storage for the column values.
-        self.__source_well_values = None
-        self.__design_rack_values = None
-        self.__target_well_values = None
-        self.__iso_volume_values = None
-        self.__iso_concentration_values = None
-        self.__final_concentration_values = None
+        #: Intermediate storage for the data rows.
+        self.__rows = None
 
     def reset(self):
         """
@@ -105,21 +99,16 @@ class ExperimentMetadataAssignmentWriter(CsvWriter):
         self.source_layout = None
         self.association_layouts = None
         self.final_concentrations = None
-        self.__source_well_values = []
-        self.__design_rack_values = []
-        self.__target_well_values = []
-        self.__iso_volume_values = []
-        self.__iso_concentration_values = []
-        self.__final_concentration_values = []
-
-    def _init_column_map_list(self):
+        self.__rows = []
+
+    def _prepare_data(self):
         """
-        Creates the :attr:`_column_map_list`
+        Collects the data rows (the final concentrations need to be checked
+        before the first row can be written).
         """
         self.__check_input()
         if not self.has_errors(): self.__fetch_report_data()
-        if not self.has_errors(): self.__generate_column_values()
-        if not self.has_errors(): self.__generate_columns()
+        if not self.has_errors(): self.__generate_rows()
 
     def __check_input(self):
         # Checks if the tools has obtained correct input values.
@@ -139,17 +128,17 @@ class ExperimentMetadataAssignmentWriter(CsvWriter):
             msg = 'Error when trying to fetch report data.'
             self.add_error(msg)
 
-    def __generate_column_values(self):
-        # Generates the values for the CSV columns.
-        self.add_debug('Generate column value lists ...')
+    def __generate_rows(self):
+        # Generates the rows for the CSV file.
+        self.add_debug('Generate rows ...')
         labels = self.association_layouts.keys()
         labels.sort()
         for label in labels:
-            self.__store_design_rack_value(label)
+            self.__store_design_rack_rows(label)
 
-    def __store_design_rack_value(self, label):
+    def __store_design_rack_rows(self, label):
         # Stores the values for a particular design rack.
-        self.add_debug('Store values for design rack %s ...' % (label))
+        self.add_debug('Store values for design rack %s ...', label)
         tf_layout = self.association_layouts[label]
         concentrations = self.final_concentrations[label]
         missing_final_concentration = []
@@ -160,50 +149,36 @@ class ExperimentMetadataAssignmentWriter(CsvWriter):
             src_pos = self.source_layout.get_working_position(
                                                     tf_pos.rack_position)
             for trg_pos in cell_plate_positions:
-                self.__source_well_values.append(tf_pos.rack_position.label)
-                self.__design_rack_values.append(label)
-                self.__target_well_values.append(trg_pos.label)
-                self.__iso_volume_values.append(src_pos.iso_volume)
-                self.__iso_concentration_values.append(
-                                                    src_pos.iso_concentration)
                 if not concentrations.has_key(trg_pos):
                     missing_final_concentration.append(trg_pos.label)
                     continue
-                final_conc = concentrations[trg_pos]
-                self.__final_concentration_values.append(final_conc)
+                row = [None] * 6
+                row[self.DESIGN_RACK_INDEX] = label
+                row[self.SOURCE_WELL_INDEX] = tf_pos.rack_position.label
+                row[self.TARGET_WELL_INDEX] = trg_pos.label
+                row[self.FINAL_CONCENTRATION_INDEX] = concentrations[trg_pos]
+                row[self.ISO_CONCENTRATION_INDEX] = src_pos.iso_concentration
+                row[self.ISO_VOLUME_INDEX] = src_pos.iso_volume
+                self.__rows.append(row)
         if len(missing_final_concentration) > 0:
             msg = 'There are final concentrations missing for the following ' \
                   'rack positions of design rack %s: %s' \
                   % (label, missing_final_concentration)
             self.add_error(msg)
 
-    def __generate_columns(self):
-        # Generates the columns for the report.
-        self.add_debug('Generate columns ...')
-        source_well_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.SOURCE_WELL_INDEX, self.SOURCE_WELL_HEADER,
-                    self.__source_well_values)
-        design_rack_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.DESIGN_RACK_INDEX, self.DESIGN_RACK_HEADER,
-                    self.__design_rack_values)
-        target_well_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.TARGET_WELL_INDEX, self.TARGET_WELL_HEADER,
-                    self.__target_well_values)
-        iso_volume_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.ISO_VOLUME_INDEX, self.ISO_VOLUME_HEADER,
-                    self.__iso_volume_values)
-        iso_concentration_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.ISO_CONCENTRATION_INDEX, self.ISO_CONCENTRATION_HEADER,
-                    self.__iso_concentration_values)
-        final_conc_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.FINAL_CONCENTRATION_INDEX,
-                    self.FINAL_CONCENTRATION_HEADER,
-                    self.__final_concentration_values)
-        self._column_map_list = [source_well_column, design_rack_column,
-                                 target_well_column, iso_volume_column,
-                                 iso_concentration_column,
-                                 final_conc_column]
-        self.add_info('Column generation completed.')
+    def _get_header_names(self):
+        header_map = {
+                self.DESIGN_RACK_INDEX : self.DESIGN_RACK_HEADER,
+                self.SOURCE_WELL_INDEX : self.SOURCE_WELL_HEADER,
+                self.TARGET_WELL_INDEX : self.TARGET_WELL_HEADER,
+                self.FINAL_CONCENTRATION_INDEX :
+                                        self.FINAL_CONCENTRATION_HEADER,
+                self.ISO_CONCENTRATION_INDEX : self.ISO_CONCENTRATION_HEADER,
+                self.ISO_VOLUME_INDEX : self.ISO_VOLUME_HEADER}
+        return [header_map[index] for index in sorted(header_map.keys())]
+
+    def _iterate_rows(self):
+        return self.__rows
 
 
 class ExperimentMetadataIsoPlateWriter(CsvWriter):
@@ -241,11 +216,6 @@ class ExperimentMetadataIsoPlateWriter(CsvWriter):
         self.generator = generator
         #: The completed ISO source layout.
         self.source_layout = None
-        #: Intermediate storage for the column values.
-        self.__position_values = None
-        self.__md_pool_values = None
-        self.__iso_concentration_values = None
-        self.__iso_volume_values = None
 
     def reset(self):
         """
@@ -253,22 +223,15 @@ class ExperimentMetadataIsoPlateWriter(CsvWriter):
         """
         CsvWriter.reset(self)
         self.source_layout = None
-        self.__position_values = []
-        self.__md_pool_values = []
-        self.__iso_concentration_values = []
-        self.__iso_volume_values = []
 
-    def _init_column_map_list(self):
+    def _prepare_data(self):
         """
-        Creates the :attr:`_column_map_list`
+        Fetches the source layout. The rows are generated while they are
+        written (see :func:`_iterate_rows`).
         """
         self.__check_input()
         if not self.has_errors():
             self.__fetch_report_data()
-        if not self.has_errors():
-            self.__generate_column_values()
-        if not self.has_errors():
-            self.__generate_columns()
 
     def __check_input(self):
         # Checks if the tools has obtained correct input values.
@@ -287,35 +250,23 @@ class ExperimentMetadataIsoPlateWriter(CsvWriter):
             self._check_input_class('source layout', self.source_layout,
                                     TransfectionLayout)
 
-    def __generate_column_values(self):
-        # Generates the values for the CSV columns.
-        self.add_debug('Generate column value lists ...')
+    def _get_header_names(self):
+        header_map = {
+                self.POSITION_INDEX : self.POSITION_HEADER,
+                self.MDP_INDEX : self.MDP_HEADER,
+                self.ISO_CONCENTRATION_INDEX : self.ISO_CONCENTRATION_HEADER,
+                self.ISO_VOLUME_INDEX : self.ISO_VOLUME_HEADER}
+        return [header_map[index] for index in sorted(header_map.keys())]
+
+    def _iterate_rows(self):
         for tf_pos in self.source_layout.get_sorted_working_positions():
             if tf_pos.is_empty: continue
-            self.__position_values.append(tf_pos.rack_position.label)
-            md_pool = str(tf_pos.molecule_design_pool)
-            self.__md_pool_values.append(md_pool)
-            self.__iso_concentration_values.append(tf_pos.iso_concentration)
-            self.__iso_volume_values.append(tf_pos.iso_volume)
-
-    def __generate_columns(self):
-        # Generates the columns for the report.
-        position_column = CsvColumnParameters.create_csv_parameter_map(
-                          self.POSITION_INDEX, self.POSITION_HEADER,
-                          self.__position_values)
-        md_pool_column = CsvColumnParameters.create_csv_parameter_map(
-                          self.MDP_INDEX, self.MDP_HEADER,
-                          self.__md_pool_values)
-        iso_conc_column = CsvColumnParameters.create_csv_parameter_map(
-                          self.ISO_CONCENTRATION_INDEX,
-                          self.ISO_CONCENTRATION_HEADER,
-                          self.__iso_concentration_values)
-        iso_volume_column = CsvColumnParameters.create_csv_parameter_map(
-                          self.ISO_VOLUME_INDEX, self.ISO_VOLUME_HEADER,
-                          self.__iso_volume_values)
-        self._column_map_list = [position_column, md_pool_column,
-                                 iso_conc_column, iso_volume_column]
-        self.add_info('Column generation completed.')
+            row = [None] * 4
+            row[self.POSITION_INDEX] = tf_pos.rack_position.label
+            row[self.MDP_INDEX] = tf_pos.molecule_design_pool
+            row[self.ISO_CONCENTRATION_INDEX] = tf_pos.iso_concentration
+            row[self.ISO_VOLUME_INDEX] = tf_pos.iso_volume
+            yield row
 
 
 class ExperimentMetadataInfoWriter(TxtWriter):
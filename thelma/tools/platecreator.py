@@ -98,7 +98,8 @@ class PlateCreator96To384(BaseTool):
         return pool_tube_bc_map
 
     def __run_tube_picker(self, pools, conc):
-        tube_picker = TubePicker(pools, conc, parent=self)
+        tube_picker = TubePicker(pools, conc, max_candidates_per_pool=1,
+                                 parent=self)
         return dict([(pool.id, tbs[0].tube_barcode)
                      for (pool, tbs) in tube_picker.get_result().iteritems()
                      if len(tbs) > 0])
@@ -13,14 +13,38 @@ premature autoflush).
 The caches can be initialised and cleared using
 :func:`initialize_semiconstant_caches` and :func:`clear_semiconstant_caches`.
 
-
-is to load all entities before a tool is started to avoid autoflushes
-during the tool run.
+The caches are process-wide: once loaded (e.g. when the application starts
+or when the first tool runs), the identifiers do not need to be resolved
+anymore. The caches only store the IDs of the entities (see
+:class:`CachedEntityKey`), never the entities themselves, so they can be
+shared between threads and sessions. For each key, there is also a
+detached copy of the entity that never belongs to any session. The first
+lookup in a session merges this copy into the session of the current
+thread without loading (no DB access), later lookups are served from the
+session.
+
+Since the caches outlive the tools, they are not cleared after a tool
+run. If semiconstant entities are changed in the DB, the caches for the
+entity type must be invalidated using :func:`invalidate_semiconstant_cache`
+(or all caches using :func:`clear_semiconstant_caches`). The next lookup
+loads the entities again.
 
 AAB
 """
+from collections import namedtuple
+from threading import Lock
+from threading import RLock
+from threading import local
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.exc import UnmappedInstanceError
+from sqlalchemy.orm.util import identity_key
+
 from everest.entities.utils import get_root_aggregate
+from everest.entities.utils import slug_from_string
 from everest.querying.specifications import lt
+from everest.repositories.rdb.session import ScopedSessionMaker
 from everest.repositories.rdb.utils import as_slug_expression
 from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
 from thelma.interfaces import IExperimentMetadataType
@@ -30,19 +54,24 @@ from thelma.interfaces import IRackPosition
 from thelma.interfaces import IRackShape
 from thelma.interfaces import IRackSpecs
 from thelma.interfaces import IReservoirSpecs
+from thelma.entities.cacheloaderregistry import cache_loader_registry
 from thelma.entities.experiment import ExperimentMetadataType
 from thelma.entities.liquidtransfer import PipettingSpecs
 from thelma.entities.liquidtransfer import ReservoirSpecs
+from thelma.entities.positionlookupregistry import position_lookup_registry
 from thelma.entities.rack import RACK_POSITION_REGEXP
+from thelma.entities.rack import RackPosition
 from thelma.entities.rack import RackShape
 from thelma.entities.rack import RackSpecs
 from thelma.entities.status import ITEM_STATUSES
+from thelma.entities.status import ItemStatus
 from thelma.entities.utils import label_from_number
 
 
 __docformat__ = 'reStructuredText en'
 
-__all__ = ['SemiconstantCache',
+__all__ = ['CachedEntityKey',
+           'SemiconstantCache',
            'ITEM_STATUS_NAMES',
            'get_item_status',
            'get_item_status_managed',
@@ -81,13 +110,25 @@ __all__ = ['SemiconstantCache',
            'get_rack_position_from_indices',
            'initialize_semiconstant_caches',
            'clear_semiconstant_caches',
+           'invalidate_semiconstant_cache',
+           'get_semiconstant_cache_statistics',
            ]
 
 
+#: Identifies a cached entity (entity class and ID). The caches store these
+#: keys instead of the entities.
+CachedEntityKey = namedtuple('CachedEntityKey', ['entity_class', 'id'])
+
+
 class SemiconstantCache(object):
     """
     A base class of semi-constant caches.
     Entities are identified by the label or name that is used a slug.
+
+    The caches are shared by all threads of the process. Each subclass has
+    its own cache. All modifications are guarded by a common lock. The
+    caches store :class:`CachedEntityKey` objects which are resolved to the
+    entities of the session of the current thread (see :func:`_attach`).
     """
 
     #: Contains the names of all known entities.
@@ -95,15 +136,35 @@ class SemiconstantCache(object):
 
     #: The marker interface for the supported entity class.
     _MARKER_INTERFACE = None
-    #: The aggregate for the entity class.
-    _aggregate = None
+    #: The supported entity class (used for invalidation and to look up
+    #: loaders in the :attr:`cache_loader_registry`).
+    _ENTITY_CLASS = None
 
-    #: The cache (entities mapped onto identifiers).
-    _cache = dict()
+    #: The cache (entity keys mapped onto identifiers) - use
+    #: :func:`_get_cache` to access it.
+    _cache = None
+    #: Has the cache been initialised (all entities loaded)?
+    _is_initialized = False
+
+    #: The number of lookups served by the cache.
+    _hits = 0
+    #: The number of lookups that required to load the entity.
+    _misses = 0
 
     #: Shall the entity identifier be converted to a slug or be used directly?
     _CONVERT_TO_SLUG = True
 
+    #: Guards the modification of the caches.
+    _lock = RLock()
+    #: Guards the hit and miss counters.
+    _statistics_lock = Lock()
+    #: Stores the entities of the session of the current thread mapped
+    #: onto their keys.
+    __attached = local()
+    #: The detached copies of the cached entities (shared by all classes)
+    #: mapped onto their keys (see :func:`_attach_all`).
+    __detached = dict()
+
     @classmethod
     def from_name(cls, entity_identifier):
         """
@@ -126,12 +187,20 @@ class SemiconstantCache(object):
             msg = 'Unknown entity identifier "%s".' % (entity_identifier)
             raise ValueError(msg)
 
-        if cls._cache.has_key(entity_identifier):
-            return cls._cache[entity_identifier]
-
-        entity = cls._get_entity_from_aggregate(entity_identifier)
-        cls._cache[entity_identifier] = entity
-        return entity
+        key = cls._get_cache().get(entity_identifier)
+        if key is None:
+            with cls._lock:
+                key = cls._get_cache().get(entity_identifier)
+                if key is None:
+                    cls._count_lookup(False)
+                    entity = cls._get_entity_from_aggregate(entity_identifier)
+                    key = cls._make_key(entity)
+                    cls._get_cache()[entity_identifier] = key
+                else:
+                    cls._count_lookup(True)
+        else:
+            cls._count_lookup(True)
+        return cls._attach(key)
 
     @classmethod
     def is_known_entity(cls, entity_identifier):
@@ -143,43 +212,203 @@ class SemiconstantCache(object):
     @classmethod
     def initialize_cache(cls):
         """
-        Loads all known entities from the DB and loads it into the
-        :attr:`_cache`. The cache can be cleared by calling
-        :func:`clear_chache`.
+        Loads all known entities into the :attr:`_cache` (if this has not
+        been done before). If there is a loader for the entity class in the
+        :attr:`cache_loader_registry` its entities are used, otherwise the
+        entities are loaded from the DB. The cache can be cleared by calling
+        :func:`clear_cache`.
         """
-        for entity_name in cls.ALL:
-            entity = cls._get_entity_from_aggregate(entity_name)
-            cls._cache[entity_name] = entity
+        with cls._lock:
+            if cls._is_initialized:
+                return
+            cache = cls._get_cache()
+            loader_entities = cls._get_loader_entities()
+            for entity_name in cls.ALL:
+                if cache.has_key(entity_name):
+                    continue
+                entity = loader_entities.get(cls._get_slug(entity_name))
+                if entity is None:
+                    entity = cls._get_entity_from_aggregate(entity_name)
+                cache[entity_name] = cls._make_key(entity)
+            cls._is_initialized = True
 
     @classmethod
     def clear_cache(cls):
         """
         Removes all entities from the cache. The cache can be re-initialised
-        by calling :func:`initialize_chache`.
+        by calling :func:`initialize_cache`.
+        """
+        with cls._lock:
+            for key in cls._get_cache().values():
+                cls.__detached.pop(key, None)
+            cls._cache = dict()
+            cls._is_initialized = False
+
+    @classmethod
+    def is_initialized(cls):
+        """
+        Returns *True* if the cache has been initialised (and not been
+        cleared since).
+        """
+        return cls._is_initialized
+
+    @classmethod
+    def get_statistics(cls):
+        """
+        Returns the number of cache hits and misses and the number of cached
+        entities.
+
+        :rtype: :class:`dict`
+        """
+        with cls._statistics_lock:
+            hits, misses = cls._hits, cls._misses
+        return dict(hits=hits, misses=misses, size=len(cls._get_cache()))
+
+    @classmethod
+    def _count_lookup(cls, is_hit):
+        """
+        Records a cache hit or miss.
         """
-        cls._cache = dict()
-        cls._aggregate = None
+        with cls._statistics_lock:
+            if is_hit:
+                cls._hits += 1
+            else:
+                cls._misses += 1
+
+    @classmethod
+    def _get_cache(cls):
+        """
+        Returns the cache of this class (each subclass gets its own one).
+        """
+        if not '_cache' in cls.__dict__ or cls._cache is None:
+            with cls._lock:
+                if not '_cache' in cls.__dict__ or cls._cache is None:
+                    cls._cache = dict()
+        return cls._cache
+
+    @classmethod
+    def _get_slug(cls, entity_identifier):
+        """
+        Returns the slug for the given identifier.
+        """
+        if cls._CONVERT_TO_SLUG:
+            return slug_from_string(entity_identifier)
+        return entity_identifier
+
+    @classmethod
+    def _get_loader_entities(cls):
+        """
+        Returns the entities provided by the :attr:`cache_loader_registry`
+        for the entity class mapped onto slugs.
+        """
+        if cls._ENTITY_CLASS is None or \
+                    not cache_loader_registry.has_loader(cls._ENTITY_CLASS):
+            return dict()
+        return dict([(entity.slug, entity) for entity
+                     in cache_loader_registry(cls._ENTITY_CLASS)])
 
     @classmethod
     def _get_entity_from_aggregate(cls, entity_identifier):
         """
         Retrieves the entity for the given identifier from the aggregate.
+        The session is not flushed.
         """
-        cls._initialize_aggregate()
         if cls._CONVERT_TO_SLUG:
             slug = as_slug_expression(entity_identifier)
         else:
             slug = entity_identifier
-        return cls._aggregate.get_by_slug(slug)
+        aggregate = get_root_aggregate(cls._MARKER_INTERFACE)
+        with ScopedSessionMaker().no_autoflush:
+            return aggregate.get_by_slug(slug)
+
+    @classmethod
+    def _make_key(cls, entity):
+        """
+        Returns the value to cache for the given entity: a
+        :class:`CachedEntityKey` for mapped entities and the entity itself
+        for entities of unmapped classes (memory repositories).
+        """
+        try:
+            object_session(entity)
+        except UnmappedInstanceError:
+            return entity
+        entity_class = cls._ENTITY_CLASS
+        if entity_class is None:
+            entity_class = type(entity)
+        return CachedEntityKey(entity_class, entity.id)
+
+    @classmethod
+    def _attach(cls, key):
+        """
+        Returns the entity of the session of the current thread for the
+        given cached key (see :func:`_attach_all`).
+        """
+        return cls._attach_all([key])[0]
 
     @classmethod
-    def _initialize_aggregate(cls):
+    def _attach_all(cls, keys):
         """
-        Initialises the aggregate for the supported entity class (if it has
-        not be initialised so far).
+        Returns the entities of the session of the current thread for the
+        given cached keys. Entities that are not in the session yet are
+        merged into it from their detached copies without loading. The
+        detached copies are loaded once per process (together with all
+        other cached entities of their class). Values that are not keys
+        (entities of memory repositories) are returned as they are.
         """
-        if cls._aggregate is None:
-            cls._aggregate = get_root_aggregate(cls._MARKER_INTERFACE)
+        session = ScopedSessionMaker()
+        attached = cls.__attached
+        if not getattr(attached, 'session', None) is session:
+            attached.session = session
+            attached.entities = dict()
+        entities = attached.entities
+        missing = []
+        for key in keys:
+            if not isinstance(key, CachedEntityKey):
+                continue
+            entity = entities.get(key)
+            if entity is None or not object_session(entity) is session:
+                missing.append(key)
+        if len(missing) > 0:
+            detached = cls.__get_detached(session, missing)
+            with session.no_autoflush:
+                for key in missing:
+                    entity = session.identity_map.get(
+                                identity_key(key.entity_class, key.id))
+                    if entity is None:
+                        entity = session.merge(detached[key], load=False)
+                    entities[key] = entity
+        return [entities.get(key) if isinstance(key, CachedEntityKey)
+                else key for key in keys]
+
+    @classmethod
+    def __get_detached(cls, session, keys):
+        # Returns the detached copies for the given keys. Missing copies are
+        # loaded together with the copies of all other cached entities of
+        # their class in a separate session sharing the connection of the
+        # given session.
+        detached = cls.__detached
+        with cls._lock:
+            missing = dict()
+            for key in keys:
+                if not detached.has_key(key):
+                    missing.setdefault(key.entity_class, set()).add(key.id)
+            if len(missing) > 0:
+                load_session = Session(bind=session.connection())
+                try:
+                    for entity_class, ids in missing.iteritems():
+                        ids.update([value.id
+                                    for value in cls._get_cache().values()
+                                    if isinstance(value, CachedEntityKey)
+                                    and value.entity_class is entity_class])
+                        query = load_session.query(entity_class) \
+                                        .filter(entity_class.id.in_(ids))
+                        for entity in query:
+                            detached[CachedEntityKey(entity_class,
+                                                     entity.id)] = entity
+                    load_session.expunge_all()
+                finally:
+                    load_session.close()
+            return dict([(key, detached[key]) for key in keys])
 
 
 class ITEM_STATUS_NAMES(SemiconstantCache):
@@ -193,6 +422,7 @@ class ITEM_STATUS_NAMES(SemiconstantCache):
 
     ALL = [MANAGED, FUTURE, UNMANAGED, DESTROYED]
     _MARKER_INTERFACE = IItemStatus
+    _ENTITY_CLASS = ItemStatus
 
 #: A short cut for :func:`ITEM_STATUS_NAMES.from_name`.
 get_item_status = ITEM_STATUS_NAMES.from_name
@@ -221,6 +451,7 @@ class EXPERIMENT_SCENARIOS(SemiconstantCache):
 
     ALL = [OPTIMISATION, SCREENING, MANUAL, ISO_LESS, LIBRARY, ORDER_ONLY, QPCR]
     _MARKER_INTERFACE = IExperimentMetadataType
+    _ENTITY_CLASS = ExperimentMetadataType
 
     #: Experiment scenarios that allow for only one final ISO plate at maximum
     #: (not regarding copies).
@@ -288,11 +519,13 @@ class RACK_SHAPE_NAMES(SemiconstantCache):
     #: In this case, only the standard shapes with 96 and 384 positions.
     ALL = [SHAPE_96, SHAPE_384]
     _MARKER_INTERFACE = IRackShape
+    _ENTITY_CLASS = RackShape
 
     _POSITION_NUMBERS = {96 : SHAPE_96, 384 : SHAPE_384}
 
-    #: Stores the ordered positions for a certain rack shape (shape name
-    #: as key, value is dict with vertical sorting as key, positions as value))
+    #: Stores the ordered (cached) positions for a certain rack shape
+    #: (number of rows, number of columns and vertical sorting as key,
+    #: positions as tuple)
     __shape_positions = dict()
 
     @classmethod
@@ -320,7 +553,16 @@ class RACK_SHAPE_NAMES(SemiconstantCache):
         Removes all entities from the cache. The cache can be re-initialised
         by calling :func:`initialize_chache`.
         """
-        SemiconstantCache.clear_cache()
+        with cls._lock:
+            super(RACK_SHAPE_NAMES, cls).clear_cache()
+            cls.clear_position_cache()
+
+    @classmethod
+    def clear_position_cache(cls):
+        """
+        Removes the position lists (they must be cleared together with the
+        :class:`RACK_POSITION_LABELS` cache).
+        """
         cls.__shape_positions = dict()
 
     @classmethod
@@ -345,51 +587,25 @@ class RACK_SHAPE_NAMES(SemiconstantCache):
             chosen direction.
         """
         if isinstance(rack_shape, RackShape):
-            shape_name = rack_shape.name
             shape_entity = rack_shape
         elif isinstance(rack_shape, basestring):
             shape_entity = cls.from_name(rack_shape)
-            shape_name = rack_shape
         else:
             msg = 'Unexpected type for rack shape (%s). Allowed types are ' \
                   'string and %s.' % (rack_shape.__class__.__name__,
                                       RackShape.__name__)
             raise TypeError(msg)
 
-        lookup = None
-        if cls.__shape_positions.has_key(shape_name):
-            lookup = cls.__shape_positions[shape_name]
-            if lookup.has_key(vertical_sorting):
-                new_list = [p for p in lookup[vertical_sorting]]
-                return new_list
-
-        positions = []
-
-        row_values = [0, 'number_rows']
-        col_values = [0, 'number_columns']
-
-        if vertical_sorting:
-            prime_values = col_values
-            sec_values = row_values
-        else:
-            prime_values = row_values
-            sec_values = col_values
-
-        for prime_index in range(getattr(shape_entity, prime_values[1])):
-            prime_values[0] = prime_index
-            for sec_index in range(getattr(shape_entity, sec_values[1])):
-                sec_values[0] = sec_index
-                coords = (row_values[0], col_values[0])
-                rack_pos = get_rack_position_from_indices(*coords)
-                positions.append(rack_pos)
-
-        if lookup is None:
-            lookup = {vertical_sorting : positions}
-        else:
-            lookup[vertical_sorting] = positions
-        cls.__shape_positions[shape_name] = lookup
-
-        return [p for p in positions]
+        key = (shape_entity.number_rows, shape_entity.number_columns,
+               vertical_sorting)
+        positions = cls.__shape_positions.get(key)
+        if positions is None:
+            positions = RACK_POSITION_LABELS.get_positions_for_dimensions(
+                                        shape_entity.number_rows,
+                                        shape_entity.number_columns,
+                                        vertical_sorting=vertical_sorting)
+            cls.__shape_positions[key] = positions
+        return cls._attach_all(positions)
 
 
 #: A shortcut to get the 96-well rack shape.
@@ -418,6 +634,7 @@ class PIPETTING_SPECS_NAMES(SemiconstantCache):
 
     ALL = [MANUAL, CYBIO, BIOMEK, BIOMEKSTOCK]
     _MARKER_INTERFACE = IPipettingSpecs
+    _ENTITY_CLASS = PipettingSpecs
 
     __MIN_TRANSFER_VOL_ATTR = 'min_transfer_volume'
     __MAX_TRANSFER_VOL_ATTR = 'max_transfer_volume'
@@ -429,24 +646,29 @@ class PIPETTING_SPECS_NAMES(SemiconstantCache):
 
     @classmethod
     def clear_cache(cls):
-        super(PIPETTING_SPECS_NAMES, cls).clear_cache()
-        cls.__value_cache = None
+        with cls._lock:
+            super(PIPETTING_SPECS_NAMES, cls).clear_cache()
+            cls.__value_cache = None
 
     @classmethod
     def initialize_cache(cls):
         """
         We also initialise the :attr:`__value_cache` here.
         """
-        super(PIPETTING_SPECS_NAMES, cls).initialize_cache()
-        cls.__value_cache = dict()
-        for ps_name in cls.ALL:
-            value_map = dict()
-            entity = cls._cache[ps_name]
-            for attr_name, factor in cls.__ATTRS.iteritems():
-                db_value = getattr(entity, attr_name)
-                value = db_value * factor
-                value_map[attr_name] = value
-            cls.__value_cache[ps_name] = value_map
+        with cls._lock:
+            super(PIPETTING_SPECS_NAMES, cls).initialize_cache()
+            if cls.__value_cache:
+                return
+            value_cache = dict()
+            for ps_name in cls.ALL:
+                value_map = dict()
+                entity = cls._attach(cls._get_cache()[ps_name])
+                for attr_name, factor in cls.__ATTRS.iteritems():
+                    db_value = getattr(entity, attr_name)
+                    value = db_value * factor
+                    value_map[attr_name] = value
+                value_cache[ps_name] = value_map
+            cls.__value_cache = value_cache
 
     @classmethod
     def __get_attribute_value(cls, pipetting_specs, attribute_name):
@@ -569,6 +791,7 @@ class RESERVOIR_SPECS_NAMES(SemiconstantCache):
     RACK_SPECS = [STANDARD_96, STANDARD_384, DEEP_96, STOCK_RACK]
 
     _MARKER_INTERFACE = IReservoirSpecs
+    _ENTITY_CLASS = ReservoirSpecs
 
     @classmethod
     def is_rack_spec(cls, reservoir_spec):
@@ -627,6 +850,7 @@ class RACK_SPECS_NAMES(SemiconstantCache):
 
     ALL = [STANDARD_96, DEEP_96, STANDARD_384, STOCK_RACK]
     _MARKER_INTERFACE = IRackSpecs
+    _ENTITY_CLASS = RackSpecs
 
     __RESERVOIR_SPECS_MAP = {
             RESERVOIR_SPECS_NAMES.STANDARD_96 : STANDARD_96,
@@ -724,13 +948,24 @@ get_reservoir_specs_from_rack_specs = RACK_SPECS_NAMES.to_reservoir_specs
 class RACK_POSITION_LABELS(SemiconstantCache):
     """
     Caching and shortcuts for :class:`thelma.entities.rack.RackPosition` entities.
-    Unlike in other caches there are no default values and the cache is not
-    initialised.
+    Unlike in other caches there are no default values.
+
+    All positions of shapes up to 1536 positions (32 x 48) are loaded in one
+    query and stored in an immutable table (rows of positions) that is
+    indexed by row and column index. The positions are also mapped onto
+    their labels. Positions outside the table are loaded on demand.
     """
     _MARKER_INTERFACE = IRackPosition
+    _ENTITY_CLASS = RackPosition
     _CONVERT_TO_SLUG = False
 
-    __coordinate_cache = dict()
+    #: The number of rows of the position table.
+    TABLE_NUMBER_ROWS = 32
+    #: The number of columns of the position table.
+    TABLE_NUMBER_COLUMNS = 48
+
+    #: The position table (a tuple of rows which are tuples of positions).
+    __position_table = None
 
     @classmethod
     def from_name(cls, label):
@@ -750,21 +985,16 @@ class RACK_POSITION_LABELS(SemiconstantCache):
                   '%s).' % (label.__class__.__name__)
             raise TypeError(msg)
         else:
-            label = cls.__clean_label(label)
-
-        if cls._cache.has_key(label):
-            return cls._cache[label]
+            label = cls.__clean_label(label).upper()
 
-        rack_pos = cls._get_entity_from_aggregate(label.lower())
-        if rack_pos is None:
-            msg = 'Unknown rack position "%s".' % (label)
-            raise ValueError(msg)
+        if cls.__position_table is None:
+            cls.initialize_cache()
+        key = cls._get_cache().get(label)
+        if key is None:
+            key = cls.__load_rack_position(label)
         else:
-            cls._cache[label] = rack_pos
-            coords = (rack_pos.row_index, rack_pos.column_index)
-            cls._cache[coords] = rack_pos
-
-        return rack_pos
+            cls._count_lookup(True)
+        return cls._attach(key)
 
     @classmethod
     def __clean_label(cls, label):
@@ -777,14 +1007,30 @@ class RACK_POSITION_LABELS(SemiconstantCache):
         else:
             return label[:-2] + label[-1:]
 
+    @classmethod
+    def __load_rack_position(cls, label):
+        # Loads a position that is not part of the position table and
+        # returns its key.
+        with cls._lock:
+            key = cls._get_cache().get(label)
+            if key is None:
+                cls._count_lookup(False)
+                rack_pos = cls._get_entity_from_aggregate(label.lower())
+                if rack_pos is None:
+                    msg = 'Unknown rack position "%s".' % (label)
+                    raise ValueError(msg)
+                key = cls._make_key(rack_pos)
+                cls._get_cache()[label] = key
+            else:
+                cls._count_lookup(True)
+        return key
+
     @classmethod
     def from_indices(cls, row_index, column_index):
         """
         Returns the rack position instance for the given row and column indices
         (loads it either from the DB or from the cache).
 
-        Invokes :func:`get_label` and :func:`from_name`.
-
         :param row_index: The row index (0-based) of the rack position.
         :type row_index: :class:`int`
 
@@ -795,12 +1041,50 @@ class RACK_POSITION_LABELS(SemiconstantCache):
         :raises ValueError: If there is not rack position for these indices in
             the DB.
         """
-        coords = (row_index, column_index)
-        if cls.__coordinate_cache.has_key(coords):
-            return cls.__coordinate_cache[coords]
+        return cls._attach(cls.__get_rack_position(row_index, column_index))
 
+    @classmethod
+    def __get_rack_position(cls, row_index, column_index):
+        # Returns the cached key of the position for the given indices.
+        table = cls.__position_table
+        if table is None:
+            cls.initialize_cache()
+            table = cls.__position_table
+        if 0 <= row_index < cls.TABLE_NUMBER_ROWS and \
+                    0 <= column_index < cls.TABLE_NUMBER_COLUMNS:
+            key = table[row_index][column_index]
+            if not key is None:
+                cls._count_lookup(True)
+                return key
         label = cls.get_label(row_index, column_index)
-        return cls.from_name(label)
+        key = cls._get_cache().get(label)
+        if key is None:
+            key = cls.__load_rack_position(label)
+        else:
+            cls._count_lookup(True)
+        return key
+
+    @classmethod
+    def get_positions_for_dimensions(cls, number_rows, number_columns,
+                                     vertical_sorting=False):
+        """
+        Returns the cached keys of the positions for a rack with the
+        given dimensions (see :func:`SemiconstantCache._attach_all`). The
+        sorting can be horizontal (A1, A2, A3, etc.) or vertical (A1, B1,
+        etc.).
+
+        :return: The rack position keys as tuple.
+        """
+        if vertical_sorting:
+            coords = [(row_index, column_index)
+                      for column_index in range(number_columns)
+                      for row_index in range(number_rows)]
+        else:
+            coords = [(row_index, column_index)
+                      for row_index in range(number_rows)
+                      for column_index in range(number_columns)]
+        return tuple([cls.__get_rack_position(row_index, column_index)
+                      for row_index, column_index in coords])
 
     @classmethod
     def get_label(cls, row_index, column_index):
@@ -852,36 +1136,38 @@ class RACK_POSITION_LABELS(SemiconstantCache):
     @classmethod
     def initialize_cache(cls):
         """
-        By default, we initialise all positions from 384-rack-shape in a
-        one-step query. This is faster than fetching a potentially large
-        number of positions one by one.
+        Loads all positions of the position table in a one-step query. This
+        is faster than fetching a potentially large number of positions one
+        by one.
         """
-        cls._initialize_aggregate()
-        shape_384 = get_384_rack_shape()
-
-        cls._aggregate.filter = lt(_row_index=shape_384.number_rows) \
-                                & lt(_column_index=shape_384.number_columns)
-        iterator = cls._aggregate.iterator()
-        while True:
-            try:
-                rack_pos = iterator.next()
-            except StopIteration:
-                break
-            else:
-                cls._cache[rack_pos.label] = rack_pos
-                coords = (rack_pos.row_index, rack_pos.column_index)
-                cls.__coordinate_cache[coords] = rack_pos
-
-        cls._aggregate.filter = None
+        with cls._lock:
+            if cls._is_initialized:
+                return
+            table = [[None] * cls.TABLE_NUMBER_COLUMNS
+                     for _ in range(cls.TABLE_NUMBER_ROWS)]
+            cache = cls._get_cache()
+            aggregate = get_root_aggregate(cls._MARKER_INTERFACE)
+            aggregate.filter = lt(_row_index=cls.TABLE_NUMBER_ROWS) \
+                               & lt(_column_index=cls.TABLE_NUMBER_COLUMNS)
+            with ScopedSessionMaker().no_autoflush:
+                for rack_pos in aggregate.iterator():
+                    key = cls._make_key(rack_pos)
+                    table[rack_pos.row_index][rack_pos.column_index] = key
+                    cache[rack_pos.label] = key
+            cls.__position_table = tuple([tuple(row) for row in table])
+            cls._is_initialized = True
 
     @classmethod
     def clear_cache(cls):
         """
-        Removes all entities from the cache.
+        Removes all entities from the cache (including the position lists
+        of the :class:`RACK_SHAPE_NAMES`).
         """
-        cls._aggregate = None
-        cls._cache = dict()
-        cls.__coordinate_cache = dict()
+        with cls._lock:
+            super(RACK_POSITION_LABELS, cls).clear_cache()
+            cls.__position_table = None
+            RACK_SHAPE_NAMES.clear_position_cache()
+
 
 #: A short cut for :func:`RACK_POSITION_LABELS.from_name`
 get_rack_position_from_label = RACK_POSITION_LABELS.from_name
@@ -889,11 +1175,16 @@ get_rack_position_from_label = RACK_POSITION_LABELS.from_name
 #: A short cut for :func:`RACK_POSITION_LABELS.from_indices`
 get_rack_position_from_indices = RACK_POSITION_LABELS.from_indices
 
+# The rack entities look up their positions through the position cache.
+position_lookup_registry.register_lookups(get_rack_position_from_label,
+                                          get_rack_position_from_indices,
+                                          get_positions_for_shape)
+
 
 __ALL_SEMICONSTANT_CLASSES = [ITEM_STATUS_NAMES,
                               EXPERIMENT_SCENARIOS,
                               RACK_SHAPE_NAMES,
-#                              PIPETTING_SPECS_NAMES,
+                              PIPETTING_SPECS_NAMES,
                               RESERVOIR_SPECS_NAMES,
                               RACK_SPECS_NAMES,
                               RACK_POSITION_LABELS,
@@ -902,7 +1193,8 @@ __ALL_SEMICONSTANT_CLASSES = [ITEM_STATUS_NAMES,
 def initialize_semiconstant_caches():
     """
     Initialises the caches for all semiconstant classes registered in
-    :attr:`_MARKER_INTERFACE`.
+    :attr:`_MARKER_INTERFACE`. Caches that have already been initialised
+    are not reloaded.
     """
     for semiconstant_cache_cls in __ALL_SEMICONSTANT_CLASSES:
         semiconstant_cache_cls.initialize_cache()
@@ -914,3 +1206,27 @@ def clear_semiconstant_caches():
     """
     for semiconstant_cache_cls in __ALL_SEMICONSTANT_CLASSES:
         semiconstant_cache_cls.clear_cache()
+
+def invalidate_semiconstant_cache(entity_class):
+    """
+    Clears the caches of all semiconstant classes that store entities of
+    the given class (e.g. after the entities have been changed in the DB).
+
+    :param entity_class: The entity class whose caches to clear (e.g.
+        :class:`thelma.entities.rack.RackShape`).
+    """
+    for semiconstant_cache_cls in __ALL_SEMICONSTANT_CLASSES:
+        cached_class = \
+                semiconstant_cache_cls._ENTITY_CLASS # pylint: disable=W0212
+        if issubclass(entity_class, cached_class):
+            semiconstant_cache_cls.clear_cache()
+
+def get_semiconstant_cache_statistics():
+    """
+    Returns the cache statistics (hits, misses and size, see
+    :func:`SemiconstantCache.get_statistics`) mapped onto the names of all
+    semiconstant classes.
+    """
+    return dict([(semiconstant_cache_cls.__name__,
+                  semiconstant_cache_cls.get_statistics())
+                 for semiconstant_cache_cls in __ALL_SEMICONSTANT_CLASSES])
@@ -30,6 +30,8 @@ from everest.resources.utils import get_collection_class
 from everest.utils import classproperty
 from paste.deploy import appconfig # pylint: disable=E0611,F0401
 from paste.script.command import Command # pylint: disable=E0611,F0401
+from thelma.instrumentation import collect_sql_statistics
+from thelma.instrumentation import is_sql_instrumentation_enabled
 from thelma.interfaces import IIsoJob
 from thelma.interfaces import IMoleculeDesignLibrary
 from thelma.interfaces import IMoleculeDesignPool
@@ -307,11 +309,19 @@ class ToolCommand(Command):
                 del kw[opt.dest]
         tool = tool_cls(**kw)
         try:
-            tool.run()
+            if is_sql_instrumentation_enabled():
+                with collect_sql_statistics(label=tool.name) as stats:
+                    tool.run()
+                tool.sql_statistics = stats
+            else:
+                tool.run()
         except:
             transaction.abort()
             raise
         else:
+            if not tool.sql_statistics is None:
+                logging.getLogger(__name__).info(
+                                        tool.sql_statistics.get_summary())
             if tool.has_errors():
                 err_msgs = tool.get_messages()
                 msg = 'Errors occurred during the tool run. Error messages:\n'
@@ -499,6 +509,14 @@ class SampleRegistrarCommand(_RegistrarCommand): # no __init__ pylint: disable=W
                 default='matrix0500',
                 type='string'),
            ),
+          ('--bulk',
+           'bulk',
+           dict(help='Flag indicating that the samples should be registered '
+                     'with bulk inserts instead of the ORM (recommended for '
+                     'large tube deliveries).',
+                action='store_true',
+                default=False),
+           ),
          ]
     registration_resource = ISampleRegistrationItem
 
@@ -560,6 +578,12 @@ class StockCondenserToolCommand(ToolCommand): # no __init__ pylint: disable=W023
                          type='string',
                          callback=_excluded_racks_callback)
                     ),
+                   ('--strategy',
+                    'strategy',
+                    dict(help='Rack association strategy ("greedy" or '
+                              '"binpacking").',
+                         type='string')
+                    ),
                    ('--output-dir',
                     'output_dir',
                     dict(help='Directory to write the condense worklists to.',
@@ -938,6 +962,9 @@ class LibraryCreationIsoExecutorToolCommand(
 
 
 class StockAuditToolCommand(ToolCommand): # no __init__ pylint: disable=W0232
+    _concentration_bands_callback = \
+        LazyOptionCallback(lambda cls, value, options:
+                                [float(el) for el in value.split(',')])
     name = 'stockaudit'
     tool = 'thelma.tools.stock.audit:StockAuditReporter'
     option_defs = [('--molecule-type',
@@ -950,7 +977,64 @@ class StockAuditToolCommand(ToolCommand): # no __init__ pylint: disable=W0232
                     'output_file',
                     dict(help='Output file to write the stock audit report '
                               'to.')
-                    )
+                    ),
+                   ('--watermark-file',
+                    'watermark_file',
+                    dict(help='File storing the time of the last audit. If '
+                              'the file exists, only tubes that have '
+                              'changed since then are reported.',
+                         type='string')
+                    ),
+                   ('--partition-by',
+                    'partition_by',
+                    dict(help='Export the report partitioned by "supplier" '
+                              'or "concentration" (one file per '
+                              'partition).',
+                         type='string')
+                    ),
+                   ('--concentration-bands',
+                    'concentration_bands',
+                    dict(help='Concentration band boundaries in uM for '
+                              'concentration partitions (comma-separated).',
+                         action='callback',
+                         type='string',
+                         callback=_concentration_bands_callback)
+                    ),
+                   ('--number-threads',
+                    'number_threads',
+                    dict(help='Number of partitions to export in parallel.',
+                         type='int')
+                    ),
+                   ]
+
+
+class StockInfoSummaryRebuilderToolCommand(ToolCommand): # no __init__ pylint: disable=W0232
+    name = 'stockinfosummaryrebuilder'
+    tool = 'thelma.tools.stock.stockinfo:StockInfoSummaryRebuilder'
+    option_defs = []
+
+
+class StockInfoSummaryCheckerToolCommand(ToolCommand): # no __init__ pylint: disable=W0232
+    _pool_ids_callback = \
+        LazyOptionCallback(lambda cls, value, options:
+                                [int(el) for el in value.split(',')])
+    name = 'stockinfosummarychecker'
+    tool = 'thelma.tools.stock.stockinfo:StockInfoSummaryChecker'
+    option_defs = [('--pool-ids',
+                    'pool_ids',
+                    dict(help='IDs of the pools to check (comma-separated; '
+                              'default: all pools).',
+                         action='callback',
+                         type='string',
+                         callback=_pool_ids_callback)
+                    ),
+                   ('--repair',
+                    'repair',
+                    dict(help='If set, the summary records of inconsistent '
+                              'pools are refreshed.',
+                         action='store_true',
+                         default=False)
+                    ),
                    ]
 
 
@@ -4,19 +4,33 @@ See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
 Stock audit - report amount and concentration for stock samples by
 molecule type.
+
+The audit records are streamed from a server-side cursor and written to the
+report file as they arrive. Incremental audits only export the stock tubes
+whose sample or location changed since the last (stored) audit. Large audits
+can be partitioned by supplier or concentration band; the partitions are
+exported in parallel into separate files.
 """
-from collections import OrderedDict
 from csv import Dialect
-from csv import DictWriter
 from csv import QUOTE_NONNUMERIC
 from csv import register_dialect
+from csv import writer
+from multiprocessing.pool import ThreadPool
+import os
+import re
 
 from everest.repositories.rdb.session import ScopedSessionMaker as Session
 from thelma.tools.base import BaseTool
+from thelma.tools.utils.base import CustomQuery
 
 
 __docformat__ = 'reStructuredText en'
 __all__ = ['StockAuditReporter',
+           'StockAuditQuery',
+           'SirnaStockAuditQuery',
+           'MirnaInhibitorStockAuditQuery',
+           'MirnaMimicStockAuditQuery',
+           'StockAuditSupplierQuery',
            ]
 
 
@@ -33,35 +47,22 @@ class AuditCsvDialect(Dialect): # ignore no __init__ pylint: disable=W0232
 register_dialect('audit', AuditCsvDialect)
 
 
-class StockAuditReporter(BaseTool):
-    """
-    Reporter for stock audits.
-
-    You may need to define a "first" aggregate function in the SQL backend: ::
-
-    -- Create a function that always returns the first non-NULL item
-    CREATE OR REPLACE FUNCTION public.first_agg ( anyelement, anyelement )
-    RETURNS anyelement LANGUAGE sql IMMUTABLE STRICT AS $$
-            SELECT $1;
-    $$;
-
-    -- And then wrap an aggregate around it
-    CREATE AGGREGATE public.first (
-            sfunc    = public.first_agg,
-            basetype = anyelement,
-            stype    = anyelement
-    );
-
-    Taken from https://wiki.postgresql.org/wiki/First/last_(aggregate)
-    """
-    QUERY_TEMPLATE = """
-     select first(ss.molecule_design_set_id) as cenixpoolid,
+#: The stock audit query. The first slot takes additional (molecule type
+#: specific) columns, the second one a prefix for the ORDER BY clause.
+#: The parameters are: $1 - molecule type, $2 - watermark timestamp (only
+#: samples changed after it are exported; NULL for a full audit), $3 -
+#: stock sample supplier IDs (NULL for all), $4 and $5 - lower (inclusive)
+#: and upper (exclusive) concentration bound in uM (NULL for no bound), $6 -
+#: also export samples without stock sample supplier if the supplier IDs
+#: are given.
+_AUDIT_QUERY_TEMPLATE = """
+     select min(ss.molecule_design_set_id) as cenixpoolid,
             string_agg(cast(md.molecule_design_id as text), ';' order by md.molecule_design_id) as cenixolddesignids,
-            first(t.barcode) as tubebarcode,
-            round(first(sm.concentration)*count(sm.concentration)*1e6) as concentration,
-            s.volume*round(first(sm.concentration)*count(sm.concentration)*1e9) as amount,
-            first(o.name) as supplier,
-            first(sr.volume)*round(first(sm.concentration)*first(mdp.number_designs)*1e9) as initialamount
+            min(t.barcode) as tubebarcode,
+            round(min(sm.concentration)*count(sm.concentration)*1e6) as concentration,
+            s.volume*round(min(sm.concentration)*count(sm.concentration)*1e9) as amount,
+            min(o.name) as supplier,
+            min(sr.volume)*round(min(sm.concentration)*min(mdp.number_designs)*1e9) as initialamount
             %s
      from tube t
             inner join container c on c.container_id = t.container_id
@@ -84,104 +85,505 @@ class StockAuditReporter(BaseTool):
                            and set.sample_set_type='ORDER') as set on set.sample_id = s.sample_id
      where cs.name='MATRIX0500'
        and c.item_status='MANAGED'
-       and md.molecule_type = '%s'
-       %s
+       and md.molecule_type = $1
+       and ($3::int[] is null or ss.supplier_id = any($3::int[])
+            or ($6::boolean and ss.supplier_id is null))
+       and ($2::timestamptz is null
+            or c.container_id in (
+                select est.source_container_id
+                from executed_sample_transfer est
+                    inner join executed_liquid_transfer elt
+                    on elt.executed_liquid_transfer_id = est.executed_liquid_transfer_id
+                where elt.timestamp > $2::timestamptz
+                union
+                select est.target_container_id
+                from executed_sample_transfer est
+                    inner join executed_liquid_transfer elt
+                    on elt.executed_liquid_transfer_id = est.executed_liquid_transfer_id
+                where elt.timestamp > $2::timestamptz
+                union
+                select esd.target_container_id
+                from executed_sample_dilution esd
+                    inner join executed_liquid_transfer elt
+                    on elt.executed_liquid_transfer_id = esd.executed_liquid_transfer_id
+                where elt.timestamp > $2::timestamptz
+                union
+                select tl.container_id
+                from tube_location tl
+                    inner join executed_rack_sample_transfer erst
+                    on (erst.source_rack_id = tl.rack_id or erst.target_rack_id = tl.rack_id)
+                    inner join executed_liquid_transfer elt
+                    on elt.executed_liquid_transfer_id = erst.executed_liquid_transfer_id
+                where elt.timestamp > $2::timestamptz
+                union
+                select tt.tube_id
+                from tube_transfer tt
+                    inner join tube_transfer_worklist_member ttwm
+                    on ttwm.tube_transfer_id = tt.tube_transfer_id
+                    inner join tube_transfer_worklist ttw
+                    on ttw.tube_transfer_worklist_id = ttwm.tube_transfer_worklist_id
+                where ttw.timestamp > $2::timestamptz
+                union
+                select tl.container_id
+                from tube_location tl
+                    inner join rack_barcoded_location rbl on rbl.rack_id = tl.rack_id
+                where rbl.checkin_date > $2::timestamptz
+                union
+                select rs.container_id
+                from sample rs
+                    inner join sample_registration rsr on rsr.sample_id = rs.sample_id
+                where rsr.time_stamp > $2::timestamptz))
      group by s.sample_id
-     order by %s first(o.name), first(sm.concentration) desc, first(ss.molecule_design_set_id)
+     having ($4::float8 is null
+            or round(min(sm.concentration)*count(sm.concentration)*1e6) >= $4::float8)
+       and ($5::float8 is null
+            or round(min(sm.concentration)*count(sm.concentration)*1e6) < $5::float8)
+     order by %s min(o.name), min(sm.concentration) desc, min(ss.molecule_design_set_id)
      """
-    CUSTOM_BITS = \
-      {'SIRNA' :
-         (
-          """, case when (first(set.label) in ('ORD_103', 'ORD_106')) then 'old'
-            when (first(set.label) in ('ORD_253')) then 'new'
-            when (first(mdp.number_designs) = 3) then 'pool'
+
+
+#: Returns the new audit watermark: the start of the oldest transaction
+#: that is still open (at most the start of the current transaction) minus
+#: a safety overlap. Changes of transactions that commit after the audit
+#: has read its data carry timestamps after this watermark and are exported
+#: by the next incremental audit. Transactions of other DB users are only
+#: visible to privileged users; the overlap also covers timestamps the
+#: application sets before its transaction starts.
+_WATERMARK_QUERY = """
+     select cast(least(now(), min(xact_start)) - cast(:overlap as interval)
+                 as text)
+     from pg_stat_activity
+     where datname = current_database() and xact_start is not null
+     """
+
+
+class StockAuditQuery(CustomQuery):
+    """
+    Streams the audit records for the stock samples of a molecule type
+    and writes them to a CSV writer as they are fetched (the query results
+    themselves are not stored).
+
+    Subclasses add molecule type specific columns.
+    """
+    PREPARED_QUERY_TEMPLATE = _AUDIT_QUERY_TEMPLATE % ('', '')
+
+    COLUMN_NAMES = ['cenixpoolid', 'cenixolddesignids', 'tubebarcode',
+                    'concentration', 'amount', 'supplier', 'initialamount']
+    #: The report column headers (in the order of the :attr:`COLUMN_NAMES`).
+    COLUMN_LABELS = ['Cenix Pool ID', 'Cenix Old Design IDs', 'Tube Barcode',
+                     'Concentration', 'Amount', 'Supplier', 'Initial Amount']
+
+    def __init__(self, molecule_type, csv_writer, changed_since=None,
+                 supplier_ids=None, include_unassigned=False,
+                 min_concentration=None, max_concentration=None):
+        """
+        Constructor:
+
+        :param str molecule_type: The ID of the molecule type to audit.
+        :param csv_writer: The CSV writer to write the records to.
+        :type csv_writer: :class:`csv.writer`
+        :param changed_since: If set, only samples whose sample or location
+            has changed since this point in time are exported.
+        :type changed_since: :class:`datetime.datetime` or timestamp
+            :class:`str`
+        :default changed_since: *None* (full audit)
+        :param supplier_ids: If set, only stock samples from these
+            suppliers are exported.
+        :type supplier_ids: collection of organization IDs
+        :default supplier_ids: *None* (all suppliers)
+        :param bool include_unassigned: If set, samples without stock
+            sample supplier (no stock sample record) are exported along
+            with the samples of the :param:`supplier_ids`.
+        :default include_unassigned: *False*
+        :param min_concentration: The inclusive lower concentration bound
+            in uM.
+        :default min_concentration: *None* (no lower bound)
+        :param max_concentration: The exclusive upper concentration bound
+            in uM.
+        :default max_concentration: *None* (no upper bound)
+        """
+        CustomQuery.__init__(self)
+        #: The ID of the molecule type to audit.
+        self.molecule_type = molecule_type
+        #: Only samples changed after this point in time are exported.
+        self.changed_since = changed_since
+        #: Only stock samples from these suppliers (IDs) are exported.
+        self.supplier_ids = supplier_ids
+        #: Also export samples without stock sample supplier?
+        self.include_unassigned = include_unassigned
+        #: The inclusive lower concentration bound in uM.
+        self.min_concentration = min_concentration
+        #: The exclusive upper concentration bound in uM.
+        self.max_concentration = max_concentration
+        #: The number of records written so far.
+        self.number_records = 0
+        self.fetch_size = self.DEFAULT_FETCH_SIZE
+        #: The CSV writer to write the records to.
+        self.__csv_writer = csv_writer
+
+    def _get_params_for_prepared_statement(self):
+        if self.supplier_ids is None:
+            supplier_ids = None
+        else:
+            supplier_ids = list(self.supplier_ids)
+        return (self.molecule_type, self.changed_since, supplier_ids,
+                self.min_concentration, self.max_concentration,
+                self.include_unassigned)
+
+    def _store_result(self, result_record):
+        self.__csv_writer.writerow(result_record)
+        self.number_records += 1
+
+    def __repr__(self):
+        str_format = '<%s molecule type: %s, changed since: %s>'
+        params = (self.__class__.__name__, self.molecule_type,
+                  self.changed_since)
+        return str_format % params
+
+
+class SirnaStockAuditQuery(StockAuditQuery):
+    """
+    Stock audit query for siRNAs (reports the library, modification and
+    Silencer Select status of the samples).
+    """
+    PREPARED_QUERY_TEMPLATE = _AUDIT_QUERY_TEMPLATE % (
+          """, case when bool_or(set.label in ('ORD_103', 'ORD_106')) then 'old'
+            when bool_or(set.label in ('ORD_253')) then 'new'
+            when (min(mdp.number_designs) = 3) then 'pool'
             else 'no'
             end as \"library\",
-            case when (first(structs.representation) is null) then 'unmodified'
-            else first(structs.representation)
+            case when (min(structs.representation) is null) then 'unmodified'
+            else min(structs.representation)
             end as \"modification\",
-            case when (first(structs.representation) = 'Ambion H') then 'yes'
+            case when (min(structs.representation) = 'Ambion H') then 'yes'
             else 'no'
             end as \"silencerselect\"
           """,
-          'SIRNA',
-          '',
-          """library, """),
-       'COMPOUND' :
-         ('',
-          'COMPOUND',
-          '',
-    #      "and organization.name != 'Microsource Discovery Systems' ",
-          ''),
-        'SSDNA' :
-         ('',
-          'SSDNA',
-          '',
-          ''),
-        'ESI_RNA' :
-        ('',
-         'ESI_RNA',
-         '',
-         ''),
-       'MIRNA_INHI' :
-         (""", case when (first(set.label) in ('ORD_357', 'ORD_361', 'ORD_364', 'ORD_367', 'ORD_402')) then 'Y'
+          """library, """)
+
+    COLUMN_NAMES = StockAuditQuery.COLUMN_NAMES \
+                   + ['library', 'modification', 'silencerselect']
+    COLUMN_LABELS = StockAuditQuery.COLUMN_LABELS \
+                    + ['Ambion Library', 'Modification', 'Silencer Select']
+
+
+class MirnaInhibitorStockAuditQuery(StockAuditQuery):
+    """
+    Stock audit query for miRNA inhibitors (reports whether the samples
+    belong to a library).
+    """
+    PREPARED_QUERY_TEMPLATE = _AUDIT_QUERY_TEMPLATE % (
+          """, case when bool_or(set.label in ('ORD_357', 'ORD_361', 'ORD_364', 'ORD_367', 'ORD_402')) then 'Y'
             else 'N'
             end as \"library\"
           """,
-          'MIRNA_INHI',
-          '',
-          """library desc, """),
-       'MIRNA_MIMI' :
-         (""", case when (first(set.label) in ('ORD_358', 'ORD_359', 'ORD_362', 'ORD_365')) then 'Y'
+          """library desc, """)
+
+    COLUMN_NAMES = StockAuditQuery.COLUMN_NAMES + ['library']
+    COLUMN_LABELS = StockAuditQuery.COLUMN_LABELS + ['Library Y/N']
+
+
+class MirnaMimicStockAuditQuery(StockAuditQuery):
+    """
+    Stock audit query for miRNA mimics (reports whether the samples
+    belong to a library).
+    """
+    PREPARED_QUERY_TEMPLATE = _AUDIT_QUERY_TEMPLATE % (
+          """, case when bool_or(set.label in ('ORD_358', 'ORD_359', 'ORD_362', 'ORD_365')) then 'Y'
             else 'N'
             end as \"library\"
           """,
-          'MIRNA_MIMI',
-          '',
-          """library desc, """),
-        }
-    COLUMN_MAP = OrderedDict(cenixpoolid='Cenix Pool ID',
-                             cenixolddesignids='Cenix Old Design IDs',
-                             tubebarcode='Tube Barcode',
-                             concentration='Concentration',
-                             amount='Amount',
-                             supplier='Supplier',
-                             initialamount='Initial Amount')
-    def __init__(self, molecule_type, output_file, parent=None):
-        BaseTool.__init__(self, parent=parent)
-        self.__molecule_type = molecule_type
-        self.__output_file = output_file
+          """library desc, """)
 
-    def reset(self):
-        self.__molecule_type = None
-        self.__output_file = None
+    COLUMN_NAMES = StockAuditQuery.COLUMN_NAMES + ['library']
+    COLUMN_LABELS = StockAuditQuery.COLUMN_LABELS + ['Library Y/N']
+
+
+class StockAuditSupplierQuery(CustomQuery):
+    """
+    Fetches the IDs and names of all suppliers of stock samples of a
+    molecule type (used to partition audits by supplier).
+
+    The results are stored as list of (supplier ID, supplier name) tuples
+    sorted by name.
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT DISTINCT ss.supplier_id, o.name AS supplier
+    FROM stock_sample ss
+    INNER JOIN organization o ON o.organization_id = ss.supplier_id
+    WHERE ss.molecule_type = $1
+    ORDER BY o.name'''
+
+    COLUMN_NAMES = ['supplier_id', 'supplier']
+
+    def __init__(self, molecule_type):
+        """
+        Constructor:
+
+        :param str molecule_type: The ID of the molecule type.
+        """
+        CustomQuery.__init__(self)
+        #: The ID of the molecule type.
+        self.molecule_type = molecule_type
+
+    def _get_params_for_prepared_statement(self):
+        return (self.molecule_type,)
+
+    def _store_result(self, result_record):
+        self._results.append(tuple(result_record))
+
+    def __repr__(self):
+        str_format = '<%s molecule type: %s>'
+        params = (self.__class__.__name__, self.molecule_type)
+        return str_format % params
+
+
+class StockAuditReporter(BaseTool):
+    """
+    Reporter for stock audits.
+
+    The audit records are streamed from the DB and written to the output
+    file directly.
+
+    If a watermark file is passed, the audit is incremental: only the
+    stock tubes whose sample or location has changed since the timestamp
+    stored in the file are exported. Since samples and tube locations do
+    not carry timestamps themselves, changes are derived from the executed
+    liquid transfers, tube transfer worklists, rack check-ins and sample
+    registrations recorded after the watermark (tubes leaving the stock
+    are not reported). After a successful export, the start of the oldest
+    transaction still open at the start of the audit (minus the
+    :attr:`WATERMARK_OVERLAP`) is stored as new watermark, so that changes
+    committed while the audit runs are not missed. Tubes changed shortly
+    before an audit can therefore be exported again by the next
+    incremental audit (within an audit, each tube is exported once). If
+    the file does not exist (yet), a full audit is run.
+
+    Audits can be partitioned by (stock sample) supplier or by
+    concentration band. Samples without stock sample supplier are exported
+    into a separate :attr:`UNASSIGNED_PARTITION_NAME` partition. Each
+    partition is exported by a separate thread (with its own DB session)
+    into a separate file named after the output file and the partition.
+
+    **Return Value:** report file path (list of partition file paths for
+    partitioned audits)
+    """
+    NAME = 'Stock Audit Reporter'
+
+    #: Partition audits by supplier (one file per supplier).
+    SUPPLIER_PARTITION = 'supplier'
+    #: Partition audits by concentration band (see
+    #: :attr:`concentration_bands`).
+    CONCENTRATION_PARTITION = 'concentration'
+    #: The name of the supplier partition for samples without stock sample
+    #: supplier.
+    UNASSIGNED_PARTITION_NAME = 'unassigned'
+
+    #: The safety overlap (in seconds) subtracted from the start of the
+    #: oldest open transaction when the new watermark is determined.
+    WATERMARK_OVERLAP = 300
+
+    #: The default number of threads exporting partitions in parallel.
+    NUMBER_EXPORT_THREADS = 4
+
+    #: The query classes for molecule types with specific report columns.
+    QUERY_CLASSES = {'SIRNA' : SirnaStockAuditQuery,
+                     'MIRNA_INHI' : MirnaInhibitorStockAuditQuery,
+                     'MIRNA_MIMI' : MirnaMimicStockAuditQuery}
+    #: The molecule types that can be audited.
+    SUPPORTED_MOLECULE_TYPES = ('SIRNA', 'COMPOUND', 'SSDNA', 'ESI_RNA',
+                                'MIRNA_INHI', 'MIRNA_MIMI')
+
+    def __init__(self, molecule_type, output_file, watermark_file=None,
+                 partition_by=None, concentration_bands=None,
+                 number_threads=None, parent=None):
+        """
+        Constructor:
+
+        :param str molecule_type: The ID of the molecule type to audit.
+        :param str output_file: The path of the report file (partitioned
+            audits insert the partition name before the file extension).
+        :param str watermark_file: The path of the file storing the
+            timestamp of the last audit (for incremental audits).
+        :default watermark_file: *None* (full audit)
+        :param str partition_by: :attr:`SUPPLIER_PARTITION` or
+            :attr:`CONCENTRATION_PARTITION`.
+        :default partition_by: *None* (no partitioning)
+        :param concentration_bands: The band boundaries in uM (for
+            concentration partitions).
+        :type concentration_bands: list of numbers
+        :param int number_threads: The number of threads exporting
+            partitions in parallel.
+        :default number_threads: *None* (:attr:`NUMBER_EXPORT_THREADS`)
+        """
+        BaseTool.__init__(self, parent=parent)
+        #: The ID of the molecule type to audit.
+        self.molecule_type = molecule_type
+        #: The path of the report file.
+        self.output_file = output_file
+        #: The path of the file storing the timestamp of the last audit.
+        self.watermark_file = watermark_file
+        #: The partitioning of the audit (if any).
+        self.partition_by = partition_by
+        #: The concentration band boundaries in uM.
+        self.concentration_bands = concentration_bands
+        #: The number of threads exporting partitions in parallel.
+        if number_threads is None:
+            number_threads = self.NUMBER_EXPORT_THREADS
+        self.number_threads = number_threads
 
     def run(self):
-        session = Session()
-        query = self.QUERY_TEMPLATE % self.CUSTOM_BITS[self.__molecule_type]
-        self.add_info('Running stock query for %s molecules.\n%s' %
-                      (self.__molecule_type, query))
-        records = session.execute(query)
-        column_map = self.COLUMN_MAP.copy()
-        if self.__molecule_type == 'SIRNA':
-            column_map['library'] = 'Ambion Library'
-            column_map['modification'] = 'Modification'
-            column_map['silencerselect'] = 'Silencer Select'
-        elif self.__molecule_type in ('MIRNA_INHI', 'MIRNA_MIMI'):
-            column_map['library'] = 'Library Y/N'
-        csv_file = open(self.__output_file, 'w')
-        with csv_file:
-            csv_writer = DictWriter(csv_file, column_map.values(),
-                                    dialect='audit')
-            self.add_info('Exporting audit report to file "%s".'
-                          % self.__output_file)
-            number_records = 0
-            csv_writer.writeheader()
-            for record in records:
-                # Translate keys to labels.
-                rec_map = {}
-                for key, label in column_map.iteritems():
-                    rec_map[label] = record[key]
-                csv_writer.writerow(rec_map)
-                number_records += 1
-            self.add_info('Wrote %d records to file.' % number_records)
+        self.reset()
+        self.add_info('Start stock audit ...')
+        self.__check_input()
+        if not self.has_errors():
+            session = Session()
+            changed_since = self.__read_watermark()
+            watermark = self.__get_new_watermark(session)
+            if changed_since is None:
+                self.add_info('Running full stock audit for %s molecules.',
+                              self.molecule_type)
+            else:
+                self.add_info('Running incremental stock audit for %s '
+                              'molecules (changes since %s).',
+                              self.molecule_type, changed_since)
+            partitions = self.__get_partitions(session)
+            if partitions is None:
+                file_name, number_records = \
+                    self.__export(session, self.output_file, changed_since)
+                self.__record_export(file_name, number_records)
+                output = file_name
+            else:
+                output = self.__export_partitions(partitions, changed_since)
+            if not self.has_errors():
+                self.__write_watermark(watermark)
+                self.return_value = output
+                self.add_info('Stock audit completed.')
+
+    def __check_input(self):
+        # Checks the molecule type and the partitioning options.
+        if not self.molecule_type in self.SUPPORTED_MOLECULE_TYPES:
+            msg = 'Unsupported molecule type "%s". Supported molecule ' \
+                  'types are: %s.' % (self.molecule_type,
+                   ', '.join(self.SUPPORTED_MOLECULE_TYPES))
+            self.add_error(msg)
+        if self.partition_by == self.CONCENTRATION_PARTITION:
+            if not self.concentration_bands:
+                msg = 'Please specify concentration band boundaries for ' \
+                      'concentration partitions!'
+                self.add_error(msg)
+        elif not self.partition_by in (None, self.SUPPLIER_PARTITION):
+            msg = 'Unknown partitioning "%s". Use "%s" or "%s".' \
+                  % (self.partition_by, self.SUPPLIER_PARTITION,
+                     self.CONCENTRATION_PARTITION)
+            self.add_error(msg)
+        self._check_input_class('number of threads', self.number_threads,
+                                int)
+
+    def __read_watermark(self):
+        # Returns the timestamp of the last audit (*None* if there is no
+        # watermark file yet).
+        changed_since = None
+        if not self.watermark_file is None \
+                                and os.path.isfile(self.watermark_file):
+            with open(self.watermark_file, 'r') as watermark_file:
+                changed_since = watermark_file.read().strip() or None
+        return changed_since
+
+    def __get_new_watermark(self, session):
+        # Determines the watermark for the next incremental audit (before
+        # any audit data is read).
+        overlap = '%i seconds' % (self.WATERMARK_OVERLAP)
+        return session.execute(_WATERMARK_QUERY,
+                               params=dict(overlap=overlap)).scalar()
+
+    def __write_watermark(self, watermark):
+        # Stores the DB time at the start of the audit.
+        if not self.watermark_file is None:
+            with open(self.watermark_file, 'w') as watermark_file:
+                watermark_file.write(watermark)
+            self.add_info('Stored new audit watermark %s in file "%s".',
+                          watermark, self.watermark_file)
+
+    def __get_partitions(self, session):
+        # Returns a list of (name, supplier IDs, include unassigned, min
+        # concentration, max concentration) tuples (*None* for unpartitioned
+        # audits).
+        partitions = None
+        if self.partition_by == self.SUPPLIER_PARTITION:
+            query = StockAuditSupplierQuery(self.molecule_type)
+            query.run(session)
+            partitions = [(supplier, [supplier_id], False, None, None)
+                          for supplier_id, supplier
+                          in query.get_query_results()]
+            partitions.append((self.UNASSIGNED_PARTITION_NAME, [], True,
+                               None, None))
+        elif self.partition_by == self.CONCENTRATION_PARTITION:
+            boundaries = sorted(set(self.concentration_bands))
+            lower_bounds = [None] + boundaries
+            upper_bounds = boundaries + [None]
+            partitions = []
+            for min_conc, max_conc in zip(lower_bounds, upper_bounds):
+                if min_conc is None:
+                    name = 'below_%guM' % (max_conc)
+                elif max_conc is None:
+                    name = '%guM_and_above' % (min_conc)
+                else:
+                    name = '%g_to_%guM' % (min_conc, max_conc)
+                partitions.append((name, None, False, min_conc, max_conc))
+        return partitions
+
+    def __export_partitions(self, partitions, changed_since):
+        # Exports the partitions in worker threads (each thread uses its
+        # own thread-local session). Returns the partition file names.
+        def export_partition(partition):
+            name, supplier_ids, include_unassigned, min_conc, max_conc = \
+                                                                partition
+            session = Session()
+            try:
+                result = self.__export(session,
+                                       self.__get_partition_file_name(name),
+                                       changed_since,
+                                       supplier_ids=supplier_ids,
+                                       include_unassigned=include_unassigned,
+                                       min_concentration=min_conc,
+                                       max_concentration=max_conc)
+            finally:
+                session.close()
+            return result
+        self.add_info('Exporting %i partitions (by %s).',
+                      len(partitions), self.partition_by)
+        number_threads = max(1, min(self.number_threads, len(partitions)))
+        pool = ThreadPool(number_threads)
+        try:
+            results = pool.map(export_partition, partitions)
+        finally:
+            pool.close()
+            pool.join()
+        for file_name, number_records in results:
+            self.__record_export(file_name, number_records)
+        return [file_name for file_name, _ in results]
+
+    def __get_partition_file_name(self, partition_name):
+        # Inserts the (sanitised) partition name before the file extension.
+        base_name, ext = os.path.splitext(self.output_file)
+        partition_name = re.sub(r'[^\w.-]+', '_', partition_name)
+        return '%s_%s%s' % (base_name, partition_name, ext)
+
+    def __export(self, session, file_name, changed_since, **kw):
+        # Streams the audit records into the given file. Returns the file
+        # name and the number of written records.
+        query_cls = self.QUERY_CLASSES.get(self.molecule_type,
+                                           StockAuditQuery)
+        with open(file_name, 'w') as csv_file:
+            csv_writer = writer(csv_file, dialect='audit')
+            csv_writer.writerow(query_cls.COLUMN_LABELS)
+            query = query_cls(self.molecule_type, csv_writer,
+                              changed_since=changed_since, **kw)
+            query.run(session)
+        return file_name, query.number_records
+
+    def __record_export(self, file_name, number_records):
+        # Records the number of records written to a file.
+        self.add_info('Wrote %d records to file "%s".',
+                      number_records, file_name)
@@ -137,12 +137,12 @@ class RackLocationQuery(CustomQuery):
     The query results is the
     """
 
-    QUERY_TEMPLATE = '''
+    PREPARED_QUERY_TEMPLATE = '''
     SELECT r.barcode AS rack_barcode,
       bl.name AS location_name,
       bl.index AS location_index
     FROM rack r, barcoded_location bl, rack_barcoded_location rbl
-    WHERE r.barcode IN %s
+    WHERE r.barcode = ANY($1)
     AND rbl.rack_id = r.rack_id
     AND rbl.barcoded_location_id = bl.barcoded_location_id'''
 
@@ -170,8 +170,8 @@ class RackLocationQuery(CustomQuery):
         #: The rack barcodes as list.
         self.rack_barcodes = rack_barcodes
 
-    def _get_params_for_sql_statement(self):
-        return create_in_term_for_db_queries(self.rack_barcodes, as_string=True)
+    def _get_params_for_prepared_statement(self):
+        return (list(self.rack_barcodes),)
 
     def _store_result(self, result_record):
         rack_barcode = result_record[self.__RACK_BARCODE_INDEX]
@@ -9,7 +9,11 @@ stock racks that can be used for ISO generation.
 AAB
 """
 from StringIO import StringIO
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
 from datetime import datetime
+import zipfile
 
 from everest.repositories.rdb.session import ScopedSessionMaker
 from thelma.tools.base import SessionTool
@@ -20,22 +24,24 @@ from thelma.tools.stock.base import RackLocationQuery
 from thelma.tools.stock.base import STOCK_ITEM_STATUS
 from thelma.tools.stock.base import STOCK_TUBE_SPECS
 from thelma.tools.stock.base import get_stock_rack_size
-from thelma.tools.stock.base import get_stock_tube_specs_db_term
 from thelma.tools.utils.base import CustomQuery
 from thelma.tools.utils.base import add_list_map_element
-from thelma.tools.utils.base import create_in_term_for_db_queries
 from thelma.tools.utils.base import get_trimmed_string
 from thelma.tools.utils.base import sort_rack_positions
 from thelma.tools.worklists.tubehandler import TubeTransferData
 from thelma.tools.worklists.tubehandler import XL20WorklistWriter
 from thelma.tools.writers import TxtWriter
-from thelma.tools.writers import create_zip_archive
+from thelma.tools.writers import add_zip_archive_entries
+from thelma.tools.writers import add_zip_archive_writer_entry
+from thelma.tools.writers import close_zip_archive
 
 
 __docformat__ = "reStructuredText en"
 __all__ = ['StockCondenser',
            'STOCK_CONDENSE_ROLES',
+           'CONDENSE_STRATEGIES',
            'StockCondenseRack',
+           'TubeCountIndex',
            'CondenseRackQuery',
            'RackContainerQuery',
            'StockCondenseReportWriter']
@@ -56,7 +62,9 @@ class StockCondenser(SessionTool):
         1. Run query determining the number of stock tubes per rack
         2. Associate racks based on tube counts
            (here we have to round, in the first we look for racks that have
-            match exactly, in the second, we may split tubes)
+            match exactly, in the second, we may split tubes;
+            alternatively, the bin packing strategy can be used - see
+            :class:`CONDENSE_STRATEGIES`)
         3. Get tube data (barcodes and positions)
         4. Complete association data
         5. Get location for the racks (for report)
@@ -74,7 +82,8 @@ class StockCondenser(SessionTool):
     #: The file name of the XL20 report file.
     REPORT_FILE_NAME = 'stock_condense_generation_report.txt'
 
-    def __init__(self, racks_to_empty=None, excluded_racks=None, parent=None):
+    def __init__(self, racks_to_empty=None, excluded_racks=None,
+                 strategy=None, parent=None):
         """
         Constructor.
 
@@ -83,6 +92,9 @@ class StockCondenser(SessionTool):
         :param excluded_racks: A list of barcodes from stock racks that shall
             not be used.
         :type excluded_racks: A list or set of rack barcodes
+        :param str strategy: The strategy used to associate donor and
+            receiver racks (see :class:`CONDENSE_STRATEGIES`).
+        :default strategy: *None* (:attr:`CONDENSE_STRATEGIES.GREEDY`)
         """
         SessionTool.__init__(self, parent=parent)
         #: The number of empty racks the run shall result in (optional).
@@ -90,9 +102,13 @@ class StockCondenser(SessionTool):
         #: A list of barcodes from stock racks that shall not be used.
         self.excluded_racks = excluded_racks
         if excluded_racks is None: self.excluded_racks = []
+        #: The strategy used to associate donor and receiver racks.
+        self.strategy = strategy
+        if strategy is None: self.strategy = CONDENSE_STRATEGIES.GREEDY
         #: The number of positions in a stock rack.
         self.__stock_rack_size = None
-        #: Maps :class:`StockCondenseRack` objects onto tube counts.
+        #: Provides the :class:`StockCondenseRack` objects by tube count
+        #: (:class:`TubeCountIndex`).
         self.__tube_count_map = None
         #: Maps donor racks onto rack barcodes.
         self.__donor_racks = None
@@ -107,10 +123,6 @@ class StockCondenser(SessionTool):
         #: stores :class:`TubeTransferData` objects, no :class:`TubeTransfer`
         #: entities.
         self.__tube_transfers = None
-        #: The stream for the worklist file.
-        self.__worklist_stream = None
-        #: The stream for the report file.
-        self.__report_stream = None
         #: The zip stream containing the two files.
         self.__zip_stream = None
 
@@ -126,8 +138,6 @@ class StockCondenser(SessionTool):
         self.__look_for_exact_matches = True
         self.__stop_associations = False
         self.__tube_transfers = []
-        self.__worklist_stream = None
-        self.__report_stream = None
         self.__zip_stream = None
 
     def run(self):
@@ -151,7 +161,6 @@ class StockCondenser(SessionTool):
         if not self.has_errors():
             self.__write_files()
         if not self.has_errors():
-            self.__create_zip_archive()
             self.return_value = self.__zip_stream
             self.add_info('Stock condense file generation completed.')
 
@@ -179,6 +188,10 @@ class StockCondenser(SessionTool):
             for excl_rack in self.excluded_racks:
                 if not self._check_input_class('excluded rack barcode',
                                                excl_rack, basestring): break
+        if not self.strategy in CONDENSE_STRATEGIES.ALL:
+            msg = 'Unknown condense strategy "%s". Allowed strategies: %s.' \
+                  % (self.strategy, ', '.join(CONDENSE_STRATEGIES.ALL))
+            self.add_error(msg)
 
     def __generate_tube_count_map(self):
         # Generates the :attr:`__tube_count_map` using the
@@ -186,9 +199,11 @@ class StockCondenser(SessionTool):
         self.add_debug('Run rack query ...')
         try:
             query = CondenseRackQuery()
+            query.fetch_size = query.DEFAULT_FETCH_SIZE
             self._run_query(query, 'Error when running rack query: ')
             if not self.has_errors():
-                self.__tube_count_map = query.get_query_results()
+                self.__tube_count_map = \
+                            TubeCountIndex(query.get_query_results())
                 if len(self.__tube_count_map) < 0:
                     msg = 'The rack query did not return any racks!'
                     self.add_error(msg)
@@ -198,11 +213,14 @@ class StockCondenser(SessionTool):
     def __associate_racks(self):
         # Associates donor and receiver racks.
         self.add_debug('Associate racks ...')
-        # first round (exact matches only)
-        self.__run_association_round()
-        if not self.__stop_associations:
-            self.__look_for_exact_matches = False
+        if self.strategy == CONDENSE_STRATEGIES.BIN_PACKING:
+            self.__pack_racks()
+        else:
+            # first round (exact matches only)
             self.__run_association_round()
+            if not self.__stop_associations:
+                self.__look_for_exact_matches = False
+                self.__run_association_round()
         if self.racks_to_empty is not None and \
                                 self.racks_to_empty > len(self.__donor_racks):
             msg = 'Unable to empty the requested number of racks (%i) ' \
@@ -210,6 +228,13 @@ class StockCondenser(SessionTool):
                   'current run will result in %i empty racks!' \
                   % (self.racks_to_empty, len(self.__donor_racks))
             self.add_warning(msg)
+        tube_moves = 0
+        for donor_rack in self.__donor_racks.values():
+            tube_moves += sum(donor_rack.associated_racks.values())
+        self.add_info('Strategy: %s. Racks emptied: %i. Receiving racks: %i. '
+                      'XL20 moves: %i.', self.strategy,
+                      len(self.__donor_racks), len(self.__receiver_racks),
+                      tube_moves)
 
     def __run_association_round(self):
         # Runs one association round.
@@ -219,21 +244,15 @@ class StockCondenser(SessionTool):
                         len(self.__donor_racks) >= self.racks_to_empty:
                 self.__stop_associations = True
                 break
-            tube_counts = self.__tube_count_map.keys()
-            tube_counts.sort()
-            tube_count = tube_counts[0]
+            tube_count = self.__tube_count_map.get_lowest_tube_count()
             if tube_count > (self.__stock_rack_size / 2):
                 break
-            condense_racks = self.__tube_count_map[tube_count]
-            potential_donor = condense_racks.pop()
-            if len(condense_racks) == 0:
-                del self.__tube_count_map[tube_count]
+            potential_donor = self.__tube_count_map.pop(tube_count)
             if potential_donor.rack_barcode in self.excluded_racks:
                 continue
             found_associations = self.__find_rack_association(potential_donor)
             if not found_associations:
-                add_list_map_element(self.__tube_count_map, tube_count,
-                                     potential_donor)
+                self.__tube_count_map.add(tube_count, potential_donor)
                 break
 
     def __find_rack_association(self, donor_rack):
@@ -266,17 +285,10 @@ class StockCondenser(SessionTool):
         donor_rack.set_role(STOCK_CONDENSE_ROLES.DONOR)
         for receiver_barcode, num_tubes in associations.iteritems():
             receiver = receiver_racks[receiver_barcode]
-            if receiver.role is None:
-                receiver.set_role(STOCK_CONDENSE_ROLES.RECEIVER)
-            donor_rack.add_rack_association(rack_barcode=receiver_barcode,
-                                              number_tubes=num_tubes)
-            receiver.add_rack_association(number_tubes=num_tubes,
-                                    rack_barcode=donor_rack.rack_barcode)
-            self.__receiver_racks[receiver_barcode] = receiver
+            self.__record_rack_association(donor_rack, receiver, num_tubes)
             resulting_receiver_tubes = receiver.resulting_tube_count
             if resulting_receiver_tubes < self.__stock_rack_size:
-                add_list_map_element(self.__tube_count_map,
-                                     resulting_receiver_tubes, receiver)
+                self.__tube_count_map.add(resulting_receiver_tubes, receiver)
 
         self.__donor_racks[donor_rack.rack_barcode] = donor_rack
         return True
@@ -285,7 +297,7 @@ class StockCondenser(SessionTool):
         # Finds a rack to take up tubes of a donor rack.
         # try to find an excat match
         receiver_tube_count = self.__stock_rack_size - donor_tube_count
-        receiver = self.__get_rack_for_tube_count(receiver_tube_count)
+        receiver = self.__tube_count_map.pop(receiver_tube_count)
         if not receiver is None:
             return receiver
         if self.__look_for_exact_matches:
@@ -300,36 +312,100 @@ class StockCondenser(SessionTool):
                 self.add_error(msg)
             return None
         # try to find a rack with less free positions
-        while receiver_tube_count < self.__stock_rack_size:
-            receiver_tube_count += 1
-            if receiver_tube_count == self.__stock_rack_size: # no rack
+        tube_count = self.__tube_count_map.get_next_higher_tube_count(
+                            receiver_tube_count, self.__stock_rack_size)
+        if tube_count is None:
+            # take a rack with more free positions
+            # There is at least one rack left ...
+            tube_count = self.__tube_count_map.get_next_lower_tube_count(
+                                                        receiver_tube_count)
+        if tube_count is None:
+            return None
+        return self.__tube_count_map.pop(tube_count)
+
+    def __record_rack_association(self, donor_rack, receiver, number_tubes):
+        # Records the transfer of the given number of tubes from the donor
+        # to the receiver rack (the donor role must have been set before).
+        if receiver.role is None:
+            receiver.set_role(STOCK_CONDENSE_ROLES.RECEIVER)
+        donor_rack.add_rack_association(rack_barcode=receiver.rack_barcode,
+                                        number_tubes=number_tubes)
+        receiver.add_rack_association(number_tubes=number_tubes,
+                                      rack_barcode=donor_rack.rack_barcode)
+        self.__receiver_racks[receiver.rack_barcode] = receiver
+
+    def __pack_racks(self):
+        # Associates racks by solving a bin packing problem. The donors are
+        # the racks with the fewest tubes (which minimises the number of
+        # tube moves per emptied rack). We take as many as the free
+        # positions of the remaining racks can take up. The donors are then
+        # packed into the receivers in order of decreasing tube count (best
+        # fit decreasing) in order to touch as few receivers as possible.
+        racks = [scr for scr in self.__tube_count_map.get_racks()
+                 if not scr.rack_barcode in self.excluded_racks]
+        free_positions = 0
+        for scr in racks:
+            free_positions += self.__stock_rack_size - scr.tube_count
+        number_donors = 0
+        donor_tubes = 0
+        for scr in racks:
+            if not self.racks_to_empty is None and \
+                                number_donors >= self.racks_to_empty:
                 break
-            receiver = self.__get_rack_for_tube_count(receiver_tube_count)
-            if not receiver is None:
-                return receiver
-        # take a rack with more free positions
-        # There is at least one rack left ...
-        receiver_tube_count = self.__stock_rack_size - donor_tube_count
-        while receiver_tube_count > 0:
-            receiver_tube_count -= 1
-            receiver = self.__get_rack_for_tube_count(receiver_tube_count)
-            if not receiver is None:
-                return receiver
-        return None
-
-    def __get_rack_for_tube_count(self, tube_count):
-        # Obtains a rack for a certain tube count (to be used as receiver
-        # racks). The element is removed from the pool.
-        if self.__tube_count_map.has_key(tube_count):
-            receiver_list = self.__tube_count_map[tube_count]
-            receiver = receiver_list.pop()
-            if len(receiver_list) < 1:
-                receiver_list = None
-                del self.__tube_count_map[tube_count]
-            result = receiver
-        else:
-            result = None
-        return result
+            if scr.tube_count > (self.__stock_rack_size / 2):
+                break
+            free_positions -= self.__stock_rack_size - scr.tube_count
+            if donor_tubes + scr.tube_count > free_positions:
+                break
+            donor_tubes += scr.tube_count
+            number_donors += 1
+        receivers = TubeCountIndex()
+        for scr in racks[number_donors:]:
+            receivers.add(scr.tube_count, scr)
+        # Receivers that have already taken up tubes (by resulting count).
+        used_receivers = TubeCountIndex()
+        for donor_rack in reversed(racks[:number_donors]):
+            donor_rack.set_role(STOCK_CONDENSE_ROLES.DONOR)
+            remaining_tubes = donor_rack.tube_count
+            while remaining_tubes > 0:
+                receiver = self.__pop_best_fit_receiver(used_receivers,
+                                                        remaining_tubes)
+                if receiver is None:
+                    receiver = self.__pop_best_fit_receiver(receivers,
+                                                            remaining_tubes)
+                if receiver is None:
+                    # split the tubes - start with the emptiest rack
+                    if len(used_receivers) > 0:
+                        tube_index = used_receivers
+                    else:
+                        tube_index = receivers
+                    receiver = tube_index.pop(
+                                        tube_index.get_lowest_tube_count())
+                if receiver.role is None:
+                    occupied_positions = receiver.tube_count
+                else:
+                    occupied_positions = receiver.resulting_tube_count
+                transferred_tubes = min(remaining_tubes,
+                                self.__stock_rack_size - occupied_positions)
+                self.__record_rack_association(donor_rack, receiver,
+                                               transferred_tubes)
+                remaining_tubes -= transferred_tubes
+                resulting_receiver_tubes = receiver.resulting_tube_count
+                if resulting_receiver_tubes < self.__stock_rack_size:
+                    used_receivers.add(resulting_receiver_tubes, receiver)
+            self.__donor_racks[donor_rack.rack_barcode] = donor_rack
+
+    def __pop_best_fit_receiver(self, tube_count_index, number_tubes):
+        # Removes and returns the fullest rack of the index that can still
+        # take up the given number of tubes (or None).
+        max_tube_count = self.__stock_rack_size - number_tubes
+        receiver = tube_count_index.pop(max_tube_count)
+        if receiver is None:
+            tube_count = tube_count_index.get_next_lower_tube_count(
+                                                            max_tube_count)
+            if not tube_count is None:
+                receiver = tube_count_index.pop(tube_count)
+        return receiver
 
     def __fetch_tube_data(self):
         # Finds the barcodes and positions for the tube of the picked racks
@@ -397,32 +473,33 @@ class StockCondenser(SessionTool):
                 all_racks[rack_barcode].location = location_str
 
     def __write_files(self):
-        # Writes the streams for two files (worklist and report).
-        self.add_debug('Write files ...')
+        # Writes the two files (worklist and report) into the zip archive.
+        # The worklist rows are written straight into their archive entry.
+        self.add_info('Writes files into zip stream ...')
+        zip_stream = StringIO()
+        archive = zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED,
+                                  False)
         worklist_writer = XL20WorklistWriter(self.__tube_transfers,
                                              parent=self)
-        self.__worklist_stream = worklist_writer.get_result()
-        if self.__worklist_stream is None:
+        if not add_zip_archive_writer_entry(archive, self.WORKLIST_FILE_NAME,
+                                            worklist_writer):
             msg = 'Error when trying to write XL20 worklist!'
             self.add_error(msg)
         report_writer = StockCondenseReportWriter(self.__donor_racks,
                                                   self.__receiver_racks,
                                                   list(self.excluded_racks),
                                                   self.racks_to_empty,
+                                                  strategy=self.strategy,
                                                   parent=self)
-        self.__report_stream = report_writer.get_result()
-        if self.__report_stream is None:
+        report_stream = report_writer.get_result()
+        if report_stream is None:
             msg = 'Error when trying to generate stock condense overview.'
             self.add_error(msg)
-
-    def __create_zip_archive(self):
-        # Creates and fills the zip archive (adds files).
-        self.add_info('Writes files into zip stream ...')
-        self.__zip_stream = StringIO()
-        zip_map = dict()
-        zip_map[self.WORKLIST_FILE_NAME] = self.__worklist_stream
-        zip_map[self.REPORT_FILE_NAME] = self.__report_stream
-        create_zip_archive(zip_stream=self.__zip_stream, stream_map=zip_map)
+        if not self.has_errors():
+            add_zip_archive_entries(archive,
+                                    {self.REPORT_FILE_NAME : report_stream})
+            close_zip_archive(archive)
+            self.__zip_stream = zip_stream
 
 
 class STOCK_CONDENSE_ROLES(object):
@@ -436,6 +513,115 @@ class STOCK_CONDENSE_ROLES(object):
     RECEIVER = 'receiver'
 
 
+class CONDENSE_STRATEGIES(object):
+    """
+    Strategies for the association of donor and receiver racks.
+    """
+    #: Two rounds: first exact tube count matches, then the receivers with
+    #: the nearest tube counts (default).
+    GREEDY = 'greedy'
+    #: The racks with the fewest tubes are emptied and packed into the
+    #: remaining racks (best fit decreasing). This minimises the number of
+    #: tube moves (XL20 robot time) and receiving racks.
+    BIN_PACKING = 'binpacking'
+
+    ALL = [GREEDY, BIN_PACKING]
+
+
+class TubeCountIndex(object):
+    """
+    Stores :class:`StockCondenseRack` objects by tube count. There is one
+    stack (list) of racks per tube count (racks are added and removed at the
+    end). The tube counts that have racks are additionally kept in a sorted
+    list so that the lowest count and the next higher or lower count can be
+    found by bisection (instead of sorting or scanning all counts).
+    """
+    def __init__(self, tube_count_map=None):
+        """
+        Constructor.
+
+        :param dict tube_count_map: Lists of :class:`StockCondenseRack`
+            objects mapped onto tube counts (optional).
+        """
+        #: The lists of racks mapped onto tube counts.
+        self.__rack_map = dict()
+        #: The tube counts that have racks (sorted).
+        self.__tube_counts = []
+        if not tube_count_map is None:
+            for tube_count, racks in tube_count_map.iteritems():
+                if len(racks) < 1:
+                    continue
+                self.__rack_map[tube_count] = list(racks)
+                self.__tube_counts.append(tube_count)
+            self.__tube_counts.sort()
+
+    def add(self, tube_count, rack):
+        """
+        Adds a rack for the given tube count.
+        """
+        if self.__rack_map.has_key(tube_count):
+            self.__rack_map[tube_count].append(rack)
+        else:
+            self.__rack_map[tube_count] = [rack]
+            insort(self.__tube_counts, tube_count)
+
+    def pop(self, tube_count):
+        """
+        Removes and returns the last rack added for the given tube count
+        (or *None* if there is no rack with this tube count).
+        """
+        racks = self.__rack_map.get(tube_count)
+        if racks is None:
+            return None
+        rack = racks.pop()
+        if len(racks) < 1:
+            del self.__rack_map[tube_count]
+            del self.__tube_counts[bisect_left(self.__tube_counts,
+                                               tube_count)]
+        return rack
+
+    def get_lowest_tube_count(self):
+        """
+        Returns the lowest tube count that has racks (or *None*).
+        """
+        if len(self.__tube_counts) < 1:
+            return None
+        return self.__tube_counts[0]
+
+    def get_racks(self):
+        """
+        Returns all racks sorted by tube count (ascending). Racks with the
+        same tube count are sorted in the order they would be removed.
+        """
+        racks = []
+        for tube_count in self.__tube_counts:
+            racks.extend(reversed(self.__rack_map[tube_count]))
+        return racks
+
+    def get_next_higher_tube_count(self, tube_count, limit):
+        """
+        Returns the lowest tube count that has racks and is larger than the
+        given count and smaller than the limit (or *None*).
+        """
+        i = bisect_right(self.__tube_counts, tube_count)
+        if i < len(self.__tube_counts) and self.__tube_counts[i] < limit:
+            return self.__tube_counts[i]
+        return None
+
+    def get_next_lower_tube_count(self, tube_count):
+        """
+        Returns the highest tube count that has racks and is smaller than
+        the given count (or *None*).
+        """
+        i = bisect_left(self.__tube_counts, tube_count)
+        if i > 0:
+            return self.__tube_counts[i - 1]
+        return None
+
+    def __len__(self):
+        return len(self.__tube_counts)
+
+
 class StockCondenseRack(object):
     """
     A helper class storing the relevant data of a stock condense rack.
@@ -566,33 +752,33 @@ class CondenseRackQuery(CustomQuery):
     """
     _instance = None
 
-    QUERY_TEMPLATE = \
-    'SELECT DISTINCT x.rack_barcode AS rack_barcode, ' \
-                    'x.desired_count AS tube_count ' \
-    'FROM tube, container, tube_location, container_specs, ' \
-       '(SELECT rack.rack_id, rack.barcode as rack_barcode,  ' \
-               'rack_specs.number_rows, rack_specs.number_columns, ' \
-               'count(tube.container_id) as desired_count ' \
-        'FROM rack, tube, container, tube_location, container_specs, rack_specs ' \
-        'WHERE rack.rack_id = tube_location.rack_id ' \
-        'AND rack.rack_specs_id = rack_specs.rack_specs_id ' \
-        'AND tube.container_id = tube_location.container_id ' \
-        'AND container.container_id = tube.container_id' \
-        'AND container.container_specs_id =  ' \
-                            'container_specs.container_specs_id ' \
-        'AND container_specs.name in %s ' \
-        'AND container.item_status = \'%s\' ' \
-        'GROUP BY rack_id, rack.barcode, rack_specs.number_rows,  ' \
-                'rack_specs.number_columns ' \
-        'HAVING count(tube.container_id) > 0) AS x ' \
-    'WHERE tube.container_id = tube_location.container_id ' \
-    'AND tube_location.rack_id = x.rack_id ' \
-    'AND container.container_id = tube.container_id' \
-    'AND container.container_specs_id = container_specs.container_specs_id ' \
-    'AND container_specs.name in %s ' \
-    'AND container.item_status = \'%s\' ' \
-    'AND x.desired_count < %i ' \
-    'ORDER BY x.desired_count DESC, x.rack_barcode '
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT DISTINCT x.rack_barcode AS rack_barcode,
+           x.desired_count AS tube_count
+    FROM tube, container, tube_location, container_specs,
+       (SELECT rack.rack_id, rack.barcode AS rack_barcode,
+               rack_specs.number_rows, rack_specs.number_columns,
+               count(tube.container_id) AS desired_count
+        FROM rack, tube, container, tube_location, container_specs, rack_specs
+        WHERE rack.rack_id = tube_location.rack_id
+        AND rack.rack_specs_id = rack_specs.rack_specs_id
+        AND tube.container_id = tube_location.container_id
+        AND container.container_id = tube.container_id
+        AND container.container_specs_id = container_specs.container_specs_id
+        AND container_specs.name = ANY($1)
+        AND container.item_status = $2
+        GROUP BY rack.rack_id, rack.barcode, rack_specs.number_rows,
+                 rack_specs.number_columns
+        HAVING count(tube.container_id) > 0) AS x
+    WHERE tube.container_id = tube_location.container_id
+    AND tube_location.rack_id = x.rack_id
+    AND container.container_id = tube.container_id
+    AND container.container_specs_id = container_specs.container_specs_id
+    AND container_specs.name = ANY($1)
+    AND container.item_status = $2
+    AND x.desired_count < $3
+    ORDER BY x.desired_count DESC, x.rack_barcode
+    '''
 
     #: The query result column (required to parse the query results).
     COLUMN_NAMES = ('rack_barcode', 'tube_count')
@@ -623,9 +809,8 @@ class CondenseRackQuery(CustomQuery):
         """
         cls._instance = None
 
-    def _get_params_for_sql_statement(self):
-        tube_specs = get_stock_tube_specs_db_term()
-        return (tube_specs, STOCK_ITEM_STATUS, tube_specs, STOCK_ITEM_STATUS,
+    def _get_params_for_prepared_statement(self):
+        return (list(STOCK_TUBE_SPECS), STOCK_ITEM_STATUS,
                 get_stock_rack_size())
 
     def _store_result(self, result_record):
@@ -647,19 +832,20 @@ class RackContainerQuery(CustomQuery):
     Runs the second query (getting the tube information for each rack).
     The results are added to the :class:`StockCondenseRack` objects.
     """
-    QUERY_TEMPLATE = \
-        'SELECT r.barcode AS rack_barcode, rp.row_index AS row_index, ' \
-            'rp.column_index AS column_index, t.barcode AS tube_barcode, ' \
-            'c.item_status AS tube_status, cs.name AS tube_specs_name ' \
-        'FROM tube t, container c, tube_location tl, rack_position rp, '\
-            'rack r, container_specs cs ' \
-        'WHERE t.container_id = tl.container_id ' \
-        'AND rp.rack_position_id = tl.rack_position_id' \
-        'AND c.container_id = t.container_id' \
-        'AND c.container_specs_id = cs.container_specs_id ' \
-        'AND r.rack_id = tl.rack_id ' \
-        'AND r.barcode IN %s ' \
-        'ORDER BY r.barcode'
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT r.barcode AS rack_barcode, rp.row_index AS row_index,
+           rp.column_index AS column_index, t.barcode AS tube_barcode,
+           c.item_status AS tube_status, cs.name AS tube_specs_name
+    FROM tube t, container c, tube_location tl, rack_position rp,
+         rack r, container_specs cs
+    WHERE t.container_id = tl.container_id
+    AND rp.rack_position_id = tl.rack_position_id
+    AND c.container_id = t.container_id
+    AND c.container_specs_id = cs.container_specs_id
+    AND r.rack_id = tl.rack_id
+    AND r.barcode = ANY($1)
+    ORDER BY r.barcode
+    '''
 
     #: The query result column (required to parse the query results).
     COLUMN_NAMES = ('rack_barcode', 'row_index', 'column_index',
@@ -696,10 +882,8 @@ class RackContainerQuery(CustomQuery):
         #: Stores data about found tubes that do not match the stock constraints
         self.mismatching_tubes = []
 
-    def _get_params_for_sql_statement(self):
-        rack_term = create_in_term_for_db_queries(self.rack_map.keys(),
-                                                  as_string=True)
-        return (rack_term)
+    def _get_params_for_prepared_statement(self):
+        return (self.rack_map.keys(),)
 
     def _store_result(self, result_record):
         rack_barcode = result_record[self.RACK_BARCODE_INDEX]
@@ -744,8 +928,12 @@ class StockCondenseReportWriter(TxtWriter):
     RACK_TO_EMTPTY_LINE = 'Racks to empty (user input): %s'
     #: Is added of there was no user input for the number of racks to empty.
     NOT_SPECIFIED_MARKER = 'not specified'
+    #: This line presents the strategy used for the rack association.
+    STRATEGY_LINE = 'Condense strategy: %s'
     #: The line presents the total number of tubes moved.
     TUBES_MOVED_LINE = 'Number of tubes to move: %i'
+    #: The line presents the number of emptied racks.
+    RACKS_EMPTIED_LINE = 'Number of racks emptied: %i'
     #: The header text for the donor rack section.
     DONOR_HEADER = 'Donating Racks'
     #: The header text for the receiver rack section.
@@ -760,7 +948,7 @@ class StockCondenseReportWriter(TxtWriter):
     NO_EXCLUDED_RACKS_MARKER = 'no excluded racks'
 
     def __init__(self, donor_racks, receiver_racks, excluded_racks,
-                 racks_to_empty, parent=None):
+                 racks_to_empty, strategy=None, parent=None):
         """
         Constructor.
 
@@ -771,6 +959,9 @@ class StockCondenseReportWriter(TxtWriter):
             used.
         :param int racks_to_empty: The number of empty racks the run shall
             result in.
+        :param str strategy: The strategy used to associate the racks
+            (see :class:`CONDENSE_STRATEGIES`).
+        :default strategy: *None* (:attr:`CONDENSE_STRATEGIES.GREEDY`)
         """
         TxtWriter.__init__(self, parent=parent)
         #: The donor racks mapped onto rack barcodes.
@@ -781,6 +972,9 @@ class StockCondenseReportWriter(TxtWriter):
         self.excluded_racks = excluded_racks
         #: The number of empty racks the run shall result in (optional).
         self.racks_to_empty = racks_to_empty
+        #: The strategy used to associate the racks.
+        self.strategy = strategy
+        if strategy is None: self.strategy = CONDENSE_STRATEGIES.GREEDY
 
     def _check_input(self):
         """
@@ -843,7 +1037,10 @@ class StockCondenseReportWriter(TxtWriter):
             for transfer_count in scr.associated_racks.values():
                 total_transfer_count += transfer_count
         moved_tubes_line = self.TUBES_MOVED_LINE % (total_transfer_count)
-        general_lines = [rack_line, moved_tubes_line]
+        emptied_racks_line = self.RACKS_EMPTIED_LINE % (len(self.donor_racks))
+        strategy_line = self.STRATEGY_LINE % (self.strategy)
+        general_lines = [rack_line, strategy_line, emptied_racks_line,
+                         moved_tubes_line]
         self._write_body_lines(general_lines)
 
     def __write_condense_racks_section(self, header, rack_map):
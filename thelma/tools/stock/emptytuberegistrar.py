@@ -81,7 +81,7 @@ class EmptyTubeRegistrar(BaseTool):
                                                           barcode, rack, pos)
                 tubes.append(tube)
                 self.add_info('Creating tube with barcode %s at '
-                              'position %s in rack %s.' %
-                              (barcode, pos_label, rack.barcode))
+                              'position %s in rack %s.',
+                              barcode, pos_label, rack.barcode)
         if not self.has_errors():
             self.return_value = tubes
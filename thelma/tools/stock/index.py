@@ -0,0 +1,495 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+A process-local index of the stock tubes. The index allows for tube picking
+without running the stock sample and optimizing queries against the DB
+for every ISO.
+
+The index is built once (on first use) with one streaming query. After that
+it is kept up to date incrementally: the tubes, tube locations and samples
+flushed by a session are recorded for that session (tools writing stock
+data without the ORM, e.g. by COPY, call :meth:`StockIndex.mark_stale`
+themselves). When the session commits, the recorded tubes are marked as
+stale. Stale tubes are reloaded from the DB with a single query the next
+time the index is accessed. Index data are loaded through a separate
+session, so uncommitted changes (of the current or any other transaction)
+never enter the index.
+
+Limitations: changes made outside this process (other application
+instances, direct SQL) and changes of rack attributes (e.g. a rack barcode
+or rack status) are only picked up when the index is rebuilt.
+
+The index is disabled by default. Use :func:`enable` (or the
+``stock_index`` application setting) to enable it.
+
+AAB
+"""
+from array import array
+from threading import RLock
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SaSession
+from sqlalchemy.orm import sessionmaker
+
+from everest.repositories.constants import REPOSITORY_TYPES
+from everest.repositories.utils import get_engine
+from thelma.entities.container import Tube
+from thelma.entities.container import TubeLocation
+from thelma.entities.sample import Sample
+from thelma.tools.semiconstants import get_rack_position_from_indices
+from thelma.tools.stock.base import STOCK_DEAD_VOLUME
+from thelma.tools.stock.base import STOCK_ITEM_STATUS
+from thelma.tools.utils.base import CONCENTRATION_CONVERSION_FACTOR
+from thelma.tools.utils.base import CustomQuery
+from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
+from thelma.tools.utils.base import add_list_map_element
+
+
+__docformat__ = 'reStructuredText en'
+
+__all__ = ['StockIndexQuery',
+           'StockIndexTubeQuery',
+           'StockIndex',
+           'get_stock_index']
+
+
+class StockIndexQuery(CustomQuery):
+    """
+    Fetches the data for all managed stock samples that are located in a
+    rack.
+
+    The result records are stored in a list (in the order of the
+    :attr:`COLUMN_NAMES`).
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT ss.sample_id AS stock_sample_id,
+           ss.molecule_design_set_id AS pool_id,
+           ss.concentration AS concentration,
+           s.volume AS volume,
+           t.barcode AS tube_barcode,
+           r.barcode AS rack_barcode,
+           rp.row_index AS row_index,
+           rp.column_index AS column_index
+    FROM stock_sample ss
+    INNER JOIN sample s ON s.sample_id = ss.sample_id
+    INNER JOIN container c ON c.container_id = s.container_id
+    INNER JOIN tube t ON t.container_id = c.container_id
+    INNER JOIN tube_location tl ON tl.container_id = c.container_id
+    INNER JOIN rack r ON r.rack_id = tl.rack_id
+    INNER JOIN rack_position rp ON rp.rack_position_id = tl.rack_position_id
+    WHERE c.item_status = $1
+    '''
+
+    COLUMN_NAMES = ['stock_sample_id', 'pool_id', 'concentration', 'volume',
+                    'tube_barcode', 'rack_barcode', 'row_index',
+                    'column_index']
+
+    def __init__(self):
+        CustomQuery.__init__(self)
+        self.fetch_size = self.DEFAULT_FETCH_SIZE
+
+    def _get_params_for_prepared_statement(self):
+        return (STOCK_ITEM_STATUS,)
+
+    def _store_result(self, result_record):
+        self._results.append(result_record)
+
+
+class StockIndexTubeQuery(StockIndexQuery):
+    """
+    Like the :class:`StockIndexQuery` but limited to a set of tubes
+    (used to refresh stale index entries).
+    """
+    PREPARED_QUERY_TEMPLATE = StockIndexQuery.PREPARED_QUERY_TEMPLATE \
+                              + 'AND t.barcode = ANY($2)'
+
+    def __init__(self, tube_barcodes):
+        """
+        Constructor:
+
+        :param tube_barcodes: The barcodes of the tubes to fetch.
+        :type tube_barcodes: collection of :class:`str`
+        """
+        StockIndexQuery.__init__(self)
+        #: The barcodes of the tubes to fetch.
+        self.tube_barcodes = tube_barcodes
+        self.fetch_size = None
+
+    def _get_params_for_prepared_statement(self):
+        return (STOCK_ITEM_STATUS, list(self.tube_barcodes))
+
+
+class StockIndex(object):
+    """
+    Stores the stock tube data in compact arrays (one slot per stock tube)
+    and provides the lookups required for tube picking.
+
+    Concentrations and volumes are stored in DB units (M and l).
+
+    Access is thread-safe. There should only be one instance per process
+    (use :func:`get_stock_index`).
+    """
+    def __init__(self):
+        #: Is the index used by the tube pickers?
+        self.__is_enabled = False
+        #: Has the index been built?
+        self.__is_built = False
+        #: Guards all access to the index data.
+        self.__lock = RLock()
+        #: The barcodes of the tubes that must be reloaded from the DB.
+        self.__stale_tube_barcodes = set()
+        #: The barcodes of the tubes changed by uncommitted transactions
+        #: mapped onto their sessions.
+        self.__pending_tube_barcodes = WeakKeyDictionary()
+        # The slot arrays.
+        self.__sample_ids = None
+        self.__pool_ids = None
+        self.__concentrations = None
+        self.__volumes = None
+        self.__row_indices = None
+        self.__column_indices = None
+        self.__tube_barcodes = None
+        self.__rack_barcodes = None
+        #: Unused slots (of removed tubes).
+        self.__free_slots = None
+        #: Maps slots onto tube barcodes.
+        self.__tube_slots = None
+        #: Maps slots onto stock sample IDs.
+        self.__sample_slots = None
+        #: Maps slot lists onto pool IDs.
+        self.__pool_slots = None
+        #: Maps slot sets onto rack barcodes.
+        self.__rack_slots = None
+        self.__clear()
+
+    @property
+    def is_enabled(self):
+        """
+        Shall the tube pickers use the index?
+        """
+        return self.__is_enabled
+
+    @property
+    def is_built(self):
+        """
+        Has the index been built (i.e. loaded from the DB)?
+        """
+        return self.__is_built
+
+    def enable(self):
+        """
+        Enables the index (it is built on first use).
+        """
+        self.__is_enabled = True
+
+    def disable(self):
+        """
+        Disables and clears the index.
+        """
+        with self.__lock:
+            self.__is_enabled = False
+            self.__stale_tube_barcodes = set()
+            self.__pending_tube_barcodes = WeakKeyDictionary()
+            self.__clear()
+
+    @property
+    def stale_tube_barcodes(self):
+        """
+        The barcodes of the tubes that will be reloaded on the next access.
+        """
+        with self.__lock:
+            return frozenset(self.__stale_tube_barcodes)
+
+    def build(self, session=None):
+        """
+        (Re)loads the whole index from the DB.
+
+        :param session: The DB session to use (default: a new session
+            that only sees committed data).
+        """
+        query = StockIndexQuery()
+        self.__run_query(query, session)
+        with self.__lock:
+            # Tubes marked stale while the query was running are kept
+            # stale (their changes might not be visible to the query).
+            self.__clear()
+            for record in query.get_query_results():
+                self.__add_record(record)
+            self.__is_built = True
+
+    def mark_stale(self, tube_barcodes, session):
+        """
+        Records the given tubes as changed by the transaction of the given
+        session; they are marked for reloading when the session commits
+        (see :meth:`session_committed`). Tube changes flushed through the
+        ORM are recorded automatically; tools that change the location,
+        volume or status of stock tubes by other means must call this
+        method for all tubes they have touched.
+
+        :param tube_barcodes: The barcodes of the tubes that have changed.
+        :type tube_barcodes: iterable of :class:`str`
+        :param session: The session of the changing transaction.
+        """
+        with self.__lock:
+            if self.__is_enabled:
+                pending = self.__pending_tube_barcodes.get(session)
+                if pending is None:
+                    pending = self.__pending_tube_barcodes[session] = set()
+                pending.update(tube_barcodes)
+
+    def session_committed(self, session):
+        """
+        Marks the tubes recorded for the given session as stale (called
+        after each commit).
+        """
+        with self.__lock:
+            pending = self.__pending_tube_barcodes.pop(session, None)
+            if pending:
+                self.__stale_tube_barcodes.update(pending)
+
+    def refresh(self, session=None):
+        """
+        Makes sure the index is built and reloads all stale tubes.
+
+        :param session: The DB session to use (default: a new session
+            that only sees committed data).
+        """
+        with self.__lock:
+            if not self.__is_built:
+                self.build(session)
+            elif len(self.__stale_tube_barcodes) > 0:
+                tube_barcodes = self.__stale_tube_barcodes
+                self.__stale_tube_barcodes = set()
+                query = StockIndexTubeQuery(tube_barcodes)
+                try:
+                    self.__run_query(query, session)
+                except:
+                    # Keep the tubes stale for the next attempt.
+                    self.__stale_tube_barcodes.update(tube_barcodes)
+                    raise
+                for tube_barcode in tube_barcodes:
+                    self.__remove_tube(tube_barcode)
+                for record in query.get_query_results():
+                    self.__add_record(record)
+
+    def get_stock_sample_map(self, pool_ids, concentration,
+                             minimum_volume=None):
+        """
+        Returns the stock samples with the given concentration and at least
+        the given volume (plus stock dead volume) for the given pools (same
+        results as the :class:`thelma.tools.stock.tubepicking.StockSampleQuery`
+        restricted to located tubes).
+
+        :param pool_ids: The molecule design pool IDs.
+        :type pool_ids: collection of :class:`int`
+        :param concentration: The stock concentration *in nM*.
+        :type concentration: positive number, unit nM
+        :param minimum_volume: The volume to be taken out *in ul* (stock dead
+            volume is added automatically).
+        :type minimum_volume: positive number, unit ul
+        :return: The stock sample IDs (as list) mapped onto pool IDs.
+        """
+        if minimum_volume is None:
+            minimum_volume = 0
+        conc = concentration / CONCENTRATION_CONVERSION_FACTOR
+        vol = (minimum_volume + STOCK_DEAD_VOLUME) / VOLUME_CONVERSION_FACTOR
+        sample_map = dict()
+        with self.__lock:
+            self.refresh()
+            for pool_id in pool_ids:
+                for slot in self.__pool_slots.get(pool_id, ()):
+                    if self.__concentrations[slot] == conc \
+                                    and self.__volumes[slot] >= vol:
+                        add_list_map_element(sample_map, pool_id,
+                                             self.__sample_ids[slot])
+        return sample_map
+
+    def get_optimized_candidates(self, sample_ids, candidate_cls):
+        """
+        Returns tube candidates for the given stock samples in the order of
+        the :class:`thelma.tools.stock.tubepicking.OptimizingQuery`: racks
+        are ranked by the number of distinct pools among the candidates
+        they hold (descending) and rack barcode. Within a rack, the
+        candidates are sorted by position.
+
+        :param sample_ids: The stock sample IDs (e.g. from
+            :func:`get_stock_sample_map`).
+        :type sample_ids: collection of :class:`int`
+        :param candidate_cls: The tube candidate class (must accept the
+            :class:`thelma.tools.stock.tubepicking.TubeCandidate`
+            constructor arguments).
+        :return: :class:`list` of candidates
+        """
+        rack_candidate_slots = dict()
+        with self.__lock:
+            self.refresh()
+            for sample_id in set(sample_ids):
+                slot = self.__sample_slots.get(sample_id)
+                if not slot is None:
+                    add_list_map_element(rack_candidate_slots,
+                                         self.__rack_barcodes[slot], slot)
+            ranking = []
+            for rack_barcode, slots in rack_candidate_slots.iteritems():
+                pool_count = len(set([self.__pool_ids[slot]
+                                      for slot in slots]))
+                ranking.append((-pool_count, rack_barcode))
+            ranking.sort()
+            candidates = []
+            for _, rack_barcode in ranking:
+                slots = sorted(rack_candidate_slots[rack_barcode],
+                               key=lambda s: (self.__row_indices[s],
+                                              self.__column_indices[s]))
+                for slot in slots:
+                    candidates.append(self.__create_candidate(slot,
+                                                              candidate_cls))
+        return candidates
+
+    def __run_query(self, query, session):
+        # Runs the given query in the given session (default: in a new
+        # session).
+        if not session is None:
+            query.run(session)
+        else:
+            session = sessionmaker(bind=get_engine(REPOSITORY_TYPES.RDB))()
+            try:
+                query.run(session)
+            finally:
+                session.close()
+
+    def __create_candidate(self, slot, candidate_cls):
+        # Creates a tube candidate for the given slot.
+        rack_pos = get_rack_position_from_indices(
+                                row_index=self.__row_indices[slot],
+                                column_index=self.__column_indices[slot])
+        return candidate_cls(pool_id=self.__pool_ids[slot],
+                             rack_barcode=self.__rack_barcodes[slot],
+                             rack_position=rack_pos,
+                             tube_barcode=self.__tube_barcodes[slot],
+                             concentration=self.__concentrations[slot],
+                             volume=self.__volumes[slot])
+
+    def __clear(self):
+        # Removes all data.
+        self.__is_built = False
+        self.__sample_ids = array('l')
+        self.__pool_ids = array('l')
+        self.__concentrations = array('d')
+        self.__volumes = array('d')
+        self.__row_indices = array('h')
+        self.__column_indices = array('h')
+        self.__tube_barcodes = []
+        self.__rack_barcodes = []
+        self.__free_slots = []
+        self.__tube_slots = dict()
+        self.__sample_slots = dict()
+        self.__pool_slots = dict()
+        self.__rack_slots = dict()
+
+    def __add_record(self, record):
+        # Stores a :class:`StockIndexQuery` result record.
+        sample_id, pool_id, conc, vol, tube_barcode, rack_barcode, \
+                row_index, column_index = record
+        rack_barcode = intern(str(rack_barcode))
+        if len(self.__free_slots) > 0:
+            slot = self.__free_slots.pop()
+            self.__sample_ids[slot] = sample_id
+            self.__pool_ids[slot] = pool_id
+            self.__concentrations[slot] = conc
+            self.__volumes[slot] = vol
+            self.__row_indices[slot] = row_index
+            self.__column_indices[slot] = column_index
+            self.__tube_barcodes[slot] = tube_barcode
+            self.__rack_barcodes[slot] = rack_barcode
+        else:
+            slot = len(self.__sample_ids)
+            self.__sample_ids.append(sample_id)
+            self.__pool_ids.append(pool_id)
+            self.__concentrations.append(conc)
+            self.__volumes.append(vol)
+            self.__row_indices.append(row_index)
+            self.__column_indices.append(column_index)
+            self.__tube_barcodes.append(tube_barcode)
+            self.__rack_barcodes.append(rack_barcode)
+        self.__tube_slots[tube_barcode] = slot
+        self.__sample_slots[sample_id] = slot
+        add_list_map_element(self.__pool_slots, pool_id, slot)
+        add_list_map_element(self.__rack_slots, rack_barcode, slot,
+                             as_set=True)
+
+    def __remove_tube(self, tube_barcode):
+        # Removes the tube with the given barcode (if it is in the index).
+        slot = self.__tube_slots.pop(tube_barcode, None)
+        if slot is None:
+            return
+        del self.__sample_slots[self.__sample_ids[slot]]
+        pool_id = self.__pool_ids[slot]
+        pool_slots = self.__pool_slots[pool_id]
+        pool_slots.remove(slot)
+        if len(pool_slots) < 1:
+            del self.__pool_slots[pool_id]
+        rack_barcode = self.__rack_barcodes[slot]
+        rack_slots = self.__rack_slots[rack_barcode]
+        rack_slots.discard(slot)
+        if len(rack_slots) < 1:
+            del self.__rack_slots[rack_barcode]
+        self.__tube_barcodes[slot] = None
+        self.__rack_barcodes[slot] = None
+        self.__sample_ids[slot] = 0
+        self.__free_slots.append(slot)
+
+    def __len__(self):
+        return len(self.__tube_slots)
+
+    def __repr__(self):
+        str_format = '<%s built: %s, tubes: %i, racks: %i>'
+        params = (self.__class__.__name__, self.__is_built,
+                  len(self.__tube_slots), len(self.__rack_slots))
+        return str_format % params
+
+
+#: The process-wide stock index.
+__STOCK_INDEX = StockIndex()
+
+def get_stock_index():
+    """
+    Returns the process-wide :class:`StockIndex`.
+    """
+    return __STOCK_INDEX
+
+
+def _get_changed_tube_barcodes(session):
+    # Returns the barcodes of the tubes affected by the pending changes of
+    # the given session.
+    tube_barcodes = set()
+    for entity in list(session.new) + list(session.dirty) \
+                  + list(session.deleted):
+        if isinstance(entity, Tube):
+            tube = entity
+        elif isinstance(entity, (TubeLocation, Sample)):
+            tube = entity.container
+        else:
+            continue
+        if isinstance(tube, Tube) and not tube.barcode is None:
+            tube_barcodes.add(tube.barcode)
+    return tube_barcodes
+
+
+def _before_flush(session, flush_context, instances): # pylint: disable=W0613
+    stock_index = get_stock_index()
+    if stock_index.is_enabled:
+        tube_barcodes = _get_changed_tube_barcodes(session)
+        if len(tube_barcodes) > 0:
+            stock_index.mark_stale(tube_barcodes, session)
+
+
+def _after_commit(session):
+    get_stock_index().session_committed(session)
+
+
+# The changes of rolled back transactions do not need to be recorded; the
+# recorded tubes of a session are dropped with the session or marked stale
+# with its next commit (which is harmless).
+event.listen(SaSession, 'before_flush', _before_flush)
+event.listen(SaSession, 'after_commit', _after_commit)
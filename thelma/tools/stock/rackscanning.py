@@ -12,18 +12,24 @@ from StringIO import StringIO
 from datetime import datetime
 from datetime import timedelta
 import glob
+from multiprocessing.pool import ThreadPool
 import os
 
 from everest.entities.utils import get_root_aggregate
+from everest.querying.specifications import cntd
+from everest.repositories.rdb.session import ScopedSessionMaker as Session
 from thelma.tools.handlers.rackscanning import RackScanningLayout
 from thelma.tools.handlers.rackscanning import \
                                         RackScanningParserHandler
 from thelma.tools.base import BaseTool
+from thelma.tools.semiconstants import get_rack_position_from_indices
+from thelma.tools.utils.base import CustomQuery
 from thelma.tools.worklists.tubehandler import TubeTransferData
 from thelma.tools.worklists.tubehandler import TubeTransferExecutor
 from thelma.tools.writers import TxtWriter
 from thelma.tools.writers import read_zip_archive
 from thelma.interfaces import IRack
+from thelma.interfaces import ITube
 from thelma.entities.rack import TubeRack
 from thelma.entities.tubetransfer import TubeTransfer
 from thelma.entities.user import User
@@ -32,9 +38,55 @@ from thelma.utils import get_utc_time
 
 __docformat__ = "reStructuredText en"
 __all__ = ['RackScanningAdjuster',
+           'RackTubeQuery',
            'RackScanningReportWriter']
 
 
+class RackTubeQuery(CustomQuery):
+    """
+    Fetches the barcodes and positions of all tubes in the given racks.
+
+    The results are stored in a list of (rack barcode, row index,
+    column index, tube barcode) tuples.
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT r.barcode AS rack_barcode,
+           rp.row_index AS row_index,
+           rp.column_index AS column_index,
+           t.barcode AS tube_barcode
+    FROM rack r
+    INNER JOIN tube_location tl ON tl.rack_id = r.rack_id
+    INNER JOIN tube t ON t.container_id = tl.container_id
+    INNER JOIN rack_position rp ON rp.rack_position_id = tl.rack_position_id
+    WHERE r.barcode = ANY($1)'''
+
+    COLUMN_NAMES = ['rack_barcode', 'row_index', 'column_index',
+                    'tube_barcode']
+
+    def __init__(self, rack_barcodes):
+        """
+        Constructor:
+
+        :param rack_barcodes: The barcodes of the racks whose tubes to fetch.
+        :type rack_barcodes: collection of :class:`str`
+        """
+        CustomQuery.__init__(self)
+        #: The barcodes of the racks whose tubes to fetch.
+        self.rack_barcodes = rack_barcodes
+        self.fetch_size = self.DEFAULT_FETCH_SIZE
+
+    def _get_params_for_prepared_statement(self):
+        return (list(self.rack_barcodes),)
+
+    def _store_result(self, result_record):
+        self._results.append(tuple(result_record))
+
+    def __repr__(self):
+        str_format = '<%s number of barcodes: %s>'
+        params = (self.__class__.__name__, len(self.rack_barcodes))
+        return str_format % params
+
+
 class RackScanningAdjuster(BaseTool):
     """
     The adjuster compares the content of rack scanning files with the actual
@@ -69,6 +121,9 @@ class RackScanningAdjuster(BaseTool):
     WORKLIST_KEY = 'worklist'
     #: The maximum age a rack scanning timestamp may have.
     MAX_FILE_AGE = 1 # days
+    #: The number of worker threads reading scanning files from a
+    #: directory.
+    NUMBER_READER_THREADS = 8
 
     def __init__(self, rack_scanning_files, adjust_database=False, user=None,
                  parent=None):
@@ -104,6 +159,9 @@ class RackScanningAdjuster(BaseTool):
         self.__racks = None
         #: The tube entities mapped onto barcodes.
         self.__tubes = None
+        #: The DB location of each tube in the scanned racks as tuple
+        #: (rack barcode, rack position) mapped onto tube barcodes.
+        self.__tube_locations = None
         #: The stream for the overview file.
         self.__overview_stream = None
         #: The tube transfers for the DB adjustment.
@@ -126,6 +184,7 @@ class RackScanningAdjuster(BaseTool):
         self.__db_layouts = dict()
         self.__racks = dict()
         self.__tubes = dict()
+        self.__tube_locations = dict()
         self.__overview_stream = None
         self.__tube_transfers = []
         self.__tube_transfer_worklist = None
@@ -196,8 +255,8 @@ class RackScanningAdjuster(BaseTool):
         if file_map is None and not self.has_errors():
             file_map = read_zip_archive(zip_stream=self.rack_scanning_files)
         if not file_map is None:
-            for fn, stream in file_map.iteritems():
-                self.__parse_rack_scanning_file(stream, fn)
+            for fn in sorted(file_map.keys()):
+                self.__parse_rack_scanning_file(file_map[fn], fn)
         elif not self.has_errors():
             if isinstance(self.rack_scanning_files, StringIO):
                 stream = self.rack_scanning_files
@@ -221,19 +280,31 @@ class RackScanningAdjuster(BaseTool):
             pass
         else:
             if os.path.isdir(realpath):
-                file_dir = os.path.realpath(self.rack_scanning_files)
-                file_map = \
-                    dict([open(fn, 'r')
-                          for fn in glob.glob("%s/*.txt" % (file_dir))])
-                if len(file_map) < 1:
+                file_names = glob.glob("%s/*.txt" % (realpath))
+                if len(file_names) < 1:
                     msg = \
                         'There are no *.TXT files in the specified directory!'
                     self.add_error(msg)
                 else:
                     # Success!
-                    result = file_map
+                    result = self.__read_files(file_names)
         return result
 
+    def __read_files(self, file_names):
+        # Reads the given files in worker threads (the files are usually
+        # located on a network share so that reading is I/O bound). The
+        # parsing itself happens in the main thread because it needs the
+        # DB session of the tool.
+        number_threads = min(self.NUMBER_READER_THREADS, len(file_names))
+        pool = ThreadPool(number_threads)
+        try:
+            contents = pool.map(_read_file, file_names)
+        finally:
+            pool.close()
+            pool.join()
+        return dict([(fn, StringIO(content))
+                     for fn, content in zip(file_names, contents)])
+
     def __parse_rack_scanning_file(self, stream, file_name=None):
         # Converts the file stream and stores the resulting rack scanning
         # layout. Also checks the validity of the file time stamp.
@@ -260,12 +331,16 @@ class RackScanningAdjuster(BaseTool):
     def __fetch_rack_data(self):
         # Fetches the racks for the rack scanning files from the database
         # and converts them into layouts (stored in :attr:`__db_layouts`).
+        # The racks are loaded with one query, their tubes with another one.
         self.add_debug('Fetch rack data from database ...')
         missing_racks = []
         wrong_type = []
+        barcodes = self.__file_layouts.keys()
         rack_agg = get_root_aggregate(IRack)
-        for barcode in self.__file_layouts.keys():
-            rack = rack_agg.get_by_slug(barcode)
+        rack_agg.filter = cntd(barcode=barcodes)
+        racks = dict([(rack.barcode, rack) for rack in rack_agg.iterator()])
+        for barcode in barcodes:
+            rack = racks.get(barcode)
             if rack is None:
                 missing_racks.append(barcode)
             elif not isinstance(rack, TubeRack):
@@ -273,7 +348,9 @@ class RackScanningAdjuster(BaseTool):
                 wrong_type.append(info)
             else:
                 self.__racks[barcode] = rack
-                self.__db_layouts[barcode] = RackScanningLayout.from_rack(rack)
+                self.__db_layouts[barcode] = RackScanningLayout(
+                                    rack_barcode=barcode,
+                                    timestamp=get_utc_time())
         if len(missing_racks) > 0:
             missing_racks.sort()
             msg = 'Could not find database records for the following rack ' \
@@ -284,6 +361,19 @@ class RackScanningAdjuster(BaseTool):
             msg = 'The following rack are no tube racks: %s.' \
                    % (', '.join(wrong_type))
             self.add_error(msg)
+        if not self.has_errors():
+            self.__fetch_tube_locations()
+
+    def __fetch_tube_locations(self):
+        # Fills the DB layouts and builds the tube location index.
+        query = RackTubeQuery(self.__db_layouts.keys())
+        query.run(Session())
+        for rack_barcode, row_index, column_index, tube_barcode \
+                                            in query.get_query_results():
+            rack_pos = get_rack_position_from_indices(row_index, column_index)
+            self.__db_layouts[rack_barcode].add_position(rack_pos,
+                                                         tube_barcode)
+            self.__tube_locations[tube_barcode] = (rack_barcode, rack_pos)
 
     def __find_differences(self):
         # Determines tubes that have different positions in both layouts and
@@ -299,8 +389,8 @@ class RackScanningAdjuster(BaseTool):
                 db_barcode = db_layout.get_barcode_for_position(rack_pos)
                 if db_barcode == file_barcode:
                     continue
-                db_rack_barcode, db_pos = self.__find_db_location_for_tube(
-                                                                file_barcode)
+                db_rack_barcode, db_pos = self.__tube_locations.get(
+                                                file_barcode, (None, None))
                 if db_rack_barcode is None:
                     missing_in_db.append(file_barcode)
                 else:
@@ -310,10 +400,9 @@ class RackScanningAdjuster(BaseTool):
                                     trg_rack_barcode=rack_barcode,
                                     trg_pos=rack_pos)
                     self.__differences.append(tt)
-        for db_layout in self.__db_layouts.values():
-            for tube_barcode in db_layout.get_tube_barcodes():
-                if not tube_barcode in found_tubes:
-                    missing_in_file.append(tube_barcode)
+        for tube_barcode in self.__tube_locations.keys():
+            if not tube_barcode in found_tubes:
+                missing_in_file.append(tube_barcode)
         all_racks = sorted(self.__db_layouts.keys())
         if len(missing_in_db) > 0:
             missing_in_db.sort()
@@ -336,16 +425,6 @@ class RackScanningAdjuster(BaseTool):
         else:
             self.__check_feasibility()
 
-    def __find_db_location_for_tube(self, tube_barcode):
-        result = (None, None)
-        # Finds the current position of a tube.
-        for rack_barcode, db_layout in self.__db_layouts.iteritems():
-            rack_pos = db_layout.get_position_for_barcode(tube_barcode)
-            if not rack_pos is None:
-                result = (rack_barcode, rack_pos)
-                break
-        return result
-
     def __check_feasibility(self):
         # The tubehandler cannot handle situations in which the target
         # position of is at the same the source position for another tube. The
@@ -386,14 +465,15 @@ class RackScanningAdjuster(BaseTool):
         # Converts the tube transfer data objects into entities. For this
         # sake, we also have to get the referring tubes.
         self.add_debug('Convert tube transfers into entities ...')
+        tube_agg = get_root_aggregate(ITube)
+        tube_agg.filter = cntd(barcode=[tt.tube_barcode
+                                        for tt in self.__differences])
+        for tube in tube_agg.iterator():
+            self.__tubes[tube.barcode] = tube
         for tt in self.__differences:
             source_position = tt.src_pos
             source_rack = self.__racks[tt.src_rack_barcode]
-            tube = None
-            for container in source_rack.containers:
-                if container.location.position == source_position:
-                    tube = container
-                    break
+            tube = self.__tubes.get(tt.tube_barcode)
             tube_transfer = TubeTransfer(tube=tube, source_rack=source_rack,
                     source_position=source_position, target_position=tt.trg_pos,
                     target_rack=self.__racks[tt.trg_rack_barcode])
@@ -411,6 +491,13 @@ class RackScanningAdjuster(BaseTool):
             self.add_error(msg)
 
 
+def _read_file(file_name):
+    # Returns the content of the given file (used by the reader threads of
+    # the :class:`RackScanningAdjuster`).
+    with open(file_name, 'r') as scanning_file:
+        return scanning_file.read()
+
+
 class RackScanningReportWriter(TxtWriter):
     """
     This class generates a report summarising the result of the adjuser run.
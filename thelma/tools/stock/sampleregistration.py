@@ -6,7 +6,9 @@ Stock sample registrar.
 
 Created on September 06, 2012.
 """
+from StringIO import StringIO
 import datetime
+from hashlib import md5
 import glob
 import logging
 import os
@@ -14,28 +16,45 @@ import os
 from everest.entities.utils import get_root_aggregate
 from everest.querying.specifications import cntd
 from everest.querying.specifications import eq
+from everest.repositories.rdb.session import ScopedSessionMaker as Session
+from sqlalchemy.sql import func
+from thelma.entities.chemicalstructure import ChemicalStructure
+from thelma.entities.container import CONTAINER_TYPES
 from thelma.entities.container import Tube
 from thelma.entities.moleculedesign import MoleculeDesign
 from thelma.entities.moleculedesign import MoleculeDesignPool
 from thelma.entities.rack import Plate
 from thelma.entities.rack import TubeRack
+from thelma.entities.sample import SAMPLE_TYPES
 from thelma.entities.sample import StockSample
+from thelma.entities.sampleregistration import \
+                                    MoleculeDesignPoolRegistrationItem
+from thelma.entities.sampleregistration import MoleculeDesignRegistrationItem
 from thelma.entities.suppliermoleculedesign import SupplierMoleculeDesign
+from thelma.instrumentation import instrument_cursor
 from thelma.interfaces import IChemicalStructure
 from thelma.interfaces import IContainerSpecs
 from thelma.interfaces import IItemStatus
 from thelma.interfaces import IMoleculeDesign
 from thelma.interfaces import IMoleculeDesignPool
+from thelma.interfaces import IMoleculeType
 from thelma.interfaces import IRackSpecs
 from thelma.interfaces import IStockSample
 from thelma.interfaces import ISupplierMoleculeDesign
 from thelma.interfaces import ITube
 from thelma.interfaces import ITubeRack
+from thelma.repositories.rdb.schema.views.stockinfo import \
+                                    DEFER_REFRESH_SETTING
 from thelma.tools.base import BaseTool
 from thelma.tools.handlers.rackscanning \
                                     import AnyRackScanningParserHandler
 from thelma.tools.handlers.rackscanning import RackScanningLayout
 from thelma.tools.semiconstants import ITEM_STATUS_NAMES
+from thelma.tools.semiconstants import get_rack_position_from_indices
+from thelma.tools.stock.index import get_stock_index
+from thelma.tools.stock.rackscanning import RackTubeQuery
+from thelma.tools.utils.base import CustomQuery
+from thelma.utils import get_utc_time
 
 
 __docformat__ = 'reStructuredText en'
@@ -150,6 +169,181 @@ class RegistrationTool(ReportingAutomationTool): # still abstract pylint: disabl
         self.registration_items = registration_items
 
 
+class RegistrationTubeQuery(CustomQuery):
+    """
+    Fetches the existing tubes for the given barcodes together with their
+    location and sample (used by the bulk mode of the
+    :class:`SampleRegistrar`).
+
+    The results are stored in a list of (tube barcode, container ID,
+    rack ID, rack barcode, row index, column index, sample ID) tuples
+    (location and sample values are *None* if the tube does not have a
+    location or sample).
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT t.barcode AS tube_barcode,
+           t.container_id AS container_id,
+           tl.rack_id AS rack_id,
+           r.barcode AS rack_barcode,
+           rp.row_index AS row_index,
+           rp.column_index AS column_index,
+           s.sample_id AS sample_id
+    FROM tube t
+    LEFT OUTER JOIN tube_location tl ON tl.container_id = t.container_id
+    LEFT OUTER JOIN rack r ON r.rack_id = tl.rack_id
+    LEFT OUTER JOIN rack_position rp
+      ON rp.rack_position_id = tl.rack_position_id
+    LEFT OUTER JOIN sample s ON s.container_id = t.container_id
+    WHERE t.barcode = ANY($1)'''
+
+    COLUMN_NAMES = ['tube_barcode', 'container_id', 'rack_id',
+                    'rack_barcode', 'row_index', 'column_index', 'sample_id']
+
+    def __init__(self, tube_barcodes):
+        """
+        Constructor:
+
+        :param tube_barcodes: The barcodes of the tubes to fetch.
+        :type tube_barcodes: collection of :class:`str`
+        """
+        CustomQuery.__init__(self)
+        #: The barcodes of the tubes to fetch.
+        self.tube_barcodes = tube_barcodes
+        self.fetch_size = self.DEFAULT_FETCH_SIZE
+
+    def _get_params_for_prepared_statement(self):
+        return (list(self.tube_barcodes),)
+
+    def _store_result(self, result_record):
+        self._results.append(tuple(result_record))
+
+    def __repr__(self):
+        str_format = '<%s number of barcodes: %s>'
+        params = (self.__class__.__name__, len(self.tube_barcodes))
+        return str_format % params
+
+
+class PoolMemberQuery(CustomQuery):
+    """
+    Fetches the molecule type and the member molecule designs of the given
+    molecule design pools.
+
+    The results are stored in a list of (pool ID, molecule type ID,
+    molecule design ID) tuples.
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT mdp.molecule_design_set_id AS pool_id,
+           mdp.molecule_type AS molecule_type_id,
+           mdsm.molecule_design_id AS molecule_design_id
+    FROM molecule_design_pool mdp
+    INNER JOIN molecule_design_set_member mdsm
+      ON mdsm.molecule_design_set_id = mdp.molecule_design_set_id
+    WHERE mdp.molecule_design_set_id = ANY($1)
+    ORDER BY mdp.molecule_design_set_id, mdsm.molecule_design_id'''
+
+    COLUMN_NAMES = ['pool_id', 'molecule_type_id', 'molecule_design_id']
+
+    def __init__(self, pool_ids):
+        """
+        Constructor:
+
+        :param pool_ids: The IDs of the molecule design pools.
+        :type pool_ids: collection of :class:`int`
+        """
+        CustomQuery.__init__(self)
+        #: The IDs of the molecule design pools.
+        self.pool_ids = pool_ids
+        self.fetch_size = self.DEFAULT_FETCH_SIZE
+
+    def _get_params_for_prepared_statement(self):
+        return (list(self.pool_ids),)
+
+    def _store_result(self, result_record):
+        self._results.append(tuple(result_record))
+
+    def __repr__(self):
+        str_format = '<%s number of pools: %s>'
+        params = (self.__class__.__name__, len(self.pool_ids))
+        return str_format % params
+
+
+class BulkTube(object):
+    """
+    Lightweight tube record used by the bulk mode of the
+    :class:`SampleRegistrar` instead of a :class:`Tube` entity.
+    """
+    def __init__(self, barcode, container_id=None, rack=None, position=None):
+        #: The tube barcode.
+        self.barcode = barcode
+        #: The container ID (*None* until a new tube has been written).
+        self.id = container_id
+        #: The rack of a new tube (*None* for existing tubes).
+        self.rack = rack
+        #: The rack position of a new tube (*None* for existing tubes).
+        self.position = position
+
+    def __repr__(self):
+        return '<%s id: %s, barcode: %s>' % (self.__class__.__name__,
+                                             self.id, self.barcode)
+
+
+class BulkStockSample(object):
+    """
+    Lightweight stock sample record used by the bulk mode of the
+    :class:`SampleRegistrar` instead of a :class:`StockSample` entity
+    (provides the attributes used by the :class:`StockSampleReporter`).
+    """
+    def __init__(self, sample_id, container, molecule_design_pool, supplier,
+                 molecule_type, volume, concentration):
+        self.id = sample_id
+        self.container = container
+        self.molecule_design_pool = molecule_design_pool
+        self.supplier = supplier
+        self.molecule_type = molecule_type
+        self.volume = volume
+        self.concentration = concentration
+
+    def __repr__(self):
+        return '<%s id: %s, container: %s>' % (self.__class__.__name__,
+                                               self.id, self.container)
+
+
+def _allocate_ids(cursor, table_name, column_name, number_ids):
+    # Draws the given number of values from the sequence of the given
+    # serial column.
+    if number_ids < 1:
+        return []
+    cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                   'FROM generate_series(1, %s)',
+                   (table_name, column_name, number_ids))
+    return [record[0] for record in cursor.fetchall()]
+
+
+def _format_copy_value(value):
+    # Formats the given value for the text format of the COPY command.
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        value = repr(value)
+    elif isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+                .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_rows(cursor, table_name, column_names, rows):
+    # Writes the given rows into the given table with a single COPY command.
+    stream = StringIO()
+    for row in rows:
+        stream.write('\t'.join([_format_copy_value(value)
+                                for value in row]))
+        stream.write('\n')
+    stream.seek(0)
+    cursor.copy_from(stream, table_name, columns=column_names)
+
+
 class SampleRegistrar(RegistrationTool):
     """
     Registrar for samples with existing design information.
@@ -169,6 +363,15 @@ class SampleRegistrar(RegistrationTool):
        created racks;
      * Create stock samples.
 
+    In bulk mode (for large tube deliveries), existing tubes and the pool
+    members are looked up with set-based queries and new tubes, tube
+    locations, samples, sample molecules, stock samples and sample
+    registrations are written with COPY commands in the current
+    transaction, bypassing the ORM unit of work (only new racks are
+    still created through the ORM). Tubes and stock samples are then
+    returned as :class:`BulkTube` and :class:`BulkStockSample` records; the
+    report files are the same as in ORM mode.
+
     New entities are stored in the return value of the tool as a dictionary:
 
       stock_samples : list of stock samples created.
@@ -181,7 +384,7 @@ class SampleRegistrar(RegistrationTool):
     def __init__(self, registration_items, report_directory=None,
                  rack_specs_name='matrix0500',
                  container_specs_name='matrix0500',
-                 validation_files=None, **kw):
+                 validation_files=None, bulk=False, **kw):
         """
         :param registration_items: delivery samples to register.
         :type registration_items: sequence of
@@ -192,9 +395,14 @@ class SampleRegistrar(RegistrationTool):
             created tubes.
         :param str validation_files: optional comma-separated list of rack
             scanning file names to use for validation of the sample positions.
+        :param bool bulk: register the samples with set-based queries and
+            COPY commands instead of the ORM (tubes only).
+        :default bulk: *False*
         """
         RegistrationTool.__init__(self, registration_items,
                                   report_directory=report_directory, **kw)
+        #: Register the samples in bulk mode?
+        self.bulk = bulk
         self.__container_specs_name = container_specs_name
         self.__rack_specs_name = rack_specs_name
         if not validation_files is None:
@@ -220,12 +428,18 @@ class SampleRegistrar(RegistrationTool):
         self.__container_specs = None
         # The item status used by the registration items.
         self.__status = None
+        # True if the samples are registered in bulk mode.
+        self.__bulk_mode = None
 
     def run(self):
         self.add_info('Running sample registrar.')
         self.return_value = {}
         # Fetch one semiconstants needed for new instances.
         self.__prepare_semiconstants()
+        self.__bulk_mode = self.bulk and self.__tube_check_needed
+        if self.bulk and not self.__bulk_mode:
+            self.add_info('Bulk registration is only supported for tubes. '
+                          'Registering the samples through the ORM.')
         # Assign a rack to each registration item if we have rack barcodes
         # (and create new racks, if necessary). This also ensures that we
         # have location information either for all or for none of the
@@ -234,7 +448,9 @@ class SampleRegistrar(RegistrationTool):
         if not self.has_errors():
             # Assign a container to each registration item (and create new
             # tubes, if necessary).
-            if self.__tube_check_needed:
+            if self.__bulk_mode:
+                self.__check_tubes_bulk()
+            elif self.__tube_check_needed:
                 self.__check_tubes()
             else:
                 self.__check_wells()
@@ -246,7 +462,9 @@ class SampleRegistrar(RegistrationTool):
             # The registration items have location information that needs
             # to be validated.
             self.__validate_locations()
-        if not self.has_errors():
+        if not self.has_errors() and self.__bulk_mode:
+            self.__write_stock_samples_bulk()
+        elif not self.has_errors():
             self.add_info('Creating stock samples for registration items.')
             new_stock_spls = []
             ss_agg = get_root_aggregate(IStockSample)
@@ -266,6 +484,11 @@ class SampleRegistrar(RegistrationTool):
                 # Update the sample registration item.
                 sri.stock_sample = stock_spl
             self.return_value['stock_samples'] = new_stock_spls
+        if not self.has_errors() and self.__bulk_mode:
+            # The stock index does not see the rows written by COPY.
+            get_stock_index().mark_stale([sri.tube_barcode
+                                          for sri in self.registration_items],
+                                         Session())
 
     def __prepare_semiconstants(self):
         self.add_debug('Preparing semiconstants.')
@@ -323,7 +546,7 @@ class SampleRegistrar(RegistrationTool):
         tube_agg = get_root_aggregate(ITube)
         bcs = [getattr(sri, 'tube_barcode')
                for sri in self.registration_items]
-        self.add_debug('Checking tubes. Barcodes: %s' % bcs)
+        self.add_debug('Checking tubes. Barcodes: %s', bcs)
         tube_agg.filter = cntd(barcode=bcs)
         tube_map = dict([(tube.barcode, tube)
                          for tube in tube_agg.iterator()])
@@ -342,6 +565,152 @@ class SampleRegistrar(RegistrationTool):
             sri.container = tube
         self.return_value['tubes'] = new_tubes
 
+    def __check_tubes_bulk(self):
+        bcs = [sri.tube_barcode for sri in self.registration_items]
+        self.add_debug('Checking %d tubes (bulk mode).', len(bcs))
+        session = Session()
+        # New racks need their IDs and barcodes from here on.
+        session.flush()
+        query = RegistrationTubeQuery(bcs)
+        query.run(session)
+        tube_map = dict([(record[0], record)
+                         for record in query.get_query_results()])
+        new_tubes = []
+        for sri in self.registration_items:
+            tube_bc = sri.tube_barcode
+            if not tube_bc in tube_map:
+                tube = BulkTube(tube_bc, rack=sri.rack,
+                                position=sri.rack_position)
+                new_tubes.append(tube)
+            else:
+                tube = self.__validate_bulk_tube(sri, tube_map[tube_bc])
+                if tube is None:
+                    continue
+            sri.container = tube
+        self.return_value['tubes'] = new_tubes
+
+    def __validate_bulk_tube(self, sri, tube_record):
+        # Applies the checks of the ORM mode (see __validate_tube and
+        # __validate_locations) to an existing tube record. Returns *None*
+        # if the tube is not valid.
+        tube_bc, container_id, rack_id, rack_bc, row_index, column_index, \
+                sample_id = tube_record
+        valid = self.__validate_tube_state(tube_bc, not sample_id is None,
+                                           not rack_id is None)
+        if not rack_id is None and self.__has_location_info:
+            pos = get_rack_position_from_indices(row_index, column_index)
+            valid = self.__validate_registered_location(sri, rack_bc, pos) \
+                    and valid
+        if not valid:
+            return None
+        return BulkTube(tube_bc, container_id=container_id)
+
+    def __write_stock_samples_bulk(self):
+        self.add_info('Writing stock samples for registration items '
+                      '(bulk mode).')
+        session = Session()
+        mt_map = dict([(mt.id, mt)
+                       for mt in get_root_aggregate(IMoleculeType).iterator()])
+        pool_ids = set([sri.molecule_design_pool.id
+                        for sri in self.registration_items])
+        pool_query = PoolMemberQuery(pool_ids)
+        pool_query.run(session)
+        pool_mt_id_map = {}
+        pool_md_ids_map = {}
+        for pool_id, mt_id, md_id in pool_query.get_query_results():
+            pool_mt_id_map[pool_id] = mt_id
+            pool_md_ids_map.setdefault(pool_id, []).append(md_id)
+        new_tubes = self.return_value['tubes']
+        time_stamp = get_utc_time()
+        cursor = instrument_cursor(
+                            session.connection().connection.cursor())
+        try:
+            # The stock info summary is refreshed once per pool below.
+            cursor.execute("SET LOCAL %s TO 'on'" % DEFER_REFRESH_SETTING)
+            tube_ids = _allocate_ids(cursor, 'container', 'container_id',
+                                     len(new_tubes))
+            for tube, tube_id in zip(new_tubes, tube_ids):
+                tube.id = tube_id
+            _copy_rows(cursor, 'container',
+                       ('container_id', 'container_specs_id', 'item_status',
+                        'container_type'),
+                       [(tube.id, self.__container_specs.id,
+                         self.__status.id, CONTAINER_TYPES.TUBE)
+                        for tube in new_tubes])
+            _copy_rows(cursor, 'tube', ('container_id', 'barcode'),
+                       [(tube.id, tube.barcode) for tube in new_tubes])
+            _copy_rows(cursor, 'tube_location',
+                       ('container_id', 'rack_id', 'rack_position_id'),
+                       [(tube.id, tube.rack.id, tube.position.id)
+                        for tube in new_tubes if not tube.rack is None])
+            sample_ids = _allocate_ids(cursor, 'sample', 'sample_id',
+                                       len(self.registration_items))
+            number_molecules = \
+                sum([len(pool_md_ids_map[sri.molecule_design_pool.id])
+                     for sri in self.registration_items])
+            molecule_ids = iter(_allocate_ids(cursor, 'molecule',
+                                              'molecule_id', number_molecules))
+            sample_rows = []
+            molecule_rows = []
+            sample_molecule_rows = []
+            stock_sample_rows = []
+            registration_rows = []
+            new_stock_spls = []
+            for sri, sample_id in zip(self.registration_items, sample_ids):
+                pool = sri.molecule_design_pool
+                md_ids = pool_md_ids_map[pool.id]
+                mt_id = pool_mt_id_map[pool.id]
+                supplier_id = sri.supplier.id
+                sample_rows.append((sample_id, SAMPLE_TYPES.STOCK,
+                                    sri.container.id, sri.volume))
+                # By definition, the sample molecules of a stock sample
+                # share the supplier and the concentration (see
+                # StockSample).
+                sm_mol_conc = sri.concentration / len(md_ids)
+                for md_id in md_ids:
+                    molecule_id = next(molecule_ids)
+                    molecule_rows.append((molecule_id, time_stamp, md_id,
+                                          supplier_id))
+                    sample_molecule_rows.append((sample_id, molecule_id,
+                                                 sm_mol_conc, 0))
+                stock_sample_rows.append((sample_id, pool.id, supplier_id,
+                                          mt_id, sri.concentration))
+                registration_rows.append((sample_id, sri.volume,
+                                          time_stamp))
+                stock_spl = BulkStockSample(sample_id, sri.container, pool,
+                                            sri.supplier, mt_map[mt_id],
+                                            sri.volume, sri.concentration)
+                new_stock_spls.append(stock_spl)
+                # Update the sample registration item.
+                sri.stock_sample = stock_spl
+            _copy_rows(cursor, 'sample',
+                       ('sample_id', 'sample_type', 'container_id', 'volume'),
+                       sample_rows)
+            _copy_rows(cursor, 'molecule',
+                       ('molecule_id', 'insert_date', 'molecule_design_id',
+                        'supplier_id'),
+                       molecule_rows)
+            _copy_rows(cursor, 'sample_molecule',
+                       ('sample_id', 'molecule_id', 'concentration',
+                        'freeze_thaw_cycles'),
+                       sample_molecule_rows)
+            _copy_rows(cursor, 'stock_sample',
+                       ('sample_id', 'molecule_design_set_id', 'supplier_id',
+                        'molecule_type', 'concentration'),
+                       stock_sample_rows)
+            _copy_rows(cursor, 'sample_registration',
+                       ('sample_id', 'volume', 'time_stamp'),
+                       registration_rows)
+            cursor.execute("SET LOCAL %s TO 'off'" % DEFER_REFRESH_SETTING)
+            cursor.execute('SELECT refresh_stock_info_summary(pool_id) '
+                           'FROM unnest(%s::integer[]) AS pool_id',
+                           (sorted(pool_ids),))
+        finally:
+            cursor.close()
+        self.add_debug('Wrote %d tubes and %d stock samples.',
+                       len(new_tubes), len(new_stock_spls))
+        self.return_value['stock_samples'] = new_stock_spls
+
     def __check_wells(self):
         self.add_debug('Checking wells.')
         for sri in self.registration_items:
@@ -349,8 +718,8 @@ class SampleRegistrar(RegistrationTool):
             sri.container = container
 
     def __make_new_rack(self, sample_registration_item):
-        self.add_debug('Creating new rack for registration barcode %s.'
-                       % sample_registration_item.rack_barcode)
+        self.add_debug('Creating new rack for registration barcode %s.',
+                       sample_registration_item.rack_barcode)
         kw = dict(label='',
                   specs=self.__rack_specs,
                   status=self.__status)
@@ -365,8 +734,8 @@ class SampleRegistrar(RegistrationTool):
         return rack
 
     def __make_new_tube(self, sample_registration_item):
-        self.add_debug('Creating new tube with barcode %s'
-                       % sample_registration_item.tube_barcode)
+        self.add_debug('Creating new tube with barcode %s',
+                       sample_registration_item.tube_barcode)
         kw = dict(specs=self.__container_specs,
                   status=self.__status)
         kw['barcode'] = sample_registration_item.tube_barcode
@@ -389,33 +758,53 @@ class SampleRegistrar(RegistrationTool):
         return valid
 
     def __validate_tube(self, tube):
+        return self.__validate_tube_state(tube.barcode,
+                                          not tube.sample is None,
+                                          not tube.location is None)
+
+    def __validate_tube_state(self, tube_barcode, has_sample, has_location):
+        # Checks that an existing tube is empty and located in a rack
+        # (shared by the ORM and the bulk mode).
         valid = True
-        if not tube.sample is None:
+        if has_sample:
             msg = 'Can not register a tube that already contains ' \
-                  'a sample (tube barcode: %s)' % tube.barcode
+                  'a sample (tube barcode: %s)' % tube_barcode
             self.add_error(msg)
             valid = False
-        if tube.location is None:
+        if not has_location:
             msg = 'Tube with barcode %s does not have a location.' \
-                  % tube.barcode
+                  % tube_barcode
             self.add_error(msg)
             valid = False
         return valid
 
+    def __validate_registered_location(self, sri, rack_barcode,
+                                       rack_position):
+        # Compares the location in the registration item with the actual
+        # location of its tube (shared by the ORM and the bulk mode).
+        if sri.rack_position != rack_position \
+           or sri.rack.barcode != rack_barcode:
+            msg = 'Location information in the registration item ' \
+                  '(%s@%s) differs from actual location information ' \
+                  '(%s@%s)' % \
+                  (sri.rack.barcode, sri.rack_position.label,
+                   rack_barcode, rack_position.label)
+            self.add_error(msg)
+            return False
+        return True
+
     def __validate_locations(self):
         self.add_debug('Validating tube positions (comparing current '
                        'positions with positions in sample registration '
                        'data).')
-        for sri in self.registration_items:
-            if sri.rack_position != sri.container.position \
-               or sri.rack.barcode != sri.container.rack.barcode:
-                msg = 'Location information in the registration item ' \
-                      '(%s@%s) differs from actual location information ' \
-                      '(%s@%s)' % \
-                      (sri.rack.barcode, sri.rack_position.label,
-                       sri.container.rack.barcode,
-                       sri.container.position.label)
-                self.add_error(msg)
+        # In bulk mode, existing tubes have been validated by the bulk tube
+        # check and new tubes are placed as registered.
+        if not self.__bulk_mode:
+            for sri in self.registration_items:
+                self.__validate_registered_location(
+                                            sri,
+                                            sri.container.rack.barcode,
+                                            sri.container.position)
         if not self.has_errors() and not self.__validation_files is None:
             self.__validate_locations_from_scanfile()
 
@@ -426,6 +815,10 @@ class SampleRegistrar(RegistrationTool):
         # Note: rack scanning files for racks which are not referenced in
         # the delivery are ignored.
         rsl_map = self.__read_rack_scanning_files()
+        if not self.has_errors() and self.__bulk_mode:
+            reg_rsl_map = self.__make_bulk_rack_scanning_layouts()
+        else:
+            reg_rsl_map = None
         if not self.has_errors():
             processed_racks = set()
             for sri in self.registration_items:
@@ -435,7 +828,10 @@ class SampleRegistrar(RegistrationTool):
                     self.add_error(msg)
                 elif not sri.rack in processed_racks:
                     processed_racks.add(sri.rack)
-                    reg_rsl = RackScanningLayout.from_rack(sri.rack)
+                    if reg_rsl_map is None:
+                        reg_rsl = RackScanningLayout.from_rack(sri.rack)
+                    else:
+                        reg_rsl = reg_rsl_map[sri.rack]
                     # The barcode of the scanned rack could be a supplier
                     # barcode for which we just created a new TheLMA barcode.
                     rack_bc = self.__new_rack_supplier_barcode_map.get(
@@ -461,12 +857,42 @@ class SampleRegistrar(RegistrationTool):
                             msg = os.linesep.join(msgs)
                             self.add_error(msg)
 
+    def __make_bulk_rack_scanning_layouts(self):
+        # Builds the expected rack scanning layouts from the tubes already
+        # in the racks and the new tubes (which are not in the session in
+        # bulk mode).
+        racks = set([sri.rack for sri in self.registration_items
+                     if not sri.rack is None])
+        rack_map = dict([(rack.barcode, rack) for rack in racks])
+        reg_rsl_map = dict([(rack, RackScanningLayout(rack.barcode,
+                                                      get_utc_time()))
+                            for rack in racks])
+        query = RackTubeQuery(rack_map.keys())
+        query.run(Session())
+        tube_data = [(rack_map[rack_bc],
+                      get_rack_position_from_indices(row_index, column_index),
+                      tube_bc)
+                     for rack_bc, row_index, column_index, tube_bc
+                     in query.get_query_results()]
+        for sri in self.registration_items:
+            if not sri.container.rack is None:
+                tube_data.append((sri.rack, sri.rack_position,
+                                  sri.tube_barcode))
+        for rack, pos, tube_bc in tube_data:
+            try:
+                reg_rsl_map[rack].add_position(pos, tube_bc)
+            except ValueError as err:
+                msg = 'Invalid position for tube %s in rack %s: %s' \
+                      % (tube_bc, rack.barcode, err)
+                self.add_error(msg)
+        return reg_rsl_map
+
     def __read_rack_scanning_files(self):
         self.add_debug('Reading rack scanning files.')
         rsl_map = {}
         for rack_scanning_filename in self.__validation_files:
-            self.add_debug('Reading rack scanning file %s.'
-                           % rack_scanning_filename)
+            self.add_debug('Reading rack scanning file %s.',
+                           rack_scanning_filename)
             with open(rack_scanning_filename, 'rU') as rs_stream:
                 parser_handler = AnyRackScanningParserHandler(rs_stream,
                                                               parent=self)
@@ -502,11 +928,12 @@ class SupplierSampleRegistrar(RegistrationTool):
     def __init__(self, registration_items, report_directory=None,
                  rack_specs_name='matrix0500',
                  container_specs_name='matrix0500',
-                 validation_files=None, **kw):
+                 validation_files=None, bulk=False, **kw):
         RegistrationTool.__init__(self, registration_items,
                                   report_directory=report_directory,
                                   **kw)
         self.__validation_files = validation_files
+        self.__bulk = bulk
         self.__rack_specs_name = rack_specs_name
         self.__container_specs_name = container_specs_name
         self.__new_smd_sri_map = None
@@ -532,6 +959,7 @@ class SupplierSampleRegistrar(RegistrationTool):
                                  rack_specs_name=self.__rack_specs_name,
                                  container_specs_name=
                                         self.__container_specs_name,
+                                 bulk=self.__bulk,
                                  parent=self)
             sr.run()
             if sr.has_errors():
@@ -578,7 +1006,12 @@ class SupplierSampleRegistrar(RegistrationTool):
             else:
                 exst_smd_map[(smd.supplier, smd.product_id)] = smd
         new_smd_sri_map = {}
-        for sri in self.registration_items:
+        # The pool structure hashes of all registration items are computed
+        # in one go (only needed for existing supplier molecule designs).
+        hash_func = MoleculeDesignPoolRegistrationItem.make_structure_hashes
+        struc_hashes = hash_func([sri.molecule_design_pool_registration_item
+                                  for sri in self.registration_items])
+        for sri, struc_hash in zip(self.registration_items, struc_hashes):
             mdpri = sri.molecule_design_pool_registration_item
             # Set the molecule type.
             mdpri.molecule_type = sri.molecule_type
@@ -590,15 +1023,7 @@ class SupplierSampleRegistrar(RegistrationTool):
                 if not smd.molecule_design_pool is None:
                     # Compare found design information against existing design
                     # information.
-                    mdris = mdpri.molecule_design_registration_items
-                    found_md_hashes = \
-                        sorted([MoleculeDesign.make_structure_hash(
-                                                    mdri.chemical_structures)
-                                for mdri in mdris])
-                    exist_mds = smd.molecule_design_pool.molecule_designs
-                    exist_md_hashes = sorted([md.structure_hash
-                                              for md in exist_mds])
-                    if found_md_hashes != exist_md_hashes:
+                    if struc_hash != smd.molecule_design_pool.structure_hash:
                         msg = 'For product ID "%s" and supplier "%s", a ' \
                               'supplier molecule design exists which has ' \
                               'different design information than the one ' \
@@ -642,8 +1067,8 @@ class SupplierSampleRegistrar(RegistrationTool):
             self.add_error(mdp_registrar.get_messages(logging.ERROR))
 
     def __process_supplier_molecule_designs(self):
-        self.add_debug('Processing %d new supplier molecule designs.'
-                       % len(self.__new_smd_sri_map))
+        self.add_debug('Processing %d new supplier molecule designs.',
+                       len(self.__new_smd_sri_map))
         smd_agg = get_root_aggregate(ISupplierMoleculeDesign)
         new_smds = []
         for key, sris in self.__new_smd_sri_map.iteritems():
@@ -725,59 +1150,40 @@ class MoleculeDesignPoolRegistrar(RegistrationTool):
     def __process_molecule_design_pools(self):
         self.add_debug('Processing molecule design pools.')
         md_pool_agg = get_root_aggregate(IMoleculeDesignPool)
+        # We use the pool *structure* hash as key here. Unlike the member
+        # hash, it is available for new designs (which may not have been
+        # flushed yet), so all existing pools are found with a single DB
+        # call. Pools containing new designs can not be found, by
+        # definition.
+        hash_func = MoleculeDesignPoolRegistrationItem.make_structure_hashes
+        struc_hashes = hash_func(self.registration_items)
         mdpri_hash_map = {}
-        hash_func = MoleculeDesignPool.make_member_hash
-        new_mdpri_map = {}
-        new_mds = self.return_value['molecule_designs']
-        for mdpri in self.registration_items:
-            # By definition, any mdpri that contains one or more new designs
-            # must be new. We must treat this as a special case because
-            # building member hash values with the new designs does not work
-            # reliably since they may not have been flushed yet.
-            mds = [mdri.molecule_design
-                   for mdri in mdpri.molecule_design_registration_items]
-            if any(md in new_mds for md in mds):
-                # We use the *structure* as key for the new pools map here
-                # as this is always available (unlike the design IDs, which
-                # may not have been generated at this point).
-                key = self.__make_new_mdpri_key(mdpri)
-                new_mdpri_map.setdefault(key, []).append(mdpri)
-            else:
-                # For pools that consist only of existing designs, we build
-                # a map with member hashes as keys so we can query with a
-                # single DB call.
-                hash_val = \
-                        hash_func([mdri.molecule_design
-                                   for mdri in
-                                   mdpri.molecule_design_registration_items])
-                mdpri_hash_map.setdefault(hash_val, []).append(mdpri)
-        if len(mdpri_hash_map) > 0:
-            md_pool_agg.filter = cntd(member_hash=mdpri_hash_map.keys())
-            existing_mdp_map = dict([(mdp.member_hash, mdp)
-                                     for mdp in md_pool_agg.iterator()])
-            # Update existing molecule design pool registration items.
-            for hash_val, mdp in existing_mdp_map.iteritems():
-                mdpris = mdpri_hash_map[hash_val]
-                for mdpri in mdpris:
-                    if not mdpri.molecule_design_pool is None \
-                       and mdp.id != mdpri.molecule_design_pool.id:
-                        msg = 'The molecule design pool ID (%s) specified ' \
-                              'in the sample data does not match the ID ' \
-                              'of the pool that retrieved for the design ' \
-                              'structure information associated with it.'
-                        self.add_error(msg)
-                        continue
-                    mdpri.molecule_design_pool = mdp
-        else:
-            existing_mdp_map = {}
-        # Determine non-existing molecule design pool registration items and
-        # build up a map (this makes sure the same design is registered at
-        # most once.
+        for mdpri, struc_hash in zip(self.registration_items, struc_hashes):
+            mdpri_hash_map.setdefault(struc_hash, []).append(mdpri)
+        md_pool_agg.filter = cntd(structure_hash=mdpri_hash_map.keys())
+        existing_mdp_map = dict([(mdp.structure_hash, mdp)
+                                 for mdp in md_pool_agg.iterator()])
+        # Update existing molecule design pool registration items.
+        for hash_val, mdp in existing_mdp_map.iteritems():
+            mdpris = mdpri_hash_map[hash_val]
+            for mdpri in mdpris:
+                if not mdpri.molecule_design_pool is None \
+                   and mdp.id != mdpri.molecule_design_pool.id:
+                    msg = 'The molecule design pool ID (%s) specified ' \
+                          'in the sample data does not match the ID ' \
+                          'of the pool that retrieved for the design ' \
+                          'structure information associated with it.'
+                    self.add_error(msg)
+                    continue
+                mdpri.molecule_design_pool = mdp
+        # Determine non-existing molecule design pool registration items (the
+        # hash map makes sure the same pool is registered at most once).
         new_mdp_hashes = \
                 set(mdpri_hash_map.keys()).difference(existing_mdp_map.keys())
+        new_md_pools = []
         for new_mdp_hash in new_mdp_hashes:
-            mdpris = mdpri_hash_map[new_mdp_hash]
-            for mdpri in mdpris:
+            new_mdpris = []
+            for mdpri in mdpri_hash_map[new_mdp_hash]:
                 if not mdpri.molecule_design_pool is None:
                     # This is a case where we supplied both design pool ID *and*
                     # structure information in the data file and the two do not
@@ -787,27 +1193,76 @@ class MoleculeDesignPoolRegistrar(RegistrationTool):
                           'information associated with it.'
                     self.add_error(msg)
                     continue
-                key = self.__make_new_mdpri_key(mdpri)
-                new_mdpri_map.setdefault(key, []).append(mdpri)
-        if len(new_mdpri_map) > 0:
-            new_md_pools = []
-            for mdpris in new_mdpri_map.values():
+                new_mdpris.append(mdpri)
+            if len(new_mdpris) > 0:
                 # We use the first mdp registration item to create a
                 # new pool and update all with the latter.
+                mdris = new_mdpris[0].molecule_design_registration_items
                 md_pool = MoleculeDesignPool(
-                        set([mdri.molecule_design
-                             for mdri in
-                             mdpris[0].molecule_design_registration_items]))
+                        set([mdri.molecule_design for mdri in mdris]))
                 md_pool_agg.add(md_pool)
                 new_md_pools.append(md_pool)
-                for mdpri in mdpris:
+                for mdpri in new_mdpris:
                     mdpri.molecule_design_pool = md_pool
+        if len(new_md_pools) > 0:
             self.return_value['molecule_design_pools'] = new_md_pools
 
-    def __make_new_mdpri_key(self, mdpri):
-        mds = [mdri.molecule_design
-               for mdri in mdpri.molecule_design_registration_items]
-        return ','.join([md.structure_hash for md in mds])
+
+class ChemicalStructureResolver(object):
+    """
+    Looks up the existing chemical structures for (structure type ID,
+    representation) keys.
+
+    All keys of a structure type are resolved with one query matching the
+    MD5 hashes of the representations (the unique index of the chemical
+    structure table is defined on the structure type and the MD5 hash of
+    the representation). Key sets larger than :attr:`CHUNK_SIZE` are
+    queried in chunks.
+    """
+    #: The maximum number of representation hashes per query.
+    CHUNK_SIZE = 10000
+
+    def __init__(self, session):
+        """
+        Constructor:
+
+        :param session: The DB session to use.
+        """
+        self.__session = session
+
+    def resolve(self, structure_keys):
+        """
+        Fetches the chemical structures for the given keys.
+
+        :param structure_keys: The keys of the structures to look up.
+        :type structure_keys: iterable of (structure type ID,
+            representation) tuples
+        :returns: :class:`dict` mapping the keys of the existing structures
+            onto :class:`thelma.entities.chemicalstructure.ChemicalStructure`
+            instances.
+        """
+        sti_map = {}
+        for sti, rpr in set(structure_keys):
+            sti_map.setdefault(sti, set()).add(self.__make_hash(rpr))
+        cs_map = {}
+        for sti, rpr_hashes in sti_map.iteritems():
+            rpr_hashes = sorted(rpr_hashes)
+            for start in range(0, len(rpr_hashes), self.CHUNK_SIZE):
+                chunk = rpr_hashes[start:start + self.CHUNK_SIZE]
+                query = self.__session.query(ChemicalStructure) \
+                    .filter(ChemicalStructure.structure_type_id == sti) \
+                    .filter(func.md5(ChemicalStructure.representation) # pylint: disable=E1101
+                            .in_(chunk))
+                for cs in query:
+                    cs_map[(cs.structure_type_id, cs.representation)] = cs
+        return cs_map
+
+    @staticmethod
+    def __make_hash(representation):
+        # The DB computes the MD5 hash of the UTF-8 encoded representation.
+        if isinstance(representation, unicode):
+            representation = representation.encode('utf-8')
+        return md5(representation).hexdigest()
 
 
 class MoleculeDesignRegistrar(RegistrationTool):
@@ -815,9 +1270,11 @@ class MoleculeDesignRegistrar(RegistrationTool):
     Molecule design registration utility.
 
     Algorithm:
-     * Loop through the chemical structure information for each registration
-       item and either look up the corresponding record (using the
-       structure_type_id and representation as key) or create a new one;
+     * Group the registration items by structure hash (items with the same
+       structures share one design);
+     * Look up the existing chemical structures for all new designs in one
+       go (see :class:`ChemicalStructureResolver`) and create the missing
+       ones;
      * Create new molecule designs using the created/found structures.
     """
     NAME = 'MoleculeDesignRegistrar'
@@ -847,21 +1304,10 @@ class MoleculeDesignRegistrar(RegistrationTool):
             # structures, so we just take the first.
             for cs in mdris[0].chemical_structures:
                 cs_keys.add((cs.structure_type_id, cs.representation))
-        # FIXME: Build a single filtering spec here (see FIXME above).
-        cs_map = {}
-        for cs_key in cs_keys:
-            sti, rpr = cs_key
-            spec = eq(structure_type_id=sti,
-                      representation=rpr)
-            cs_agg.filter = spec
-            try:
-                cs = cs_agg.iterator().next()
-            except StopIteration:
-                continue
-            else:
-                cs_map[cs_key] = cs
-        self.add_debug('Creating %d new molecule designs.'
-                       % len(self.__new_mdris))
+        self.add_debug('Looking up %d chemical structures.', len(cs_keys))
+        cs_map = ChemicalStructureResolver(Session()).resolve(cs_keys)
+        self.add_debug('Creating %d new molecule designs.',
+                       len(self.__new_mdris))
         for mdris in self.__new_mdris:
             md_structs = []
             # By definition, all mdris for a given hash have the same
@@ -893,11 +1339,12 @@ class MoleculeDesignRegistrar(RegistrationTool):
         self.add_debug('Checking for new molecule designs.')
         md_agg = get_root_aggregate(IMoleculeDesign)
         # Build a map design hash -> registration item for all molecule design
-        # registration items.
+        # registration items. Items with the same structures (e.g. several
+        # samples of one design) share one hash computation.
         mdri_map = {}
-        for mdri in self.registration_items:
-            struc_hash = \
-              MoleculeDesign.make_structure_hash(mdri.chemical_structures)
+        struc_hashes = MoleculeDesignRegistrationItem.make_structure_hashes(
+                                                    self.registration_items)
+        for mdri, struc_hash in zip(self.registration_items, struc_hashes):
             mdri_map.setdefault(struc_hash, []).append(mdri)
         # Build "contained" specification, filter all existing designs and
         # build difference set of new designs.
@@ -0,0 +1,174 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Maintenance tools for the materialised stock info summary (see
+:mod:`thelma.repositories.rdb.schema.views.stockinfo`).
+"""
+from everest.repositories.rdb.session import ScopedSessionMaker as Session
+from thelma.tools.base import BaseTool
+from thelma.tools.utils.base import CustomQuery
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['StockInfoSummaryDifferenceQuery',
+           'StockInfoSummaryChecker',
+           'StockInfoSummaryRebuilder',
+           ]
+
+
+class StockInfoSummaryDifferenceQuery(CustomQuery):
+    """
+    Compares the stock info summary table with the live stock info view.
+
+    The results are stored as list of (pool ID, concentration, problem)
+    tuples. The problem is one of :attr:`MISSING_IN_SUMMARY`,
+    :attr:`NOT_IN_VIEW` and :attr:`VALUES_DIFFER`.
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT coalesce(sis.molecule_design_set_id,
+                    siv.molecule_design_set_id) AS pool_id,
+           coalesce(sis.concentration, siv.concentration) AS concentration,
+           CASE WHEN sis.molecule_design_set_id IS NULL THEN 'missing'
+                WHEN siv.molecule_design_set_id IS NULL THEN 'obsolete'
+                ELSE 'differs'
+           END AS problem
+    FROM stock_info_summary sis
+    FULL OUTER JOIN stock_info_view siv
+      ON siv.molecule_design_set_id = sis.molecule_design_set_id
+      AND siv.concentration = sis.concentration
+    WHERE ($1::integer[] IS NULL
+           OR coalesce(sis.molecule_design_set_id,
+                       siv.molecule_design_set_id) = ANY($1::integer[]))
+    AND (sis.molecule_design_set_id IS NULL
+         OR siv.molecule_design_set_id IS NULL
+         OR sis.stock_info_id IS DISTINCT FROM siv.stock_info_id
+         OR sis.molecule_type_id IS DISTINCT FROM siv.molecule_type_id
+         OR sis.total_tubes IS DISTINCT FROM siv.total_tubes
+         OR sis.total_volume IS DISTINCT FROM siv.total_volume
+         OR sis.minimum_volume IS DISTINCT FROM siv.minimum_volume
+         OR sis.maximum_volume IS DISTINCT FROM siv.maximum_volume)
+    ORDER BY pool_id, concentration'''
+
+    COLUMN_NAMES = ['pool_id', 'concentration', 'problem']
+
+    #: The view record is missing in the summary.
+    MISSING_IN_SUMMARY = 'missing'
+    #: The summary record does not exist in the view (anymore).
+    NOT_IN_VIEW = 'obsolete'
+    #: The summary record values differ from the view record values.
+    VALUES_DIFFER = 'differs'
+
+    def __init__(self, pool_ids=None):
+        """
+        Constructor:
+
+        :param pool_ids: The IDs of the pools to check.
+        :type pool_ids: collection of :class:`int`
+        :default pool_ids: *None* (check all pools)
+        """
+        CustomQuery.__init__(self)
+        #: The IDs of the pools to check (*None* for all pools).
+        self.pool_ids = pool_ids
+        self.fetch_size = self.DEFAULT_FETCH_SIZE
+
+    def _get_params_for_prepared_statement(self):
+        if self.pool_ids is None:
+            pool_ids = None
+        else:
+            pool_ids = list(self.pool_ids)
+        return (pool_ids,)
+
+    def _store_result(self, result_record):
+        self._results.append(tuple(result_record))
+
+    def __repr__(self):
+        return '<%s>' % (self.__class__.__name__)
+
+
+class StockInfoSummaryChecker(BaseTool):
+    """
+    Checks the consistency of the stock info summary table with the live
+    stock info view. Inconsistent pools are recorded as errors unless
+    :attr:`repair` is set, in which case their summary records are
+    refreshed.
+
+    **Return Value:** list of (pool ID, concentration, problem) tuples
+        (see :class:`StockInfoSummaryDifferenceQuery`)
+    """
+    NAME = 'Stock Info Summary Checker'
+
+    #: The maximum number of differences listed in messages.
+    MAX_REPORTED_DIFFERENCES = 20
+
+    def __init__(self, pool_ids=None, repair=False, parent=None):
+        """
+        Constructor:
+
+        :param pool_ids: The IDs of the pools to check.
+        :type pool_ids: collection of :class:`int`
+        :default pool_ids: *None* (check all pools)
+        :param bool repair: Refresh the summary records of inconsistent
+            pools?
+        :default repair: *False*
+        """
+        BaseTool.__init__(self, parent=parent)
+        #: The IDs of the pools to check (*None* for all pools).
+        self.pool_ids = pool_ids
+        #: Refresh the summary records of inconsistent pools?
+        self.repair = repair
+
+    def run(self):
+        self.reset()
+        self.add_info('Start stock info summary check ...')
+        session = Session()
+        query = StockInfoSummaryDifferenceQuery(pool_ids=self.pool_ids)
+        query.run(session)
+        differences = query.get_query_results()
+        if len(differences) < 1:
+            self.add_info('The stock info summary is consistent.')
+        else:
+            diff_strs = ['%s (%s uM): %s' % (pool_id, conc * 1e6, problem)
+                         for pool_id, conc, problem
+                         in differences[:self.MAX_REPORTED_DIFFERENCES]]
+            if len(differences) > self.MAX_REPORTED_DIFFERENCES:
+                diff_strs.append('...')
+            pool_ids = sorted(set([diff[0] for diff in differences]))
+            if self.repair:
+                for pool_id in pool_ids:
+                    session.execute('SELECT refresh_stock_info_summary(:id)',
+                                    params=dict(id=pool_id))
+                msg = 'Refreshed the stock info summary for %i inconsistent ' \
+                      'pools. Differences: %s.' \
+                      % (len(pool_ids), ', '.join(diff_strs))
+                self.add_info(msg)
+            else:
+                msg = 'The stock info summary is inconsistent with the ' \
+                      'stock info view for %i pools. Differences: %s.' \
+                      % (len(pool_ids), ', '.join(diff_strs))
+                self.add_error(msg)
+        self.return_value = differences
+        self.add_info('Stock info summary check completed.')
+
+
+class StockInfoSummaryRebuilder(BaseTool):
+    """
+    Recomputes all records of the stock info summary table from the
+    stock info view.
+
+    **Return Value:** the number of summary records (:class:`int`)
+    """
+    NAME = 'Stock Info Summary Rebuilder'
+
+    def __init__(self, parent=None):
+        BaseTool.__init__(self, parent=parent)
+
+    def run(self):
+        self.reset()
+        self.add_info('Start stock info summary rebuild ...')
+        session = Session()
+        number_records = \
+            session.execute('SELECT rebuild_stock_info_summary()').scalar()
+        self.add_info('Rebuilt the stock info summary (%i records).',
+                      number_records)
+        self.return_value = number_records
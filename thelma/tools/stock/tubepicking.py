@@ -14,6 +14,9 @@ also possible to try to minimize the number of stock racks used instead.
 AAB
 """
 from collections import OrderedDict
+from heapq import heapify
+from heapq import heappop
+from heapq import heappush
 
 from sqlalchemy.orm.collections import InstrumentedSet
 
@@ -21,12 +24,13 @@ from thelma.tools.semiconstants import get_rack_position_from_indices
 from thelma.tools.base import SessionTool
 from thelma.tools.stock.base import STOCK_DEAD_VOLUME
 from thelma.tools.stock.base import STOCK_ITEM_STATUS
-from thelma.tools.stock.base import get_stock_tube_specs_db_term
+from thelma.tools.stock.base import STOCK_TUBE_SPECS
+from thelma.tools.stock.index import get_stock_index
 from thelma.tools.utils.base import CONCENTRATION_CONVERSION_FACTOR
 from thelma.tools.utils.base import CustomQuery
 from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
 from thelma.tools.utils.base import add_list_map_element
-from thelma.tools.utils.base import create_in_term_for_db_queries
+from thelma.tools.utils.base import is_smaller_than
 from thelma.tools.utils.base import is_valid_number
 from thelma.entities.moleculedesign import MoleculeDesignPool
 
@@ -39,8 +43,12 @@ __all__ = ['StockSampleQuery',
            'TubePickingQuery',
            'SinglePoolQuery',
            'MultiPoolQuery',
+           'BatchPoolQuery',
            'OptimizingQuery',
-           'TubePicker']
+           'TubePicker',
+           'sort_candidates_by_rack_cover',
+           'pick_lowest_volume_candidate',
+           'BatchTubePicker']
 
 
 class StockSampleQuery(CustomQuery):
@@ -51,16 +59,16 @@ class StockSampleQuery(CustomQuery):
     The results are stored in a dictionary (stock sample IDs mapped onto pool
     IDs).
     """
-    QUERY_TEMPLATE = '''
+    PREPARED_QUERY_TEMPLATE = '''
     SELECT ss.molecule_design_set_id AS pool_id,
            ss.sample_id AS stock_sample_id
     FROM stock_sample ss, sample s, container c
-    WHERE ss.molecule_design_set_id IN %s
-    AND ss.concentration = %s
+    WHERE ss.molecule_design_set_id = ANY($1)
+    AND ss.concentration = $2
     AND s.sample_id = ss.sample_id
-    AND s.volume >= %s
+    AND s.volume >= $3
     AND c.container_id = s.container_id
-    AND c.item_status = '%s'
+    AND c.item_status = $4
     '''
 
     RESULT_COLLECTION_CLS = dict
@@ -101,12 +109,11 @@ class StockSampleQuery(CustomQuery):
         if minimum_volume is None:
             self.minimum_volume = 0
 
-    def _get_params_for_sql_statement(self):
-        pool_str = create_in_term_for_db_queries(self.pool_ids)
+    def _get_params_for_prepared_statement(self):
         conc = self.concentration / CONCENTRATION_CONVERSION_FACTOR
         vol = (self.minimum_volume + STOCK_DEAD_VOLUME) \
               / VOLUME_CONVERSION_FACTOR
-        return (pool_str, conc, vol, STOCK_ITEM_STATUS)
+        return (list(self.pool_ids), conc, vol, STOCK_ITEM_STATUS)
 
     def _store_result(self, result_record):
         pool_id = result_record[self.__POOL_INDEX]
@@ -120,12 +127,14 @@ class TubePoolQuery(CustomQuery):
 
     The results are stored in a dictionary (pool IDs mapped onto tube barcodes).
     """
-    QUERY_TEMPLATE = 'SELECT ss.molecule_design_set_id AS pool_id, ' \
-                     ' t.barcode AS tube_barcode ' \
-                     'FROM stock_sample ss, sample s, tube t ' \
-                     'WHERE ss.sample_id = s.sample_id ' \
-                     'AND s.container_id = t.container_id ' \
-                     'AND t.barcode IN %s;'
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT ss.molecule_design_set_id AS pool_id,
+           t.barcode AS tube_barcode
+    FROM stock_sample ss, sample s, tube t
+    WHERE ss.sample_id = s.sample_id
+    AND s.container_id = t.container_id
+    AND t.barcode = ANY($1)
+    '''
 
     __POOL_COL_NAME = 'pool_id'
     __TUBE_BARCODE_COL_NAME = 'tube_barcode'
@@ -149,8 +158,8 @@ class TubePoolQuery(CustomQuery):
         #: A list of barcodes from stock tubes.
         self.tube_barcodes = tube_barcodes
 
-    def _get_params_for_sql_statement(self):
-        return create_in_term_for_db_queries(self.tube_barcodes, as_string=True)
+    def _get_params_for_prepared_statement(self):
+        return (list(self.tube_barcodes),)
 
     def _store_result(self, result_record):
         pool_id = result_record[self.__POOL_INDEX]
@@ -316,26 +325,28 @@ class _PoolQuery(TubePickingQuery):
     """
     Used if there is you look for tubes for particular molecule design pools.
     """
-    #: The operator to be inserted into the pool ID clause of the
-    #: :attr:`QUERY_TEMPLATE`.
-    _POOL_OPERATOR = None
+    #: The pool ID clause of the :attr:`PREPARED_QUERY_TEMPLATE` (the pool
+    #: ID term is bound to parameter $1).
+    _POOL_CLAUSE = None
 
-    QUERY_TEMPLATE = '''
+    #: The query shared by all pool queries (the :attr:`_POOL_CLAUSE` is
+    #: inserted by the subclasses).
+    _QUERY_TEMPLATE_BASE = '''
     SELECT t.barcode AS tube_barcode, s.volume AS volume,
         rp.row_index AS row_index, rp.column_index AS column_index, r.barcode AS rack_barcode,
         ss.concentration AS concentration,
         ss.molecule_design_set_id AS pool_id
     FROM stock_sample ss, sample s, container c, tube t,
         container_specs cs, tube_location tl, rack_position rp, rack r
-    WHERE ss.molecule_design_set_id %s %s
+    WHERE ss.molecule_design_set_id %s
     AND ss.sample_id = s.sample_id
-    AND ss.concentration = %s
-    AND s.volume >= %s
+    AND ss.concentration = $2
+    AND s.volume >= $3
     AND t.container_id = s.container_id
     AND c.container_id = t.container_id
-    AND c.item_status = '%s'
+    AND c.item_status = $4
     AND c.container_specs_id = cs.container_specs_id
-    AND cs.name IN %s
+    AND cs.name = ANY($5)
     AND tl.container_id = c.container_id
     AND rp.rack_position_id = tl.rack_position_id
     AND tl.rack_id = r.rack_id
@@ -371,11 +382,11 @@ class _PoolQuery(TubePickingQuery):
 
     def _get_pool_id_term(self):
         """
-        Returns the term for the pool clause (after the operator).
+        Returns the value for the pool clause parameter.
         """
         raise NotImplementedError('Abstract method.')
 
-    def _get_params_for_sql_statement(self):
+    def _get_params_for_prepared_statement(self):
         """
         If there is no minimum volume specified, the minimum volume is set
         to 0.
@@ -384,10 +395,8 @@ class _PoolQuery(TubePickingQuery):
         conc = self.concentration / CONCENTRATION_CONVERSION_FACTOR
         vol = (self.minimum_volume + STOCK_DEAD_VOLUME) \
               / VOLUME_CONVERSION_FACTOR
-        tube_specs_term = get_stock_tube_specs_db_term()
-
-        return (self._POOL_OPERATOR, pool_term, conc, vol, STOCK_ITEM_STATUS,
-                tube_specs_term)
+        return (pool_term, conc, vol, STOCK_ITEM_STATUS,
+                list(STOCK_TUBE_SPECS))
 
 
 class SinglePoolQuery(_PoolQuery):
@@ -398,7 +407,9 @@ class SinglePoolQuery(_PoolQuery):
     The query results are a list of valid :class:`TubeCandidate` objects.
     """
 
-    _POOL_OPERATOR = '='
+    _POOL_CLAUSE = '= $1'
+
+    PREPARED_QUERY_TEMPLATE = _PoolQuery._QUERY_TEMPLATE_BASE % (_POOL_CLAUSE)
 
     RESULT_COLLECTION_CLS = list
 
@@ -439,7 +450,9 @@ class MultiPoolQuery(_PoolQuery):
     design pool but do not require a rack number minimisation.
     """
 
-    _POOL_OPERATOR = 'IN'
+    _POOL_CLAUSE = '= ANY($1)'
+
+    PREPARED_QUERY_TEMPLATE = _PoolQuery._QUERY_TEMPLATE_BASE % (_POOL_CLAUSE)
 
     def __init__(self, pool_ids, concentration, minimum_volume=None):
         """
@@ -463,7 +476,80 @@ class MultiPoolQuery(_PoolQuery):
         self.pool_ids = pool_ids
 
     def _get_pool_id_term(self):
-        return create_in_term_for_db_queries(self.pool_ids)
+        return list(self.pool_ids)
+
+
+class BatchPoolQuery(TubePickingQuery):
+    """
+    Used if you look for tubes for several molecule design pools that might
+    have different stock concentrations and require different volumes (e.g.
+    all pools of an ISO job). All pools are handled in one query.
+
+    The results are :class:`TubeCandidate` objects mapped onto pool IDs.
+    """
+    PREPARED_QUERY_TEMPLATE = '''
+    SELECT t.barcode AS tube_barcode, s.volume AS volume,
+        rp.row_index AS row_index, rp.column_index AS column_index,
+        r.barcode AS rack_barcode, ss.concentration AS concentration,
+        ss.molecule_design_set_id AS pool_id
+    FROM (SELECT unnest($1::integer[]) AS pool_id,
+                 unnest($2::float8[]) AS concentration,
+                 unnest($3::float8[]) AS volume) AS req,
+        stock_sample ss, sample s, container c, tube t,
+        container_specs cs, tube_location tl, rack_position rp, rack r
+    WHERE ss.molecule_design_set_id = req.pool_id
+    AND ss.concentration = req.concentration
+    AND ss.sample_id = s.sample_id
+    AND s.volume >= req.volume
+    AND t.container_id = s.container_id
+    AND c.container_id = t.container_id
+    AND c.item_status = $4
+    AND c.container_specs_id = cs.container_specs_id
+    AND cs.name = ANY($5)
+    AND tl.container_id = c.container_id
+    AND rp.rack_position_id = tl.rack_position_id
+    AND tl.rack_id = r.rack_id
+    ORDER BY r.barcode, rp.row_index, rp.column_index
+    '''
+
+    COLUMN_NAMES = ['tube_barcode', 'volume', 'row_index', 'column_index',
+                    'rack_barcode', 'concentration', 'pool_id']
+
+    def __init__(self, stock_concentrations, minimum_volumes=None):
+        """
+        Constructor:
+
+        :param stock_concentrations: The stock concentrations *in nM* mapped
+            onto pool IDs.
+        :type stock_concentrations: :class:`dict`
+
+        :param minimum_volumes: The minimum volumes *in ul* mapped onto
+            pool IDs - the dead volume of the stock is added to it
+            automatically. Pools without minimum volume accept all tubes.
+        :type minimum_volumes: :class:`dict`
+        """
+        TubePickingQuery.__init__(self)
+        #: The stock concentrations *in nM* mapped onto pool IDs.
+        self.stock_concentrations = stock_concentrations
+        if minimum_volumes is None:
+            minimum_volumes = dict()
+        #: The minimum volumes *in ul* mapped onto pool IDs.
+        self.minimum_volumes = minimum_volumes
+
+    def _get_params_for_prepared_statement(self):
+        pool_ids = []
+        concentrations = []
+        volumes = []
+        for pool_id, conc in self.stock_concentrations.iteritems():
+            pool_ids.append(pool_id)
+            concentrations.append(conc / CONCENTRATION_CONVERSION_FACTOR)
+            min_vol = self.minimum_volumes.get(pool_id)
+            if min_vol is None:
+                min_vol = 0
+            volumes.append((min_vol + STOCK_DEAD_VOLUME) \
+                           / VOLUME_CONVERSION_FACTOR)
+        return (pool_ids, concentrations, volumes, STOCK_ITEM_STATUS,
+                list(STOCK_TUBE_SPECS))
 
 
 class OptimizingQuery(TubePickingQuery):
@@ -484,7 +570,7 @@ class OptimizingQuery(TubePickingQuery):
     # samples. This minimizes the number of racks to pull from the stock.
     # Note that the nested GROUP BY statements are cleverly avoidig a
     # DISTINCT clause in the count expression for the desired count.
-    QUERY_TEMPLATE = '''
+    PREPARED_QUERY_TEMPLATE = '''
     SELECT DISTINCT stock_sample.molecule_design_set_id AS pool_id,
            rack_tube_counts.rack_barcode AS rack_barcode,
            rack_position.row_index AS row_index,
@@ -504,7 +590,7 @@ class OptimizingQuery(TubePickingQuery):
           INNER JOIN stock_sample xss ON xss.sample_id=xs.sample_id
           INNER JOIN molecule_design_set xmds
               ON xmds.molecule_design_set_id=xss.molecule_design_set_id
-          WHERE xss.sample_id IN %s
+          WHERE xss.sample_id = ANY($1)
           GROUP BY xr.rack_id, xmds.molecule_design_set_id
           HAVING COUNT(xtl.container_id) > 0 ) AS tmp
           GROUP BY tmp.rack_id, tmp.rack_barcode ) AS rack_tube_counts
@@ -513,9 +599,9 @@ class OptimizingQuery(TubePickingQuery):
     AND tube_location.rack_id = rack_tube_counts.rack_id
     AND tube.container_id = sample.container_id
     AND sample.sample_id = stock_sample.sample_id
-    AND sample.sample_id IN %s
+    AND sample.sample_id = ANY($1)
     ORDER BY rack_tube_counts.desired_count desc,
-        rack_tube_counts.rack_barcode;
+        rack_tube_counts.rack_barcode
     '''
 
     COLUMN_NAMES = ['pool_id', 'rack_barcode', 'row_index', 'column_index',
@@ -524,27 +610,68 @@ class OptimizingQuery(TubePickingQuery):
 
     IGNORE_COLUMNS = ['total_candidates']
 
-    def __init__(self, sample_ids):
+    def __init__(self, sample_ids, pool_ids=None, max_candidates_per_pool=None,
+                 excluded_racks=None):
         """
         Constructor:
 
-        :param session: The DB session to be used.
-
         :param sample_ids: The stock sample IDs that have been found in
             former queries (e.g. the :class:`StockSampleQuery`).
         :type sample_ids: collection of :class:`int`
+
+        :param pool_ids: The IDs of the pools the samples belong to (only
+            required if there is a :param:`max_candidates_per_pool`).
+        :type pool_ids: collection of :class:`int`
+
+        :param max_candidates_per_pool: If set, the query stops as soon as
+            there are at least this many candidates for each pool.
+        :type max_candidates_per_pool: positive :class:`int`
+        :default max_candidates_per_pool: *None* (all candidates)
+
+        :param excluded_racks: Candidates in these racks are still stored but
+            do not count towards the :param:`max_candidates_per_pool`.
+        :type excluded_racks: collection of rack barcodes
         """
         TubePickingQuery.__init__(self)
         #: The IDs for the single molecule design pool stock samples.
         self.sample_ids = sample_ids
+        #: The minimum number of candidates per pool required before the
+        #: query stops (*None* = all candidates).
+        self.max_candidates_per_pool = max_candidates_per_pool
+        if excluded_racks is None:
+            excluded_racks = []
+        #: Candidates in these racks do not count towards the
+        #: :attr:`max_candidates_per_pool`.
+        self.excluded_racks = set(excluded_racks)
+        #: The IDs of the pools the samples belong to.
+        self.pool_ids = pool_ids
+        #: The number of counted candidates for each pool.
+        self.__candidate_counts = None
+        #: The pools for which there are enough candidates.
+        self.__complete_pool_ids = None
+
+    def run(self, session):
+        self.__candidate_counts = dict()
+        self.__complete_pool_ids = set()
+        TubePickingQuery.run(self, session)
 
-    def _get_params_for_sql_statement(self):
-        sample_str = create_in_term_for_db_queries(self.sample_ids)
-        return (sample_str, sample_str)
+    def _get_params_for_prepared_statement(self):
+        return (list(self.sample_ids),)
 
     def _store_result(self, result_record):
         candidate = self._create_candidate_from_query_result(result_record)
         self._results.append(candidate)
+        if not self.max_candidates_per_pool is None \
+                and not candidate.rack_barcode in self.excluded_racks:
+            pool_id = candidate.pool_id
+            cand_count = self.__candidate_counts.get(pool_id, 0) + 1
+            self.__candidate_counts[pool_id] = cand_count
+            if cand_count >= self.max_candidates_per_pool:
+                self.__complete_pool_ids.add(pool_id)
+
+    def _is_complete(self):
+        return not self.max_candidates_per_pool is None \
+               and len(self.__complete_pool_ids) >= len(self.pool_ids)
 
 
 class TubePicker(SessionTool):
@@ -563,7 +690,8 @@ class TubePicker(SessionTool):
 
     def __init__(self, molecule_design_pools, stock_concentration,
                  take_out_volume=None, excluded_racks=None,
-                 requested_tubes=None, parent=None):
+                 requested_tubes=None, max_candidates_per_pool=None,
+                 parent=None):
         """
         Constructor.
 
@@ -581,6 +709,11 @@ class TubePicker(SessionTool):
             not be used for molecule design picking.
         :param list requested_tubes: List of barcodes from stock tubes that are
             supposed to be used.
+        :param int max_candidates_per_pool: If set, the optimizing query
+            streams its results and stops as soon as there are this many
+            candidates for each pool (only applies if there are no requested
+            tubes since these might be found later).
+        :default max_candidates_per_pool: *None* (all candidates)
         """
         SessionTool.__init__(self, parent=parent)
         self.molecule_design_pools = molecule_design_pools
@@ -592,11 +725,14 @@ class TubePicker(SessionTool):
         if requested_tubes is None:
             requested_tubes = []
         self.requested_tubes = requested_tubes
+        self.max_candidates_per_pool = max_candidates_per_pool
         #: The pools mapped onto their IDs.
         self._pool_map = None
         #: Stores the suitable stock sample IDs for the pools. The results are
         #: determined by the :class:`SINGLE_POOL_QUERY`.
         self._stock_samples = None
+        #: The IDs of the pools for which there are suitable stock samples.
+        self._stock_sample_pool_ids = None
         #: Returns all candidates in the same order as in the query result.
         #: Use :func:`get_unsorted_candidates` to access this list.
         self._unsorted_candidates = None
@@ -613,6 +749,7 @@ class TubePicker(SessionTool):
         SessionTool.reset(self)
         self._pool_map = dict()
         self._stock_samples = []
+        self._stock_sample_pool_ids = set()
         self._unsorted_candidates = []
         self._picked_candidates = OrderedDict()
 
@@ -677,13 +814,9 @@ class TubePicker(SessionTool):
         and have the requested :attr:`stock_concentration`.
         """
         self.add_debug('Get stock samples ...')
-        query = StockSampleQuery(pool_ids=self._pool_map.keys(),
-                                 concentration=self.stock_concentration,
-                                 minimum_volume=self.take_out_volume)
-        self._run_query(query, 'Error when trying to query stock samples: ')
+        sample_map = self.__find_stock_samples()
         if not self.has_errors():
-            sample_map = query.get_query_results()
-            found_pools = set()
+            found_pools = self._stock_sample_pool_ids
 
             for pool_id, stock_sample_ids in sample_map.iteritems():
                 found_pools.add(pool_id)
@@ -702,16 +835,39 @@ class TubePicker(SessionTool):
                       % (', '.join(sorted(missing_pools)))
                 self.add_warning(msg)
 
+    def __find_stock_samples(self):
+        # Returns the suitable stock sample IDs mapped onto pool IDs. The
+        # samples are taken from the stock index (if enabled) or queried
+        # using the :class:`StockSampleQuery`.
+        stock_index = get_stock_index()
+        if stock_index.is_enabled:
+            return stock_index.get_stock_sample_map(self._pool_map.keys(),
+                                            self.stock_concentration,
+                                            minimum_volume=self.take_out_volume)
+        query = StockSampleQuery(pool_ids=self._pool_map.keys(),
+                                 concentration=self.stock_concentration,
+                                 minimum_volume=self.take_out_volume)
+        self._run_query(query, 'Error when trying to query stock samples: ')
+        return query.get_query_results()
+
     def _run_optimizer(self):
         """
         Runs the actual optimising query (by default we use the
-        :class:`OptimizingQuery`).
+        :class:`OptimizingQuery`). If the stock index is enabled, the
+        candidates are ranked in memory instead (in the same order).
         """
         self.add_debug('Run optimizing query ...')
-        query = OptimizingQuery(sample_ids=self._stock_samples)
-        self._run_query(query, 'Error when trying to run optimizing query: ')
+        stock_index = get_stock_index()
+        if stock_index.is_enabled:
+            self._unsorted_candidates = stock_index.get_optimized_candidates(
+                                        self._stock_samples, TubeCandidate)
+        else:
+            query = self._create_optimizing_query()
+            self._run_query(query,
+                            'Error when trying to run optimizing query: ')
+            if not self.has_errors():
+                self._unsorted_candidates = query.get_query_results()
         if not self.has_errors():
-            self._unsorted_candidates = query.get_query_results()
             for candidate in self._unsorted_candidates:
                 if candidate.rack_barcode in self.excluded_racks:
                     continue
@@ -722,6 +878,22 @@ class TubePicker(SessionTool):
         else:
             self._sort_candidates()
 
+    def _create_optimizing_query(self):
+        """
+        If there is a :attr:`max_candidates_per_pool` (and there are no
+        requested tubes), the query results are streamed and the query stops
+        once there are enough candidates for each pool.
+        """
+        if self.max_candidates_per_pool is None \
+                or len(self.requested_tubes) > 0:
+            return OptimizingQuery(sample_ids=self._stock_samples)
+        query = OptimizingQuery(sample_ids=self._stock_samples,
+                        pool_ids=self._stock_sample_pool_ids,
+                        max_candidates_per_pool=self.max_candidates_per_pool,
+                        excluded_racks=self.excluded_racks)
+        query.fetch_size = query.DEFAULT_FETCH_SIZE
+        return query
+
     def _store_candidate_data(self, candidate):
         """
         Stores the candidate in the :attr:`_picked_candidates` map. Subclasses
@@ -776,3 +948,272 @@ class TubePicker(SessionTool):
             msg = 'Unable to find valid tubes for the following pools: ' \
                   '%s.' % (self._get_joined_str(diff, is_strs=False))
             self.add_warning(msg)
+
+
+def sort_candidates_by_rack_cover(candidates, pulled_racks=None):
+    """
+    Sorts tube candidates by rack so that the racks required to provide
+    a candidate for each pool are as few as possible (greedy set cover).
+
+    The racks are ranked one by one: the next rack is always the one
+    holding candidates for the largest number of pools that are not covered
+    by the racks ranked before (ties are broken by rack barcode). Racks that
+    do not add any new pool come last (in their original order). Within a
+    rack, the original candidate order is kept. Hence, the first candidate
+    for each pool in the sorted list is the one to pick.
+
+    :param candidates: The tube candidates to sort.
+    :type candidates: iterable of :class:`TubeCandidate`
+    :param pulled_racks: Barcodes of racks that are retrieved from the stock
+        anyway (e.g. for other tubes). They are ranked first.
+    :type pulled_racks: iterable of rack barcodes
+    :return: sorted :class:`list` of candidates
+    """
+    rack_candidates = OrderedDict()
+    rack_pools = dict()
+    for candidate in candidates:
+        rack_barcode = candidate.rack_barcode
+        add_list_map_element(rack_candidates, rack_barcode, candidate)
+        add_list_map_element(rack_pools, rack_barcode, candidate.pool_id,
+                             as_set=True)
+    covered_pools = set()
+    ranked_racks = []
+    if not pulled_racks is None:
+        for rack_barcode in sorted(set(pulled_racks)):
+            if rack_pools.has_key(rack_barcode):
+                ranked_racks.append(rack_barcode)
+                covered_pools.update(rack_pools.pop(rack_barcode))
+    # Gains can only decrease when more pools are covered. Hence, a
+    # rack whose recomputed gain is still the highest in the heap is the
+    # best choice (lazy greedy evaluation).
+    heap = [(-len(pools - covered_pools), rack_barcode)
+            for rack_barcode, pools in rack_pools.iteritems()]
+    heapify(heap)
+    while len(heap) > 0:
+        neg_gain, rack_barcode = heappop(heap)
+        gain = len(rack_pools[rack_barcode] - covered_pools)
+        if gain < 1:
+            break
+        if gain < -neg_gain:
+            heappush(heap, (-gain, rack_barcode))
+            continue
+        ranked_racks.append(rack_barcode)
+        covered_pools.update(rack_pools[rack_barcode])
+    ranked = set(ranked_racks)
+    for rack_barcode in rack_candidates.keys():
+        if not rack_barcode in ranked:
+            ranked_racks.append(rack_barcode)
+    sorted_candidates = []
+    for rack_barcode in ranked_racks:
+        sorted_candidates.extend(rack_candidates[rack_barcode])
+    return sorted_candidates
+
+
+def pick_lowest_volume_candidate(candidates, required_volume):
+    """
+    Picks the candidate with the lowest volume that still provides the
+    required volume. If there are several tubes with the same volume, the
+    one that comes first in the candidate list is picked (for sorted
+    candidates this is the one that is best for rack number minimisation,
+    see :func:`sort_candidates_by_rack_cover`).
+
+    :param candidates: The tube candidates for one pool.
+    :type candidates: iterable of :class:`TubeCandidate`
+    :param required_volume: The volume the tube must provide *in ul*.
+    :type required_volume: positive number
+    :return: the picked :class:`TubeCandidate` or *None* if no candidate
+        has enough volume
+    """
+    suitable = [(candidate.volume, rank, candidate)
+                for rank, candidate in enumerate(candidates)
+                if not is_smaller_than(candidate.volume, required_volume)]
+    if len(suitable) < 1:
+        return None
+    return min(suitable)[2]
+
+
+class BatchTubePicker(SessionTool):
+    """
+    Picks tubes for all pools of a whole ISO job at once. Unlike the
+    :class:`TubePicker` pools may have different stock concentrations and
+    take out volumes.
+
+    All candidates are fetched with one query (:class:`BatchPoolQuery`) or
+    taken from the stock index (if enabled, see
+    :mod:`thelma.tools.stock.index`). The candidates are then sorted so
+    that the number of stock racks to retrieve is minimised (see
+    :func:`sort_candidates_by_rack_cover`).
+    Requested tubes come first.
+
+    **Return Value:** the candidates (sorted lists) mapped onto pools
+        (the first candidate is the one to pick)
+    """
+    NAME = 'Batch Tube Picker'
+
+    def __init__(self, stock_concentrations, take_out_volumes=None,
+                 excluded_racks=None, requested_tubes=None, pulled_racks=None,
+                 parent=None):
+        """
+        Constructor.
+
+        :param dict stock_concentrations: The stock concentrations in nM
+            (positive numbers) mapped onto molecule design pools
+            (:class:`thelma.entities.moleculedesign.MoleculeDesignPool`).
+        :param dict take_out_volumes: The volumes in ul that shall be
+            removed from the stock mapped onto molecule design pools (pools
+            without volume are not filtered by volume).
+        :param list excluded_racks: List of barcodes from stock racks that shall
+            not be used for molecule design picking.
+        :param list requested_tubes: List of barcodes from stock tubes that are
+            supposed to be used.
+        :param list pulled_racks: List of barcodes from stock racks that are
+            retrieved from the stock anyway (their tubes are preferred).
+        """
+        SessionTool.__init__(self, parent=parent)
+        self.stock_concentrations = stock_concentrations
+        if take_out_volumes is None:
+            take_out_volumes = dict()
+        self.take_out_volumes = take_out_volumes
+        if excluded_racks is None:
+            excluded_racks = []
+        self.excluded_racks = excluded_racks
+        if requested_tubes is None:
+            requested_tubes = []
+        self.requested_tubes = requested_tubes
+        if pulled_racks is None:
+            pulled_racks = []
+        self.pulled_racks = pulled_racks
+        #: The pools mapped onto their IDs.
+        self.__pool_map = None
+        #: The picked candidates (sorted lists) mapped onto pools.
+        self.__picked_candidates = None
+        #: The barcodes of the tubes in excluded racks mapped onto pool IDs.
+        self.__excluded_tubes = None
+
+    def reset(self):
+        SessionTool.reset(self)
+        self.__pool_map = dict()
+        self.__picked_candidates = OrderedDict()
+        self.__excluded_tubes = dict()
+
+    def run(self):
+        self.reset()
+        self.add_info('Start batch tube picking ...')
+        self.__check_input()
+        if not self.has_errors():
+            self.__pick_candidates()
+        if not self.has_errors():
+            self.return_value = self.__picked_candidates
+            self.add_info('Batch tube picker run completed.')
+
+    def get_excluded_tubes(self):
+        """
+        Returns the barcodes of the suitable tubes that have been skipped
+        because their racks are excluded (as sets mapped onto pool IDs).
+        """
+        return self._get_additional_value(self.__excluded_tubes)
+
+    def __check_input(self):
+        # Checks the input values.
+        self.add_debug('Check input values ...')
+        if self._check_input_map_classes(self.stock_concentrations,
+                    'stock concentration map', 'molecule design pool',
+                    MoleculeDesignPool, 'stock concentration', (int, float)):
+            for pool, conc in self.stock_concentrations.iteritems():
+                if not is_valid_number(conc):
+                    msg = 'The stock concentration must be a positive ' \
+                          'number (obtained: %s, pool %s).' % (conc, pool.id)
+                    self.add_error(msg)
+                self.__pool_map[pool.id] = pool
+        if self._check_input_map_classes(self.take_out_volumes,
+                    'take out volume map', 'molecule design pool',
+                    MoleculeDesignPool, 'take out volume', (int, float),
+                    may_be_empty=True):
+            for pool, vol in self.take_out_volumes.iteritems():
+                if not is_valid_number(vol):
+                    msg = 'The stock take out volume must be a positive ' \
+                          'number (obtained: %s, pool %s).' % (vol, pool.id)
+                    self.add_error(msg)
+        self._check_input_list_classes('excluded rack', self.excluded_racks,
+                                       basestring, may_be_empty=True)
+        if self._check_input_list_classes('requested tube',
+                    self.requested_tubes, basestring, may_be_empty=True):
+            self.requested_tubes = set(self.requested_tubes)
+        self._check_input_list_classes('pulled rack', self.pulled_racks,
+                                       basestring, may_be_empty=True)
+
+    def __pick_candidates(self):
+        # Finds the candidates and sorts them.
+        candidate_map = self.__find_candidates()
+        if self.has_errors():
+            return
+        candidates = []
+        requested = []
+        pulled_racks = set(self.pulled_racks)
+        for pool_candidates in candidate_map.values():
+            for candidate in pool_candidates:
+                if candidate.rack_barcode in self.excluded_racks:
+                    add_list_map_element(self.__excluded_tubes,
+                                         candidate.pool_id,
+                                         candidate.tube_barcode, as_set=True)
+                    continue
+                candidates.append(candidate)
+                if candidate.tube_barcode in self.requested_tubes:
+                    requested.append(candidate)
+                    pulled_racks.add(candidate.rack_barcode)
+        for candidate in requested:
+            self.__store_candidate(candidate)
+        for candidate in sort_candidates_by_rack_cover(candidates,
+                                                       pulled_racks):
+            if not candidate.tube_barcode in self.requested_tubes:
+                self.__store_candidate(candidate)
+        missing_pools = [pool.id for pool in self.stock_concentrations.keys()
+                         if not self.__picked_candidates.has_key(pool)]
+        if len(missing_pools) > 0:
+            msg = 'Unable to find valid tubes for the following pools: ' \
+                  '%s.' % (self._get_joined_str(missing_pools, is_strs=False))
+            self.add_warning(msg)
+
+    def __find_candidates(self):
+        # Returns the tube candidates mapped onto pool IDs. The candidates
+        # are taken from the stock index (if enabled) or queried using the
+        # :class:`BatchPoolQuery`.
+        stock_concentrations = dict([(pool.id, conc) for pool, conc
+                                     in self.stock_concentrations.iteritems()])
+        take_out_volumes = dict([(pool.id, vol) for pool, vol
+                                 in self.take_out_volumes.iteritems()])
+        stock_index = get_stock_index()
+        if not stock_index.is_enabled:
+            self.add_debug('Run batch pool query ...')
+            query = BatchPoolQuery(stock_concentrations,
+                                   minimum_volumes=take_out_volumes)
+            self._run_query(query,
+                            'Error when trying to run batch pool query: ')
+            if self.has_errors():
+                return None
+            return query.get_query_results()
+        self.add_debug('Search stock index ...')
+        # The index is searched once per stock concentration and take out
+        # volume.
+        pool_id_map = dict()
+        for pool_id, conc in stock_concentrations.iteritems():
+            add_list_map_element(pool_id_map,
+                                 (conc, take_out_volumes.get(pool_id)),
+                                 pool_id)
+        sample_ids = []
+        for (conc, vol), pool_ids in pool_id_map.iteritems():
+            sample_map = stock_index.get_stock_sample_map(pool_ids, conc,
+                                                          minimum_volume=vol)
+            for pool_sample_ids in sample_map.values():
+                sample_ids.extend(pool_sample_ids)
+        candidate_map = dict()
+        for candidate in stock_index.get_optimized_candidates(sample_ids,
+                                                              TubeCandidate):
+            add_list_map_element(candidate_map, candidate.pool_id, candidate)
+        return candidate_map
+
+    def __store_candidate(self, candidate):
+        # Stores a candidate for its pool.
+        pool = self.__pool_map[candidate.pool_id]
+        candidate.set_pool(pool)
+        add_list_map_element(self.__picked_candidates, pool, candidate)
@@ -4,10 +4,18 @@ See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
 
 Utility methods and classes for tools.
 """
+from hashlib import md5
+from itertools import count
 from math import ceil
+import re
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.query import Query
 
+from everest.entities.utils import get_root_aggregate
+from everest.querying.specifications import cntd
+from thelma.instrumentation import instrument_cursor
+from thelma.interfaces import IMoleculeDesignPool
+
 
 __docformat__ = "reStructuredText en"
 __all__ = ['MAX_PLATE_LABEL_LENGTH',
@@ -22,6 +30,7 @@ __all__ = ['MAX_PLATE_LABEL_LENGTH',
            'round_up',
            'create_in_term_for_db_queries',
            'add_list_map_element',
+           'get_molecule_design_pool_map',
            'CustomQuery']
 
 
@@ -274,6 +283,23 @@ def add_list_map_element(value_map, map_key, new_element, as_set=False):
         values.append(new_element)
 
 
+def get_molecule_design_pool_map(pool_ids):
+    """
+    Loads the molecule design pools for the given IDs with one query
+    (instead of one query per pool).
+
+    :param pool_ids: The IDs of the pools to load.
+    :type pool_ids: iterable of :class:`int`
+    :return: The pools mapped onto their IDs (unknown IDs are not contained).
+    """
+    pool_ids = list(set(pool_ids))
+    if len(pool_ids) < 1:
+        return dict()
+    pool_agg = get_root_aggregate(IMoleculeDesignPool)
+    pool_agg.filter = cntd(id=pool_ids)
+    return dict([(pool.id, pool) for pool in pool_agg.iterator()])
+
+
 def get_nested_dict(parent_dict, map_key):
     """
     Helper function fetching dictionary from another dictionary in which it is
@@ -296,9 +322,29 @@ def get_nested_dict(parent_dict, map_key):
 class CustomQuery(object):
     """
     Creates and runs a DB query. The results are converted into candidates list.
+
+    There are two ways to specify the query:
+
+     * :attr:`PREPARED_QUERY_TEMPLATE` (recommended): the query uses
+       PostgreSQL positional parameters (``$1``, ``$2``, ...) and the values
+       are bound by the DB driver (collections are bound as arrays, use
+       ``= ANY($1)`` instead of ``IN``). The statement is prepared once per
+       DB connection and reused for all subsequent runs. The values are
+       provided by :func:`_get_params_for_prepared_statement`.
+     * :attr:`QUERY_TEMPLATE`: the search values are formatted into the
+       query string (see :func:`create_sql_statement`).
+
+    By default, all result records are fetched before they are stored. For
+    large results, a :attr:`fetch_size` can be set. In this case, the records
+    are streamed from a named (server-side) cursor and stored batch by batch.
+    Subclasses can stop the retrieval early by overwriting
+    :func:`_is_complete`.
     """
     #: The raw query without values for the variable clauses.
     QUERY_TEMPLATE = None
+    #: The parameterised query using PostgreSQL positional parameters. If
+    #: this is set, the :attr:`QUERY_TEMPLATE` is ignored.
+    PREPARED_QUERY_TEMPLATE = None
     #: The query result column names in the order in which there are expected.
     COLUMN_NAMES = None
 
@@ -306,6 +352,16 @@ class CustomQuery(object):
     #: (default: :class:`list`).
     RESULT_COLLECTION_CLS = list
 
+    #: The key under which the names of the statements prepared for a DB
+    #: connection are stored in the connection info dictionary.
+    _PREPARED_STATEMENTS_KEY = 'thelma_prepared_statements'
+
+    #: The default number of records fetched per round trip in streaming mode.
+    DEFAULT_FETCH_SIZE = 2000
+
+    #: Used to generate unique names for server-side cursors.
+    __cursor_counter = count()
+
     def __init__(self):
         """
         Constructor:
@@ -317,6 +373,11 @@ class CustomQuery(object):
         self.sql_statement = None
         #: A dictionary or list containing the query results.
         self._results = None
+        #: The number of records to fetch per round trip. If this is set,
+        #: the results are streamed using a server-side cursor (only
+        #: available for queries with a :attr:`PREPARED_QUERY_TEMPLATE`).
+        #: Set to *None* (default) to fetch all records at once.
+        self.fetch_size = None
 
     def create_sql_statement(self):
         """
@@ -333,6 +394,25 @@ class CustomQuery(object):
         """
         raise NotImplementedError('Abstract method')
 
+    def _get_params_for_prepared_statement(self):
+        """
+        Returns a tuple of values to be bound to the parameters of the
+        :attr:`PREPARED_QUERY_TEMPLATE` (in the order of the parameter
+        numbers). Collections must be passed as lists (they are bound
+        as arrays).
+        """
+        raise NotImplementedError('Abstract method')
+
+    @classmethod
+    def get_prepared_statement_name(cls):
+        """
+        Returns the name under which the :attr:`PREPARED_QUERY_TEMPLATE` is
+        prepared in the DB (derived from the class name and the template,
+        so each template is prepared only once per DB connection).
+        """
+        template_hash = md5(cls.PREPARED_QUERY_TEMPLATE).hexdigest()[:10]
+        return '%s_%s' % (cls.__name__.lower(), template_hash)
+
     def run(self, session):
         """
         Runs the query and converts its results to a :class:`TubeCandidate`s.
@@ -344,10 +424,27 @@ class CustomQuery(object):
 
         :raise ValueError: If there is not at least one result for the query
         """
+        self._results = self.RESULT_COLLECTION_CLS() #pylint: disable=E1102
+        if self.PREPARED_QUERY_TEMPLATE is None:
+            self.__store_results(self.__fetch_results(session))
+        elif self.fetch_size is None:
+            self.__store_results(self.__fetch_prepared_results(session))
+        else:
+            self.__stream_results(session)
+
+    def __store_results(self, records):
+        # Stores the given records. Returns *True* if the query reports to
+        # be complete before all records have been processed.
+        for record in records:
+            self._store_result(record)
+            if self._is_complete():
+                return True
+        return False
+
+    def __fetch_results(self, session):
+        # Runs the formatted :attr:`sql_statement` via the ORM.
         if self.sql_statement is None:
             self.create_sql_statement()
-
-        self._results = self.RESULT_COLLECTION_CLS() #pylint: disable=E1102
         column_names = tuple(self.COLUMN_NAMES)
         try:
             results = session.query(*column_names) \
@@ -356,9 +453,103 @@ class CustomQuery(object):
         except NoResultFound:
             raise ValueError('The tube picking query did not return any ' \
                              'result!')
-        else:
-            for record in results:
-                self._store_result(record)
+        return results
+
+    def __fetch_prepared_results(self, session):
+        # Executes the prepared statement (preparing it first if this has
+        # not been done for the connection yet) and returns the records
+        # (in the order of the :attr:`COLUMN_NAMES`).
+        if session.autoflush:
+            session.flush()
+        conn = session.connection()
+        statement_names = conn.info.setdefault(self._PREPARED_STATEMENTS_KEY,
+                                               set())
+        statement_name = self.get_prepared_statement_name()
+        cursor = instrument_cursor(conn.connection.cursor())
+        try:
+            if not statement_name in statement_names:
+                cursor.execute('PREPARE %s AS %s' \
+                               % (statement_name, self.PREPARED_QUERY_TEMPLATE))
+                statement_names.add(statement_name)
+            params = tuple(self._get_params_for_prepared_statement())
+            placeholders = ', '.join(['%s'] * len(params))
+            cursor.execute('EXECUTE %s (%s)' % (statement_name, placeholders),
+                           params)
+            column_indices = self._get_column_indices(cursor.description)
+            results = [tuple([record[i] for i in column_indices])
+                       for record in cursor]
+        finally:
+            cursor.close()
+        return results
+
+    def __stream_results(self, session):
+        # Declares a named cursor for the parameterised query and stores
+        # the records batch by batch. Cursor declarations cannot run
+        # prepared statements, hence the parameters are bound by the driver.
+        if session.autoflush:
+            session.flush()
+        conn = session.connection()
+        cursor_name = '%s_cursor_%i' % (self.get_prepared_statement_name(),
+                                        next(self.__cursor_counter))
+        cursor = instrument_cursor(
+                            conn.connection.cursor(name=cursor_name))
+        cursor.itersize = self.fetch_size
+        try:
+            params = self._get_params_for_prepared_statement()
+            cursor.execute(self.get_bound_statement(),
+                           self.get_bound_statement_params(params))
+            column_indices = None
+            while True:
+                records = cursor.fetchmany(self.fetch_size)
+                if len(records) < 1:
+                    break
+                if column_indices is None:
+                    column_indices = \
+                            self._get_column_indices(cursor.description)
+                is_complete = self.__store_results(
+                                    tuple([record[i] for i in column_indices])
+                                    for record in records)
+                if is_complete:
+                    break
+        finally:
+            cursor.close()
+
+    @classmethod
+    def get_bound_statement(cls):
+        """
+        Returns the :attr:`PREPARED_QUERY_TEMPLATE` with the positional
+        parameters replaced by named DB-API (pyformat) placeholders (see
+        :func:`get_bound_statement_params`).
+        """
+        statement = cls.PREPARED_QUERY_TEMPLATE.replace('%', '%%')
+        return re.sub(r'\$(\d+)', r'%(p\1)s', statement)
+
+    @staticmethod
+    def get_bound_statement_params(params):
+        """
+        Converts the given prepared statement parameter values into a
+        dictionary matching the placeholders of the
+        :func:`get_bound_statement`.
+        """
+        return dict([('p%i' % (i + 1), value)
+                     for i, value in enumerate(params)])
+
+    def _get_column_indices(self, cursor_description):
+        """
+        Returns the positions of the :attr:`COLUMN_NAMES` within the records
+        described by the given DB-API cursor description.
+
+        :raises ValueError: If an expected column is not part of the result.
+        """
+        result_columns = [col_desc[0] for col_desc in cursor_description]
+        column_indices = []
+        for col_name in self.COLUMN_NAMES:
+            if not col_name in result_columns:
+                msg = 'The query result does not contain a column "%s".' \
+                      % (col_name)
+                raise ValueError(msg)
+            column_indices.append(result_columns.index(col_name))
+        return column_indices
 
     def _store_result(self, result_record):
         """
@@ -367,6 +558,14 @@ class CustomQuery(object):
         """
         raise NotImplementedError('Abstract method')
 
+    def _is_complete(self):
+        """
+        Is called after each stored result record. If the method returns
+        *True* the remaining records are skipped (in streaming mode, they are
+        not even fetched from the DB). By default, all records are stored.
+        """
+        return False
+
     def get_query_results(self):
         """
         Returns the result collection.
@@ -10,6 +10,8 @@ from everest.entities.utils import get_root_aggregate
 from thelma.tools.semiconstants import get_positions_for_shape
 from thelma.tools.base import BaseTool
 from thelma.tools.utils.base import add_list_map_element
+from thelma.tools.utils.base import get_converted_number
+from thelma.tools.utils.base import get_molecule_design_pool_map
 from thelma.tools.utils.layouts import EMPTY_POSITION_TYPE
 from thelma.tools.utils.layouts import LIBRARY_POSITION_TYPE
 from thelma.tools.utils.layouts import LibraryBaseLayout
@@ -56,6 +58,9 @@ class BaseLayoutConverter(BaseTool):
     #: The class of the working positions to be generated (subclass of
     #: :class:`WorkingPosition`).
     POSITION_CLS = WorkingPosition
+    #: Converters record messages for every rack position; only the latest
+    #: debug and info messages are kept.
+    MAX_MESSAGE_STACK_SIZE = 1000
 
     # A key for the rack position in the parameter map generated during
     # the conversion.
@@ -78,6 +83,9 @@ class BaseLayoutConverter(BaseTool):
         self.__position_map = None
         #: Parameters which do not have to be specified in the layout at all.
         self._optional_parameters = None
+        #: Maps the tag predicates of the layout onto parameters (*None* for
+        #: predicates that do not belong to any parameter).
+        self._predicate_map = None
         #: Lists for intermediate error storage.
         self._multiple_tags = None
 
@@ -89,6 +97,7 @@ class BaseLayoutConverter(BaseTool):
         self.__position_map = dict()
         self._parameter_validators = None
         self._optional_parameters = set()
+        self._predicate_map = None
         self._multiple_tags = []
 
     def run(self):
@@ -102,13 +111,10 @@ class BaseLayoutConverter(BaseTool):
         if not self.has_errors():
             self._initialize_parameter_validators()
             self._initialize_other_attributes()
+            self.__compile_predicate_map()
             self.__check_parameter_completeness()
         if not self.has_errors():
-            for rack_position in get_positions_for_shape(self.rack_layout.shape):
-                tag_set = self.rack_layout.get_tags_for_position(rack_position)
-                parameter_map = self._get_parameter_map(tag_set, rack_position)
-                working_position = self.__obtain_working_position(parameter_map)
-                self.__position_map[rack_position] = working_position
+            self.__convert_positions()
         self._record_errors()
 
         if not self.has_errors():
@@ -146,6 +152,24 @@ class BaseLayoutConverter(BaseTool):
         """
         pass
 
+    def __compile_predicate_map(self):
+        """
+        Looks up the parameter for each distinct tag predicate of the layout
+        once so that the conversion of the positions does not need to
+        consult the validators anymore.
+        """
+        predicate_map = dict()
+        for tag in self.rack_layout.get_tags():
+            predicate = tag.predicate
+            if predicate in predicate_map: continue
+            parameter = None
+            for param, validator in self._parameter_validators.iteritems():
+                if validator.has_alias(predicate):
+                    parameter = param
+                    break
+            predicate_map[predicate] = parameter
+        self._predicate_map = predicate_map
+
     def __check_parameter_completeness(self):
         """
         Checks whether there are tags for all required parameters in the
@@ -153,8 +177,7 @@ class BaseLayoutConverter(BaseTool):
         """
         self.add_debug('Check completeness of the required parameters ...')
 
-        all_predicates = \
-            set([tag.predicate for tag in self.rack_layout.get_tags()])
+        all_predicates = self._predicate_map.keys()
         has_tag_map = dict()
         for parameter, validator in self._parameter_validators.iteritems():
             has_tag_map[parameter] = \
@@ -167,29 +190,52 @@ class BaseLayoutConverter(BaseTool):
                        self._parameter_validators[parameter].aliases))
                 self.add_error(msg)
 
-    def _get_parameter_map(self, tag_set, rack_position):
+    def __convert_positions(self):
         """
-        Returns a dictionary containing the parameter values for a
-        rack position.
+        Creates the working positions for all positions of the rack shape.
+        Positions that belong to the same tagged rack position sets share
+        the same tags, hence, their tags are only converted once.
         """
-        parameter_map = {self._RACK_POSITION_KEY : rack_position}
+        set_indices = dict()
+        for i, trps in enumerate(self.rack_layout.tagged_rack_position_sets):
+            for rack_position in trps.rack_position_set:
+                add_list_map_element(set_indices, rack_position, i)
+        signature_maps = dict()
+        for rack_position in get_positions_for_shape(self.rack_layout.shape):
+            signature = tuple(set_indices.get(rack_position, ()))
+            if signature in signature_maps:
+                values, multiple_predicates = signature_maps[signature]
+            else:
+                tag_set = self.rack_layout.get_tags_for_position(rack_position)
+                values, multiple_predicates = self.__convert_tag_set(tag_set)
+                signature_maps[signature] = (values, multiple_predicates)
+            for predicate in multiple_predicates:
+                info = '%s ("%s")' % (rack_position, predicate)
+                self._multiple_tags.append(info)
+            parameter_map = dict(values)
+            parameter_map[self._RACK_POSITION_KEY] = rack_position
+            working_position = self.__obtain_working_position(parameter_map)
+            self.__position_map[rack_position] = working_position
+
+    def __convert_tag_set(self, tag_set):
+        """
+        Returns a dictionary containing the parameter values for the tags
+        of a rack position and a list of the predicates that specify an
+        already set parameter.
+        """
+        values = dict()
         for parameter in self._parameter_validators.keys():
-            parameter_map[parameter] = None
+            values[parameter] = None
+        multiple_predicates = []
         for tag in tag_set:
-            #: Find parameter for this tag (if any).
-            predicate = None
-            for parameter, validator in self._parameter_validators.iteritems():
-                if validator.has_alias(tag.predicate):
-                    predicate = parameter
-                    break
-            if predicate is None: continue
+            parameter = self._predicate_map[tag.predicate]
+            if parameter is None: continue
             value = tag.value
             if value == WorkingPosition.NONE_REPLACER: value = None
-            if not parameter_map[predicate.lower()] is None:
-                info = '%s ("%s")' % (rack_position, tag.predicate)
-                self._multiple_tags.append(info)
-            parameter_map[predicate] = value
-        return parameter_map
+            if not values[parameter] is None:
+                multiple_predicates.append(tag.predicate)
+            values[parameter] = value
+        return values, multiple_predicates
 
     def __obtain_working_position(self, parameter_map):
         """
@@ -320,6 +366,8 @@ class MoleculeDesignPoolLayoutConverter(BaseLayoutConverter):
         self.__pool_aggregate = get_root_aggregate(IMoleculeDesignPool)
         #: Stores the molecule design pools for molecule design pool IDs.
         self.__pool_map = None
+        #: Have the pools of the rack layout been loaded yet?
+        self.__pools_fetched = None
         # intermediate storage of invalid rack positions
         self.__unknown_pools = None
         self.__invalid_pos_type = None
@@ -329,6 +377,7 @@ class MoleculeDesignPoolLayoutConverter(BaseLayoutConverter):
     def reset(self):
         BaseLayoutConverter.reset(self)
         self.__pool_map = dict()
+        self.__pools_fetched = False
         self.__unknown_pools = []
         self.__invalid_pos_type = set()
         self.__missing_pool = set()
@@ -426,8 +475,14 @@ class MoleculeDesignPoolLayoutConverter(BaseLayoutConverter):
         Returns the :class:`MoleculeDesignPool` entity for a position and
         checks whether it is a valid (=known) one.
         """
+        if not self.__pools_fetched:
+            self.__fetch_pools()
         if self.__pool_map.has_key(pool_id):
-            return self.__pool_map[pool_id]
+            entity = self.__pool_map[pool_id]
+            if entity is None:
+                info = '%s (%s)' % (pool_id, position_label)
+                self.__unknown_pools.append(info)
+            return entity
 
         if not is_valid_number(pool_id, is_integer=True):
             info = '%s (%s)' % (pool_id, position_label)
@@ -443,6 +498,25 @@ class MoleculeDesignPoolLayoutConverter(BaseLayoutConverter):
         self.__pool_map[pool_id] = entity
         return entity
 
+    def __fetch_pools(self):
+        """
+        Loads the pools for all pool IDs in the rack layout with one query.
+        IDs that cannot be found are stored with a *None* value (they are
+        reported when they are requested for a position).
+        """
+        self.__pools_fetched = True
+        pool_param = self.PARAMETER_SET.MOLECULE_DESIGN_POOL
+        tag_values = dict()
+        for tag in self.rack_layout.get_tags():
+            if not self._predicate_map.get(tag.predicate) == pool_param:
+                continue
+            if is_valid_number(tag.value, is_integer=True):
+                tag_values[tag.value] = get_converted_number(tag.value,
+                                                             is_integer=True)
+        pool_map = get_molecule_design_pool_map(tag_values.values())
+        for tag_value, pool_id in tag_values.iteritems():
+            self.__pool_map[tag_value] = pool_map.get(pool_id)
+
     def _record_errors(self):
         BaseLayoutConverter._record_errors(self)
 
@@ -10,11 +10,14 @@ from thelma.tools.semiconstants import get_positions_for_shape
 from thelma.tools.base import BaseTool
 from thelma.tools.utils.base import CONCENTRATION_CONVERSION_FACTOR
 from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
+from thelma.tools.utils.base import add_list_map_element
 from thelma.tools.utils.base import get_converted_number
 from thelma.tools.utils.base import get_trimmed_string
 from thelma.tools.utils.base import is_smaller_than
 from thelma.tools.utils.base import is_valid_number
 from thelma.tools.utils.base import sort_rack_positions
+from thelma.entities.aggregates import QUERY_PROFILES
+from thelma.entities.aggregates import load_query_profile
 from thelma.entities.moleculedesign import MoleculeDesignPool
 from thelma.entities.moleculetype import MoleculeType
 from thelma.entities.rack import Rack
@@ -23,6 +26,7 @@ from thelma.entities.rack import RackPositionSet
 from thelma.entities.racklayout import RackLayout
 from thelma.entities.tagging import Tag
 from thelma.entities.tagging import TaggedRackPositionSet
+from thelma.entities.utils import PositionBitmask
 from thelma.entities.utils import get_user
 
 
@@ -512,26 +516,26 @@ class WorkingLayout(object):
         Creates a list of tagged rack position sets for this layout.
         """
 
+        # The positions of a tag are collected as bitmask. Tags with equal
+        # bitmasks share a rack position set (which is encoded and looked
+        # up only once).
         tag_map = dict()
+        tag_positions = dict()
         for rack_position, working_position in self._position_map.iteritems():
+            bit = PositionBitmask.get_bit(rack_position.row_index,
+                                          rack_position.column_index)
             for tag in working_position.get_tag_set():
-                if not tag_map.has_key(tag): tag_map[tag] = set()
-                tag_map[tag].add(rack_position)
-
-        rps_map = dict()
-        rps_tag_map = dict()
-        for tag, pos_set in tag_map.iteritems():
-            rack_pos_set = RackPositionSet.from_positions(pos_set)
-            hash_value = rack_pos_set.hash_value
-            if not rps_map.has_key(hash_value):
-                rps_map[hash_value] = rack_pos_set
-                rps_tag_map[hash_value] = set()
-            rps_tag_map[hash_value].add(tag)
+                tag_map[tag] = tag_map.get(tag, 0) | bit
+                add_list_map_element(tag_positions, tag, rack_position)
+
+        mask_tag_map = dict()
+        for tag, mask in tag_map.iteritems():
+            add_list_map_element(mask_tag_map, mask, tag, as_set=True)
 
         tagged_rack_position_sets = []
-        for hash_value in rps_map.keys():
-            rack_pos_set = rps_map[hash_value]
-            tags = rps_tag_map[hash_value]
+        for tags in mask_tag_map.values():
+            positions = tag_positions[iter(tags).next()]
+            rack_pos_set = RackPositionSet.from_positions(positions)
             trps = TaggedRackPositionSet(tags, rack_pos_set, self._user)
             tagged_rack_position_sets.append(trps)
 
@@ -1690,6 +1694,9 @@ class BaseRackVerifier(BaseTool):
     _LAYOUT_CLS = MoleculeDesignPoolLayout
     #: Shall the volumes be checked, too? (Default: False).
     _CHECK_VOLUMES = False
+    #: The related entities to load for the rack before it is traversed
+    #: (see :class:`thelma.entities.aggregates.QUERY_PROFILES`).
+    _RACK_QUERY_PROFILE = QUERY_PROFILES.RACK_SAMPLE_MOLECULES
 
     def __init__(self, reference_layout=None, parent=None):
         """
@@ -1752,6 +1759,7 @@ class BaseRackVerifier(BaseTool):
             self.__compare_rack_shapes()
         if not self.has_errors():
             self.__create_rack_md_map()
+            self.__load_expected_pools()
         if not self.has_errors():
             self.__compare_positions()
             self.__record_results()
@@ -1814,6 +1822,7 @@ class BaseRackVerifier(BaseTool):
             pos_label = rack_pos.label
             self._rack_md_map[pos_label] = None
             self._rack_volume_map[pos_label] = None
+        load_query_profile([self._rack], self._RACK_QUERY_PROFILE)
         for container in self._rack.containers:
             pos_label = container.position.label
             sample = container.sample
@@ -1832,6 +1841,16 @@ class BaseRackVerifier(BaseTool):
                 else:
                     self._rack_md_map[pos_label].append(md_id)
 
+    def __load_expected_pools(self):
+        # Loads the molecule designs of the (already loaded) pools of the
+        # expected layout in one batch instead of one lazy load per pool.
+        pools = set()
+        for pool_pos in self._expected_layout.working_positions():
+            pool = pool_pos.molecule_design_pool
+            if isinstance(pool, MoleculeDesignPool):
+                pools.add(pool)
+        load_query_profile(pools, QUERY_PROFILES.POOL_MOLECULE_DESIGNS)
+
     def __compare_positions(self):
         # Compares the molecule design IDs of the positions.
         # Library positions are ignored.
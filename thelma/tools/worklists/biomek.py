@@ -12,11 +12,11 @@ from thelma.tools.semiconstants import get_pipetting_specs_biomek
 from thelma.tools.semiconstants import get_positions_for_shape
 from thelma.tools.worklists.base import EmptyPositionManager
 from thelma.tools.worklists.writers import WorklistWriter
-from thelma.tools.writers import CsvColumnParameters
 from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
 from thelma.tools.utils.base import get_trimmed_string
 from thelma.tools.utils.base import round_up
 from thelma.tools.utils.base import sort_rack_positions
+from thelma.entities.aggregates import load_query_profile
 from thelma.entities.liquidtransfer import ReservoirSpecs
 from thelma.entities.liquidtransfer import TRANSFER_TYPES
 from thelma.entities.rack import Plate
@@ -64,48 +64,31 @@ class BiomekWorklistWriter(WorklistWriter):
                                 parent=parent)
         if self.pipetting_specs is None:
             self.pipetting_specs = get_pipetting_specs_biomek()
-        # These are the CsvColumnParameters for the worklists.
-        self._source_rack_values = None
-        self._source_pos_values = None
-        self._target_rack_values = None
-        self._target_pos_values = None
-        self._volume_values = None
 
-    def reset(self):
+    def _get_header_names(self):
         """
-        Resets all values escept for input values.
+        Returns the column headers in column order.
         """
-        WorklistWriter.reset(self)
-        self._source_rack_values = []
-        self._source_pos_values = []
-        self._target_rack_values = []
-        self._target_pos_values = []
-        self._volume_values = []
-
-    def _init_column_maps(self):
+        header_map = {self.SOURCE_RACK_INDEX : self.SOURCE_RACK_HEADER,
+                      self.SOURCE_POS_INDEX : self.SOURCE_POS_HEADER,
+                      self.TARGET_RACK_INDEX : self.TARGET_RACK_HEADER,
+                      self.TARGET_POS_INDEX : self.TARGET_POS_HEADER,
+                      self.TRANSFER_VOLUME_INDEX : self.TRANSFER_VOLUME_HEADER}
+        return [header_map[index] for index in sorted(header_map.keys())]
+
+    def _make_row(self, source_rack, source_pos, target_rack, target_pos,
+                  volume):
         """
-        Initialises the CsvColumnParameters object for the
-        :attr:`_column_map_list`.
+        Returns a data row (values are placed according to the column
+        indices). Subclasses can extend the row.
         """
-        source_rack_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.SOURCE_RACK_INDEX, self.SOURCE_RACK_HEADER,
-                    self._source_rack_values)
-        source_pos_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.SOURCE_POS_INDEX, self.SOURCE_POS_HEADER,
-                    self._source_pos_values)
-        target_rack_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.TARGET_RACK_INDEX, self.TARGET_RACK_HEADER,
-                    self._target_rack_values)
-        target_pos_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.TARGET_POS_INDEX, self.TARGET_POS_HEADER,
-                    self._target_pos_values)
-        volume_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.TRANSFER_VOLUME_INDEX, self.TRANSFER_VOLUME_HEADER,
-                    self._volume_values)
-        self._column_map_list = [source_rack_column, source_pos_column,
-                                 target_rack_column, target_pos_column,
-                                 volume_column]
-        self.add_info('Column generation complete.')
+        row = [None] * 5
+        row[self.SOURCE_RACK_INDEX] = source_rack
+        row[self.SOURCE_POS_INDEX] = source_pos
+        row[self.TARGET_RACK_INDEX] = target_rack
+        row[self.TARGET_POS_INDEX] = target_pos
+        row[self.TRANSFER_VOLUME_INDEX] = volume
+        return row
 
 
 class SampleTransferWorklistWriter(BiomekWorklistWriter):
@@ -145,6 +128,8 @@ class SampleTransferWorklistWriter(BiomekWorklistWriter):
         """
         Initialises the source rack related values and lookups.
         """
+        if not self.source_rack is self.target_rack:
+            load_query_profile([self.source_rack], self.RACK_QUERY_PROFILE)
         for container in self.source_rack.containers:
             rack_pos = container.position
             self._source_containers[rack_pos] = container
@@ -158,9 +143,9 @@ class SampleTransferWorklistWriter(BiomekWorklistWriter):
             self._source_dead_volume = well_specs.dead_volume \
                                        * VOLUME_CONVERSION_FACTOR
 
-    def _generate_column_values(self):
+    def _generate_rows(self):
         """
-        This method generates the value lists for the CSV columns.
+        This method yields the data rows for the CSV file.
         """
         source_rack_barcode = self.source_rack.barcode
         target_rack_barcode = self.target_rack.barcode
@@ -171,12 +156,10 @@ class SampleTransferWorklistWriter(BiomekWorklistWriter):
             if not self._check_transfer_volume(pt.volume, pt.target_position,
                                                pt.source_position):
                 continue
-            self._source_rack_values.append(source_rack_barcode)
-            self._source_pos_values.append(pt.source_position.label)
-            self._target_rack_values.append(target_rack_barcode)
-            self._target_pos_values.append(pt.target_position.label)
             volume = get_trimmed_string(pt.volume * VOLUME_CONVERSION_FACTOR)
-            self._volume_values.append(volume)
+            yield self._make_row(source_rack_barcode, pt.source_position.label,
+                                 target_rack_barcode, pt.target_position.label,
+                                 volume)
 
     def __get_sorted_transfers(self):
         """
@@ -239,8 +222,6 @@ class SampleDilutionWorklistWriter(BiomekWorklistWriter):
         self.reservoir_specs = reservoir_specs
         #: The maximum volume of source rack container.
         self._source_max_volume = None
-        #: Values for a column presenting diluent information.
-        self._diluent_info_values = None
         #: Maps source position amounts (volumes) onto diluents.
         self._diluent_map = None
         #: Maps total diluent amounts (volumes) onto diluents.
@@ -263,7 +244,6 @@ class SampleDilutionWorklistWriter(BiomekWorklistWriter):
         """
         BiomekWorklistWriter.reset(self)
         self._source_max_volume = None
-        self._diluent_info_values = []
         self._amount_map = dict()
         self._diluent_map = dict()
         self.__has_split_volumes = False
@@ -294,9 +274,20 @@ class SampleDilutionWorklistWriter(BiomekWorklistWriter):
         self.__emtpy_pos_manager = EmptyPositionManager(
                                     rack_shape=self.reservoir_specs.rack_shape)
 
-    def _generate_column_values(self):
+    def _reset_row_generation(self):
+        """
+        Also discards the source positions assigned to the diluents.
+        """
+        BiomekWorklistWriter._reset_row_generation(self)
+        self._amount_map = dict()
+        self._diluent_map = dict()
+        self.__emtpy_pos_manager = EmptyPositionManager(
+                                    rack_shape=self.reservoir_specs.rack_shape)
+        self.__last_source_rack_pos = None
+
+    def _generate_rows(self):
         """
-        This method generates the value lists for the CSV columns.
+        This method yields the data rows for the CSV file.
         """
         target_rack_barcode = self.target_rack.barcode
         sorted_transfers = self.__get_sorted_transfers()
@@ -312,12 +303,18 @@ class SampleDilutionWorklistWriter(BiomekWorklistWriter):
                                                 pt.diluent_info, volume, i)
                 if self.has_errors():
                     break
-                self._source_rack_values.append(self.source_rack_barcode)
-                self._source_pos_values.append(source_pos.label)
-                self._volume_values.append(get_trimmed_string(volume))
-                self._target_rack_values.append(target_rack_barcode)
-                self._target_pos_values.append(pt.target_position.label)
-                self._diluent_info_values.append(pt.diluent_info)
+                row = self._make_row(self.source_rack_barcode,
+                                     source_pos.label, target_rack_barcode,
+                                     pt.target_position.label,
+                                     get_trimmed_string(volume))
+                row.insert(self.DILUENT_INFO_INDEX, pt.diluent_info)
+                yield row
+
+    def _record_errors(self):
+        """
+        Also records warnings about split volumes and sources.
+        """
+        BiomekWorklistWriter._record_errors(self)
         if self.__has_split_volumes:
             msg = 'Some dilution volumes exceed the allowed maximum transfer ' \
                   'volume of %s ul. The dilution volumes have been distributed ' \
@@ -403,15 +400,11 @@ class SampleDilutionWorklistWriter(BiomekWorklistWriter):
         if not source_pos is None:
             self._amount_map[source_pos] = volume + self._source_dead_volume
 
-    def _init_column_maps(self):
+    def _get_header_names(self):
         """
-        Initialises the CsvColumnParameters object for the
-        :attr:`_column_map_list`.
+        Returns the column headers in column order (including the diluent
+        info column).
         """
-        BiomekWorklistWriter._init_column_maps(self)
-        diluent_info_column = \
-            CsvColumnParameters.create_csv_parameter_map(
-                        self.DILUENT_INFO_INDEX, self.DILUENT_INFO_HEADER,
-                        self._diluent_info_values)
-        self._column_map_list.append(diluent_info_column)
-
+        header_names = BiomekWorklistWriter._get_header_names(self)
+        header_names.insert(self.DILUENT_INFO_INDEX, self.DILUENT_INFO_HEADER)
+        return header_names
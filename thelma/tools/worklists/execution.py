@@ -6,6 +6,8 @@ Classes for the execution of planned liquid transfers and worklists.
 
 AAB
 """
+from array import array
+
 from thelma.tools.semiconstants import ITEM_STATUS_NAMES
 from thelma.tools.semiconstants import get_item_status_managed
 from thelma.tools.semiconstants import get_positions_for_shape
@@ -35,6 +37,8 @@ from thelma.entities.rack import Plate
 from thelma.entities.rack import Rack
 from thelma.entities.rack import RackPosition
 from thelma.entities.user import User
+from thelma.entities.aggregates import QUERY_PROFILES
+from thelma.entities.aggregates import load_query_profile
 from thelma.utils import get_utc_time
 
 
@@ -45,11 +49,9 @@ __all__ = ['LiquidTransferExecutor',
            'SampleDilutionWorklistExecutor',
            'SampleTransferWorklistExecutor',
            'RackSampleTransferExecutor',
-           'SampleComponent',
-           'SampleData',
-           'TransferredSample',
-           'SourceSample',
-           'TargetSample']
+           'RackSampleState',
+           'SourceRackSampleState',
+           'TargetRackSampleState']
 
 
 class LiquidTransferExecutor(BaseTool):
@@ -62,6 +64,9 @@ class LiquidTransferExecutor(BaseTool):
     #: The transfer type supported by this class
     #: (see :class:`thelma.entities.liquidtransfer.TRANSFER_TYPES`).
     TRANSFER_TYPE = None
+    #: The related entities to load for the racks before they are
+    #: traversed (see :class:`thelma.entities.aggregates.QUERY_PROFILES`).
+    RACK_QUERY_PROFILE = QUERY_PROFILES.RACK_SAMPLE_MOLECULES
 
     def __init__(self, target_rack, pipetting_specs, user, parent=None):
         """
@@ -99,10 +104,11 @@ class LiquidTransferExecutor(BaseTool):
         #: The maximum transfer volume used in ul.
         self._max_transfer_volume = None
         # Intermediate storage of volumes and concentrations
-        #: :class:`SourceSample` objects mapped onto rack positions.
+        #: The :class:`SourceRackSampleState` for the source rack (if the
+        #: source rack is tracked).
         #: Note: Contains only data for samples that are going to be altered.
         self._source_samples = None
-        #: :class:`TargetSample` objects mapped onto rack positions.
+        #: The :class:`TargetRackSampleState` for the target rack.
         #: Note: Contains only data for samples that are going to be altered.
         self._target_samples = None
         # :ATTENTION: It is important not to include data of sample that
@@ -121,8 +127,8 @@ class LiquidTransferExecutor(BaseTool):
         Resets all values except for input values.
         """
         BaseTool.reset(self)
-        self._source_samples = dict()
-        self._target_samples = dict()
+        self._source_samples = None
+        self._target_samples = None
         self._target_containers = dict()
         self._target_max_volume = None
         self._source_containers = dict()
@@ -167,9 +173,11 @@ class LiquidTransferExecutor(BaseTool):
         """
         Initialises the target rack related values and lookups.
         """
+        load_query_profile([self.target_rack], self.RACK_QUERY_PROFILE)
         for container in self.target_rack.containers:
             rack_pos = container.position
             self._target_containers[rack_pos] = container
+        self._target_samples = TargetRackSampleState(self.target_rack)
         if isinstance(self.target_rack, Plate):
             well_specs = self.target_rack.specs.well_specs
             self._target_max_volume = well_specs.max_volume \
@@ -187,58 +195,57 @@ class LiquidTransferExecutor(BaseTool):
         """
         raise NotImplementedError('Abstract method.')
 
-    def _get_target_sample(self, rack_pos):
+    def _init_source_samples(self, source_rack):
         """
-        Fetches the target sample object for the given rack position or
-        creates a new object if there is none so far.
+        Initialises the source containers lookup and the source sample
+        state for the given source rack.
         """
-        if self._target_samples.has_key(rack_pos):
-            target_sample = self._target_samples[rack_pos]
-        else:
-            target_container = self._target_containers[rack_pos]
-            target_sample = TargetSample.from_sample(target_container.sample)
-            if target_sample is None:
-                target_sample = TargetSample(volume=0)
-            self._target_samples[rack_pos] = target_sample
-        return target_sample
+        if not source_rack is self.target_rack:
+            load_query_profile([source_rack], self.RACK_QUERY_PROFILE)
+        for container in source_rack.containers:
+            rack_pos = container.position
+            self._source_containers[rack_pos] = container
+        self._source_samples = SourceRackSampleState(source_rack)
+        if isinstance(source_rack, Plate):
+            well_specs = source_rack.specs.well_specs
+            self._source_dead_volume = well_specs.dead_volume \
+                                      * VOLUME_CONVERSION_FACTOR
 
-    def _get_source_sample(self, rack_pos):
+    def _register_sample_transfer(self, source_pos, target_pos, volume):
         """
-        Fetches the source sample object for the given rack position or
-        creates a new object if there is none so far.
+        Registers the transfer of the given volume (in l) from the source
+        sample to the target sample at the given rack positions.
+
+        :return: *False* if the source container does not have a sample.
         """
-        if self._source_samples.has_key(rack_pos):
-            source_sample = self._source_samples[rack_pos]
-        else:
-            source_container = self._source_containers[rack_pos]
-            source_sample = SourceSample.from_sample(source_container.sample)
-            self._source_samples[rack_pos] = source_sample
-        if source_sample is None:
-            info = '%s (no sample)' % (rack_pos.label)
+        components = self._source_samples.remove_volume(source_pos, volume)
+        if components is None:
+            info = '%s (no sample)' % (source_pos.label)
             self._source_volume_too_small.append(info)
-        return source_sample
+            return False
+        self._target_samples.add_volume(target_pos, volume, components)
+        return True
 
     def __check_resulting_volumes(self):
         # Checks the final volumes that would result from the execution.
         self.add_debug('Check resulting volumes ...')
         # checking the target samples
-        for trg_pos, target_sample in self._target_samples.iteritems():
+        for trg_pos, final_volume in self._target_samples.get_final_volumes():
             max_volume = self.__get_max_volume_for_target_container(trg_pos)
             if max_volume is None: continue
-            final_volume = target_sample.final_volume
             if is_smaller_than(max_volume, final_volume):
                 info = '%s (final vol: %.1f ul, max vol: %.0f ul)' \
                         % (trg_pos.label, final_volume, max_volume)
                 self._target_volume_too_large.append(info)
-        # checking the source samples
-        for src_pos, source_sample in self._source_samples.iteritems():
-            if source_sample is None: continue
+        # checking the source samples (not tracked for sample dilutions)
+        if self._source_samples is None:
+            return
+        for src_pos, sample_volume, total_transfer_volume in \
+                                self._source_samples.get_transfer_volumes():
             dead_volume = self.__get_dead_volume_for_source_container(src_pos)
             if dead_volume is None: continue
-            total_transfer_volume = source_sample.total_transfer_volume
             if are_equal_values(total_transfer_volume, 0): continue
             required_volume = total_transfer_volume + dead_volume
-            sample_volume = source_sample.volume
             if is_smaller_than(sample_volume, required_volume):
                 info = '%s (required: %.1f ul, found: %.1f ul)' \
                         % (src_pos.label, required_volume, sample_volume)
@@ -347,25 +354,13 @@ class LiquidTransferExecutor(BaseTool):
         # Updates the racks involved in the transfer.
         self._update_rack(self.target_rack, self._target_samples)
 
-    def _update_rack(self, rack, sample_data_map):
+    def _update_rack(self, rack, sample_state):
         """
-        Updates the racks sample for a particular rack.
+        Updates the racks sample for a particular rack (only the containers
+        registered with the passed sample state are touched).
         If the rack is a target rack, the sample molecules are updated as well.
         """
-        # FIXME: It is very inefficient to loop over all containers in the
-        #        rack when you only update a few containers.
-        #        Should do:
-        #        for pos, sample_data in sample_data_map.iteritems():
-        #            cnt = rack.container_positions[pos]
-        #            upd_spl = sample_data.update_container_sample(cnt)
-        #            cnt.sample = upd_spl
-        for container in rack.containers:
-            rack_pos = container.position
-            if not sample_data_map.has_key(rack_pos):
-                continue
-            sample_data = sample_data_map[rack_pos]
-            updated_sample = sample_data.update_container_sample(container)
-            container.sample = updated_sample
+        sample_state.update_container_samples()
 
     def _create_executed_items(self):
         """
@@ -564,8 +559,8 @@ class SampleDilutionWorklistExecutor(WorklistExecutor):
         elif not self._target_containers.has_key(trg_pos):
             self._target_container_missing.append(trg_pos.label)
         else:
-            target_sample = self._get_target_sample(trg_pos)
-            target_sample.create_and_add_transfer(planned_liquid_transfer)
+            self._target_samples.add_volume(trg_pos,
+                                            planned_liquid_transfer.volume)
 
     def _create_executed_liquid_transfer(self, planned_liquid_transfer):
         """
@@ -619,13 +614,7 @@ class SampleTransferWorklistExecutor(WorklistExecutor):
         """
         Initialises the source rack related values and lookups.
         """
-        for container in self.source_rack.containers:
-            rack_pos = container.position
-            self._source_containers[rack_pos] = container
-        if isinstance(self.source_rack, Plate):
-            well_specs = self.source_rack.specs.well_specs
-            self._source_dead_volume = well_specs.dead_volume \
-                                      * VOLUME_CONVERSION_FACTOR
+        self._init_source_samples(self.source_rack)
 
     def _register_transfer(self, planned_liquid_transfer):
         """
@@ -640,16 +629,11 @@ class SampleTransferWorklistExecutor(WorklistExecutor):
             self._source_container_missing.add(src_pos.label)
         elif not self._target_containers.has_key(trg_pos):
             self._target_container_missing.append(trg_pos.label)
-        else:
-            source_sample = self._get_source_sample(src_pos)
-            if not source_sample is None:
-                transfer_sample = source_sample.create_and_add_transfer(
-                                                    planned_liquid_transfer)
-                target_sample = self._get_target_sample(trg_pos)
-                # Copy over freeze/thaw cycle information.
-                target_sample.freeze_thaw_cycles = \
-                                    source_sample.freeze_thaw_cycles
-                target_sample.add_transfer(transfer_sample)
+        elif self._register_sample_transfer(src_pos, trg_pos,
+                                            planned_liquid_transfer.volume):
+            # Copy over freeze/thaw cycle information.
+            self._target_samples.set_freeze_thaw_cycles(trg_pos,
+                    self._source_samples.get_freeze_thaw_cycles(src_pos))
 
     def _update_racks(self):
         """
@@ -738,13 +722,7 @@ class RackSampleTransferExecutor(LiquidTransferExecutor):
         Initialises the source rack related values and lookups. Also checks
         the rack shape and translation type match and the transfer volume.
         """
-        for container in self.source_rack.containers:
-            rack_pos = container.position
-            self._source_containers[rack_pos] = container
-        if isinstance(self.source_rack, Plate):
-            well_specs = self.source_rack.specs.well_specs
-            self._source_dead_volume = well_specs.dead_volume \
-                                      * VOLUME_CONVERSION_FACTOR
+        self._init_source_samples(self.source_rack)
         if self.source_rack.barcode == self.target_rack.barcode:
             self.__is_intra_rack_transfer = True
         self.__setup_translator()
@@ -855,12 +833,8 @@ class RackSampleTransferExecutor(LiquidTransferExecutor):
             if not self._target_containers.has_key(target_pos):
                 self._target_container_missing.append(target_pos.label)
                 continue
-            source_sample = self._get_source_sample(source_pos)
-            if not source_sample is None:
-                transfer_sample = source_sample.create_and_add_transfer(
-                                            self.planned_rack_sample_transfer)
-                target_sample = self._get_target_sample(target_pos)
-                target_sample.add_transfer(transfer_sample)
+            self._register_sample_transfer(source_pos, target_pos,
+                                    self.planned_rack_sample_transfer.volume)
 
     def _create_executed_items(self):
         """
@@ -910,308 +884,305 @@ class RackSampleTransferExecutor(LiquidTransferExecutor):
         return tubes
 
 
-class SampleComponent(object):
-    """
-    Helper class representing a component of a liquid (sample).
-
-    Stores a concentration and molecule. The volume is left at the sample,
-    since a sample might comprise several components.
-
-    :Note: This class is similar to :class:`thelma.entities.sample.SampleMolecule`
+class RackSampleState(object):
     """
-    def __init__(self, molecule, concentration):
-        """
-        Constructor.
-
-        :param molecule: The molecule being the component.
-        :type molecule: :class:`thelma.entities.sample.Molecule`
-        :param int concentration: The concentration of the molecule *in M*
-            (positive number).
-        """
-        #: The molecule being the component.
-        self.molecule = molecule
-        #: The concentration of the molecule *in nM*.
-        self.concentration = concentration * CONCENTRATION_CONVERSION_FACTOR
-
-    @property
-    def molecule_design(self):
-        """
-        The molecule design of the molecule.
-        """
-        return self.molecule.molecule_design
+    Column-oriented simulation of the sample states of a rack during the
+    execution of liquid transfers.
 
-    def __str__(self):
-        return '%s-%.02f' % (self.molecule_design.id, self.concentration)
+    Volumes (in ul) and the concentrations of the sample molecule designs
+    (in nM) are stored in flat typed arrays indexed by the (row-major)
+    rack position index, so that a worklist series for a 384-well plate
+    only accumulates numbers instead of creating helper objects per
+    container and transfer. The resulting volumes are rounded to 0.1 ul,
+    concentrations to 0.01 nM.
 
-    def __repr__(self):
-        str_format = '<%s molecule: %s, molecule design: %s, ' \
-                     'concentration: %.2f nM>'
-        params = (self.__class__.__name__, self.molecule,
-                  self.molecule_design, self.concentration)
-        return str_format % params
-
-
-class SampleData(object):
-    """
-    Container class storing all relevant data for the liquid involved
-    in the transfer.
-
-    The liquid can either be the source sample, the
-    target sample or the volume that is actually transferred
-    There are specialised subclasses for each case.
+    Samples are registered on demand when a transfer refers to their
+    position. There are specialised subclasses for source and target racks.
 
-    The object intrisically convert database units (l and M) into working
-    units (ul and nM).
-    On update, the values are rounded and converted back.
+    :Note: Only samples that are going to be altered are registered,
+        reported and updated.
     """
 
-    def __init__(self, volume):
+    def __init__(self, rack):
         """
         Constructor.
 
-        :param int volume: The volume of the liquid *in l* (positive number).
+        :param rack: The simulated rack.
+        :type rack: :class:`thelma.entities.rack.Rack`
         """
-        if self.__class__ is SampleData:
+        if self.__class__ is RackSampleState:
             raise TypeError('Abstract class')
-        #: The volume of the liquid *in ul*.
-        self.volume = volume * VOLUME_CONVERSION_FACTOR
-        #: Freeze thaw cycles the sample has gone through. This
-        #: information is copied from the source to the target sample.
-        self.freeze_thaw_cycles = None
-        #: The components making up that liquid (0-n).
-        self._sample_components = dict()
+        rack_shape = rack.rack_shape
+        #: The number of columns of the rack shape (for index calculation).
+        self.__number_columns = rack_shape.number_columns
+        #: The number of positions of the rack shape.
+        self._size = rack_shape.size
+        #: The containers of the rack (mapped onto indices).
+        self.__containers = [None] * self._size
+        for container in rack.containers:
+            self.__containers[self._get_index(container.position)] = container
+        #: The rack positions of the registered samples mapped onto indices.
+        self._positions = dict()
+        #: Flags for the indices that have a sample.
+        self._has_sample = array('b', [0]) * self._size
+        #: The original sample volumes in ul.
+        self._volumes = array('d', [0.0]) * self._size
+        #: The original sample concentrations in nM mapped onto molecule
+        #: design IDs.
+        self._concentrations = dict()
+        #: The (molecule design ID, molecule, concentration in nM) tuples
+        #: of the original samples (lists, created on demand).
+        self._components = [None] * self._size
+
+    def _get_index(self, rack_position):
+        """
+        Returns the array index for the given rack position.
+        """
+        return rack_position.row_index * self.__number_columns \
+               + rack_position.column_index
+
+    def _get_design_array(self, array_map, molecule_design_id):
+        """
+        Returns the array for the given molecule design ID from the given
+        map (an array is created if there is none so far).
+        """
+        design_array = array_map.get(molecule_design_id)
+        if design_array is None:
+            design_array = array('d', [0.0]) * self._size
+            array_map[molecule_design_id] = design_array
+        return design_array
+
+    def _register(self, rack_position):
+        """
+        Registers the (original) sample of the container at the given rack
+        position unless this has been done before.
+
+        :raises ValueError: If a molecule design occurs twice in the sample.
+        :return: The array index for the rack position.
+        """
+        idx = self._get_index(rack_position)
+        if idx in self._positions:
+            return idx
+        self._positions[idx] = rack_position
+        sample = self.__containers[idx].sample
+        if sample is None:
+            return idx
+        self._has_sample[idx] = 1
+        self._volumes[idx] = sample.volume * VOLUME_CONVERSION_FACTOR
+        self._init_sample(idx, sample)
+        components = []
+        for sm in sample.sample_molecules:
+            md_id = sm.molecule.molecule_design.id
+            concentration = sm.concentration * CONCENTRATION_CONVERSION_FACTOR
+            if any(md_id == comp[0] for comp in components):
+                msg = 'Duplicate sample component: %s-%.02f' \
+                      % (md_id, concentration)
+                raise ValueError(msg)
+            self._get_design_array(self._concentrations,
+                                   md_id)[idx] = concentration
+            components.append((md_id, sm.molecule, concentration))
+        self._components[idx] = components
+        return idx
 
-    @classmethod
-    def from_sample(cls, sample):
+    def _init_sample(self, index, sample):
         """
-        Factory method creating a :class:`SampleData` from a sample entity.
-
-        :Note: The sample is allowed to be *None*.
+        Initialises subclass specific values for a newly registered sample.
+        """
+        pass
 
-        :param sample: The sample data object.
-        :type sample: :class:`thelma.entities.sample.Sample`
-        :return: :class:`SampleData` object representing that sample.
+    def get_positions(self):
         """
-        if sample is None:
-            result = None
-        else:
-            sample_data = cls(sample.volume)
-            for sm in sample.sample_molecules:
-                sample_data.add_sample_component(sm)
-            result = sample_data
-        return result
+        Returns the rack positions of all registered samples.
+        """
+        return self._positions.values()
 
-    def add_sample_component(self, sample_molecule):
+    def update_container_samples(self):
         """
-        Creates and registers a :class:`SampleComponent` object using the
-        pass sample molecule.
+        Updates the samples of all containers with registered samples
+        reflecting their state after transfer execution.
 
-        :raises ValueError: If there is already a component with this
-            molecule design ID.
+        :return: The updated containers.
         """
-        comp = SampleComponent(molecule=sample_molecule.molecule,
-                               concentration=sample_molecule.concentration)
-        md_id = sample_molecule.molecule.molecule_design.id
-        if self._sample_components.has_key(md_id):
-            raise ValueError('Duplicate sample component: %s' % (comp))
-        self._sample_components[md_id] = comp
+        containers = []
+        for idx in self._positions:
+            container = self.__containers[idx]
+            container.sample = self._update_container_sample(idx, container)
+            containers.append(container)
+        return containers
 
-    def update_container_sample(self, container):
+    def _update_container_sample(self, index, container):
         """
-        Updates the passed container reflecting its state after transfer
-        execution.
+        Returns the updated sample for the given container (or *None*).
         """
         raise NotImplementedError('Abstract method')
 
-    def __str__(self):
-        return '%.1f ul' % (self.volume)
+    def __len__(self):
+        return len(self._positions)
 
     def __repr__(self):
-        str_format = '<%s volume: %.1f ul, components: %s>'
-        params = (self.__class__.__name__, self.volume,
-                  self._sample_components.values())
+        str_format = '<%s number of positions: %i, registered samples: %i>'
+        params = (self.__class__.__name__, self._size, len(self._positions))
         return str_format % params
 
 
-class TransferredSample(SampleData):
+class SourceRackSampleState(RackSampleState):
     """
-    Special :class:`SampleData` class for transferred volumes.
+    Special :class:`RackSampleState` for source racks.
 
-    Transfer sample does not get updated.
+    The class records the volumes taken out of each source sample. Sample
+    components are not altered.
     """
-    @property
-    def sample_components(self):
-        """
-        The components making up that liquid.
-        """
-        return self._sample_components
 
-    @classmethod
-    def from_sample(cls, sample):
-        """
-        Transfer sample are temporary. They are not attached to sample entities.
-        """
-        raise NotImplementedError('Transfer samples are not attached to ' \
-                                  'sample entities.')
+    def __init__(self, rack):
+        RackSampleState.__init__(self, rack)
+        #: The total transfer volumes in ul.
+        self.__transfer_volumes = array('d', [0.0]) * self._size
+        #: The freeze/thaw cycles of the original samples.
+        self.__freeze_thaw_cycles = [None] * self._size
 
-    def add_source_sample_components(self, sample_components):
-        """
-        Adds the sample components of the source sample.
+    def _init_sample(self, index, sample):
+        self.__freeze_thaw_cycles[index] = sample.freeze_thaw_cycles
 
-        :param sample_components: The sample components of the source sample.
-        :type sample_components: :class:`list`
+    def remove_volume(self, rack_position, volume):
         """
-        self._sample_components = sample_components
+        Registers a transfer taking liquid out of the sample at the given
+        rack position.
 
-    def update_container_sample(self, container):
-        """
-        Transfer sample are not associated with containers.
+        :param float volume: The transfer volume *in l*.
+        :return: The components of the source sample as (molecule design ID,
+            molecule, concentration in nM) tuples or *None* if the source
+            container does not have a sample.
         """
-        raise NotImplementedError('Transfers are not stored in containers!')
-
-
-class SourceSample(SampleData):
-    """
-    Special :class:`SampleData` class for source sample.
-
-    They might contain any number of :class:`TransferredSample` object.
-
-    The class calculate the final volume of the sample using all registered
-    :class:`TransferredSample` objects. :attr:`volume` refers to the original
-    source sample volume. SampleComponent objects (SampleMolecule objects) are
-    not altered.
-    """
-
-    def __init__(self, volume):
-        SampleData.__init__(self, volume)
-        #: All transfers using this sample as source.
-        self.__transfers = []
+        idx = self._register(rack_position)
+        if not self._has_sample[idx]:
+            return None
+        self.__transfer_volumes[idx] += volume * VOLUME_CONVERSION_FACTOR
+        return self._components[idx]
 
-    @property
-    def total_transfer_volume(self):
+    def get_freeze_thaw_cycles(self, rack_position):
         """
-        The volume required to provide liquid for all registered transfers.
+        Returns the freeze/thaw cycles of the original sample at the given
+        (registered) rack position.
         """
-        total_transfer_volume = 0
-        for transfer_sample in self.__transfers:
-            total_transfer_volume += transfer_sample.volume
-        return total_transfer_volume
+        return self.__freeze_thaw_cycles[self._get_index(rack_position)]
 
-    def create_and_add_transfer(self, planned_liquid_transfer):
+    def get_transfer_volumes(self):
         """
-        Creates, registers and returns a :class:`TransferredSample` object using
-        a planned liquid transfer as input.
-
-        :param planned_liquid_transfer: The planned liquid transfer.
-        :type: :class:`thelma.entities.liquidtransfer.PlannedSampleTransfer` or
-            :class:`thelma.entities.liquidtransfer.PlannedRackSampleTransfer`
-        :raises TypeErrors: in case of invalid planned transfer type
-
-        :return: The generated :class:`TransferredSample` object.
+        Returns a list of (rack position, sample volume, total transfer
+        volume) tuples (volumes in ul) for all registered positions that
+        have a sample.
         """
-        valid_types = (PlannedSampleTransfer, PlannedRackSampleTransfer)
-        if not isinstance(planned_liquid_transfer, valid_types):
-            msg = 'Unsupported type "%s"' \
-                   % (planned_liquid_transfer.__class__.__name__)
-            raise TypeError(msg)
-        transfer_sample = TransferredSample(planned_liquid_transfer.volume)
-        transfer_sample.add_source_sample_components(self._sample_components)
-        self.__transfers.append(transfer_sample)
-        return transfer_sample
+        volumes = self._volumes
+        transfer_volumes = self.__transfer_volumes
+        has_sample = self._has_sample
+        return [(rack_pos, volumes[idx], transfer_volumes[idx])
+                for idx, rack_pos in self._positions.iteritems()
+                if has_sample[idx]]
 
-    def update_container_sample(self, container):
-        """
-        Updates the passed container reflecting its state after transfer
-        execution. In case of source sample, we only need to adjust the
-        volume.
-        """
+    def _update_container_sample(self, index, container):
+        # In case of source samples, we only need to adjust the volume.
         if container.sample is None:
             result = None
         else:
-            final_volume = self.volume - self.total_transfer_volume
+            final_volume = self._volumes[index] \
+                           - self.__transfer_volumes[index]
             final_volume = round(final_volume, 1)
             container.sample.volume = final_volume / VOLUME_CONVERSION_FACTOR
             result = container.sample
         return result
 
-    @classmethod
-    def from_sample(cls, sample):
-        sample_data = super(SourceSample, cls).from_sample(sample)
-        if not sample_data is None:
-            sample_data.freeze_thaw_cycles = sample.freeze_thaw_cycles
-        return sample_data
 
-    def __repr__(self):
-        str_format = '<%s volume: %.1f ul, components: %s, number of ' \
-                     'transfers: %s, total transfer volume: %s>'
-        params = (self.__class__.__name__, self.volume,
-                  self._sample_components.values(), len(self.__transfers),
-                  self.total_transfer_volume)
-        return str_format % params
-
-
-class TargetSample(SampleData):
-    """
-    A special :class:`SampleData` class for source sample. They might contain
-    up to one transfer samples.
-
-    The class calculate the final volume of the sample using the registered
-    :class:`TransferredSample` object. Also sample components are updated or
-    added.
+class TargetRackSampleState(RackSampleState):
     """
-    def __init__(self, volume):
-        SampleData.__init__(self, volume)
-        #: All transfers using this sample as source.
-        self.__transfers = []
+    Special :class:`RackSampleState` for target racks.
 
-    @property
-    def final_volume(self):
-        """
-        The volume of the sample after the transfer.
-        """
-        if len(self.__transfers) < 1:
-            result = self.volume
-        else:
-            vol = self.volume
-            for transfer in self.__transfers:
-                vol += transfer.volume
-            result = vol
-        return result
+    The class records the volumes and sample components added to each
+    target sample. Containers without sample start with a volume of 0.
 
-    def create_and_add_transfer(self, planned_sample_dilution):
-        """
-        Creates, registers and returns a :class:`TransferredSample` object using
-        a planned container dilution as input.
+    The final concentration of a sample component is calculated using the
+    following formula:
 
-        :Note: invokes :func:`add_transfer`
+    .. code-block:: none
 
-        :param planned_sample_dilution: The planned container dilution.
-        :type: :class:`thelma.entities.liquidtransfer.PlannedSampleDilution`
-        :raises TypeErrors: in case of invalid transfer type
+                   (targetConc * targetVol) + (transferConc * transferVol)
+       finalConc = -------------------------------------------------------
+                                       finalVol
 
-        :return: The generated :class:`TransferredSample` object.
-        """
-        if not isinstance(planned_sample_dilution, PlannedSampleDilution):
-            msg = 'Unsupported type "%s"' \
-                   % (planned_sample_dilution.__class__.__name__)
-            raise TypeError(msg)
-        transfer_sample = TransferredSample(planned_sample_dilution.volume)
-        self.add_transfer(transfer_sample)
-        return transfer_sample
-
-    def add_transfer(self, transfer_sample):
-        """
-        Registers pass transfer sample.
-        """
-        self.__transfers.append(transfer_sample)
+    For components already present in the target sample, the transfer
+    volume is the volume of all transfers into the sample; for new
+    components it is the volume of the transfers providing the component.
+    """
 
-    def update_container_sample(self, container):
-        """
-        Updates the passed container reflecting its state after transfer
-        execution. In case of target sample, we adjust the volumes and the
-        sample components.
-        """
-        final_volume = round(self.final_volume, 1)
+    def __init__(self, rack):
+        RackSampleState.__init__(self, rack)
+        #: The sample volumes after the transfers in ul.
+        self.__final_volumes = array('d', [0.0]) * self._size
+        #: The total transfer volumes in ul.
+        self.__transfer_volumes = array('d', [0.0]) * self._size
+        #: The concentrations of the last transfer providing a molecule design
+        #: in nM mapped onto molecule design IDs.
+        self.__transfer_concentrations = dict()
+        #: The transfer volumes providing a molecule design in ul mapped onto
+        #: molecule design IDs.
+        self.__design_transfer_volumes = dict()
+        #: The molecules added by transfers mapped onto molecule design IDs
+        #: (dictionaries, created on demand).
+        self.__transfer_molecules = [None] * self._size
+        #: The freeze/thaw cycles copied over from source samples.
+        self.__freeze_thaw_cycles = [None] * self._size
+
+    def _init_sample(self, index, sample):
+        self.__final_volumes[index] = self._volumes[index]
+
+    def add_volume(self, rack_position, volume, components=None):
+        """
+        Registers a transfer adding liquid to the sample at the given
+        rack position.
+
+        :param float volume: The transfer volume *in l*.
+        :param components: The components of the transferred liquid
+            (see :func:`SourceRackSampleState.remove_volume`).
+        :type components: :class:`list`
+        """
+        idx = self._register(rack_position)
+        transfer_volume = volume * VOLUME_CONVERSION_FACTOR
+        self.__final_volumes[idx] += transfer_volume
+        self.__transfer_volumes[idx] += transfer_volume
+        if not components:
+            return
+        molecules = self.__transfer_molecules[idx]
+        if molecules is None:
+            molecules = dict()
+            self.__transfer_molecules[idx] = molecules
+        for md_id, molecule, concentration in components:
+            self._get_design_array(self.__transfer_concentrations,
+                                   md_id)[idx] = concentration
+            self._get_design_array(self.__design_transfer_volumes,
+                                   md_id)[idx] += transfer_volume
+            molecules[md_id] = molecule
+
+    def set_freeze_thaw_cycles(self, rack_position, freeze_thaw_cycles):
+        """
+        Sets the freeze/thaw cycles for the sample at the given (registered)
+        rack position (copied over from the source sample).
+        """
+        idx = self._get_index(rack_position)
+        self.__freeze_thaw_cycles[idx] = freeze_thaw_cycles
+
+    def get_final_volumes(self):
+        """
+        Returns a list of (rack position, final volume in ul) tuples for
+        all registered positions.
+        """
+        final_volumes = self.__final_volumes
+        return [(rack_pos, final_volumes[idx])
+                for idx, rack_pos in self._positions.iteritems()]
+
+    def _update_container_sample(self, index, container):
+        # In case of target samples, we adjust the volumes and the sample
+        # components.
+        total_volume = self.__final_volumes[index]
+        final_volume = round(total_volume, 1)
         conv_final_volume = final_volume / VOLUME_CONVERSION_FACTOR
         if are_equal_values(final_volume, 0):
             return None
@@ -1222,67 +1193,40 @@ class TargetSample(SampleData):
             spl.volume = conv_final_volume
         # FIXME: This is ugly; however, there is no better way to squeeze
         #        f/t cycle tracking into the current system.
-        if self.freeze_thaw_cycles is None:
-            # If we have even a single source sample that is not tracked, we
-            # can not make any sensible statement as to the maximum number
-            # of f/t cycles the pool went through.
+        # If we have even a single source sample that is not tracked, we
+        # can not make any sensible statement as to the maximum number of
+        # f/t cycles the pool went through.
+        freeze_thaw_cycles = self.__freeze_thaw_cycles[index]
+        if freeze_thaw_cycles is None:
             spl.freeze_thaw_cycles = None
         else:
             spl.freeze_thaw_cycles = max(spl.freeze_thaw_cycles,
-                                         self.freeze_thaw_cycles)
+                                         freeze_thaw_cycles)
+        target_volume = self._volumes[index]
+        transfer_molecules = self.__transfer_molecules[index]
+        if transfer_molecules is None:
+            transfer_molecules = dict()
         updated_mds = set()
-        transfer_components = dict()
-        md_transfers = dict()
-        for transfer in self.__transfers:
-            for md_id, comp in transfer.sample_components.iteritems():
-                transfer_components[md_id] = comp
-                add_list_map_element(md_transfers, md_id, transfer)
         # update existing sample molecules
-        for sm in container.sample.sample_molecules:
+        for sm in spl.sample_molecules:
             md_id = sm.molecule.molecule_design.id
             updated_mds.add(md_id)
-            target_comp = self._sample_components[md_id]
-
-            if transfer_components.has_key(md_id):
-                transfer_conc = transfer_components[md_id].concentration
+            if md_id in transfer_molecules:
+                transfer_conc = self.__transfer_concentrations[md_id][index]
             else:
                 transfer_conc = 0
-            final_conc = self.__get_final_concentration(
-                                    target_comp.concentration, transfer_conc)
-            sm.concentration = final_conc / CONCENTRATION_CONVERSION_FACTOR
+            final_conc = (self._concentrations[md_id][index] * target_volume
+                          + transfer_conc * self.__transfer_volumes[index]) \
+                          / total_volume
+            sm.concentration = round(final_conc, 2) \
+                               / CONCENTRATION_CONVERSION_FACTOR
         # add new sample molecules
-        for md_id, comp in transfer_components.iteritems():
+        for md_id, molecule in transfer_molecules.iteritems():
             if md_id in updated_mds:
                 continue
-            transfers = md_transfers[md_id]
-            final_conc = self.__get_final_concentration(0, comp.concentration,
-                                                        transfers)
-            conv_final_conc = final_conc / CONCENTRATION_CONVERSION_FACTOR
-            container.sample.make_sample_molecule(comp.molecule,
-                                                  conv_final_conc)
-        return container.sample
-
-    def __get_final_concentration(self, target_conc, transfer_conc,
-                                  transfers=None):
-        # Calculates the final concentration of a sample component using the
-        # following formula:
-        #            (targetConc * targetVol) + (transferConc * transferVol)
-        # finalConc = -------------------------------------------------------
-        #                                finalVol
-        transfer_volume = 0
-        if transfers is None:
-            transfers = self.__transfers
-        for transfer in transfers:
-            transfer_volume += transfer.volume
-        target_product = target_conc * self.volume
-        transfer_product = transfer_conc * transfer_volume
-        final_conc = (target_product + transfer_product) / self.final_volume
-        final_conc = round(final_conc, 2)
-        return final_conc
-
-    def __repr__(self):
-        str_format = '<%s volume: %.1f ul, components: %s, transfers: %s>'
-        params = (self.__class__.__name__, self.volume, self._sample_components,
-                  len(self.__transfers))
-        return str_format % params
-
+            final_conc = (self.__transfer_concentrations[md_id][index]
+                          * self.__design_transfer_volumes[md_id][index]) \
+                          / total_volume
+            spl.make_sample_molecule(molecule, round(final_conc, 2)
+                                     / CONCENTRATION_CONVERSION_FACTOR)
+        return spl
@@ -801,10 +801,14 @@ class SerialWriterExecutorTool(BaseTool):
     :attr:`MODE_PRINT_WORKLISTS`). Execution mode requires a user to be set.
     Printing modes silently ignores the user.
 
-    **Return Value:** a zip stream for for printing mode or executed worklists
-        for execution mode (can be overwritten)
+    **Return Value:** a zip stream for for printing mode (or the file
+        streams mapped onto file names, see :attr:`return_file_map`) or
+        executed worklists for execution mode (can be overwritten)
     """
     NAME = 'Serial Writer Executor'
+    #: The worklist writers and executors of a series record their messages
+    #: here; only the latest debug and info messages are kept.
+    MAX_MESSAGE_STACK_SIZE = 1000
     #: Marks usage of execution mode.
     MODE_EXECUTE = 'execute'
     #: Marker for the usage of worklist printing mode.
@@ -831,6 +835,10 @@ class SerialWriterExecutorTool(BaseTool):
         self.mode = mode
         #: Required for execution mode.
         self.user = user
+        #: In printing mode, return the file streams mapped onto file names
+        #: instead of a zip stream? (For callers archiving the files of
+        #: several tools together.)
+        self.return_file_map = False
         #: The transfer jobs mapped onto job indices.
         self._transfer_jobs = None
         #: The worklists for each rack sample transfer job index.
@@ -910,9 +918,12 @@ class SerialWriterExecutorTool(BaseTool):
         if not self.has_errors():
             file_map = self._get_file_map(merge_map, rack_transfer_stream)
         if not self.has_errors():
-            zip_stream = StringIO()
-            create_zip_archive(zip_stream, file_map)
-            self.return_value = zip_stream
+            if self.return_file_map:
+                self.return_value = file_map
+            else:
+                zip_stream = StringIO()
+                create_zip_archive(zip_stream, file_map)
+                self.return_value = zip_stream
             self.add_info('Serial working print completed.')
 
     def __run_serial_writer(self):
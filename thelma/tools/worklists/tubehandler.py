@@ -8,7 +8,6 @@ from StringIO import StringIO
 
 from thelma.tools.handlers.tubehandler import XL20OutputParserHandler
 from thelma.tools.base import BaseTool
-from thelma.tools.writers import CsvColumnParameters
 from thelma.tools.writers import CsvWriter
 from thelma.tools.utils.base import add_list_map_element
 from thelma.entities.rack import TubeRack
@@ -88,7 +87,8 @@ class TubeTransferData(object):
 class BaseXL20WorklistWriter(CsvWriter):
     """
     This tool writes a worklist for the XL20 (tube handler). The
-    :func:`_store_column_values` function can be customised at will.
+    :func:`_generate_rows` function can be customised at will. The rows
+    are generated while they are written.
 
     **Return Value:** the XL20 worklist as stream
     """
@@ -113,39 +113,11 @@ class BaseXL20WorklistWriter(CsvWriter):
     #: The header for the destination position column.
     DEST_POSITION_HEADER = 'Destination Position'
 
-    def __init__(self, parent=None):
-        CsvWriter.__init__(self, parent=parent)
-        #: The values for the source rack column.
-        self._source_rack_values = None
-        #: The values for the source position column.
-        self._source_position_values = None
-        #: The values of the tube barcode column.
-        self._tube_barcode_values = None
-        #: The values of the destination rack column.
-        self._dest_rack_values = None
-        #: The values of the destination position column.
-        self._dest_position_values = None
-
-    def reset(self):
-        """
-        Resets all attributes except the initialization values.
+    def _prepare_data(self):
         """
-        CsvWriter.reset(self)
-        self._source_rack_values = []
-        self._source_position_values = []
-        self._tube_barcode_values = []
-        self._dest_rack_values = []
-        self._dest_position_values = []
-
-    def _init_column_map_list(self):
-        """
-        Creates the :attr:`_column_map_list`
+        Checks the input.
         """
         self._check_input()
-        if not self.has_errors():
-            self._store_column_values()
-        if not self.has_errors():
-            self.__generate_columns()
 
     def _check_input(self):
         """
@@ -153,35 +125,39 @@ class BaseXL20WorklistWriter(CsvWriter):
         """
         raise NotImplementedError('Abstract method.')
 
-    def _store_column_values(self):
+    def _generate_rows(self):
         """
-        Stores the column values.
+        Yields the data rows (use :func:`_make_row`).
         """
         raise NotImplementedError('Abstract method.')
 
-    def __generate_columns(self):
+    def _make_row(self, source_rack, source_position, tube_barcode, dest_rack,
+                  dest_position):
+        """
+        Returns a data row (values are placed according to the column
+        indices).
         """
-        Generates the columns for the report.
+        row = [None] * 5
+        row[self.SOURCE_RACK_INDEX] = source_rack
+        row[self.SOURCE_POSITION_INDEX] = source_position
+        row[self.TUBE_BARCODE_INDEX] = tube_barcode
+        row[self.DEST_RACK_INDEX] = dest_rack
+        row[self.DEST_POSITION_INDEX] = dest_position
+        return row
+
+    def _get_header_names(self):
         """
-        self.add_debug('Generate columns ...')
-        src_rack_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.SOURCE_RACK_INDEX, self.SOURCE_RACK_HEADER,
-                    self._source_rack_values)
-        src_pos_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.SOURCE_POSITION_INDEX, self.SOURCE_POSITION_HEADER,
-                    self._source_position_values)
-        tube_barcode_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.TUBE_BARCODE_INDEX, self.TUBE_BARCODE_HEADER,
-                    self._tube_barcode_values)
-        dest_rack_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.DEST_RACK_INDEX, self.DEST_RACK_HEADER,
-                    self._dest_rack_values)
-        dest_pos_column = CsvColumnParameters.create_csv_parameter_map(
-                    self.DEST_POSITION_INDEX, self.DEST_POSITION_HEADER,
-                    self._dest_position_values)
-        self._column_map_list = [src_rack_column, src_pos_column,
-                                 tube_barcode_column, dest_rack_column,
-                                 dest_pos_column]
+        Returns the column headers in column order.
+        """
+        header_map = {self.SOURCE_RACK_INDEX : self.SOURCE_RACK_HEADER,
+                      self.SOURCE_POSITION_INDEX : self.SOURCE_POSITION_HEADER,
+                      self.TUBE_BARCODE_INDEX : self.TUBE_BARCODE_HEADER,
+                      self.DEST_RACK_INDEX : self.DEST_RACK_HEADER,
+                      self.DEST_POSITION_INDEX : self.DEST_POSITION_HEADER}
+        return [header_map[index] for index in sorted(header_map.keys())]
+
+    def _iterate_rows(self):
+        return self._generate_rows()
 
 
 class XL20WorklistWriter(BaseXL20WorklistWriter):
@@ -229,11 +205,11 @@ class XL20WorklistWriter(BaseXL20WorklistWriter):
                     break
             self._tube_transfer_data = all_tt_data
 
-    def _store_column_values(self):
+    def _generate_rows(self):
         """
-        Stores the column values.
+        Yields the data rows (sorted by source rack and tube barcode).
         """
-        self.add_debug('Store column values ...')
+        self.add_debug('Generate rows ...')
         src_rack_map = dict()
         for tube_transfer in self._tube_transfer_data:
             add_list_map_element(src_rack_map, tube_transfer.src_rack_barcode,
@@ -244,11 +220,10 @@ class XL20WorklistWriter(BaseXL20WorklistWriter):
                                    cmp=lambda tt1, tt2: cmp(tt1.tube_barcode,
                                                             tt2.tube_barcode))
             for tube_transfer in tube_barcodes:
-                self._source_rack_values.append(src_rack)
-                self._source_position_values.append(tube_transfer.src_pos.label)
-                self._tube_barcode_values.append(tube_transfer.tube_barcode)
-                self._dest_rack_values.append(tube_transfer.trg_rack_barcode)
-                self._dest_position_values.append(tube_transfer.trg_pos.label)
+                yield self._make_row(src_rack, tube_transfer.src_pos.label,
+                                     tube_transfer.tube_barcode,
+                                     tube_transfer.trg_rack_barcode,
+                                     tube_transfer.trg_pos.label)
 
 
 class TubeTransferExecutor(BaseTool):
@@ -11,6 +11,8 @@ from thelma.tools.utils.base import VOLUME_CONVERSION_FACTOR
 from thelma.tools.utils.base import get_trimmed_string
 from thelma.tools.utils.base import is_larger_than
 from thelma.tools.utils.base import is_smaller_than
+from thelma.entities.aggregates import QUERY_PROFILES
+from thelma.entities.aggregates import load_query_profile
 from thelma.entities.liquidtransfer import PipettingSpecs
 from thelma.entities.liquidtransfer import PlannedWorklist
 from thelma.entities.liquidtransfer import TRANSFER_TYPES
@@ -34,6 +36,11 @@ class WorklistWriter(CsvWriter):
     #: The transfer type supported by this class
     #: (see :class:`thelma.entities.liquidtransfer.TRANSFER_TYPES`).
     TRANSFER_TYPE = None
+    #: The related entities to load for the racks before they are
+    #: traversed (see :class:`thelma.entities.aggregates.QUERY_PROFILES`).
+    RACK_QUERY_PROFILE = QUERY_PROFILES.RACK_SAMPLES
+    #: The number of debug and info messages kept for standalone runs.
+    MAX_MESSAGE_STACK_SIZE = 1000
 
     def __init__(self, planned_worklist, target_rack, pipetting_specs,
                  ignored_positions=None, parent=None):
@@ -92,6 +99,10 @@ class WorklistWriter(CsvWriter):
         self._source_container_missing = None
         self._target_volume_too_large = None
         self._target_container_missing = None
+        #: The source volumes before the first transfer (all transfers need
+        #: to be checked before the first row can be written, the volumes are
+        #: restored before the rows are generated again for writing).
+        self.__initial_source_volumes = None
 
     def reset(self):
         """
@@ -111,12 +122,14 @@ class WorklistWriter(CsvWriter):
         self._source_container_missing = set()
         self._target_volume_too_large = []
         self._target_container_missing = []
+        self.__initial_source_volumes = None
 
-    def _init_column_map_list(self):
+    def _prepare_data(self):
         """
-        Creates the :attr:`_column_map_list` for the CSV writer.
+        Checks the planned transfers. The rows are generated once to find
+        invalid transfers but they are not stored (see :func:`_iterate_rows`).
         """
-        self.add_info('Start column generation for worklist file ...')
+        self.add_info('Start row generation for worklist file ...')
         self._check_input()
         if not self.has_errors():
             self._init_target_data()
@@ -124,12 +137,11 @@ class WorklistWriter(CsvWriter):
             self.__check_planned_liquid_transfers()
         if not self.has_errors():
             self.__set_transfer_volume_range()
-            self._generate_column_values()
+            self.__initial_source_volumes = dict(self._source_volumes)
+            for _ in self._generate_rows(): pass
             self._record_errors()
         if not self.has_errors():
-            self._init_column_maps()
-        if not self.has_errors():
-            self.add_info('Column generation completed ...')
+            self.add_info('Row generation completed ...')
 
     def _check_input(self):
         """
@@ -153,6 +165,7 @@ class WorklistWriter(CsvWriter):
         """
         Initialises the target rack related values and lookups.
         """
+        load_query_profile([self.target_rack], self.RACK_QUERY_PROFILE)
         for container in self.target_rack.containers:
             rack_pos = container.position
             self._target_containers[rack_pos] = container
@@ -184,11 +197,18 @@ class WorklistWriter(CsvWriter):
             self._max_transfer_volume = VOLUME_CONVERSION_FACTOR \
                                     * self.pipetting_specs.max_transfer_volume
 
-    def _generate_column_values(self):
+    def _generate_rows(self):
+        """
+        This method yields the data rows for the CSV file.
+        """
+        raise NotImplementedError('Abstract method.')
+
+    def _reset_row_generation(self):
         """
-        This method generates the value lists for the CSV columns.
+        Restores the values changed while the rows are generated, so that
+        the rows can be generated again.
         """
-        self.add_error('Abstract method: _generate_column_values()')
+        self._source_volumes = dict(self.__initial_source_volumes)
 
     def __check_planned_liquid_transfers(self):
         # Checks whether all planned transfers in the worklist have the
@@ -316,9 +336,16 @@ class WorklistWriter(CsvWriter):
                    % (', '.join(sorted(self._target_container_missing)))
             self.add_error(msg)
 
-    def _init_column_maps(self):
+    def _get_header_names(self):
+        """
+        Returns the column headers in column order.
+        """
+        raise NotImplementedError('Abstract method.')
+
+    def _iterate_rows(self):
         """
-        Initialises the CsvColumnParameters object for the
-        :attr:`_column_map_list`.
+        Generates the rows again while they are written (the transfers have
+        been checked by :func:`_prepare_data`).
         """
-        self.add_error('Abstract method: _init_column_maps()')
+        self._reset_row_generation()
+        return self._generate_rows()
@@ -6,7 +6,10 @@ This is an abstract super class for CSV stream generators.
 """
 
 from StringIO import StringIO
+from itertools import chain
+from itertools import izip
 import os
+from tempfile import NamedTemporaryFile
 from zipfile import BadZipfile
 import zipfile
 
@@ -19,6 +22,9 @@ __all__ = ['LINEBREAK_CHAR',
            'CsvWriter',
            'CsvColumnParameters',
            'TxtWriter',
+           'add_zip_archive_entries',
+           'add_zip_archive_writer_entry',
+           'close_zip_archive',
            'create_zip_archive',
            'read_zip_archive',
            'merge_csv_streams']
@@ -33,6 +39,15 @@ class CsvWriter(BaseTool):
     """
     A base tool to generate CSV file streams.
 
+    There are two ways to provide the data: column-oriented writers create
+    a list of :class:`CsvColumnParameters` (see :func:`_init_column_map_list`),
+    row-oriented writers override :func:`_prepare_data`,
+    :func:`_get_header_names` and :func:`_iterate_rows`. In both cases the
+    rows are written one by one, either into an in-memory stream
+    (:func:`run`) or straight into a file-like object like a file or an
+    HTTP response body (:func:`write_to`). Values are joined with the
+    :attr:`DELIMITER` as they are (there is no quoting).
+
     **Return Value:** a file stream (CSV format)
     """
 
@@ -41,8 +56,6 @@ class CsvWriter(BaseTool):
 
     def __init__(self, parent=None):
         BaseTool.__init__(self, parent=parent)
-        #: The stream to be generated.
-        self.__stream = None
         #: Maps :class:`CsvColumnDictionary`s onto column indices.
         self._index_map = None
         #: A list with of :class:`CsvColumnDictionary` (to be set by the
@@ -56,7 +69,6 @@ class CsvWriter(BaseTool):
         Resets all attributes except for the user input.
         """
         BaseTool.reset(self)
-        self.__stream = None
         self._column_map_list = None
         self._index_map = None
 
@@ -66,13 +78,13 @@ class CsvWriter(BaseTool):
         """
         self.reset()
         self.add_info('Start CSV generation ...')
-        self._init_column_map_list()
-        if not self.has_errors(): self.__init_index_map()
-        if not self.has_errors(): self.__init_stream()
-        if not self.has_errors(): self.__write_stream()
+        self.add_debug('Initialize stream ...')
+        stream = StringIO()
+        self.__write(stream)
         if not self.has_errors():
+            stream.seek(0)
             self.add_info('CSV generation complete.')
-            self.return_value = self.__stream
+            self.return_value = stream
 
     def get_result(self, write_headers=True, run=True): #pylint: disable=W0221
         """
@@ -90,12 +102,65 @@ class CsvWriter(BaseTool):
         if run: self.run()
         return self.return_value
 
+    def write_to(self, stream, write_headers=True):
+        """
+        Writes the CSV data straight into the given file-like object (e.g.
+        an open file or the body file of an HTTP response) without building
+        an intermediate in-memory stream. The stream is neither rewound nor
+        closed.
+
+        If an error occurs while rows are written (see :func:`_iterate_rows`),
+        the stream might contain partial data.
+
+        :param stream: The target for the CSV data.
+        :type stream: file-like object with a *write* method
+        :param write_headers: A boolean that defines whether to print a header.
+        :type write_headers: :class:`boolean`
+        :default write_headers: *True*
+        :return: *True* if the data has been written without errors.
+        """
+        self._write_headers = write_headers
+        self.reset()
+        self.add_info('Start CSV generation ...')
+        self.__write(stream)
+        if not self.has_errors():
+            self.add_info('CSV generation complete.')
+        return not self.has_errors()
+
+    def _prepare_data(self):
+        """
+        Collects the data to be written. By default, this creates and
+        validates the :attr:`_column_map_list`. Row-oriented writers
+        override this method.
+        """
+        self._init_column_map_list()
+        if not self.has_errors(): self.__init_index_map()
+        if not self.has_errors(): self.__check_column_lengths()
+
     def _init_column_map_list(self):
         """
         Creates the :attr:`_column_map_list`
         """
         raise NotImplementedError('Abstract method.')
 
+    def _get_header_names(self):
+        """
+        Returns the column headers in column order. By default, the headers
+        are taken from the :attr:`_column_map_list`.
+        """
+        return [self._index_map[index].header_name
+                for index in sorted(self._index_map.keys())]
+
+    def _iterate_rows(self):
+        """
+        Returns an iterable of rows (sequences with one value per column).
+        Values are converted using :func:`str`. By default, the rows are
+        assembled from the value lists of the :attr:`_column_map_list`.
+        """
+        value_lists = [self._index_map[index].value_list
+                       for index in sorted(self._index_map.keys())]
+        return izip(*value_lists)
+
     def __init_index_map(self):
         """
         Checks the validity of the passed column map and generates the
@@ -144,73 +209,56 @@ class CsvWriter(BaseTool):
 
         return True
 
-    def __init_stream(self):
-        """
-        Initialises the stream.
+    def __check_column_lengths(self):
         """
-        self.add_debug('Initialize stream ...')
-        self.__stream = StringIO()
-
-    def __write_stream(self):
+        Makes sure all columns have the same number of values (before
+        anything is written).
         """
-        Writes the body into the stream.
-        """
-
-        self.add_debug('Prepare body ...')
-
         line_count = len(self._index_map[0].value_list)
-
         for column_map in self._column_map_list:
-            value_list = column_map.value_list
-            if len(value_list) != line_count:
+            if len(column_map.value_list) != line_count:
                 msg = 'The columns have different numbers of values!'
                 self.add_error(msg)
-        if line_count < 1:
-            self.add_error('There is no data to be printed!')
+                break
 
-        if not self.has_errors() and self._write_headers:
-            self.__write_header()
+    def __write(self, stream):
+        """
+        Collects the data and writes header and rows into the given stream.
+        """
+        self._prepare_data()
         if not self.has_errors():
-            self.__write_data_lines(line_count)
-            self.__stream.seek(0)
+            header_names = self._get_header_names()
+            self.__write_rows(stream, header_names, self._iterate_rows())
 
-    def __write_header(self):
+    def __write_rows(self, stream, header_names, rows):
         """
-        Writes the column header line into the stream.
+        Writes the header and data rows into the given stream. The first row
+        is fetched before anything is written so that empty data does not
+        produce a header-only file.
         """
-
+        self.add_debug('Print data lines ...')
+        row_iterator = iter(rows)
+        try:
+            first_row = next(row_iterator)
+        except StopIteration:
+            self.add_error('There is no data to be printed!')
+            return
+        column_count = len(header_names)
         if self._write_headers:
-            indices = self._index_map.keys()
-            indices.sort()
-            header_values = []
-            for index in indices:
-                column_map = self._index_map[index]
-                header_values.append(column_map.header_name)
-            self.__write_line(header_values)
+            self.__write_line(stream, header_names)
+        for row in chain((first_row,), row_iterator):
+            if len(row) != column_count:
+                msg = 'The columns have different numbers of values!'
+                self.add_error(msg)
+                break
+            self.__write_line(stream, row)
 
-    def __write_line(self, line_values):
+    def __write_line(self, stream, line_values):
         """
         Generates a writable line from a list of values.
         """
         raw_line = self.DELIMITER.join(str(i) for i in line_values)
-        w_line = '%s%s' % (raw_line, LINEBREAK_CHAR)
-        self.__stream.write(w_line)
-
-    def __write_data_lines(self, line_count):
-        """
-        Generates the actual data lines and writes them into the stream.
-        """
-        self.add_debug('Print data lines ...')
-
-        indices = self._index_map.keys()
-        indices.sort()
-
-        for i in range(line_count):
-            data_values = []
-            for column_index in indices:
-                value_list = self._index_map[column_index].value_list
-                data_values.append(value_list[i])
-            self.__write_line(data_values)
+        stream.write('%s%s' % (raw_line, LINEBREAK_CHAR))
 
 
 class CsvColumnParameters(object):
@@ -420,17 +468,65 @@ def create_zip_archive(zip_stream, stream_map):
     :return: zip archive
     """
     archive = zipfile.ZipFile(zip_stream, 'a', zipfile.ZIP_DEFLATED, False)
+    add_zip_archive_entries(archive, stream_map)
+    close_zip_archive(archive)
+    return archive
+
+
+def add_zip_archive_entries(archive, stream_map):
+    """
+    Adds the given streams to a zip archive that is open for writing.
 
+    :param archive: The zip archive.
+    :type archive: :class:`zipfile.ZipFile`
+
+    :param stream_map: The file streams mapped onto file names.
+    :type stream_map: :class:`dict`
+    """
     for zip_fn, stream in stream_map.iteritems():
         archive.writestr(zip_fn, stream.read())
 
+
+def add_zip_archive_writer_entry(archive, zip_fn, writer):
+    """
+    Adds the output of the given CSV writer to a zip archive that is open
+    for writing. The rows are written into a temporary file which is then
+    compressed into the archive chunk by chunk (the content is never held
+    in memory as a whole). Nothing is added if the writer fails.
+
+    :param archive: The zip archive.
+    :type archive: :class:`zipfile.ZipFile`
+
+    :param str zip_fn: The file name within the archive.
+
+    :param writer: The writer generating the file content.
+    :type writer: :class:`CsvWriter`
+
+    :return: *True* if the data has been written without errors.
+    """
+    tmp_file = NamedTemporaryFile(suffix='.csv', delete=False)
+    try:
+        with tmp_file:
+            is_written = writer.write_to(tmp_file)
+        if is_written:
+            archive.write(tmp_file.name, zip_fn)
+    finally:
+        os.remove(tmp_file.name)
+    return is_written
+
+
+def close_zip_archive(archive):
+    """
+    Closes the given zip archive (which writes the archive directory).
+
+    :param archive: The zip archive.
+    :type archive: :class:`zipfile.ZipFile`
+    """
     # Mark the files as having been created on Windows so that
     # Unix permissions are not inferred as 0000
     for zfile in archive.filelist: zfile.create_system = 0
     archive.close()
 
-    return archive
-
 
 def read_zip_archive(zip_stream):
     """
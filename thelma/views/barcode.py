@@ -0,0 +1,39 @@
+"""
+This file is part of the TheLMA (THe Laboratory Management Application) project.
+See LICENSE.txt for licensing, CONTRIBUTORS.txt for contributor information.
+
+Custom view for the barcode print job resource.
+"""
+import json
+
+from pyramid.httpexceptions import HTTPAccepted
+
+from everest.mime import JsonMime
+from everest.views.postcollection import PostCollectionView
+from thelma.barcodeprinter import get_barcode_print_queue
+
+
+__docformat__ = 'reStructuredText en'
+__all__ = ['PostBarcodePrintJobCollectionView',
+           ]
+
+
+class PostBarcodePrintJobCollectionView(PostCollectionView):
+    """
+    If the barcode print queue is enabled, the labels are printed in the
+    background and the response (202 Accepted) only contains the ID of
+    the print queue job. Otherwise, the labels are printed before the
+    response is sent (201 Created).
+    """
+    def _process_request_data(self, data):
+        if not get_barcode_print_queue().is_enabled:
+            return PostCollectionView._process_request_data(self, data)
+        rpr = self._get_request_representer()
+        member = rpr.resource_from_data(data)
+        self.context.add(member)
+        job_id = member.get_entity().print_queue_job_id
+        # Prepare and return response.
+        self.request.response.content_type = JsonMime.mime_type_string
+        self.request.response.body = json.dumps(dict(job_id=job_id))
+        self.request.response.status = self._status(HTTPAccepted)
+        return self.request.response